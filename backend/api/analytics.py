@@ -0,0 +1,319 @@
+"""
+Fleet analytics rollups
+Daily, monthly and yearly miles, driving and on-duty time and trip counts
+per driver and per lane, kept up to date as trips are planned and
+re-planned. Every trip remembers what it contributed (TripRollup), so a
+change only applies the difference. Date-range queries add up rollup rows
+in the database, covering the range with year rows for whole years, month
+rows for the remaining whole months and day rows for the ragged ends.
+"""
+
+import calendar
+from datetime import date, time, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import connection, transaction
+from django.db.models import FloatField, Max, Q, Sum
+from django.db.models.functions import TruncMonth
+
+from .geocoder import normalize_location
+from .models import ELDLog, FleetRollup, Trip, TripRollup
+from .timeline import DutyTimeline
+
+
+DAY_SECONDS = 24 * 3600
+DAY_END = time(23, 59, 59)  # Logs close a day at 23:59:59
+VALUE_FIELDS = ['miles', 'driving_seconds', 'on_duty_seconds', 'trips']
+
+
+def _seconds(value: time) -> int:
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _month_end(day: date) -> date:
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+class FleetRollups:
+    """Maintain and query FleetRollup rows"""
+
+    @staticmethod
+    def driver(trip: Trip) -> Tuple[str, str]:
+        """(key, label); drivers are users, or the trip itself when it has no user"""
+        if trip.user_id:
+            return f'user:{trip.user_id}', trip.user.username
+        return f'trip:{trip.id}', f'Trip {trip.id}'
+
+    @staticmethod
+    def lane(trip: Trip) -> Tuple[str, str]:
+        """(key, label) of the loaded lane; spelling variants share a key"""
+        key = f'{normalize_location(trip.pickup_location)} -> {normalize_location(trip.dropoff_location)}'
+        return key[:410], f'{trip.pickup_location} → {trip.dropoff_location}'[:410]
+
+    @staticmethod
+    def contribution(logs: Iterable[ELDLog]) -> Dict[str, list]:
+        """
+        A trip's totals per day
+
+        Args:
+            logs: The trip's ELD logs (prefetch 'duty_statuses' for row-stored logs)
+
+        Returns:
+            {'YYYY-MM-DD': [miles, driving seconds, on-duty seconds, trips]};
+            the trip is counted on its first day
+        """
+        days = {}
+        for log in logs:
+            driving = on_duty = 0
+            for status in DutyTimeline.statuses(log):
+                if status.status not in ('driving', 'on_duty'):
+                    continue
+                end = DAY_SECONDS if status.end_time == DAY_END else _seconds(status.end_time)
+                seconds = max(end - _seconds(status.start_time), 0)
+                on_duty += seconds
+                if status.status == 'driving':
+                    driving += seconds
+            days[log.date.isoformat()] = [round(float(log.total_miles), 2), driving, on_duty, 0]
+        if days:
+            days[min(days)][3] = 1
+        return days
+
+    @staticmethod
+    def _add(deltas: Dict, dimension: str, key: str, label: str, days: Dict[str, list], sign: int):
+        """Accumulate day, month and year deltas for one contribution"""
+        for day, (miles, driving, on_duty, trips) in days.items():
+            day = date.fromisoformat(day)
+            for grain, period in (('day', day), ('month', _month_start(day)), ('year', day.replace(month=1, day=1))):
+                entry = deltas.setdefault((dimension, grain, key, period), [label, Decimal('0'), 0, 0, 0])
+                entry[1] += sign * Decimal(str(miles))
+                entry[2] += sign * driving
+                entry[3] += sign * on_duty
+                entry[4] += sign * trips
+
+    @staticmethod
+    def _apply(deltas: Dict):
+        """Add deltas to the rollup rows in one upsert per row (atomic per row in the database)"""
+        rows = [
+            (dimension, grain, key, label, period, miles, driving, on_duty, trips)
+            for (dimension, grain, key, period), (label, miles, driving, on_duty, trips) in deltas.items()
+            if miles or driving or on_duty or trips
+        ]
+        if not rows:
+            return
+        quote = connection.ops.quote_name
+        table = quote(FleetRollup._meta.db_table)
+        columns = ['dimension', 'grain', 'key', 'label', 'period'] + VALUE_FIELDS
+        period_field = FleetRollup._meta.get_field('period')
+        miles_field = FleetRollup._meta.get_field('miles')
+        sql = (
+            f"INSERT INTO {table} ({', '.join(quote(column) for column in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON CONFLICT ({', '.join(quote(column) for column in ['dimension', 'grain', 'period', 'key'])}) "
+            f"DO UPDATE SET "
+            + ', '.join(f'{quote(field)} = {table}.{quote(field)} + excluded.{quote(field)}' for field in VALUE_FIELDS)
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                (dimension, grain, key, label, period_field.get_db_prep_value(period, connection),
+                 miles_field.get_db_prep_value(miles, connection), driving, on_duty, trips)
+                for dimension, grain, key, label, period, miles, driving, on_duty, trips in rows
+            ])
+
+        # Days a re-plan no longer covers drop out instead of lingering as zeros
+        emptied = Q()
+        for dimension, grain, key, _, period, miles, driving, on_duty, trips in rows:
+            if miles < 0 or driving < 0 or on_duty < 0 or trips < 0:
+                emptied |= Q(dimension=dimension, grain=grain, key=key, period=period)
+        if emptied:
+            FleetRollup.objects.filter(emptied, miles=0, driving_seconds=0, on_duty_seconds=0, trips=0).delete()
+
+    @staticmethod
+    def record_trip(trip: Trip):
+        """
+        Bring the rollups in line with a trip's current logs
+
+        Call after creating or re-planning a trip; only the change since the
+        trip was last recorded is applied.
+        """
+        with transaction.atomic():
+            previous = TripRollup.objects.select_for_update().filter(trip=trip).first()
+            driver_key, driver_label = FleetRollups.driver(trip)
+            lane_key, lane_label = FleetRollups.lane(trip)
+            days = FleetRollups.contribution(trip.eld_logs.prefetch_related('duty_statuses'))
+
+            deltas = {}
+            if previous:
+                FleetRollups._add(deltas, 'driver', previous.driver_key, driver_label, previous.days, -1)
+                FleetRollups._add(deltas, 'lane', previous.lane_key, lane_label, previous.days, -1)
+            FleetRollups._add(deltas, 'driver', driver_key, driver_label, days, 1)
+            FleetRollups._add(deltas, 'lane', lane_key, lane_label, days, 1)
+            FleetRollups._apply(deltas)
+
+            TripRollup.objects.update_or_create(
+                trip=trip, defaults={'driver_key': driver_key, 'lane_key': lane_key, 'days': days}
+            )
+
+    @staticmethod
+    def record_new_trips(trip_ids: List[int]):
+        """
+        Add trips that were never recorded, in one batch
+
+        For bulk inserts (manage.py plan_trips); call inside the transaction
+        that created the trips.
+        """
+        deltas = {}
+        contributions = []
+        trips = Trip.objects.filter(id__in=trip_ids).select_related('user').defer(
+            'route_geometry').prefetch_related('eld_logs__duty_statuses')
+        for trip in trips:
+            driver_key, driver_label = FleetRollups.driver(trip)
+            lane_key, lane_label = FleetRollups.lane(trip)
+            days = FleetRollups.contribution(trip.eld_logs.all())
+            FleetRollups._add(deltas, 'driver', driver_key, driver_label, days, 1)
+            FleetRollups._add(deltas, 'lane', lane_key, lane_label, days, 1)
+            contributions.append(TripRollup(trip=trip, driver_key=driver_key, lane_key=lane_key, days=days))
+        FleetRollups._apply(deltas)
+        TripRollup.objects.bulk_create(contributions)
+
+    @staticmethod
+    def rebuild(batch_size: int = 500) -> int:
+        """
+        Recompute all rollups from the trips in the database
+
+        Contributions of trips that are no longer in the database (archived
+        or deleted) are dropped.
+
+        Returns:
+            Number of trips counted
+        """
+        trip_ids = list(Trip.objects.order_by('id').values_list('id', flat=True))
+        with transaction.atomic():
+            FleetRollup.objects.all().delete()
+            TripRollup.objects.all().delete()
+            for start in range(0, len(trip_ids), batch_size):
+                FleetRollups.record_new_trips(trip_ids[start:start + batch_size])
+        return len(trip_ids)
+
+    # Queries
+
+    @staticmethod
+    def _pieces(start: date, end: date, coarsest: str) -> List[Tuple[str, date, date]]:
+        """
+        Cover a date range with as few rollup rows as possible
+
+        Whole years come from year rows, remaining whole months from month
+        rows and the ragged ends from day rows (never coarser than coarsest).
+
+        Returns:
+            (grain, first period, last period) ranges
+        """
+        pieces = []
+        first_month = start if start.day == 1 else _month_end(start) + timedelta(days=1)
+        last_month = _month_start(end) if end == _month_end(end) else _month_start(_month_start(end) - timedelta(days=1))
+        if coarsest == 'day' or first_month > last_month:
+            pieces.append(('day', start, end))
+        else:
+            pieces += [('day', start, first_month - timedelta(days=1)),
+                       ('day', _month_end(last_month) + timedelta(days=1), end)]
+            first_year = first_month if first_month.month == 1 else date(first_month.year + 1, 1, 1)
+            last_year = last_month.year if last_month.month == 12 else last_month.year - 1
+            if coarsest == 'year' and first_year.year <= last_year:
+                pieces += [('month', first_month, first_year - timedelta(days=1)),
+                           ('year', first_year, date(last_year, 1, 1)),
+                           ('month', date(last_year + 1, 1, 1), last_month)]
+            else:
+                pieces.append(('month', first_month, last_month))
+        return [(grain, low, high) for grain, low, high in pieces if low <= high]
+
+    @staticmethod
+    def _sum(queryset, pieces: List[Tuple[str, date, date]], group_fields: List[str]) -> List[Dict]:
+        """
+        Aggregate in the database, one query per piece so each is a range
+        scan of the (dimension, grain, period, ...) index, and merge the groups
+        """
+        merged = {}
+        size = len(group_fields)
+        for grain, low, high in pieces:
+            for values in queryset.filter(grain=grain, period__range=(low, high)).values(*group_fields).annotate(
+                # Reported as floats anyway; skips a Decimal per group
+                total_miles=Sum('miles', output_field=FloatField()),
+                total_driving=Sum('driving_seconds'),
+                total_on_duty=Sum('on_duty_seconds'),
+                total_trips=Sum('trips'),
+            ).order_by().values_list(*group_fields, 'total_miles', 'total_driving', 'total_on_duty', 'total_trips'):
+                identity, sums = values[:size], values[size:]
+                entry = merged.get(identity)
+                merged[identity] = list(sums) if entry is None else [a + (b or 0) for a, b in zip(entry, sums)]
+        return [
+            {**dict(zip(group_fields, identity)), 'total_miles': miles or 0, 'total_driving': driving or 0,
+             'total_on_duty': on_duty or 0, 'total_trips': trips or 0}
+            for identity, (miles, driving, on_duty, trips) in merged.items()
+        ]
+
+    @staticmethod
+    def query(dimension: str, start: date, end: date, interval: str = 'total',
+              key: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        """
+        Totals for a date range
+
+        Args:
+            dimension: 'driver' or 'lane'
+            start: First day (inclusive)
+            end: Last day (inclusive)
+            interval: 'total', 'month' or 'day'
+            key: Only this driver or lane key
+            limit: Maximum number of keys, busiest (by miles) first
+
+        Returns:
+            Rows with key, label, period (except for 'total'), miles,
+            driving_hours, on_duty_hours and trips
+        """
+        rows = FleetRollup.objects.filter(dimension=dimension)
+        if key:
+            rows = rows.filter(key=key)
+
+        # Busiest keys over the whole range first, then their breakdown
+        pieces = FleetRollups._pieces(start, end, 'year')
+        totals = FleetRollups._sum(rows, pieces, ['key'])
+        totals.sort(key=lambda group: (-group['total_miles'], group['key']))
+        totals = totals[:limit]
+        keys = [group['key'] for group in totals]
+        labels = {}
+        for grain, low, high in pieces:
+            missing = [key for key in keys if key not in labels]
+            if not missing:
+                break
+            labels.update(rows.filter(key__in=missing, grain=grain, period__range=(low, high)).values(
+                'key').annotate(name=Max('label')).order_by().values_list('key', 'name'))
+
+        if interval == 'total':
+            groups = totals
+        else:
+            order = {key: index for index, key in enumerate(keys)}
+            breakdown = rows.filter(key__in=keys)
+            pieces = FleetRollups._pieces(start, end, interval)
+            if interval == 'month':
+                # Month rows already start on the 1st; day rows fold into their month
+                groups = FleetRollups._sum(breakdown.annotate(month=TruncMonth('period')), pieces, ['key', 'month'])
+            else:
+                groups = FleetRollups._sum(breakdown, pieces, ['key', 'period'])
+            groups.sort(key=lambda group: (order[group['key']], group.get('month') or group.get('period')))
+
+        results = []
+        for group in groups:
+            row = {'key': group['key'], 'label': labels.get(group['key'], group['key'])}
+            if interval != 'total':
+                row['period'] = group.get('month') or group.get('period')
+            row.update({
+                'miles': round(group['total_miles'], 2),
+                'driving_hours': round(group['total_driving'] / 3600, 2),
+                'on_duty_hours': round(group['total_on_duty'] / 3600, 2),
+                'trips': group['total_trips'],
+            })
+            results.append(row)
+        return results
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Connects the user cache invalidation and search trigger signals
+        from . import auth_backend  # noqa: F401
+        from . import search  # noqa: F401
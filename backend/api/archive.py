@@ -0,0 +1,295 @@
+"""
+Cold archive for completed trips
+Moves old completed trips, with their route points, ELD logs and duty
+statuses, out of the database into append-only files partitioned by month.
+
+Archive files are columnar: trips are written in row groups, and every
+column of every table in a group is a separate zlib-compressed JSON array,
+so similar values sit together and compress well. A sidecar SQLite index
+maps each trip id to its group's byte range, so reading an archived trip
+is one index lookup and one read of a single group.
+
+File layout:
+    FILE_HEADER, then per row group GROUP_HEADER, a JSON directory
+    ({'trip_ids': [...], 'tables': {table: {'rows': n, 'columns':
+    {column: [offset, length]}}}}) and the column blocks it points to
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from datetime import timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Trip
+from .serializers import (
+    DutyStatusSerializer, ELDLogSerializer, RoutePointSerializer, TripSerializer
+)
+
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_MAGIC = b'TRPA'
+ARCHIVE_VERSION = 1
+FILE_HEADER = struct.Struct('<4sH')    # magic, version
+GROUP_HEADER = struct.Struct('<II')    # directory length, column data length
+
+NESTED_FIELDS = ('route_points', 'eld_logs', 'duty_statuses')
+
+# Columns per table: the API fields plus what a restore would need
+TABLES = {
+    'trips': [field for field in TripSerializer.Meta.fields if field not in NESTED_FIELDS]
+             + ['user_id', 'route_geometry'],
+    'route_points': ['trip_id'] + RoutePointSerializer.Meta.fields,
+    'eld_logs': ['trip_id'] + [field for field in ELDLogSerializer.Meta.fields if field not in NESTED_FIELDS],
+    'duty_statuses': ['log_id'] + DutyStatusSerializer.Meta.fields,
+}
+PRIVATE_COLUMNS = ('user_id', 'route_geometry')
+
+
+def _encode_group(trips: List[Trip]) -> bytes:
+    """Serialize trips (with prefetched children) into one row group"""
+    rows = {table: [] for table in TABLES}
+    for trip, data in zip(trips, TripSerializer(trips, many=True).data):
+        rows['trips'].append({**data, 'user_id': trip.user_id, 'route_geometry': trip.route_geometry})
+        for point in data['route_points']:
+            rows['route_points'].append({**point, 'trip_id': trip.id})
+        for log in data['eld_logs']:
+            rows['eld_logs'].append({**log, 'trip_id': trip.id})
+            for status in log['duty_statuses']:
+                rows['duty_statuses'].append({**status, 'log_id': log['id']})
+
+    directory = {'trip_ids': [trip.id for trip in trips], 'tables': {}}
+    blocks = []
+    offset = 0
+    for table, columns in TABLES.items():
+        entry = directory['tables'][table] = {'rows': len(rows[table]), 'columns': {}}
+        for column in columns:
+            block = zlib.compress(json.dumps(
+                [row.get(column) for row in rows[table]], separators=(',', ':')
+            ).encode('utf-8'), 6)
+            entry['columns'][column] = [offset, len(block)]
+            blocks.append(block)
+            offset += len(block)
+    header = json.dumps(directory, separators=(',', ':')).encode('utf-8')
+    return GROUP_HEADER.pack(len(header), offset) + header + b''.join(blocks)
+
+
+@lru_cache(maxsize=64)
+def _read_group(path: str, offset: int, length: int) -> Dict[str, Dict[str, list]]:
+    """Decode one row group into {table: {column: values}} (recently read groups are cached)"""
+    with open(path, 'rb') as handle:
+        handle.seek(offset)
+        data = handle.read(length)
+    header_length, _ = GROUP_HEADER.unpack_from(data)
+    start = GROUP_HEADER.size + header_length
+    directory = json.loads(data[GROUP_HEADER.size:start])
+    tables = {}
+    for table, entry in directory['tables'].items():
+        tables[table] = {
+            column: json.loads(zlib.decompress(data[start + block_offset:start + block_offset + block_length]))
+            for column, (block_offset, block_length) in entry['columns'].items()
+            # Columns kept only for restores are never decompressed on reads
+            if column not in PRIVATE_COLUMNS
+        }
+    return tables
+
+
+def _table_rows(tables: Dict, table: str, key: str, value) -> List[Dict]:
+    """Rows of a decoded table whose key column equals value, in the table's columns"""
+    columns = tables.get(table, {})
+    keys = columns.get(key, [])
+    names = [name for name in TABLES[table] if name != key]
+    return [
+        {name: columns[name][row] if name in columns else None for name in names}
+        for row in range(len(keys)) if keys[row] == value
+    ]
+
+
+class TripArchive:
+    """Write, index and read archived trips"""
+
+    _local = threading.local()
+
+    INDEX_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS trips (
+            trip_id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            archived_at REAL NOT NULL
+        );
+    """
+
+    @staticmethod
+    def archive_dir() -> Path:
+        return Path(getattr(settings, 'ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+    @staticmethod
+    def _index(create: bool = False) -> Optional[sqlite3.Connection]:
+        """Per-thread connection to the sidecar index; None when there is no archive yet"""
+        path = TripArchive.archive_dir() / 'index.sqlite3'
+        local = TripArchive._local
+        if getattr(local, 'path', None) != path or getattr(local, 'pid', None) != os.getpid():
+            if not create and not path.exists():
+                return None
+            path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(str(path), timeout=10, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(TripArchive.INDEX_SCHEMA)
+            local.connection, local.path, local.pid = connection, path, os.getpid()
+        return local.connection
+
+    @staticmethod
+    def _add_to_index(entries: List[tuple]):
+        connection = TripArchive._index(create=True)
+        now = time.time()
+        connection.execute('BEGIN')
+        # A trip archived again (e.g. after an interrupted run) points at its newest copy
+        connection.executemany(
+            'INSERT OR REPLACE INTO trips (trip_id, path, offset, length, archived_at) VALUES (?, ?, ?, ?, ?)',
+            [(trip_id, path, offset, length, now) for trip_id, path, offset, length in entries]
+        )
+        connection.execute('COMMIT')
+
+    @staticmethod
+    def _write_month(month: str, trip_ids: List[int], group_size: int) -> List[tuple]:
+        """
+        Write one month's trips to a new archive file
+
+        Returns:
+            (trip id, path, offset, length) index entries
+        """
+        directory = TripArchive.archive_dir() / month
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"trips-{timezone.now().strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.arc"
+        relative = str(path.relative_to(TripArchive.archive_dir()))
+        entries = []
+        partial = path.with_suffix('.arc.tmp')
+        with open(partial, 'wb') as handle:
+            handle.write(FILE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION))
+            for start in range(0, len(trip_ids), group_size):
+                trips = list(Trip.objects.filter(id__in=trip_ids[start:start + group_size]).order_by('id')
+                             .prefetch_related('route_points', 'eld_logs__duty_statuses'))
+                group = _encode_group(trips)
+                offset = handle.tell()
+                handle.write(group)
+                entries.extend((trip.id, relative, offset, len(group)) for trip in trips)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(partial, path)
+        return entries
+
+    @staticmethod
+    def archive(older_than_days: int = 90, group_size: Optional[int] = None, dry_run: bool = False) -> Dict:
+        """
+        Move completed trips last updated more than older_than_days ago into the archive
+
+        Files are written and indexed before the trips are deleted, so an
+        interrupted run never loses a trip (at worst it is archived twice).
+
+        Args:
+            older_than_days: Age threshold in days
+            group_size: Trips per row group (default ARCHIVE_ROW_GROUP_TRIPS)
+            dry_run: Only count what would be archived
+
+        Returns:
+            Dictionary with trips archived, months, files, bytes written and elapsed seconds
+        """
+        started = time.perf_counter()
+        group_size = group_size or getattr(settings, 'ARCHIVE_ROW_GROUP_TRIPS', 100)
+        cutoff = timezone.now() - timedelta(days=older_than_days)
+        months: Dict[str, List[int]] = {}
+        for trip_id, created_at in Trip.objects.filter(
+            status='completed', updated_at__lt=cutoff
+        ).order_by('created_at', 'id').values_list('id', 'created_at'):
+            months.setdefault(timezone.localtime(created_at).strftime('%Y-%m'), []).append(trip_id)
+
+        result = {'trips': sum(len(ids) for ids in months.values()), 'months': len(months),
+                  'files': 0, 'bytes': 0}
+        if not dry_run:
+            for month, trip_ids in months.items():
+                entries = TripArchive._write_month(month, trip_ids, group_size)
+                TripArchive._add_to_index(entries)
+                result['files'] += 1
+                result['bytes'] += (TripArchive.archive_dir() / entries[0][1]).stat().st_size if entries else 0
+                for start in range(0, len(trip_ids), 1000):
+                    with transaction.atomic():
+                        Trip.objects.filter(id__in=trip_ids[start:start + 1000]).delete()
+                logger.info("Archived %d trips from %s", len(trip_ids), month)
+        result['elapsed_seconds'] = round(time.perf_counter() - started, 2)
+        return result
+
+    @staticmethod
+    def load(trip_id: int) -> Optional[Dict]:
+        """
+        Read an archived trip
+
+        Returns:
+            The trip in the trip detail (TripSerializer) shape, or None
+            when it is not in the archive
+        """
+        connection = TripArchive._index()
+        if connection is None:
+            return None
+        row = connection.execute('SELECT path, offset, length FROM trips WHERE trip_id = ?', (trip_id,)).fetchone()
+        if row is None:
+            return None
+        path, offset, length = row
+        tables = _read_group(str(TripArchive.archive_dir() / path), offset, length)
+        trips = _table_rows(tables, 'trips', 'id', trip_id)
+        if not trips:
+            return None
+        trip = {'id': trip_id, **trips[0]}
+        for column in PRIVATE_COLUMNS:
+            del trip[column]
+        trip['route_points'] = _table_rows(tables, 'route_points', 'trip_id', trip_id)
+        trip['eld_logs'] = []
+        for log in _table_rows(tables, 'eld_logs', 'trip_id', trip_id):
+            log['duty_statuses'] = _table_rows(tables, 'duty_statuses', 'log_id', log['id'])
+            trip['eld_logs'].append(log)
+        return trip
+
+    @staticmethod
+    def rebuild_index() -> int:
+        """
+        Recreate the sidecar index by walking every archive file
+
+        Returns:
+            Number of trips indexed
+        """
+        root = TripArchive.archive_dir()
+        entries = []
+        for path in sorted(root.glob('*/*.arc')):
+            relative = str(path.relative_to(root))
+            with open(path, 'rb') as handle:
+                magic, version = FILE_HEADER.unpack(handle.read(FILE_HEADER.size))
+                if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+                    logger.warning("Skipping %s, not a version %d archive", relative, ARCHIVE_VERSION)
+                    continue
+                while True:
+                    offset = handle.tell()
+                    header = handle.read(GROUP_HEADER.size)
+                    if len(header) < GROUP_HEADER.size:
+                        break
+                    header_length, data_length = GROUP_HEADER.unpack(header)
+                    directory = json.loads(handle.read(header_length))
+                    handle.seek(data_length, os.SEEK_CUR)
+                    length = GROUP_HEADER.size + header_length + data_length
+                    entries.extend((trip_id, relative, offset, length) for trip_id in directory['trip_ids'])
+        connection = TripArchive._index(create=True)
+        connection.execute('DELETE FROM trips')
+        TripArchive._add_to_index(entries)
+        _read_group.cache_clear()
+        return len({entry[0] for entry in entries})
@@ -0,0 +1,218 @@
+"""
+Driver-to-load assignment
+Builds a deadhead cost matrix from DistanceMatrixService distances, masks
+pairs that would exceed the driver's remaining HOS cycle, and solves the
+assignment with the Hungarian algorithm (pure Python, O(n^2 m))
+"""
+
+import time
+from typing import Dict, List, Optional
+
+from .calculations import HOSCalculator
+from .matrix_service import DistanceMatrixService
+
+
+# Cost for pairs that are infeasible or unresolved; large enough that the
+# solver only uses them when nothing else is left, then they are dropped
+INFEASIBLE_COST = 1e7
+
+
+def solve_assignment(cost: List[List[float]]) -> List[int]:
+    """
+    Minimum-cost assignment (Hungarian algorithm, shortest augmenting paths)
+
+    Args:
+        cost: Rectangular cost matrix, rows x columns
+
+    Returns:
+        Assigned column for every row, -1 for rows left unassigned when
+        there are more rows than columns
+    """
+    if not cost or not cost[0]:
+        return [-1] * len(cost)
+    rows, columns = len(cost), len(cost[0])
+    if rows > columns:
+        # Solve the transpose so every row of the working matrix gets a column
+        transposed = [list(column) for column in zip(*cost)]
+        assignment = [-1] * rows
+        for column, row in enumerate(solve_assignment(transposed)):
+            if row >= 0:
+                assignment[row] = column
+        return assignment
+
+    infinity = float('inf')
+    u = [0.0] * (rows + 1)
+    v = [0.0] * (columns + 1)
+    owner = [0] * (columns + 1)  # owner[j]: 1-based row matched to column j
+    for row in range(1, rows + 1):
+        owner[0] = row
+        j0 = 0
+        minv = [infinity] * (columns + 1)
+        way = [0] * (columns + 1)
+        unused = list(range(1, columns + 1))
+        used = [0]
+        used_at = {0: 0.0}
+        # Dual updates are accumulated in offset instead of touching every
+        # column per step; used columns settle their share once per row
+        offset = 0.0
+        while True:
+            i0 = owner[j0]
+            cost_row = cost[i0 - 1]
+            base = offset - u[i0]
+            delta = infinity
+            j1 = 0
+            for j in unused:
+                reduced = cost_row[j - 1] + base - v[j]
+                if reduced < minv[j]:
+                    minv[j] = reduced
+                    way[j] = j0
+                else:
+                    reduced = minv[j]
+                if reduced < delta:
+                    delta = reduced
+                    j1 = j
+            offset = delta
+            j0 = j1
+            unused.remove(j0)
+            used.append(j0)
+            used_at[j0] = offset
+            if owner[j0] == 0:
+                break
+        for j in used:
+            shift = offset - used_at[j]
+            v[j] -= shift
+            u[owner[j]] += shift
+        # Flip the augmenting path
+        while j0:
+            j1 = way[j0]
+            owner[j0] = owner[j1]
+            j0 = j1
+
+    assignment = [-1] * rows
+    for column in range(1, columns + 1):
+        if owner[column]:
+            assignment[owner[column] - 1] = column - 1
+    return assignment
+
+
+class LoadAssignmentOptimizer:
+    """Assign loads to drivers minimising deadhead within HOS cycle limits"""
+
+    @staticmethod
+    def build_costs(deadhead: List[List[Optional[float]]], loaded: List[Optional[float]],
+                    cycle_used: List[float], max_deadhead_miles: Optional[float] = None,
+                    deadhead_hours: Optional[List[List[Optional[float]]]] = None,
+                    loaded_hours: Optional[List[Optional[float]]] = None) -> Dict:
+        """
+        Cost and feasibility matrices for every driver/load pair
+
+        Args:
+            deadhead: Driver location -> pickup miles, drivers x loads
+            loaded: Pickup -> dropoff miles per load
+            cycle_used: Cycle hours already used per driver
+            max_deadhead_miles: Optional cap on empty miles per assignment
+            deadhead_hours: Route durations matching deadhead, if known
+            loaded_hours: Route durations matching loaded, if known
+
+        Returns:
+            Dictionary with cost (deadhead or INFEASIBLE_COST) and the
+            HOSCalculator.feasibility_matrix output for the full trips
+        """
+        trip_miles = [
+            [None if empty is None or loaded[column] is None else empty + loaded[column]
+             for column, empty in enumerate(row)]
+            for row in deadhead
+        ]
+        trip_hours = None
+        if deadhead_hours is not None and loaded_hours is not None:
+            trip_hours = [
+                [None if empty is None or loaded_hours[column] is None else empty + loaded_hours[column]
+                 for column, empty in enumerate(row)]
+                for row in deadhead_hours
+            ]
+        feasibility = HOSCalculator.feasibility_matrix(trip_miles, cycle_used, trip_hours)
+        cost = []
+        for row, feasible_row in zip(deadhead, feasibility['feasible']):
+            cost.append([
+                empty if feasible and (max_deadhead_miles is None or empty <= max_deadhead_miles)
+                else INFEASIBLE_COST
+                for empty, feasible in zip(row, feasible_row)
+            ])
+        feasibility['cost'] = cost
+        return feasibility
+
+    @staticmethod
+    def optimize(drivers: List[Dict], loads: List[Dict], max_deadhead_miles: Optional[float] = None) -> Dict:
+        """
+        Assign at most one load per driver, minimising total deadhead miles
+
+        Args:
+            drivers: Dicts with id, location and cycle_used
+            loads: Dicts with id, pickup_location and dropoff_location
+            max_deadhead_miles: Optional cap on empty miles per assignment
+
+        Returns:
+            Dictionary with assignments, unassigned driver/load ids, total
+            deadhead miles and timing statistics
+        """
+        started = time.perf_counter()
+        deadhead = DistanceMatrixService.compute(
+            [driver['location'] for driver in drivers],
+            [load['pickup_location'] for load in loads]
+        )
+        loaded = DistanceMatrixService.compute_pairs(
+            [(load['pickup_location'], load['dropoff_location']) for load in loads]
+        )
+        matrix_done = time.perf_counter()
+
+        costs = LoadAssignmentOptimizer.build_costs(
+            deadhead['distance_miles'], loaded['distance_miles'],
+            [float(driver.get('cycle_used', 0)) for driver in drivers], max_deadhead_miles,
+            deadhead['duration_hours'], loaded['duration_hours']
+        )
+        # Drivers and loads without a single feasible pairing would only make
+        # the solver explore the whole matrix before landing on INFEASIBLE_COST
+        cost = costs['cost']
+        rows = [
+            row for row, row_costs in enumerate(cost)
+            if min(row_costs, default=INFEASIBLE_COST) < INFEASIBLE_COST
+        ]
+        columns = [
+            column for column in range(len(loads))
+            if any(cost[row][column] < INFEASIBLE_COST for row in rows)
+        ]
+        assignment = solve_assignment([[cost[row][column] for column in columns] for row in rows])
+        solve_done = time.perf_counter()
+
+        assignments = []
+        assigned_loads = set()
+        for row, position in zip(rows, assignment):
+            column = columns[position] if position >= 0 else -1
+            # Infeasible cells only get picked when no feasible option is left
+            if column < 0 or cost[row][column] >= INFEASIBLE_COST:
+                continue
+            assigned_loads.add(column)
+            assignments.append({
+                'driver_id': drivers[row]['id'],
+                'load_id': loads[column]['id'],
+                'deadhead_miles': deadhead['distance_miles'][row][column],
+                'loaded_miles': loaded['distance_miles'][column],
+                'total_trip_time': round(costs['total_trip_time'][row][column], 2),
+                'remaining_cycle_hours': round(costs['remaining_cycle_hours'][row], 2),
+            })
+
+        assigned_drivers = {item['driver_id'] for item in assignments}
+        return {
+            'assignments': assignments,
+            'unassigned_drivers': [driver['id'] for driver in drivers if driver['id'] not in assigned_drivers],
+            'unassigned_loads': [load['id'] for column, load in enumerate(loads) if column not in assigned_loads],
+            'total_deadhead_miles': round(sum(item['deadhead_miles'] for item in assignments), 2),
+            'stats': {
+                'drivers': len(drivers),
+                'loads': len(loads),
+                'matrix_ms': round((matrix_done - started) * 1000, 1),
+                'solve_ms': round((solve_done - matrix_done) * 1000, 1),
+                'deadhead_matrix': deadhead['stats'],
+                'loaded_pairs': loaded['stats'],
+            },
+        }
@@ -0,0 +1,104 @@
+"""
+Cached authentication backend
+ModelBackend with two shortcuts for the request hot path: users are kept in
+a per-process cache for USER_CACHE_TIMEOUT seconds, so a request with a
+valid session doesn't query auth_user, and logins look users up by email
+(indexed by migration 0007) and check the password in the same step.
+
+Saving or deleting a user drops it from this process's cache and bumps its
+version in the Django cache, which other processes check before using
+their copy. That only reaches other workers when the default cache is
+shared between them, so the user cache stays off with the per-process
+LocMemCache or DummyCache backends.
+"""
+
+import copy
+import threading
+import time
+from typing import Dict, Tuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+
+# Cache backends whose entries other worker processes can't see
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def _version_key(user_id) -> str:
+    return f'auth-user-version:{user_id}'
+
+
+def user_cache_enabled() -> bool:
+    """True when USER_CACHE_TIMEOUT is set and the default cache is shared"""
+    if not getattr(settings, 'USER_CACHE_TIMEOUT', 300):
+        return False
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    return backend not in LOCAL_CACHE_BACKENDS
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend with cached get_user() and email logins"""
+
+    _users: Dict[str, Tuple[object, int, float]] = {}  # user id -> (user, version, expires)
+    _lock = threading.Lock()
+
+    def authenticate(self, request, username=None, password=None, email=None, **kwargs):
+        """Authenticate by username (like ModelBackend) or by email"""
+        if email is None:
+            return super().authenticate(request, username=username, password=password, **kwargs)
+        if password is None:
+            return None
+        User = get_user_model()
+        try:
+            user = User._default_manager.get(email=email)
+        except User.DoesNotExist:
+            # Run the hasher anyway so unknown emails take as long as wrong passwords
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        if not user_cache_enabled():
+            return super().get_user(user_id)
+        timeout = getattr(settings, 'USER_CACHE_TIMEOUT', 300)
+        key = str(user_id)
+        version = cache.get(_version_key(key), 0)
+        entry = CachedModelBackend._users.get(key)
+        if entry is not None and entry[1] == version and entry[2] > time.monotonic():
+            if not self.user_can_authenticate(entry[0]):
+                return None
+            # Requests get their own copy so attributes set on one don't leak into another
+            return copy.copy(entry[0])
+
+        user = super().get_user(user_id)
+        if user is not None:
+            with CachedModelBackend._lock:
+                CachedModelBackend._users[key] = (copy.copy(user), version, time.monotonic() + timeout)
+        return user
+
+    @staticmethod
+    def invalidate(user_id):
+        """Forget a user in this process and make other processes refetch it"""
+        key = str(user_id)
+        with CachedModelBackend._lock:
+            CachedModelBackend._users.pop(key, None)
+        try:
+            cache.incr(_version_key(key))
+        except ValueError:
+            cache.set(_version_key(key), 1, None)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def _user_changed(sender, instance, **kwargs):
+    CachedModelBackend.invalidate(instance.pk)
@@ -0,0 +1,453 @@
+"""
+Benchmark suite for the trip planning pipeline
+Times the HOS calculations, log/route generation and the API endpoints so
+changes can be compared run over run
+"""
+
+import io
+import platform
+import random
+import statistics
+import subprocess
+import time
+from contextlib import ExitStack, redirect_stdout
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from .assignment import LoadAssignmentOptimizer, solve_assignment
+from .calculations import HOSCalculator
+from .matrix_service import DistanceMatrixService
+from .models import Trip, RoutePoint, ELDLog, DutyStatus
+from .ors_standin import LatencyDistribution, ORSStandInServer, StandInConfig
+from .scheduling import AppointmentScheduler
+from .sleeper_planner import SleeperBerthPlanner
+from .timeline import DutyTimeline
+from .violations import HOSViolationScanner
+
+
+# Locations used for generated workloads
+SAMPLE_LOCATIONS = [
+    'New York, NY', 'Los Angeles, CA', 'Chicago, IL', 'Houston, TX',
+    'Phoenix, AZ', 'Dallas, TX', 'Miami, FL', 'Seattle, WA',
+    'Portland, OR', 'Denver, CO', 'Atlanta, GA', 'Memphis, TN',
+]
+
+# Wider set of lanes for the many-to-many matrix case
+MATRIX_LOCATIONS = SAMPLE_LOCATIONS + [
+    'Boston, MA', 'Detroit, MI', 'Nashville, TN', 'Kansas City, MO', 'Salt Lake City, UT',
+    'Las Vegas, NV', 'Albuquerque, NM', 'Oklahoma City, OK', 'Omaha, NE', 'Minneapolis, MN',
+    'Charlotte, NC', 'Jacksonville, FL', 'Louisville, KY', 'Indianapolis, IN', 'Columbus, OH',
+    'Pittsburgh, PA', 'Baltimore, MD', 'Richmond, VA', 'El Paso, TX', 'San Antonio, TX',
+    'Sacramento, CA', 'Boise, ID', 'Spokane, WA', 'Billings, MT', 'Fargo, ND',
+    'Little Rock, AR', 'Birmingham, AL', 'Savannah, GA', 'Tampa, FL', 'New Orleans, LA',
+]
+
+
+def _git_revision() -> Optional[str]:
+    """Return the current git commit, if the tree is a checkout"""
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            timeout=5, cwd=settings.BASE_DIR
+        )
+        if result.returncode == 0:
+            return result.stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return None
+
+
+def summarize(name: str, samples_ns: List[int], extra: Optional[dict] = None) -> dict:
+    """
+    Reduce raw timings to summary statistics
+
+    Args:
+        name: Benchmark case name
+        samples_ns: Per-iteration timings in nanoseconds
+        extra: Additional fields merged into the result
+
+    Returns:
+        Dictionary of timing statistics in milliseconds
+    """
+    samples_ms = sorted(sample / 1e6 for sample in samples_ns)
+    p95_index = min(len(samples_ms) - 1, int(round(0.95 * (len(samples_ms) - 1))))
+    mean_ms = statistics.fmean(samples_ms)
+    result = {
+        'name': name,
+        'iterations': len(samples_ms),
+        'mean_ms': round(mean_ms, 4),
+        'median_ms': round(statistics.median(samples_ms), 4),
+        'p95_ms': round(samples_ms[p95_index], 4),
+        'min_ms': round(samples_ms[0], 4),
+        'max_ms': round(samples_ms[-1], 4),
+        'stdev_ms': round(statistics.stdev(samples_ms), 4) if len(samples_ms) > 1 else 0.0,
+        'ops_per_sec': round(1000.0 / mean_ms, 2) if mean_ms else None,
+    }
+    if extra:
+        result.update(extra)
+    return result
+
+
+class BenchmarkSuite:
+    """Collection of timed benchmark cases for the trip planning pipeline"""
+
+    def __init__(self, iterations: int = 50, warmup: int = 5, seed_trips: int = 200,
+                 batch_size: int = 1000, seed: int = 42, ors_latency: Optional[str] = None):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.seed_trips = seed_trips
+        self.batch_size = batch_size
+        self.seed = seed
+        self.ors_latency = LatencyDistribution.parse(ors_latency)
+        self.client = Client()
+        self.cases: Dict[str, Callable[[], dict]] = {
+            'hos_scalar': self.bench_hos_scalar,
+            'hos_batch': self.bench_hos_batch,
+            'eld_logs': self.bench_eld_logs,
+            'duty_timeline': self.bench_duty_timeline,
+            'route_points': self.bench_route_points,
+            'sleeper_plan': self.bench_sleeper_plan,
+            'appointment_schedule': self.bench_appointment_schedule,
+            'calculate_endpoint': self.bench_calculate_endpoint,
+            'distance_matrix': self.bench_distance_matrix,
+            'assignment': self.bench_assignment,
+            'read_endpoints': self.bench_read_endpoints,
+            'violation_scan': self.bench_violation_scan,
+        }
+
+    def _time(self, func: Callable[[], object], iterations: Optional[int] = None) -> List[int]:
+        """Run func with warmup and return per-iteration timings in nanoseconds"""
+        for _ in range(self.warmup):
+            func()
+        samples = []
+        for _ in range(iterations or self.iterations):
+            start = time.perf_counter_ns()
+            func()
+            samples.append(time.perf_counter_ns() - start)
+        return samples
+
+    def _time_request(self, name: str, func: Callable[[], object]) -> dict:
+        """Time an endpoint call, silencing view debug output and counting queries"""
+        queries = []
+
+        def count_queries(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        sink = io.StringIO()
+        with redirect_stdout(sink):
+            with connection.execute_wrapper(count_queries):
+                func()
+            samples = self._time(func)
+        return summarize(name, samples, {'queries': len(queries)})
+
+    def _ors_standin(self):
+        """Context manager running the ORS stand-in with DistanceService pointed at it"""
+        config = StandInConfig(
+            geocode_latency=self.ors_latency, directions_latency=self.ors_latency, seed=self.seed
+        )
+        server = ORSStandInServer(config)
+        stack = ExitStack()
+        stack.enter_context(server)
+        # The shared ORS quota limiter would pace the timed loops, not measure them
+        stack.enter_context(override_settings(ORS_BASE_URL=server.base_url, ORS_RATE_LIMITS={}))
+        return stack
+
+    def _sample_details(self, distance: float = 2800.0) -> dict:
+        # DistanceService returns distances as floats, so the benchmarks do too
+        return HOSCalculator.calculate_trip_details(Decimal('25.50'), distance)
+
+    # Pure calculation cases
+
+    def bench_hos_scalar(self) -> List[dict]:
+        samples = self._time(lambda: self._sample_details(1234.56))
+        return [summarize('hos_scalar', samples)]
+
+    def bench_hos_batch(self) -> List[dict]:
+        rng = random.Random(self.seed)
+        batch = [
+            (Decimal(str(round(rng.uniform(0, 60), 2))), round(rng.uniform(50, 3000), 2))
+            for _ in range(self.batch_size)
+        ]
+
+        def run_batch():
+            for cycle_used, distance in batch:
+                HOSCalculator.calculate_trip_details(cycle_used, distance)
+
+        samples = self._time(run_batch)
+        return [summarize('hos_batch', samples, {'batch_size': self.batch_size})]
+
+    def bench_eld_logs(self) -> List[dict]:
+        details = self._sample_details()
+        start = timezone.now()
+        samples = self._time(lambda: HOSCalculator.generate_eld_logs(details, start))
+        return [summarize('eld_logs', samples, {'days': details['days_needed']})]
+
+    def bench_duty_timeline(self) -> List[dict]:
+        start = timezone.now().replace(hour=6, minute=0, second=0, microsecond=0)
+        plan = SleeperBerthPlanner.plan(2500, 20, start)
+        statuses = max((log['duty_statuses'] for log in SleeperBerthPlanner.generate_eld_logs(plan)), key=len)
+        timeline, remarks = DutyTimeline.encode(statuses)
+        extra = {'statuses': len(statuses), 'bytes': len(timeline)}
+        return [
+            summarize('duty_timeline_encode', self._time(lambda: DutyTimeline.encode(statuses)), extra),
+            summarize('duty_timeline_decode', self._time(lambda: DutyTimeline.decode(timeline, remarks)), extra),
+        ]
+
+    def bench_route_points(self) -> List[dict]:
+        details = self._sample_details()
+        samples = self._time(lambda: HOSCalculator.generate_route_points(
+            'New York, NY', 'Chicago, IL', 'Los Angeles, CA', details
+        ))
+        return [summarize('route_points', samples)]
+
+    def bench_appointment_schedule(self) -> List[dict]:
+        start = datetime(2024, 1, 1, 6, 0)
+
+        def solve():
+            return AppointmentScheduler(
+                250.0, 1400.0, 25.5, start,
+                pickup_window=(start + timedelta(hours=14), start + timedelta(hours=20)),
+                dropoff_window=(start + timedelta(days=3), start + timedelta(days=4)),
+            ).solve()
+
+        samples = self._time(solve)
+        result = summarize('appointment_schedule', samples)
+        result['candidates'] = solve()['candidates_evaluated']
+        return [result]
+
+    def bench_sleeper_plan(self) -> List[dict]:
+        start = datetime(2024, 1, 1, 6, 0)
+        samples = self._time(lambda: SleeperBerthPlanner.plan(3000.0, 25.5, start))
+        result = summarize('sleeper_plan', samples)
+        result['distance_miles'] = 3000
+        return [result]
+
+    # Endpoint cases
+
+    def bench_calculate_endpoint(self) -> List[dict]:
+        payload = {
+            'current_location': 'New York, NY',
+            'pickup_location': 'Chicago, IL',
+            'dropoff_location': 'Los Angeles, CA',
+            'current_cycle_used': 25.5,
+        }
+
+        def calculate(clear_cache: bool):
+            if clear_cache:
+                cache.clear()
+            return self.client.post('/api/calculate/', data=payload, content_type='application/json')
+
+        with self._ors_standin():
+            # Cold: every iteration goes upstream; cached: routes come from the cache
+            results = [
+                self._time_request('calculate_endpoint', lambda: calculate(True)),
+                self._time_request('calculate_endpoint_cached', lambda: calculate(False)),
+            ]
+        for result in results:
+            result['ors_latency'] = str(self.ors_latency)
+        return results
+
+    def bench_distance_matrix(self) -> List[dict]:
+        rng = random.Random(self.seed)
+        origins = [rng.choice(MATRIX_LOCATIONS) for _ in range(50)]
+        destinations = [rng.choice(MATRIX_LOCATIONS) for _ in range(200)]
+
+        def compute(clear_cache: bool):
+            if clear_cache:
+                cache.clear()
+            return DistanceMatrixService.compute_with_feasibility(origins, destinations, 25.5)
+
+        with self._ors_standin():
+            results = [
+                summarize('distance_matrix', self._time(lambda: compute(True), iterations=min(self.iterations, 10))),
+                summarize('distance_matrix_cached', self._time(lambda: compute(False), iterations=min(self.iterations, 10))),
+            ]
+        for result in results:
+            result.update({'origins': len(origins), 'destinations': len(destinations)})
+        return results
+
+    def bench_assignment(self) -> List[dict]:
+        rng = random.Random(self.seed)
+        size = 500
+        # Deadhead-like costs with roughly a quarter of the pairs infeasible
+        points = [(rng.uniform(0, 2500), rng.uniform(0, 1200)) for _ in range(2 * size)]
+        cost = [
+            [1e7 if rng.random() < 0.25 else ((dx - px) ** 2 + (dy - py) ** 2) ** 0.5 for px, py in points[size:]]
+            for dx, dy in points[:size]
+        ]
+        drivers = [
+            {'id': str(index), 'location': rng.choice(MATRIX_LOCATIONS), 'cycle_used': rng.uniform(0, 60)}
+            for index in range(100)
+        ]
+        loads = [
+            {'id': str(index), 'pickup_location': rng.choice(MATRIX_LOCATIONS),
+             'dropoff_location': rng.choice(MATRIX_LOCATIONS)}
+            for index in range(100)
+        ]
+
+        def optimize():
+            cache.clear()
+            return LoadAssignmentOptimizer.optimize(drivers, loads)
+
+        solver = summarize('assignment_solver', self._time(lambda: solve_assignment(cost), iterations=min(self.iterations, 5)))
+        solver.update({'drivers': size, 'loads': size})
+        with self._ors_standin():
+            optimizer = summarize('assignment_optimize', self._time(optimize, iterations=min(self.iterations, 10)))
+        optimizer.update({'drivers': len(drivers), 'loads': len(loads)})
+        return [solver, optimizer]
+
+    def bench_read_endpoints(self) -> List[dict]:
+        trip_id = Trip.objects.order_by('id').values_list('id', flat=True).first()
+        if trip_id is None:
+            return []
+        endpoints = [
+            ('trip_list', '/api/trips/'),
+            ('trip_detail', f'/api/trips/{trip_id}/'),
+            ('trip_route', f'/api/trips/{trip_id}/route/'),
+            ('trip_eld_logs', f'/api/trips/{trip_id}/logs/'),
+        ]
+        results = []
+        for name, url in endpoints:
+            result = self._time_request(name, lambda url=url: self.client.get(url))
+            result['seed_trips'] = self.seed_trips
+            results.append(result)
+        return results
+
+    def bench_violation_scan(self) -> List[dict]:
+        samples = self._time(lambda: HOSViolationScanner().scan(full=True), iterations=min(self.iterations, 10))
+        result = summarize('violation_scan', samples)
+        result['duty_statuses'] = DutyStatus.objects.count()
+        result['rows_per_sec'] = round(result['duty_statuses'] / (result['mean_ms'] / 1000)) if result['mean_ms'] else None
+        return [result]
+
+    # Database seeding
+
+    def seed_database(self):
+        """Populate the benchmark database with generated trips, routes and logs"""
+        rng = random.Random(self.seed)
+        start = timezone.now()
+        trips = []
+        plans = []
+        for _ in range(self.seed_trips):
+            current, pickup, dropoff = rng.sample(SAMPLE_LOCATIONS, 3)
+            cycle_used = Decimal(str(round(rng.uniform(0, 60), 2)))
+            distance = round(rng.uniform(100, 3000), 2)
+            details = HOSCalculator.calculate_trip_details(cycle_used, distance)
+            trips.append(Trip(
+                current_location=current,
+                pickup_location=pickup,
+                dropoff_location=dropoff,
+                current_cycle_used=cycle_used,
+                total_distance=details['total_distance'],
+                estimated_drive_time=details['estimated_drive_time'],
+                total_trip_time=details['total_trip_time'],
+                fuel_stops=details['fuel_stops'],
+                rest_stops=details['rest_stops'],
+                status='planned'
+            ))
+            plans.append((
+                HOSCalculator.generate_route_points(current, pickup, dropoff, details),
+                HOSCalculator.generate_eld_logs(details, start),
+            ))
+        trips = Trip.objects.bulk_create(trips)
+
+        route_points = []
+        logs = []
+        log_statuses = []
+        for trip, (points, eld_logs) in zip(trips, plans):
+            for point in points:
+                route_points.append(RoutePoint(
+                    trip=trip,
+                    point_type=point['point_type'],
+                    latitude=point['latitude'],
+                    longitude=point['longitude'],
+                    address=point['address'],
+                    sequence=point['sequence'],
+                    duration_minutes=point['duration_minutes']
+                ))
+            for log_data in eld_logs:
+                logs.append(ELDLog(
+                    trip=trip,
+                    date=log_data['date'],
+                    total_miles=log_data['total_miles']
+                ))
+                log_statuses.append(log_data['duty_statuses'])
+        RoutePoint.objects.bulk_create(route_points, batch_size=1000)
+        DutyTimeline.create_logs(logs, log_statuses, batch_size=1000)
+
+    def run(self, selected: Optional[List[str]] = None, progress: Optional[Callable[[str], None]] = None) -> dict:
+        """
+        Run the selected benchmark cases
+
+        Args:
+            selected: Case names to run (all cases when empty)
+            progress: Optional callback receiving each case name before it runs
+
+        Returns:
+            Dictionary with run metadata and per-case results
+        """
+        names = selected or list(self.cases)
+        unknown = [name for name in names if name not in self.cases]
+        if unknown:
+            raise ValueError(f"Unknown benchmark cases: {', '.join(unknown)}")
+
+        results = []
+        for name in names:
+            if progress:
+                progress(name)
+            results.extend(self.cases[name]())
+
+        return {
+            'timestamp': datetime.now().astimezone().isoformat(),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+            'database': connection.vendor,
+            'options': {
+                'iterations': self.iterations,
+                'warmup': self.warmup,
+                'seed_trips': self.seed_trips,
+                'batch_size': self.batch_size,
+                'seed': self.seed,
+                'ors_latency': str(self.ors_latency),
+            },
+            'results': results,
+        }
+
+
+def compare_runs(baseline: dict, current: dict) -> List[dict]:
+    """
+    Compare two benchmark runs case by case
+
+    Args:
+        baseline: Earlier run loaded from JSON
+        current: New run
+
+    Returns:
+        List of rows with baseline/current mean and the relative change
+    """
+    previous = {result['name']: result for result in baseline.get('results', [])}
+    rows = []
+    for result in current['results']:
+        before = previous.get(result['name'])
+        if not before:
+            continue
+        change = (result['mean_ms'] - before['mean_ms']) / before['mean_ms'] if before['mean_ms'] else 0.0
+        rows.append({
+            'name': result['name'],
+            'baseline_mean_ms': before['mean_ms'],
+            'current_mean_ms': result['mean_ms'],
+            'change_pct': round(change * 100, 1),
+        })
+    return rows
@@ -0,0 +1,375 @@
+"""
+Bulk trip planning
+Plans a CSV or NDJSON file of trip requests the way /api/calculate/ plans
+one, without the HTTP round trips. Rows are read in chunks: the main
+process validates them and routes each distinct lane once (through the
+shared geocode and route caches and the ORS rate limiter, at batch
+priority), a process pool does the HOS planning, and the main process
+writes each chunk with bulk inserts while the pool plans the next one.
+
+Every chunk is committed together with the run's progress (PlanningRun)
+and its lines in the results file, so an interrupted run resumes after the
+last committed row without planning anything twice.
+"""
+
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.db import connections, transaction
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from .analytics import FleetRollups
+from .calculations import HOSCalculator
+from .distance_service import DistanceService, LocationNotFound
+from .fuel_planner import FuelStopPlanner
+from .models import ELDLog, PlanningRun, RoutePoint, Trip
+from .rate_limiter import BATCH, OrsRateLimiter
+from .scheduling import AppointmentScheduler
+from .serializers import TripCalculationRequestSerializer
+from .sleeper_planner import SleeperBerthPlanner
+from .speed_profiles import HourlySpeeds, SpeedProfiles
+from .timeline import DutyTimeline
+
+
+def read_rows(path: Path) -> Iterator[Tuple[int, Dict]]:
+    """
+    Stream (row number, request) pairs from a CSV or NDJSON file
+
+    CSV columns are the /api/calculate/ fields; empty cells are left out so
+    optional fields get their defaults. Rows are numbered from 1.
+    """
+    with open(path, newline='', encoding='utf-8') as handle:
+        if path.suffix.lower() in ('.ndjson', '.jsonl'):
+            number = 0
+            for line in handle:
+                if line.strip():
+                    number += 1
+                    yield number, json.loads(line)
+        else:
+            for number, row in enumerate(csv.DictReader(handle), start=1):
+                yield number, {key: value for key, value in row.items() if key and value not in ('', None)}
+
+
+def plan_trip(job: Dict) -> Dict:
+    """
+    The CPU-bound part of /api/calculate/ for one request (runs in pool workers)
+
+    Args:
+        job: Validated request data with the routed distances and the chunk's start time
+
+    Returns:
+        trip_details, route_points, eld_logs and optional sleeper_plan,
+        schedule and fuel_plan, or an error
+    """
+    data = job['data']
+    try:
+        schedule = None
+        if job['legs']:
+            pickup_miles, delivery_miles = job['legs']
+            schedule = AppointmentScheduler(
+                pickup_miles, delivery_miles, data['current_cycle_used'],
+                data.get('earliest_departure') or job['now'],
+                pickup_window=(data.get('pickup_window_start'), data.get('pickup_window_end')),
+                dropoff_window=(data.get('dropoff_window_start'), data.get('dropoff_window_end')),
+                speeds=job['speeds']
+            ).solve()
+            if not schedule['feasible']:
+                return {'error': f"No HOS-compliant schedule meets the appointment windows: {schedule['reason']}"}
+
+        departure = schedule['schedule']['departure'] if schedule else job['now']
+        drive_hours = None
+        if job['speeds']:
+            drive_hours = job['speeds'].drive_minutes(
+                job['distance_miles'], HourlySpeeds.minute_of_day(departure)) / 60
+        fuel_plan = FuelStopPlanner.plan(
+            job['route'].get('route_info', {}).get('coordinates', []), job['distance_miles'],
+            data['current_cycle_used'], job['speeds'], departure
+        )
+        trip_details = HOSCalculator.calculate_trip_details(
+            data['current_cycle_used'], job['distance_miles'], drive_hours,
+            len(fuel_plan['stops']) if fuel_plan else None
+        )
+        route_points = HOSCalculator.generate_route_points(
+            data['current_location'], data['pickup_location'], data['dropoff_location'], trip_details, fuel_plan
+        )
+        sleeper_plan = None
+        if schedule:
+            eld_logs = HOSCalculator.generate_eld_logs_from_events(schedule.pop('events'))
+        elif data['use_sleeper_berth']:
+            start = timezone.localtime(job['now']).replace(hour=6, minute=0, second=0, microsecond=0)
+            plan = SleeperBerthPlanner.plan(job['distance_miles'], data['current_cycle_used'], start)
+            eld_logs = SleeperBerthPlanner.generate_eld_logs(plan)
+            sleeper_plan = SleeperBerthPlanner.summarize(plan)
+        else:
+            eld_logs = HOSCalculator.generate_eld_logs(trip_details, job['now'])
+        return {'trip_details': trip_details, 'route_points': route_points, 'eld_logs': eld_logs,
+                'sleeper_plan': sleeper_plan, 'schedule': schedule, 'fuel_plan': fuel_plan}
+    except Exception as e:
+        return {'error': f'Calculation failed: {e}'}
+
+
+def _init_worker():
+    # Spawned workers (macOS, Windows) start without Django; forked ones already have it
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+class BulkTripPlanner:
+    """Plan a file of trip requests with a process pool and chunked bulk inserts"""
+
+    def __init__(self, input_path, results_path, run_name: Optional[str] = None, workers: Optional[int] = None,
+                 chunk_size: int = 500, route_workers: int = 8, user=None,
+                 progress: Optional[Callable[[Dict], None]] = None):
+        """
+        Args:
+            input_path: CSV or NDJSON (.ndjson/.jsonl) file of /api/calculate/ requests
+            results_path: NDJSON file with one line per input row
+            run_name: Progress record to resume (default: the input file name)
+            workers: Planning processes (default: CPU count; 0 plans in this process)
+            chunk_size: Rows per commit
+            route_workers: Concurrent route lookups
+            user: Owner of the created trips
+            progress: Called with the run totals after every committed chunk
+        """
+        self.input_path = Path(input_path)
+        self.results_path = Path(results_path)
+        self.run_name = run_name or self.input_path.name
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunk_size = chunk_size
+        self.route_workers = route_workers
+        self.user = user
+        self.progress = progress
+
+    # Resuming
+
+    def _open_run(self, restart: bool) -> PlanningRun:
+        run, created = PlanningRun.objects.get_or_create(
+            name=self.run_name, defaults={'input_path': str(self.input_path)}
+        )
+        if not created and run.input_path != str(self.input_path) and not restart:
+            raise ValueError(f"Run '{self.run_name}' planned {run.input_path}; pick another run name or restart")
+        if restart or created:
+            run.input_path, run.rows_done, run.trips_created, run.errors = str(self.input_path), 0, 0, 0
+            run.finished_at = None
+            run.save()
+        self._trim_results(run.rows_done)
+        return run
+
+    def _trim_results(self, rows_done: int):
+        """Drop result lines of rows that were written but never committed"""
+        if not self.results_path.exists():
+            return
+        with open(self.results_path, encoding='utf-8') as handle:
+            kept = [line for line in handle if line.strip() and json.loads(line)['row'] <= rows_done]
+        partial = self.results_path.with_name(self.results_path.name + '.tmp')
+        with open(partial, 'w', encoding='utf-8') as handle:
+            handle.writelines(kept)
+        os.replace(partial, self.results_path)
+
+    # Per chunk
+
+    @staticmethod
+    def _lanes(job: Dict) -> List[Tuple[str, str]]:
+        data = job['data']
+        lanes = [(data['current_location'], data['dropoff_location'])]
+        if job['windows']:
+            lanes += [(data['current_location'], data['pickup_location']),
+                      (data['pickup_location'], data['dropoff_location'])]
+        return lanes
+
+    def _route(self, jobs: List[Dict]) -> Tuple[List[Dict], Dict[int, Dict]]:
+        """Look up every distinct lane of a chunk once; returns (routed jobs, errors by row)"""
+        lanes = {lane for job in jobs for lane in self._lanes(job)}
+
+        def lookup(lane):
+            with OrsRateLimiter.priority(BATCH):
+                try:
+                    return lane, DistanceService.calculate_distance_and_duration(*lane)
+                except LocationNotFound as e:
+                    return lane, e
+
+        with ThreadPoolExecutor(max_workers=max(self.route_workers, 1)) as executor:
+            routes = dict(executor.map(lookup, lanes))
+        # A row with a location nobody can place fails alone
+        errors = {}
+        for job in jobs:
+            failed = next((routes[lane] for lane in self._lanes(job) if isinstance(routes[lane], LocationNotFound)),
+                          None)
+            if failed:
+                errors[job['row']] = {'row': job['row'], 'ref': job['ref'], 'status': 'error', 'error': str(failed)}
+        jobs = [job for job in jobs if job['row'] not in errors]
+        # One query for the chunk's speed profiles
+        SpeedProfiles.load({
+            key for job in jobs for key in SpeedProfiles.keys(
+                job['data']['pickup_location'], job['data']['dropoff_location'],
+                routes[(job['data']['current_location'], job['data']['dropoff_location'])].get(
+                    'route_info', {}).get('coordinates', []))
+        })
+        for job in jobs:
+            data = job['data']
+            job['route'] = routes[(data['current_location'], data['dropoff_location'])]
+            job['distance_miles'] = job['route']['distance_miles']
+            job['speeds'] = SpeedProfiles.speeds(
+                data['pickup_location'], data['dropoff_location'],
+                job['route'].get('route_info', {}).get('coordinates', []),
+                job['distance_miles'], job['route'].get('duration_hours')
+            )
+            job['legs'] = (
+                routes[(data['current_location'], data['pickup_location'])]['distance_miles'],
+                routes[(data['pickup_location'], data['dropoff_location'])]['distance_miles'],
+            ) if job['windows'] else None
+        return jobs, errors
+
+    def _prepare(self, rows: List[Tuple[int, Dict]], now: datetime) -> Tuple[List[Dict], Dict[int, Dict]]:
+        """Validate and route a chunk; returns (planning jobs, errors by row)"""
+        jobs, errors = [], {}
+        for number, request in rows:
+            serializer = TripCalculationRequestSerializer(data=request)
+            if not serializer.is_valid():
+                errors[number] = {'row': number, 'ref': request.get('ref'), 'status': 'error',
+                                  'errors': serializer.errors}
+                continue
+            data = dict(serializer.validated_data)
+            windows = any(data.get(field) for field in
+                          TripCalculationRequestSerializer.WINDOW_FIELDS + ['earliest_departure'])
+            jobs.append({'row': number, 'ref': request.get('ref'), 'data': data, 'windows': windows, 'now': now})
+        jobs, route_errors = self._route(jobs)
+        return jobs, {**errors, **route_errors}
+
+    def _write(self, run: PlanningRun, last_row: int, jobs: List[Dict], plans, errors: Dict[int, Dict]) -> Dict:
+        """Insert a planned chunk, its result lines and the run's progress in one transaction"""
+        planned = []
+        for job, plan in zip(jobs, plans):
+            if 'error' in plan:
+                errors[job['row']] = {'row': job['row'], 'ref': job['ref'], 'status': 'error', 'error': plan['error']}
+            else:
+                planned.append((job, plan))
+
+        with transaction.atomic():
+            trips = Trip.objects.bulk_create([
+                Trip(
+                    current_location=job['data']['current_location'],
+                    pickup_location=job['data']['pickup_location'],
+                    dropoff_location=job['data']['dropoff_location'],
+                    current_cycle_used=job['data']['current_cycle_used'],
+                    total_distance=plan['trip_details']['total_distance'],
+                    estimated_drive_time=plan['trip_details']['estimated_drive_time'],
+                    total_trip_time=plan['trip_details']['total_trip_time'],
+                    fuel_stops=plan['trip_details']['fuel_stops'],
+                    rest_stops=plan['trip_details']['rest_stops'],
+                    route_geometry=job['route'].get('route_info', {}).get('coordinates', []),
+                    status='planned',
+                    user=self.user,
+                ) for job, plan in planned
+            ], batch_size=self.chunk_size)
+            RoutePoint.objects.bulk_create([
+                RoutePoint(trip=trip, point_type=point['point_type'], latitude=point['latitude'],
+                           longitude=point['longitude'], address=point['address'], sequence=point['sequence'],
+                           duration_minutes=point['duration_minutes'])
+                for trip, (_, plan) in zip(trips, planned)
+                for point in plan['route_points']
+            ], batch_size=self.chunk_size)
+            log_rows = [(trip, log_data) for trip, (_, plan) in zip(trips, planned) for log_data in plan['eld_logs']]
+            DutyTimeline.create_logs(
+                [ELDLog(trip=trip, date=log_data['date'], driver_name=log_data['driver_name'],
+                        carrier_name=log_data['carrier_name'], vehicle_number=log_data['vehicle_number'],
+                        total_miles=log_data['total_miles']) for trip, log_data in log_rows],
+                [log_data['duty_statuses'] for _, log_data in log_rows],
+                batch_size=self.chunk_size,
+            )
+            FleetRollups.record_new_trips([trip.id for trip in trips])
+
+            results = dict(errors)
+            for trip, (job, plan) in zip(trips, planned):
+                details = plan['trip_details']
+                results[job['row']] = {
+                    'row': job['row'], 'ref': job['ref'], 'status': 'ok', 'trip_id': trip.id,
+                    'total_distance': details['total_distance'],
+                    'estimated_drive_time': details['estimated_drive_time'],
+                    'total_trip_time': details['total_trip_time'],
+                    'fuel_stops': details['fuel_stops'], 'rest_stops': details['rest_stops'],
+                    'days_needed': details['days_needed'], 'feasible': details['feasible'],
+                    'eld_logs': len(plan['eld_logs']),
+                    'route_estimated': not job['route'].get('success', False),
+                }
+                if plan['schedule']:
+                    results[job['row']]['departure'] = plan['schedule']['schedule']['departure']
+                    results[job['row']]['arrival'] = plan['schedule']['earliest_arrival']
+                if plan['sleeper_plan']:
+                    results[job['row']]['sleeper_plan'] = plan['sleeper_plan']
+                if plan['fuel_plan']:
+                    results[job['row']]['fuel_cost'] = plan['fuel_plan']['fuel_cost']
+            # Written before the commit: lines past the committed row are trimmed on resume
+            with open(self.results_path, 'a', encoding='utf-8') as handle:
+                for row in sorted(results):
+                    handle.write(json.dumps(results[row], cls=JSONEncoder) + '\n')
+                handle.flush()
+                os.fsync(handle.fileno())
+
+            run.rows_done = last_row
+            run.trips_created += len(trips)
+            run.errors += len(errors)
+            run.save(update_fields=['rows_done', 'trips_created', 'errors', 'updated_at'])
+        return {'trips': len(trips), 'errors': len(errors)}
+
+    def run(self, restart: bool = False) -> Dict:
+        """
+        Plan the input file, resuming after the last committed row
+
+        Returns:
+            Dictionary with rows, trips created, errors, rows skipped as
+            already done and elapsed seconds
+        """
+        started = time.perf_counter()
+        run = self._open_run(restart)
+        rows = read_rows(self.input_path)
+        skipped = sum(1 for _ in islice(rows, run.rows_done))
+        totals = {'rows': 0, 'trips': 0, 'errors': 0, 'skipped': skipped}
+
+        pool = None
+        try:
+            pending = None
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if chunk:
+                    jobs, errors = self._prepare(chunk, timezone.now())
+                    if self.workers:
+                        if pool is None:
+                            # Forked workers must not inherit open database connections.
+                            # _prepare has just used the connection, and a fork pool
+                            # starts all of its workers at the first map
+                            connections.close_all()
+                            pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+                        plans = pool.map(plan_trip, jobs, chunksize=max(len(jobs) // (self.workers * 4), 1))
+                    else:
+                        plans = map(plan_trip, jobs)
+                # The pool plans this chunk while the previous one is written
+                if pending:
+                    result = self._write(run, *pending)
+                    totals['trips'] += result['trips']
+                    totals['errors'] += result['errors']
+                    if self.progress:
+                        self.progress({**totals, 'rows_done': run.rows_done,
+                                       'elapsed_seconds': time.perf_counter() - started})
+                if not chunk:
+                    break
+                totals['rows'] += len(chunk)
+                pending = (chunk[-1][0], jobs, plans, errors)
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+
+        run.finished_at = timezone.now()
+        run.save(update_fields=['finished_at', 'updated_at'])
+        totals['elapsed_seconds'] = round(time.perf_counter() - started, 2)
+        return totals
@@ -0,0 +1,117 @@
+"""
+Lane cache warm-up
+Mines trip history for the busiest lanes and fills the geocode and route
+caches ahead of peak hours, so the first requests of the day don't pay the
+full ORS latency and entries don't expire in the middle of busy periods
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .distance_service import DistanceService, LocationNotFound
+from .geocoder import normalize_location
+from .models import Trip
+from .rate_limiter import BATCH, OrsRateLimiter
+
+
+class LaneCacheWarmer:
+    """Pre-populate geocode and route caches for the most requested lanes"""
+
+    @staticmethod
+    def top_lanes(limit: int = 200, days: Optional[int] = 30, include_legs: bool = False) -> List[Tuple[str, str]]:
+        """
+        Most requested lanes in trip history
+
+        Args:
+            limit: Number of lanes to return
+            days: Only count trips created in this many days (None for all)
+            include_legs: Also count the current -> pickup and pickup -> dropoff
+                legs that appointment scheduling routes
+
+        Returns:
+            (start, end) location pairs, busiest first, one per normalized lane
+        """
+        trips = Trip.objects.all()
+        if days:
+            trips = trips.filter(created_at__gte=timezone.now() - timedelta(days=days))
+        pairs = [('current_location', 'dropoff_location')]
+        if include_legs:
+            pairs += [('current_location', 'pickup_location'), ('pickup_location', 'dropoff_location')]
+
+        counts: Dict[Tuple[str, str], List] = {}
+        for start_field, end_field in pairs:
+            rows = trips.values(start_field, end_field).annotate(
+                trips=Count('id'), last_used=Max('created_at')
+            ).order_by('-trips')[:limit]
+            for row in rows:
+                start, end = row[start_field], row[end_field]
+                # Spelling variants share a cache entry
+                lane = (normalize_location(start), normalize_location(end))
+                entry = counts.setdefault(lane, [0, None, (start, end)])
+                entry[0] += row['trips']
+                if entry[1] is None or row['last_used'] > entry[1]:
+                    entry[1] = row['last_used']
+        ranked = sorted(counts.values(), key=lambda entry: (-entry[0], -entry[1].timestamp()))
+        return [locations for _, _, locations in ranked[:limit]]
+
+    @staticmethod
+    def warm_lane(start_location: str, end_location: str, refresh_within: int = 0) -> str:
+        """
+        Make sure a lane's route is cached and stays fresh for a while
+
+        Args:
+            start_location: Starting location string
+            end_location: Destination location string
+            refresh_within: Also refetch entries that go stale within this
+                many seconds
+
+        Returns:
+            'cached', 'fetched' or 'failed'
+        """
+        cached = cache.get(DistanceService.route_cache_key(start_location, end_location))
+        if cached and cached.get('refresh_after', float('inf')) > time.time() + refresh_within:
+            return 'cached'
+        # Geocodes are cached as a side effect of routing; warm-up yields
+        # the ORS quota to interactive requests
+        with OrsRateLimiter.priority(BATCH):
+            try:
+                result = DistanceService.fetch_route(start_location, end_location)
+            except LocationNotFound:
+                return 'failed'
+        return 'fetched' if result.get('success') else 'failed'
+
+    @staticmethod
+    def warm(limit: int = 200, days: Optional[int] = 30, include_legs: bool = False,
+             refresh_within: int = 6 * 3600, workers: int = 4) -> Dict:
+        """
+        Warm the busiest lanes
+
+        Args:
+            limit: Number of lanes to warm
+            days: History window in days (None for all trips)
+            include_legs: Include the pickup legs
+            refresh_within: Refetch entries going stale within this many seconds
+            workers: Concurrent ORS requests
+
+        Returns:
+            Dictionary with lane counts per outcome and elapsed seconds
+        """
+        started = time.perf_counter()
+        lanes = LaneCacheWarmer.top_lanes(limit, days, include_legs)
+        outcomes = {'cached': 0, 'fetched': 0, 'failed': 0}
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            for outcome in executor.map(
+                lambda lane: LaneCacheWarmer.warm_lane(lane[0], lane[1], refresh_within), lanes
+            ):
+                outcomes[outcome] += 1
+        return {
+            'lanes': len(lanes),
+            **outcomes,
+            'elapsed_seconds': round(time.perf_counter() - started, 2),
+        }
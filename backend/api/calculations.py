@@ -7,6 +7,8 @@ from decimal import Decimal, ROUND_HALF_UP
 from datetime import datetime, timedelta, time
 import math
 
+from django.conf import settings
+
 
 class HOSCalculator:
     """Hours of Service calculator for 70-hour/8-day rule"""
@@ -34,23 +36,70 @@ class HOSCalculator:
     UNLOADING_TIME = 1  # hour for dropoff
     
     @staticmethod
-    def calculate_trip_details(current_cycle_used: Decimal, distance_miles: Decimal) -> dict:
+    def calculate_trip_details(current_cycle_used: Decimal, distance_miles: Decimal,
+                               drive_hours: float = None, fuel_stops: int = None) -> dict:
         """
         Calculate trip details based on HOS regulations
         
         Args:
             current_cycle_used: Current hours used in 70-hour cycle
             distance_miles: Total trip distance in miles
+            drive_hours: Driving time from the route and the hourly speeds
+                (default: distance at AVERAGE_SPEED)
+            fuel_stops: Number of planned fuel stops (default: one per
+                FUEL_STOP_INTERVAL miles)
             
         Returns:
             Dictionary with calculated trip details
         """
+        hours = HOSCalculator._trip_hours(distance_miles, drive_hours, fuel_stops)
+        driving_time = hours['driving_time']
+        total_trip_time = hours['total_trip_time']
+        
+        # Calculate days needed
+        days_needed = math.ceil(total_trip_time / HOSCalculator.MAX_DAILY_ON_DUTY)
+        
+        # Check if trip is feasible with current cycle
+        remaining_cycle_hours = HOSCalculator.MAX_WEEKLY_ON_DUTY - current_cycle_used
+        feasible = remaining_cycle_hours >= total_trip_time
+        
+        return {
+            'total_distance': distance_miles,
+            'estimated_drive_time': Decimal(str(round(driving_time, 2))),
+            'total_trip_time': Decimal(str(round(total_trip_time, 2))),
+            'fuel_stops': hours['fuel_stops'],
+            'rest_stops': hours['rest_stops'],
+            'days_needed': days_needed,
+            'feasible': feasible,
+            'remaining_cycle_hours': Decimal(str(round(remaining_cycle_hours, 2))),
+            'pickup_duration': HOSCalculator.LOADING_TIME,
+            'dropoff_duration': HOSCalculator.UNLOADING_TIME,
+            'fuel_stop_duration': HOSCalculator.FUEL_STOP_TIME,
+            'rest_break_duration': HOSCalculator.MANDATORY_BREAK_DURATION,
+            'on_duty_time': Decimal(str(round(hours['on_duty_time'], 2))),
+            'driving_time': Decimal(str(round(driving_time, 2))),
+            'fuel_time': Decimal(str(round(hours['fuel_time'], 2))),
+            'rest_time': Decimal(str(round(hours['rest_time'], 2))),
+        }
+    
+    @staticmethod
+    def _trip_hours(distance_miles, drive_hours=None, fuel_stops=None) -> dict:
+        """
+        Driving, stop and on-duty hours of a trip
+        
+        Shared by calculate_trip_details and trip_time_hours so planned
+        trips and the feasibility matrices add up the same way.
+        """
         # Calculate driving time
-        driving_time = distance_miles / HOSCalculator.AVERAGE_SPEED
+        if drive_hours is None:
+            driving_time = distance_miles / HOSCalculator.AVERAGE_SPEED
+        else:
+            driving_time = drive_hours
         
         # Calculate fuel stops needed (every 1000 miles)
-        fuel_stops = math.ceil(distance_miles / HOSCalculator.FUEL_STOP_INTERVAL) - 1
-        fuel_stops = max(0, fuel_stops)  # Ensure non-negative
+        if fuel_stops is None:
+            fuel_stops = math.ceil(distance_miles / HOSCalculator.FUEL_STOP_INTERVAL) - 1
+            fuel_stops = max(0, fuel_stops)  # Ensure non-negative
         
         # Calculate total fuel stop time
         total_fuel_time = fuel_stops * HOSCalculator.FUEL_STOP_TIME
@@ -72,35 +121,76 @@ class HOSCalculator:
         # Calculate total trip time (including all on-duty activities)
         total_trip_time = driving_time + total_fuel_time + pickup_dropoff_time + total_rest_time + total_on_duty_time
         
-        # Calculate days needed
-        days_needed = math.ceil(total_trip_time / HOSCalculator.MAX_DAILY_ON_DUTY)
-        
-        # Check if trip is feasible with current cycle
-        remaining_cycle_hours = HOSCalculator.MAX_WEEKLY_ON_DUTY - current_cycle_used
-        feasible = remaining_cycle_hours >= total_trip_time
-        
         return {
-            'total_distance': distance_miles,
-            'estimated_drive_time': Decimal(str(round(driving_time, 2))),
-            'total_trip_time': Decimal(str(round(total_trip_time, 2))),
+            'driving_time': driving_time,
             'fuel_stops': fuel_stops,
+            'fuel_time': total_fuel_time,
             'rest_stops': rest_stops_needed,
-            'days_needed': days_needed,
+            'rest_time': total_rest_time,
+            'on_duty_time': total_on_duty_time,
+            'total_trip_time': total_trip_time,
+        }
+    
+    @staticmethod
+    def trip_time_hours(distance_miles: float, drive_hours: float = None) -> float:
+        """
+        Total on-duty trip time for a distance, as a plain float
+        
+        The total of calculate_trip_details without building the full
+        details dictionary, for use in bulk evaluation.
+        
+        Args:
+            distance_miles: Total trip distance in miles
+            drive_hours: Driving time (default: distance at AVERAGE_SPEED)
+            
+        Returns:
+            Total trip time in hours
+        """
+        return float(HOSCalculator._trip_hours(distance_miles, drive_hours)['total_trip_time'])
+    
+    @staticmethod
+    def feasibility_matrix(distance_matrix: list, cycle_used, duration_matrix: list = None) -> dict:
+        """
+        Evaluate HOS cycle feasibility for every cell of a distance matrix
+        
+        Args:
+            distance_matrix: Rows of distances in miles (None for unknown cells)
+            cycle_used: Hours already used in the 70-hour cycle, either one
+                value for every row or one value per row
+            duration_matrix: Rows of route durations in hours; driving time
+                comes from them as in /api/calculate/ (at the route's average
+                speed) unless SPEED_PROFILES_ENABLED is off
+            
+        Returns:
+            Dictionary with total_trip_time and feasible matrices (None where
+            the distance is unknown) and the remaining cycle hours per row
+        """
+        if isinstance(cycle_used, (list, tuple)):
+            row_cycles = [float(value) for value in cycle_used]
+        else:
+            row_cycles = [float(cycle_used)] * len(distance_matrix)
+        
+        if duration_matrix is None or not getattr(settings, 'SPEED_PROFILES_ENABLED', True):
+            duration_matrix = [[None] * len(row) for row in distance_matrix]
+        trip_time_hours = HOSCalculator.trip_time_hours
+        remaining = [HOSCalculator.MAX_WEEKLY_ON_DUTY - used for used in row_cycles]
+        total_times = []
+        feasible = []
+        for row, duration_row, row_remaining in zip(distance_matrix, duration_matrix, remaining):
+            times = [None if distance is None else trip_time_hours(distance, duration)
+                     for distance, duration in zip(row, duration_row)]
+            total_times.append([None if hours is None else round(hours, 2) for hours in times])
+            feasible.append([None if hours is None else row_remaining >= hours for hours in times])
+        
+        return {
+            'total_trip_time': total_times,
             'feasible': feasible,
-            'remaining_cycle_hours': Decimal(str(round(remaining_cycle_hours, 2))),
-            'pickup_duration': HOSCalculator.LOADING_TIME,
-            'dropoff_duration': HOSCalculator.UNLOADING_TIME,
-            'fuel_stop_duration': HOSCalculator.FUEL_STOP_TIME,
-            'rest_break_duration': HOSCalculator.MANDATORY_BREAK_DURATION,
-            'on_duty_time': Decimal(str(round(total_on_duty_time, 2))),
-            'driving_time': Decimal(str(round(driving_time, 2))),
-            'fuel_time': Decimal(str(round(total_fuel_time, 2))),
-            'rest_time': Decimal(str(round(total_rest_time, 2))),
+            'remaining_cycle_hours': [round(hours, 2) for hours in remaining],
         }
     
     @staticmethod
     def generate_route_points(current_location: str, pickup_location: str, 
-                            dropoff_location: str, trip_details: dict) -> list:
+                            dropoff_location: str, trip_details: dict, fuel_plan: dict = None) -> list:
         """
         Generate route points for the trip
         
@@ -109,6 +199,8 @@ class HOSCalculator:
             pickup_location: Pickup location
             dropoff_location: Dropoff location
             trip_details: Calculated trip details
+            fuel_plan: Priced fuel stops (api/fuel_planner.py) placed instead
+                of evenly distributed ones
             
         Returns:
             List of route points
@@ -140,8 +232,22 @@ class HOSCalculator:
         })
         sequence += 1
         
+        # Fuel stops at the planned stations
+        if fuel_plan:
+            for stop in fuel_plan['stops']:
+                points.append({
+                    'point_type': 'fuel',
+                    'address': f"{stop['name']}, {stop['address']}"[:200] if stop['address'] else stop['name'][:200],
+                    'latitude': stop['latitude'],
+                    'longitude': stop['longitude'],
+                    'sequence': sequence,
+                    'duration_minutes': int(trip_details['fuel_stop_duration'] * 60),
+                    'estimated_arrival': None
+                })
+                sequence += 1
+        
         # Fuel stops (simplified - evenly distributed)
-        fuel_stops = trip_details['fuel_stops']
+        fuel_stops = 0 if fuel_plan else trip_details['fuel_stops']
         if fuel_stops > 0:
             for i in range(fuel_stops):
                 points.append({
@@ -291,3 +397,47 @@ class HOSCalculator:
             })
         
         return logs
+    
+    @staticmethod
+    def generate_eld_logs_from_events(events: list) -> list:
+        """
+        Generate ELD logs from a timed schedule, one log per calendar day
+        
+        Args:
+            events: Dicts with status, start, end (datetimes), location and
+                miles, in order; events crossing midnight are split
+            
+        Returns:
+            List of ELD log dictionaries (same format as generate_eld_logs)
+        """
+        logs = []
+        day_end = time(23, 59, 59)
+        for event in events:
+            start = event['start']
+            duration = (event['end'] - event['start']).total_seconds()
+            while start < event['end']:
+                midnight = datetime.combine(start.date() + timedelta(days=1), time(0, 0), tzinfo=start.tzinfo)
+                end = min(event['end'], midnight)
+                if not logs or logs[-1]['date'] != start.date():
+                    logs.append({
+                        'date': start.date(),
+                        'driver_name': 'Driver',
+                        'carrier_name': 'Carrier',
+                        'vehicle_number': 'V001',
+                        'total_miles': 0.0,
+                        'duty_statuses': []
+                    })
+                log = logs[-1]
+                log['duty_statuses'].append({
+                    'status': event['status'],
+                    'start_time': start.time(),
+                    'end_time': day_end if end == midnight else end.time(),
+                    'location': event['location'],
+                    'sequence': len(log['duty_statuses'])
+                })
+                if duration:
+                    log['total_miles'] += event['miles'] * (end - start).total_seconds() / duration
+                start = end
+        for log in logs:
+            log['total_miles'] = round(log['total_miles'], 2)
+        return logs
@@ -0,0 +1,176 @@
+"""
+Negotiated response compression
+CompressionMiddleware compresses responses of at least COMPRESSION_MIN_SIZE
+bytes with the best encoding the client accepts: brotli when the optional
+'brotli' package is installed, otherwise gzip. Streaming responses (the
+event streams) and responses that are already encoded pass through.
+
+Trip documents (detail, route and ELD logs) are cached as rendered JSON
+together with their compressed variants, made once at the highest levels,
+so serving a cached document costs neither serialization nor compression.
+The cache key carries the trip's updated_at, so saving the trip (as
+re-planning does) retires its documents.
+"""
+
+import gzip
+from typing import Callable, Dict, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip only
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+
+def available_encodings() -> tuple:
+    """Encodings the server can produce, most preferred first"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """
+    The encoding to use for a request's Accept-Encoding header
+
+    Honors q-values ("gzip;q=0" refuses gzip) and '*'; ties go to the
+    server's preference.
+
+    Returns:
+        'br', 'gzip' or None for an uncompressed response
+    """
+    qualities = {}
+    for part in accept_encoding.split(','):
+        coding, *params = part.strip().split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding.strip():
+            qualities[coding.strip().lower()] = quality
+    best = None
+    for encoding in available_encodings():
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+def compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    """
+    Compress a body
+
+    Args:
+        data: Uncompressed bytes
+        encoding: 'br' or 'gzip'
+        best: Use the highest level (for bodies compressed once and served many times)
+    """
+    if encoding == 'br':
+        quality = 11 if best else getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5)
+        return brotli.compress(data, quality=quality)
+    level = 9 if best else getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class CompressionMiddleware:
+    """Compress responses with the client's preferred encoding (goes near the top of MIDDLEWARE)"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def process(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < getattr(settings, 'COMPRESSION_MIN_SIZE', 1024):
+            return response
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The representation changed; a strong validator no longer holds
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        return self.process(request, response)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+
+class TripDocumentCache:
+    """Rendered trip documents cached with their compressed variants"""
+
+    @staticmethod
+    def key(kind: str, trip) -> str:
+        return f'trip-doc:{kind}:{trip.id}:{trip.updated_at.timestamp():.6f}'
+
+    @staticmethod
+    def entry(kind: str, trip, build: Callable[[], object]) -> Dict[str, bytes]:
+        """
+        The cached document, rendering and compressing it on a miss
+
+        Args:
+            kind: Document name ('detail', 'route', 'logs')
+            trip: Trip with id and updated_at loaded
+            build: Returns the response data
+
+        Returns:
+            Dictionary of body bytes by encoding ('identity', 'gzip' and 'br'
+            when brotli is installed; only 'identity' for small documents)
+        """
+        key = TripDocumentCache.key(kind, trip)
+        entry = cache.get(key)
+        if entry is None:
+            body = JSONRenderer().render(build())
+            entry = {'identity': body}
+            if len(body) >= getattr(settings, 'COMPRESSION_MIN_SIZE', 1024):
+                for encoding in available_encodings():
+                    entry[encoding] = compress(body, encoding, best=True)
+            cache.set(key, entry, getattr(settings, 'TRIP_DOCUMENT_CACHE_TIMEOUT', 3600))
+        return entry
+
+    @staticmethod
+    def respond(request, kind: str, trip, build: Callable[[], object]) -> HttpResponse:
+        """A JSON response with the cached document in the encoding the client accepts"""
+        entry = TripDocumentCache.entry(kind, trip, build)
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding in entry:
+            response = HttpResponse(entry[encoding], content_type='application/json')
+            response['Content-Encoding'] = encoding
+        else:
+            response = HttpResponse(entry['identity'], content_type='application/json')
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
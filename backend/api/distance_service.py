@@ -3,21 +3,96 @@ Distance calculation service using OpenRouteService API
 Provides real distance and duration calculations between locations
 """
 
-import requests
+import hashlib
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Tuple, Optional
 from django.conf import settings
+from django.core.cache import cache
+
+from .geocoder import OfflineGeocoder, great_circle_miles, normalize_location
+from .rate_limiter import BATCH, OrsRateLimiter
+
+# Background refreshes of stale route cache entries
+_refresh_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'ROUTE_REFRESH_WORKERS', 2), thread_name_prefix='route-refresh'
+)
+
+
+class LocationNotFound(ValueError):
+    """Neither ORS nor the offline gazetteer could place a location"""
+
+    def __init__(self, locations):
+        self.locations = list(locations)
+        super().__init__(f"Could not find {' or '.join(repr(location) for location in self.locations)}")
+
 
 class DistanceService:
     """Service for calculating real distances and travel times between locations"""
     
-    # OpenRouteService API endpoint
-    ORS_API_URL = "https://api.openrouteservice.org/v2/directions/driving-hgv"
+    # OpenRouteService API endpoints, relative to settings.ORS_BASE_URL
+    DEFAULT_ORS_BASE_URL = "https://api.openrouteservice.org"
+    DIRECTIONS_PATH = "/v2/directions/driving-hgv/geojson"
+    GEOCODE_PATH = "/geocode/search"
+    
+    # Cache key prefixes for geocode results and successful routes
+    GEOCODE_CACHE_PREFIX = "geocode:v1:"
+    ROUTE_CACHE_PREFIX = "route:v1:"
+    
+    _http = None
+    _http_pid = None
+    _http_lock = threading.Lock()
+    
+    @staticmethod
+    def http():
+        """
+        Process-wide requests session for ORS calls, created on first use
+        
+        Keeps connections (and their TLS handshakes) alive between calls.
+        requests is imported here rather than at module load, and a forked
+        worker gets its own session instead of sharing the parent's sockets.
+        """
+        if DistanceService._http is None or DistanceService._http_pid != os.getpid():
+            with DistanceService._http_lock:
+                if DistanceService._http is None or DistanceService._http_pid != os.getpid():
+                    import requests
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_maxsize=getattr(settings, 'ORS_HTTP_POOL_SIZE', 10))
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    DistanceService._http, DistanceService._http_pid = session, os.getpid()
+        return DistanceService._http
+    
+    @staticmethod
+    def ors_url(path: str) -> str:
+        """Build an ORS endpoint URL from the configured base URL"""
+        base_url = getattr(settings, 'ORS_BASE_URL', '') or DistanceService.DEFAULT_ORS_BASE_URL
+        return base_url.rstrip('/') + path
+    
+    @staticmethod
+    def cache_key(prefix: str, *locations: str) -> str:
+        """Build a cache key from location strings"""
+        return DistanceService.normalized_cache_key(prefix, *(normalize_location(location) for location in locations))
+    
+    @staticmethod
+    def normalized_cache_key(prefix: str, *normalized: str) -> str:
+        """Build a cache key from already normalized location strings"""
+        return prefix + hashlib.sha1('|'.join(normalized).encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def route_cache_key(start_location: str, end_location: str) -> str:
+        return DistanceService.cache_key(DistanceService.ROUTE_CACHE_PREFIX, start_location, end_location)
     
     @staticmethod
     def geocode_location(location: str) -> Optional[Tuple[float, float]]:
         """
-        Geocode a location string to coordinates using OpenRouteService
+        Geocode a location string to coordinates
+        
+        The offline gazetteer is tried first; OpenRouteService is only called
+        for locations it cannot resolve confidently.
         
         Args:
             location: Location string (e.g., "New York, NY")
@@ -25,40 +100,121 @@ class DistanceService:
         Returns:
             Tuple of (longitude, latitude) or None if not found
         """
+        geocoder = OfflineGeocoder.get_default()
+        if geocoder:
+            coords = geocoder.geocode(location)
+            if coords:
+                return coords
+        
+        cache_key = DistanceService.cache_key(DistanceService.GEOCODE_CACHE_PREFIX, location)
+        cached = cache.get(cache_key)
+        if cached:
+            return tuple(cached)
+        
         try:
+            if not OrsRateLimiter.acquire('geocode'):
+                return None
+            
             # Use OpenRouteService geocoding
-            geocode_url = "https://api.openrouteservice.org/geocode/search"
+            geocode_url = DistanceService.ors_url(DistanceService.GEOCODE_PATH)
             params = {
                 'api_key': getattr(settings, 'ORS_API_KEY', ''),
                 'text': location,
                 'size': 1
             }
             
-            response = requests.get(geocode_url, params=params, timeout=10)
+            response = DistanceService.http().get(geocode_url, params=params, timeout=10)
+            OrsRateLimiter.penalize_response('geocode', response)
             response.raise_for_status()
             
             data = response.json()
             if data.get('features'):
                 coords = data['features'][0]['geometry']['coordinates']
-                return (coords[0], coords[1])  # (longitude, latitude)
+                coords = (coords[0], coords[1])  # (longitude, latitude)
+                cache.set(cache_key, coords, getattr(settings, 'GEOCODE_CACHE_TIMEOUT', 30 * 24 * 3600))
+                return coords
                 
         except Exception as e:
             print(f"Geocoding error for '{location}': {e}")
             
         return None
     
+    @staticmethod
+    def route_cache_timeouts() -> Tuple[int, int]:
+        """(fresh seconds, extra seconds a stale route may still be served)"""
+        return (getattr(settings, 'ROUTE_CACHE_TIMEOUT', 24 * 3600),
+                getattr(settings, 'ROUTE_CACHE_STALE_TIMEOUT', 6 * 3600))
+    
     @staticmethod
     def calculate_distance_and_duration(start_location: str, end_location: str) -> Dict:
         """
         Calculate real distance and duration between two locations
         
+        Successful ORS routes are cached per (start, end) pair with
+        stale-while-revalidate: for ROUTE_CACHE_TIMEOUT seconds they are
+        fresh, for ROUTE_CACHE_STALE_TIMEOUT seconds after that they are still
+        served while a background thread fetches a replacement. Fallback
+        estimates are not cached.
+        
+        Args:
+            start_location: Starting location string
+            end_location: Destination location string
+            
+        Returns:
+            Dictionary with distance_miles, duration_hours, and route_info
+
+        Raises:
+            LocationNotFound: a location could not be geocoded at all
+        """
+        route_cache_key = DistanceService.route_cache_key(start_location, end_location)
+        cached = cache.get(route_cache_key)
+        if cached:
+            if cached.get('refresh_after', float('inf')) <= time.time():
+                DistanceService.refresh_route_in_background(start_location, end_location)
+            return cached
+        return DistanceService.fetch_route(start_location, end_location)
+    
+    @staticmethod
+    def refresh_route_in_background(start_location: str, end_location: str) -> bool:
+        """
+        Queue a route refresh unless one is already running for the pair
+        
+        Returns:
+            True if a refresh was queued
+        """
+        # cache.add is atomic, so only one request (or process, with a shared
+        # cache) schedules the refresh
+        lock_key = DistanceService.route_cache_key(start_location, end_location) + ':refreshing'
+        if not cache.add(lock_key, True, getattr(settings, 'ROUTE_REFRESH_LOCK_TIMEOUT', 60)):
+            return False
+        
+        def refresh():
+            try:
+                with OrsRateLimiter.priority(BATCH):
+                    DistanceService.fetch_route(start_location, end_location)
+            finally:
+                cache.delete(lock_key)
+        
+        _refresh_executor.submit(refresh)
+        return True
+    
+    @staticmethod
+    def fetch_route(start_location: str, end_location: str) -> Dict:
+        """
+        Route a pair through ORS and cache the result, bypassing the cache
+        
         Args:
             start_location: Starting location string
             end_location: Destination location string
             
         Returns:
             Dictionary with distance_miles, duration_hours, and route_info
+            (a fallback estimate when ORS fails)
+
+        Raises:
+            LocationNotFound: a location could not be geocoded at all
         """
+        start_coords = end_coords = None
         try:
             # Geocode both locations
             start_coords = DistanceService.geocode_location(start_location)
@@ -66,10 +222,13 @@ class DistanceService:
             
             if not start_coords or not end_coords:
                 # Fallback to mock calculation
-                return DistanceService._mock_calculation(start_location, end_location)
+                return DistanceService._mock_calculation(start_location, end_location, start_coords, end_coords)
+            
+            if not OrsRateLimiter.acquire('directions'):
+                return DistanceService._mock_calculation(start_location, end_location, start_coords, end_coords)
             
             # Calculate route using OpenRouteService
-            route_url = DistanceService.ORS_API_URL
+            route_url = DistanceService.ors_url(DistanceService.DIRECTIONS_PATH)
             headers = {
                 'Authorization': getattr(settings, 'ORS_API_KEY', ''),
                 'Content-Type': 'application/json'
@@ -85,7 +244,8 @@ class DistanceService:
                 }
             }
             
-            response = requests.post(route_url, headers=headers, json=payload, timeout=15)
+            response = DistanceService.http().post(route_url, headers=headers, json=payload, timeout=15)
+            OrsRateLimiter.penalize_response('directions', response)
             response.raise_for_status()
             
             data = response.json()
@@ -103,7 +263,7 @@ class DistanceService:
                 duration_seconds = summary['duration']
                 duration_hours = duration_seconds / 3600
                 
-                return {
+                result = {
                     'distance_miles': round(distance_miles, 2),
                     'duration_hours': round(duration_hours, 2),
                     'route_info': {
@@ -113,42 +273,56 @@ class DistanceService:
                     },
                     'success': True
                 }
+                fresh_timeout, stale_timeout = DistanceService.route_cache_timeouts()
+                result['refresh_after'] = time.time() + fresh_timeout
+                cache.set(DistanceService.route_cache_key(start_location, end_location), result,
+                          fresh_timeout + stale_timeout)
+                return result
             else:
-                return DistanceService._mock_calculation(start_location, end_location)
+                return DistanceService._mock_calculation(start_location, end_location, start_coords, end_coords)
                 
+        except LocationNotFound:
+            raise
         except Exception as e:
             print(f"Route calculation error: {e}")
-            return DistanceService._mock_calculation(start_location, end_location)
+            return DistanceService._mock_calculation(start_location, end_location, start_coords, end_coords)
     
     @staticmethod
-    def _mock_calculation(start_location: str, end_location: str) -> Dict:
+    def _mock_calculation(start_location: str, end_location: str,
+                          start_coords: Optional[Tuple[float, float]] = None,
+                          end_coords: Optional[Tuple[float, float]] = None) -> Dict:
         """
-        Fallback mock calculation when API is unavailable
+        Fallback calculation when the routing API is unavailable
+        
+        Estimates road distance as great-circle distance times
+        ROAD_CIRCUITY_FACTOR, using the offline gazetteer for any location
+        without coordinates.
         
         Args:
             start_location: Starting location string
             end_location: Destination location string
+            start_coords: Already geocoded (longitude, latitude) of the start, if any
+            end_coords: Already geocoded (longitude, latitude) of the destination, if any
             
         Returns:
             Dictionary with estimated distance and duration
+        
+        Raises:
+            LocationNotFound: a location has no coordinates; a made-up
+                distance would plan a trip that has nothing to do with it
         """
-        # Simple distance estimation based on location names
-        # This is a fallback when the API is not available
-        distance_miles = 850  # Default fallback
-        
-        # Try to estimate based on common routes
-        start_lower = start_location.lower()
-        end_lower = end_location.lower()
-        
-        # Common route estimations
-        if 'new york' in start_lower and 'los angeles' in end_lower:
-            distance_miles = 2800
-        elif 'chicago' in start_lower and 'miami' in end_lower:
-            distance_miles = 1200
-        elif 'dallas' in start_lower and 'phoenix' in end_lower:
-            distance_miles = 1000
-        elif 'seattle' in start_lower and 'portland' in end_lower:
-            distance_miles = 175
+        geocoder = OfflineGeocoder.get_default()
+        if geocoder:
+            # Without routing a street address is placed at its city
+            start_coords = start_coords or geocoder.geocode(start_location, street_addresses=True)
+            end_coords = end_coords or geocoder.geocode(end_location, street_addresses=True)
+        if not start_coords or not end_coords:
+            raise LocationNotFound(location for location, coords in ((start_location, start_coords),
+                                                                     (end_location, end_coords)) if not coords)
+        
+        circuity = getattr(settings, 'ROAD_CIRCUITY_FACTOR', 1.2)
+        distance_miles = round(great_circle_miles(start_coords, end_coords) * circuity, 2)
+        coordinates = [list(start_coords), list(end_coords)]
         
         # Estimate duration based on truck speed (55 mph average)
         duration_hours = distance_miles / 55
@@ -157,10 +331,11 @@ class DistanceService:
             'distance_miles': distance_miles,
             'duration_hours': round(duration_hours, 2),
             'route_info': {
-                'coordinates': [],
+                'coordinates': coordinates,
                 'summary': {'distance': distance_miles * 1609.34, 'duration': duration_hours * 3600},
                 'waypoints': 2
             },
             'success': False,  # Indicates this is a fallback calculation
-            'fallback': True
+            'fallback': True,
+            'offline_estimate': True
         }
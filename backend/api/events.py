@@ -0,0 +1,216 @@
+"""
+Trip event stream
+In-process publish/subscribe for compact trip deltas (status, ETA, plan
+changes), delivered to browsers as server-sent events. Subscribers are
+asyncio queues, so an ASGI worker can hold thousands of idle connections;
+publishers are the regular sync views and may run in any thread.
+
+Nothing is shared between processes: events reach only the streams of the
+process that published them, so the API has to run as one server process.
+"""
+
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class _Subscription:
+    """One connected client: a bounded queue on the subscriber's event loop"""
+
+    def __init__(self, topic: str, loop: asyncio.AbstractEventLoop, size: int):
+        self.topic = topic
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.overflowed = False
+
+    def deliver(self, event: Dict):
+        # Runs on the subscriber's loop; a client that stops reading gets a
+        # single resync event instead of an unbounded backlog
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class TripEventBroker:
+    """Fan-out of trip events to per-trip, per-user and all-trip topics"""
+
+    def __init__(self, history: int = 1000, queue_size: int = 100, snapshots: int = 10000):
+        self._lock = threading.Lock()
+        # Millisecond-based ids keep increasing across process restarts
+        self._ids = itertools.count(int(time.time() * 1000))
+        self._subscribers: Dict[str, Set[_Subscription]] = {}
+        # Recent events for clients reconnecting with Last-Event-ID
+        self._history: deque = deque(maxlen=history)
+        # Last published state per trip, so events only carry changed fields
+        self._snapshots: OrderedDict = OrderedDict()
+        self._snapshot_limit = snapshots
+        self.queue_size = queue_size
+
+    @staticmethod
+    def topics_for(trip) -> List[str]:
+        topics = ['trips', f'trip:{trip.id}']
+        if trip.user_id:
+            topics.append(f'user:{trip.user_id}')
+        return topics
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def publish(self, topics: List[str], event_type: str, data: Dict) -> int:
+        """
+        Send an event to every subscriber of the given topics
+
+        Args:
+            topics: Topic names, e.g. ['trips', 'trip:12']
+            event_type: SSE event name
+            data: JSON-serializable payload
+
+        Returns:
+            Event id
+        """
+        with self._lock:
+            event = {'id': next(self._ids), 'event': event_type, 'topics': topics, 'data': data}
+            # Serialized once for all subscribers
+            event['wire'] = self.format(event)
+            self._history.append(event)
+            targets = [
+                subscription
+                for topic in topics
+                for subscription in self._subscribers.get(topic, ())
+            ]
+        # One thread-safe wakeup per event loop rather than per subscriber
+        by_loop: Dict[asyncio.AbstractEventLoop, List[_Subscription]] = {}
+        for subscription in targets:
+            by_loop.setdefault(subscription.loop, []).append(subscription)
+        for loop, subscriptions in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(self._deliver_all, subscriptions, event)
+            except RuntimeError:
+                # Loop already closed; the streams' cleanup removes them
+                pass
+        return event['id']
+
+    @staticmethod
+    def _deliver_all(subscriptions: List[_Subscription], event: Dict):
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+    def publish_trip(self, trip, event_type: str = 'trip.updated', changes: Optional[Dict] = None) -> Optional[int]:
+        """
+        Publish the fields of a trip that changed since the last event for it
+
+        Args:
+            trip: Trip instance, already saved
+            event_type: SSE event name ('trip.created', 'trip.updated')
+            changes: Optional row-level diff, e.g. the re-planning changes
+
+        Returns:
+            Event id, or None when nothing changed
+        """
+        end_point = trip.route_points.filter(point_type='end').values_list('estimated_arrival', flat=True).first()
+        snapshot = {
+            'status': trip.status,
+            'estimated_arrival': end_point,
+            'total_trip_time': trip.total_trip_time,
+            'total_distance': trip.total_distance,
+            'miles_completed': trip.miles_completed,
+            'fuel_stops': trip.fuel_stops,
+            'rest_stops': trip.rest_stops,
+        }
+        # Round-trip through JSON so Decimals and datetimes compare as sent
+        snapshot = json.loads(json.dumps(snapshot, cls=DjangoJSONEncoder))
+        with self._lock:
+            previous = self._snapshots.pop(trip.id, {})
+            self._snapshots[trip.id] = snapshot
+            while len(self._snapshots) > self._snapshot_limit:
+                self._snapshots.popitem(last=False)
+
+        delta = {field: value for field, value in snapshot.items() if previous.get(field, object()) != value}
+        # Row ids only, and only for tables that actually changed
+        changed_rows = {}
+        for table, diff in (changes or {}).items():
+            rows = {key: ids for key, ids in diff.items() if key != 'unchanged' and ids}
+            if rows:
+                changed_rows[table] = rows
+        if changed_rows:
+            delta['changes'] = changed_rows
+        if not delta:
+            return None
+        delta['trip_id'] = trip.id
+        return self.publish(self.topics_for(trip), event_type, delta)
+
+    def subscribe(self, topic: str, last_event_id: Optional[int] = None):
+        """
+        Register a subscriber on the running event loop
+
+        Returns:
+            (subscription, missed events since last_event_id)
+        """
+        subscription = _Subscription(topic, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(subscription)
+            missed = []
+            if last_event_id is not None:
+                missed = [event for event in self._history
+                          if event['id'] > last_event_id and topic in event['topics']]
+        return subscription, missed
+
+    def unsubscribe(self, subscription: _Subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.topic)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.topic]
+
+    @staticmethod
+    def format(event: Dict) -> str:
+        """Server-sent event wire format"""
+        data = json.dumps(event['data'], cls=DjangoJSONEncoder, separators=(',', ':'))
+        return f"id: {event['id']}\nevent: {event['event']}\ndata: {data}\n\n"
+
+    async def stream(self, topic: str, last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+        """
+        Server-sent events for a topic until the client disconnects
+
+        Sends a comment line every SSE_HEARTBEAT_SECONDS so proxies keep idle
+        connections open, and a 'resync' event if the client fell too far
+        behind (it should then refetch the trip over REST).
+        """
+        heartbeat = getattr(settings, 'SSE_HEARTBEAT_SECONDS', 15)
+        subscription, missed = self.subscribe(topic, last_event_id)
+        try:
+            yield f"retry: {getattr(settings, 'SSE_RETRY_MILLISECONDS', 5000)}\n\n"
+            last_id = last_event_id or 0
+            for event in missed:
+                last_id = event['id']
+                yield event['wire']
+            while not (subscription.overflowed and subscription.queue.empty()):
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                last_id = event['id']
+                yield event['wire']
+            # Reconnecting with this id replays whatever is still in the history
+            yield self.format({'id': last_id, 'event': 'resync', 'data': {'topic': topic}})
+        finally:
+            self.unsubscribe(subscription)
+
+
+broker = TripEventBroker(
+    history=getattr(settings, 'SSE_HISTORY_SIZE', 1000),
+    queue_size=getattr(settings, 'SSE_QUEUE_SIZE', 100),
+)
@@ -0,0 +1,324 @@
+"""
+Fuel-price-aware fuel stops
+Instead of a stop every 1,000 miles wherever the truck happens to be, fuel
+stops are picked from a local list of stations and diesel prices
+(FUEL_STATIONS_PATH) to spend the least on fuel:
+
+- Stations are bucketed in a latitude/longitude grid, so finding the ones
+  within FUEL_CORRIDOR_MILES of a route reads a few cells per sampled route
+  point instead of the whole list
+- A dynamic program walks the corridor stations in route order over the
+  fuel level, in FUEL_PLAN_UNIT_MILES of range. At each station the truck
+  drives on, or stops and fills to any level. A stop also pays for its
+  detour and FUEL_STOP_PENALTY (the time it takes), which is waived when
+  the station is within FUEL_BREAK_ALIGN_MILES of an HOS break or reset
+  the driver takes anyway.
+
+The station file is re-read when it changes, so a price feed can replace
+it in place. Without a file, trips keep the 1,000-mile rule.
+"""
+
+import csv
+import logging
+import math
+import os
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from .calculations import HOSCalculator
+from .geocoder import EARTH_RADIUS_METERS, METERS_PER_MILE
+from .scheduling import HOSClock
+from .speed_profiles import HourlySpeeds
+
+
+logger = logging.getLogger(__name__)
+
+MILES_PER_DEGREE = math.radians(1) * EARTH_RADIUS_METERS / METERS_PER_MILE
+INFINITY = float('inf')
+
+
+class FuelStation(NamedTuple):
+    name: str
+    address: str
+    latitude: float
+    longitude: float
+    price: float  # per gallon
+
+
+def read_fuel_stations_csv(path) -> List[FuelStation]:
+    """
+    Read fuel stations from a CSV file
+
+    Expected columns: name, address, latitude, longitude and price (diesel
+    per gallon). Rows without a price are skipped.
+    """
+    stations = []
+    with open(path, newline='', encoding='utf-8') as source:
+        for row in csv.DictReader(source):
+            if not (row.get('price') or '').strip():
+                continue
+            stations.append(FuelStation(
+                row['name'].strip(), (row.get('address') or '').strip(),
+                float(row['latitude']), float(row['longitude']), float(row['price'])
+            ))
+    return stations
+
+
+class FuelStationIndex:
+    """Fuel stations bucketed in a latitude/longitude grid"""
+
+    _default = None
+    _default_mtime = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, stations: Sequence[FuelStation], cell_degrees: float = 0.1):
+        """
+        Args:
+            stations: Stations to index
+            cell_degrees: Grid cell size
+        """
+        self.stations = list(stations)
+        self.cell_degrees = cell_degrees
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        for index, station in enumerate(self.stations):
+            self._cells.setdefault(self._cell(station.latitude, station.longitude), []).append(index)
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees)
+
+    @classmethod
+    def get_default(cls) -> Optional['FuelStationIndex']:
+        """
+        The process-wide index of FUEL_STATIONS_PATH, None without the file
+
+        The file is read again when its modification time changes.
+        """
+        path = getattr(settings, 'FUEL_STATIONS_PATH', None)
+        try:
+            mtime = os.path.getmtime(path) if path else None
+        except OSError:
+            mtime = None
+        if mtime is None:
+            return None
+        if cls._default_mtime != mtime:
+            with cls._default_lock:
+                if cls._default_mtime != mtime:
+                    try:
+                        cls._default = cls(read_fuel_stations_csv(path),
+                                           getattr(settings, 'FUEL_INDEX_CELL_DEGREES', 0.1))
+                    except (OSError, KeyError, ValueError) as e:
+                        logger.warning("Fuel stations unavailable: %s", e)
+                        cls._default = None
+                    cls._default_mtime = mtime
+        return cls._default
+
+    def corridor(self, coordinates: Sequence, radius_miles: float,
+                 step_miles: float = 2.0) -> Tuple[List[Tuple[float, float, int]], float]:
+        """
+        Stations near a route
+
+        The route is sampled every step_miles and the grid cells around each
+        sample are read.
+
+        Args:
+            coordinates: Route vertices as [longitude, latitude]
+            radius_miles: Largest distance from the route
+            step_miles: Spacing of the route samples
+
+        Returns:
+            (route mile, distance from the route, station index) for every
+            station within the radius, in route order, and the length of the
+            geometry in miles
+        """
+        nearest: Dict[int, Tuple[float, float]] = {}
+        search = radius_miles + step_miles / 2
+        lat_cells = math.ceil(search / (self.cell_degrees * MILES_PER_DEGREE))
+
+        def visit(longitude, latitude, mile):
+            scale = math.cos(math.radians(latitude))
+            lon_cells = math.ceil(search / (self.cell_degrees * MILES_PER_DEGREE * max(scale, 0.01)))
+            row, column = self._cell(latitude, longitude)
+            for cell_row in range(row - lat_cells, row + lat_cells + 1):
+                for cell_column in range(column - lon_cells, column + lon_cells + 1):
+                    for index in self._cells.get((cell_row, cell_column), ()):
+                        station = self.stations[index]
+                        # Equirectangular distance; plenty at corridor scale
+                        dx = (station.longitude - longitude) * scale * MILES_PER_DEGREE
+                        dy = (station.latitude - latitude) * MILES_PER_DEGREE
+                        distance = math.hypot(dx, dy)
+                        if distance <= search and (index not in nearest or distance < nearest[index][0]):
+                            nearest[index] = (distance, mile)
+
+        # Samples run along the whole route, so dense geometry doesn't add any
+        mile, next_sample = 0.0, 0.0
+        for start, end in zip(coordinates, coordinates[1:]):
+            (lon1, lat1), (lon2, lat2) = start[:2], end[:2]
+            # Equirectangular too: route segments are short, and miles are scaled to the ORS distance
+            length = MILES_PER_DEGREE * math.hypot((lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2)),
+                                                   lat2 - lat1)
+            while next_sample < mile + length:
+                t = (next_sample - mile) / length
+                visit(lon1 + t * (lon2 - lon1), lat1 + t * (lat2 - lat1), next_sample)
+                next_sample += step_miles
+            mile += length
+        if coordinates:
+            visit(*coordinates[-1][:2], mile)
+        return sorted((mile, distance, index) for index, (distance, mile) in nearest.items()
+                      if distance <= radius_miles), mile
+
+
+class FuelStopPlanner:
+    """Cheapest fuel stops along a route within the tank range"""
+
+    @staticmethod
+    def rest_miles(distance_miles: float, current_cycle_used: float, speeds: Optional[HourlySpeeds] = None,
+                   departure=None) -> List[float]:
+        """Route miles at which the HOS simulation takes a break, reset or restart"""
+        start_minute = HourlySpeeds.minute_of_day(departure) if departure is not None else 0
+        clock = HOSClock(current_cycle_used, speeds, start_minute)
+        clock.on_duty(30, 'Pre-trip inspection')
+        clock.drive(float(distance_miles))
+        miles = 0.0
+        rests = []
+        for status, minutes, _, event_miles in clock.events:
+            if status == 'driving':
+                miles += event_miles
+            elif status == 'off_duty' and minutes >= HOSClock.BREAK:
+                rests.append(miles)
+        return rests
+
+    @staticmethod
+    def _candidates(corridor: List[Tuple[float, float, int]], stations: List[FuelStation], scale: float,
+                    rests: List[float], unit: float) -> List[Tuple[int, float, FuelStation, float, bool]]:
+        """
+        Corridor stations worth considering
+
+        Per FUEL_PLAN_UNIT_MILES of route only the cheapest station at an HOS
+        rest and the cheapest elsewhere can be part of a best plan.
+
+        Returns:
+            (route unit, route mile, station, detour miles, at a rest) in route order
+        """
+        align = getattr(settings, 'FUEL_BREAK_ALIGN_MILES', 25)
+        best: Dict[Tuple[int, bool], Tuple] = {}
+        for mile, distance, index in corridor:
+            mile *= scale
+            station = stations[index]
+            at_rest = any(abs(mile - rest) <= align for rest in rests)
+            key = (math.ceil(mile / unit - 1e-9), at_rest)
+            if key not in best or (station.price, distance) < (best[key][2].price, best[key][3]):
+                best[key] = (key[0], mile, station, distance, at_rest)
+        return sorted(best.values(), key=lambda candidate: (candidate[0], candidate[1]))
+
+    @staticmethod
+    def plan(coordinates: Sequence, distance_miles: float, current_cycle_used: float,
+             speeds: Optional[HourlySpeeds] = None, departure=None,
+             index: Optional[FuelStationIndex] = None) -> Optional[Dict]:
+        """
+        Plan fuel stops for a route
+
+        Args:
+            coordinates: Route geometry as [longitude, latitude]
+            distance_miles: Route distance (station positions are scaled to it)
+            current_cycle_used: Hours used in the 70-hour cycle (for the HOS rests)
+            speeds: Hourly driving speeds of the HOS simulation
+            departure: Departure time, for the hourly speeds
+            index: Stations (default: FUEL_STATIONS_PATH)
+
+        Returns:
+            Dictionary with the stops (station, route mile, gallons, cost and
+            whether it coincides with an HOS rest) and the trip's fuel totals,
+            or None without stations or route geometry, or when the corridor
+            has a gap longer than the tank range
+        """
+        index = index or FuelStationIndex.get_default()
+        distance_miles = float(distance_miles or 0)
+        if index is None or len(coordinates) < 2 or not distance_miles:
+            return None
+        tank_range = getattr(settings, 'FUEL_TANK_RANGE_MILES', HOSCalculator.FUEL_STOP_INTERVAL)
+        mpg = getattr(settings, 'FUEL_MPG', 6.5)
+        unit = getattr(settings, 'FUEL_PLAN_UNIT_MILES', 10)
+        penalty = getattr(settings, 'FUEL_STOP_PENALTY', 15.0)
+        levels = int(tank_range // unit)
+        reserve = math.ceil(getattr(settings, 'FUEL_RESERVE_MILES', 50) / unit - 1e-9)
+        start_level = int(levels * getattr(settings, 'FUEL_START_LEVEL', 1.0))
+        end_unit = math.ceil(distance_miles / unit - 1e-9)
+
+        corridor, geometry_miles = index.corridor(coordinates, getattr(settings, 'FUEL_CORRIDOR_MILES', 5))
+        scale = distance_miles / geometry_miles if geometry_miles else 1.0
+        rests = FuelStopPlanner.rest_miles(distance_miles, current_cycle_used, speeds, departure)
+        candidates = [candidate for candidate in
+                      FuelStopPlanner._candidates(corridor, index.stations, scale, rests, unit)
+                      if candidate[0] < end_unit]
+
+        # cost[level]: cheapest purchases so far, arriving with `level` units of range
+        cost = [INFINITY] * (levels + 1)
+        cost[start_level] = 0.0
+        position = 0
+        choices = []  # per candidate: arrival level each level was bought from, -1 for driving on
+        for route_unit, mile, station, detour, at_rest in candidates:
+            used = route_unit - position
+            position = route_unit
+            arrived = [cost[level + used] if level + used <= levels else INFINITY for level in range(levels + 1)]
+            # There and back, then buy at price per unit of range
+            detour_units = math.ceil(2 * detour / unit - 1e-9)
+            unit_price = station.price * unit / mpg
+            stop_cost = 0.0 if at_rest else penalty
+            best, best_from = INFINITY, -1
+            cost, choice = [], []
+            for level in range(levels + 1):
+                # best: cheapest arrival left with less than `level` after the detour (a stop buys something)
+                stopped = best + level * unit_price + stop_cost
+                source = level + detour_units
+                if source <= levels and arrived[source] - level * unit_price < best:
+                    best, best_from = arrived[source] - level * unit_price, source
+                if stopped < arrived[level]:
+                    cost.append(stopped)
+                    choice.append(best_from)
+                else:
+                    cost.append(arrived[level])
+                    choice.append(-1)
+            choices.append((used, detour_units, choice))
+
+        used = end_unit - position
+        finishing = [(cost[level], level) for level in range(used + reserve, levels + 1)]
+        if not finishing or min(finishing)[0] == INFINITY:
+            logger.info("No fuel plan within a %s-mile range over %d stations", tank_range, len(candidates))
+            return None
+        total, level = min(finishing)
+
+        stops = []
+        for (_, mile, station, detour, at_rest), (used, detour_units, choice) in zip(reversed(candidates),
+                                                                                     reversed(choices)):
+            source = choice[level]
+            if source >= 0:
+                gallons = (level - (source - detour_units)) * unit / mpg
+                stops.append({
+                    'name': station.name,
+                    'address': station.address,
+                    'latitude': station.latitude,
+                    'longitude': station.longitude,
+                    'price': station.price,
+                    'route_mile': round(mile, 1),
+                    'detour_miles': round(detour, 1),
+                    'gallons': round(gallons, 1),
+                    'cost': round(gallons * station.price, 2),
+                    'at_rest': at_rest,
+                })
+                level = source
+            level += used
+        stops.reverse()
+
+        prices = [index.stations[station_index].price for _, _, station_index in corridor]
+        fuel_cost = sum(stop['cost'] for stop in stops)
+        return {
+            'stops': stops,
+            'gallons': round(sum(stop['gallons'] for stop in stops), 1),
+            'fuel_cost': round(fuel_cost, 2),
+            'plan_cost': round(total, 2),  # fuel plus stop penalties
+            'average_corridor_price': round(sum(prices) / len(prices), 3) if prices else None,
+            'stations_considered': len(candidates),
+            'tank_range_miles': tank_range,
+        }
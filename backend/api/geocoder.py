@@ -0,0 +1,436 @@
+"""
+Offline geocoder backed by a local gazetteer index
+Resolves US cities, ZIP codes and freight terminals without calling ORS, and
+provides the great-circle distance estimate used when routing is unavailable
+"""
+
+import bisect
+import csv
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import unicodedata
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_MILE = 1609.344
+
+# Binary index layout (little endian):
+#   header, records, keys, trigram codes, trigram spans, postings, strings
+INDEX_MAGIC = b'GZX1'
+INDEX_VERSION = 1
+HEADER = struct.Struct('<4sHxxIIIIIIIIII')
+RECORD = struct.Struct('<ffIHBx')   # latitude, longitude, name offset, name length, kind
+KEY = struct.Struct('<IHHI')        # key offset, key length, trigram count, record id
+
+KINDS = ['city', 'zip', 'terminal']
+
+STATE_CODES = {
+    'alabama': 'al', 'alaska': 'ak', 'arizona': 'az', 'arkansas': 'ar', 'california': 'ca',
+    'colorado': 'co', 'connecticut': 'ct', 'delaware': 'de', 'district of columbia': 'dc',
+    'florida': 'fl', 'georgia': 'ga', 'hawaii': 'hi', 'idaho': 'id', 'illinois': 'il',
+    'indiana': 'in', 'iowa': 'ia', 'kansas': 'ks', 'kentucky': 'ky', 'louisiana': 'la',
+    'maine': 'me', 'maryland': 'md', 'massachusetts': 'ma', 'michigan': 'mi', 'minnesota': 'mn',
+    'mississippi': 'ms', 'missouri': 'mo', 'montana': 'mt', 'nebraska': 'ne', 'nevada': 'nv',
+    'new hampshire': 'nh', 'new jersey': 'nj', 'new mexico': 'nm', 'new york': 'ny',
+    'north carolina': 'nc', 'north dakota': 'nd', 'ohio': 'oh', 'oklahoma': 'ok', 'oregon': 'or',
+    'pennsylvania': 'pa', 'rhode island': 'ri', 'south carolina': 'sc', 'south dakota': 'sd',
+    'tennessee': 'tn', 'texas': 'tx', 'utah': 'ut', 'vermont': 'vt', 'virginia': 'va',
+    'washington': 'wa', 'west virginia': 'wv', 'wisconsin': 'wi', 'wyoming': 'wy',
+}
+# Longest names first so "west virginia" wins over "virginia"
+_STATE_NAMES = sorted(STATE_CODES, key=lambda name: -len(name.split()))
+_STATE_CODE_SET = set(STATE_CODES.values())
+_TOKEN_ALIASES = {'saint': 'st', 'fort': 'ft', 'mount': 'mt'}
+_COUNTRY_SUFFIXES = [('united', 'states', 'of', 'america'), ('united', 'states'), ('usa',), ('us',)]
+# A ZIP code ends the (normalized) text: "dallas tx 75201", "60601 1234"
+_ZIP_PATTERN = re.compile(r'(?:^| )(\d{5})(?: \d{4})?$')
+# A house number before a street name: "1200 Main St", "12b Elm", "40-12 Queens Blvd"
+_STREET_PATTERN = re.compile(r'^\s*\d+[a-z]?(?:-\d+)?\s+[a-z]', re.IGNORECASE)
+ZIP_AGREEMENT_MILES = 60  # Farthest a ZIP may be from the city given with it
+_TRIGRAM_ALPHABET = ' 0123456789abcdefghijklmnopqrstuvwxyz'
+_TRIGRAM_SYMBOLS = {char: index for index, char in enumerate(_TRIGRAM_ALPHABET)}
+
+
+class GazetteerMatch(NamedTuple):
+    name: str
+    kind: str
+    latitude: float
+    longitude: float
+    score: float
+
+
+def haversine_meters(start: Iterable[float], end: Iterable[float]) -> float:
+    """Great-circle distance between two (longitude, latitude) pairs in meters"""
+    lon1, lat1 = (math.radians(value) for value in start)
+    lon2, lat2 = (math.radians(value) for value in end)
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+def great_circle_miles(start: Iterable[float], end: Iterable[float]) -> float:
+    """Great-circle distance between two (longitude, latitude) pairs in miles"""
+    return haversine_meters(start, end) / METERS_PER_MILE
+
+
+def normalize_location(text: str) -> str:
+    """
+    Canonicalize a location string for index keys and queries
+
+    Lowercases, strips accents and punctuation, drops a trailing country,
+    abbreviates saint/fort/mount and replaces a trailing state name with its
+    postal code ("Saint Louis, Missouri, USA" -> "st louis mo").
+    """
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    tokens = re.sub(r'[^a-z0-9]+', ' ', text).split()
+    for suffix in _COUNTRY_SUFFIXES:
+        if len(tokens) > len(suffix) and tuple(tokens[-len(suffix):]) == suffix:
+            tokens = tokens[:-len(suffix)]
+            break
+    for state_name in _STATE_NAMES:
+        state_tokens = state_name.split()
+        if len(tokens) > len(state_tokens) and tokens[-len(state_tokens):] == state_tokens:
+            tokens = tokens[:-len(state_tokens)] + [STATE_CODES[state_name]]
+            break
+    return ' '.join(_TOKEN_ALIASES.get(token, token) for token in tokens)
+
+
+def trigram_codes(key: str) -> List[int]:
+    """Distinct trigram codes of a normalized key, padded with spaces"""
+    padded = f"  {key} "
+    codes = set()
+    for index in range(len(padded) - 2):
+        a, b, c = padded[index:index + 3]
+        codes.add((_TRIGRAM_SYMBOLS[a] * 37 + _TRIGRAM_SYMBOLS[b]) * 37 + _TRIGRAM_SYMBOLS[c])
+    return sorted(codes)
+
+
+def looks_like_street_address(text: str) -> bool:
+    """Whether a location starts with a house number ("10001 Main St, Dallas, TX")"""
+    return bool(_STREET_PATTERN.match(text.split(',', 1)[0]))
+
+
+def read_gazetteer_csv(path) -> List[dict]:
+    """
+    Read gazetteer rows from a CSV file
+
+    Expected columns: name, state, kind (city/zip/terminal), latitude,
+    longitude and optional aliases separated by "|". Earlier rows rank
+    higher when a bare name (e.g. "Portland") is ambiguous.
+    """
+    rows = []
+    with open(path, newline='', encoding='utf-8') as source:
+        for row in csv.DictReader(source):
+            rows.append({
+                'name': row['name'].strip(),
+                'state': (row.get('state') or '').strip().upper(),
+                'kind': (row.get('kind') or 'city').strip(),
+                'latitude': float(row['latitude']),
+                'longitude': float(row['longitude']),
+                'aliases': [alias.strip() for alias in (row.get('aliases') or '').split('|') if alias.strip()],
+            })
+    return rows
+
+
+def build_index(rows: List[dict]) -> bytes:
+    """
+    Compile gazetteer rows into the binary index format
+
+    Args:
+        rows: Rows as returned by read_gazetteer_csv
+
+    Returns:
+        Index bytes suitable for OfflineGeocoder
+    """
+    strings = bytearray()
+    records = bytearray()
+    keys = set()
+    for record_id, row in enumerate(rows):
+        display = f"{row['name']}, {row['state']}" if row['state'] and row['kind'] != 'zip' else row['name']
+        encoded = display.encode('utf-8')
+        records += RECORD.pack(row['latitude'], row['longitude'], len(strings), len(encoded),
+                               KINDS.index(row['kind']))
+        strings += encoded
+
+        state = row['state'].lower()
+        for name in [row['name']] + row['aliases']:
+            normalized = normalize_location(name)
+            if not normalized:
+                continue
+            keys.add((normalized, record_id))
+            if state and row['kind'] != 'zip':
+                keys.add((f"{normalized} {state}", record_id))
+
+    sorted_keys = sorted(keys)
+    key_table = bytearray()
+    postings: Dict[int, List[int]] = {}
+    for key_index, (key, record_id) in enumerate(sorted_keys):
+        encoded = key.encode('ascii')
+        codes = trigram_codes(key)
+        key_table += KEY.pack(len(strings), len(encoded), len(codes), record_id)
+        strings += encoded
+        for code in codes:
+            postings.setdefault(code, []).append(key_index)
+
+    trigram_code_array = array('I', sorted(postings))
+    span_array = array('I')
+    posting_array = array('I')
+    for code in trigram_code_array:
+        span_array.extend((len(posting_array), len(postings[code])))
+        posting_array.extend(postings[code])
+
+    sections = [bytes(records), bytes(key_table), trigram_code_array.tobytes(),
+                span_array.tobytes(), posting_array.tobytes(), bytes(strings)]
+    offsets = []
+    position = HEADER.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+    header = HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(rows), len(sorted_keys),
+                         len(trigram_code_array), len(posting_array), *offsets)
+    return header + b''.join(sections)
+
+
+def write_index(path, data: bytes):
+    """
+    Write an index file atomically
+
+    The bytes go to a temporary file in the same directory, which then
+    replaces the index, so a worker mapping the file never sees a partial
+    one and concurrent writers leave one complete copy.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.gazetteer-', suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as index_file:
+            index_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class OfflineGeocoder:
+    """Fuzzy geocoder over a memory-mapped gazetteer index"""
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, data):
+        """
+        Args:
+            data: Index bytes or an mmap of an index file
+        """
+        self._data = data
+        view = memoryview(data)
+        (magic, version, self.record_count, self.key_count, trigram_count, posting_count,
+         records_offset, keys_offset, codes_offset, spans_offset, postings_offset,
+         self._strings_offset) = HEADER.unpack_from(view, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError('Unsupported gazetteer index format')
+        self._view = view
+        self._records_offset = records_offset
+        self._keys_offset = keys_offset
+        self._codes = view[codes_offset:codes_offset + 4 * trigram_count].cast('I')
+        self._spans = view[spans_offset:spans_offset + 8 * trigram_count].cast('I')
+        self._postings = view[postings_offset:postings_offset + 4 * posting_count].cast('I')
+
+    @classmethod
+    def from_file(cls, path) -> 'OfflineGeocoder':
+        with open(path, 'rb') as index_file:
+            data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data)
+
+    @classmethod
+    def get_default(cls) -> Optional['OfflineGeocoder']:
+        """
+        Return the process-wide geocoder, loading it on first use
+
+        The index is rebuilt from GAZETTEER_SOURCE_PATH when the compiled
+        file at GAZETTEER_INDEX_PATH is missing or older than the source.
+        """
+        if not getattr(settings, 'OFFLINE_GEOCODER_ENABLED', True):
+            return None
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls._load_default()
+        return cls._default or None
+
+    @classmethod
+    def _load_default(cls):
+        index_path = getattr(settings, 'GAZETTEER_INDEX_PATH', None)
+        source_path = getattr(settings, 'GAZETTEER_SOURCE_PATH', None)
+        try:
+            stale = source_path and os.path.exists(source_path) and (
+                not index_path or not os.path.exists(index_path)
+                or os.path.getmtime(index_path) < os.path.getmtime(source_path)
+            )
+            if stale:
+                data = build_index(read_gazetteer_csv(source_path))
+                try:
+                    write_index(index_path, data)
+                except (OSError, TypeError):
+                    return cls(data)
+            if index_path and os.path.exists(index_path):
+                return cls.from_file(index_path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning("Offline geocoder unavailable: %s", e)
+        return False
+
+    @classmethod
+    def reset_default(cls):
+        with cls._default_lock:
+            cls._default = None
+
+    # Low-level index access
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self._strings_offset + offset
+        return bytes(self._view[start:start + length]).decode('utf-8')
+
+    def _key(self, key_index: int) -> Tuple[str, int, int]:
+        offset, length, trigram_count, record_id = KEY.unpack_from(self._view, self._keys_offset + key_index * KEY.size)
+        return self._string(offset, length), trigram_count, record_id
+
+    def _record(self, record_id: int, score: float) -> GazetteerMatch:
+        latitude, longitude, name_offset, name_length, kind = RECORD.unpack_from(
+            self._view, self._records_offset + record_id * RECORD.size
+        )
+        return GazetteerMatch(self._string(name_offset, name_length), KINDS[kind],
+                              round(latitude, 5), round(longitude, 5), score)
+
+    def _lower_bound(self, key: str) -> int:
+        low, high = 0, self.key_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Lookup tiers
+
+    def _exact(self, key: str) -> Optional[int]:
+        index = self._lower_bound(key)
+        if index < self.key_count:
+            candidate, _, record_id = self._key(index)
+            if candidate == key:
+                return record_id
+        return None
+
+    def _trigram(self, key: str, min_score: float) -> Optional[Tuple[int, float]]:
+        query_codes = trigram_codes(key)
+        query_state = key.rsplit(' ', 1)[-1]
+        if query_state not in _STATE_CODE_SET:
+            query_state = None
+        hits: Dict[int, int] = {}
+        for code in query_codes:
+            position = bisect.bisect_left(self._codes, code)
+            if position < len(self._codes) and self._codes[position] == code:
+                start, count = self._spans[2 * position], self._spans[2 * position + 1]
+                for key_index in self._postings[start:start + count]:
+                    hits[key_index] = hits.get(key_index, 0) + 1
+        best = None
+        for key_index, common in hits.items():
+            candidate, trigram_count, record_id = self._key(key_index)
+            # A similar name without the queried state is a different place
+            if query_state and not candidate.endswith(' ' + query_state):
+                continue
+            score = 2.0 * common / (len(query_codes) + trigram_count)
+            if score >= min_score and (best is None or (score, -record_id) > (best[1], -best[0])):
+                best = (record_id, score)
+        return best
+
+    def lookup(self, text: str, min_score: float = 0.6) -> Optional[GazetteerMatch]:
+        """
+        Find the best gazetteer entry for a free-text location
+
+        Tries, in order: a ZIP code ending the text, exact matches on the
+        full string and its trailing comma-separated parts, and trigram
+        similarity (Dice coefficient). Names are indexed with and without
+        their state, so only whole words match exactly; a partial word
+        ("Chicag") or a shorter name ("Kansas" for Kansas City) is scored
+        by trigrams instead. A ZIP code is only taken
+        when the city before it (if any) lies within ZIP_AGREEMENT_MILES of
+        it; a conflicting pair gives None.
+
+        Args:
+            text: Location string (e.g. "Chicago, IL" or "Chicgo Illinois")
+            min_score: Minimum trigram similarity accepted
+
+        Returns:
+            GazetteerMatch or None if nothing is close enough
+        """
+        if not text or not text.strip():
+            return None
+
+        zip_match = _ZIP_PATTERN.search(normalize_location(text))
+        if zip_match:
+            record_id = self._exact(zip_match.group(1))
+            if record_id is not None:
+                zip_code = self._record(record_id, 1.0)
+                place = zip_match.string[:zip_match.start()].strip()
+                if place and place not in _STATE_CODE_SET:
+                    city = self.lookup(place, min_score)
+                    if city and city.kind != 'zip' and great_circle_miles(
+                            (city.longitude, city.latitude),
+                            (zip_code.longitude, zip_code.latitude)) > ZIP_AGREEMENT_MILES:
+                        return None
+                return zip_code
+
+        parts = [part for part in text.split(',') if part.strip()]
+        candidates = []
+        for start in range(len(parts)):
+            normalized = normalize_location(','.join(parts[start:]))
+            if normalized and normalized not in candidates:
+                candidates.append(normalized)
+
+        for key in candidates:
+            record_id = self._exact(key)
+            if record_id is not None:
+                return self._record(record_id, 1.0)
+
+        best = None
+        for key in candidates:
+            match = self._trigram(key, min_score)
+            if match and (best is None or match[1] > best[1]):
+                best = match
+        if best:
+            return self._record(best[0], round(best[1], 3))
+        return None
+
+    def geocode(self, text: str, street_addresses: bool = False) -> Optional[Tuple[float, float]]:
+        """
+        Geocode to (longitude, latitude) when the match is confident enough
+
+        Uses settings.OFFLINE_GEOCODER_MIN_SCORE as the acceptance threshold.
+
+        Args:
+            text: Location string
+            street_addresses: Accept the city of a street address; by default
+                street addresses give None so they are geocoded by ORS
+        """
+        if not street_addresses and looks_like_street_address(text):
+            return None
+        min_score = getattr(settings, 'OFFLINE_GEOCODER_MIN_SCORE', 0.75)
+        match = self.lookup(text, min_score=min_score)
+        if match is None:
+            return None
+        return (match.longitude, match.latitude)
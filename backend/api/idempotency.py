@@ -0,0 +1,259 @@
+"""
+Idempotent POST handling
+Requests sent with an Idempotency-Key header get their response stored and
+replayed on retries; concurrent identical requests, with or without a key,
+are coalesced so only one of them runs the view
+"""
+
+import hashlib
+import json
+import threading
+import time
+from datetime import timedelta
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyRecord
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run a function once per key at a time; concurrent callers share the result"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, func: Callable[[], object], timeout: Optional[float] = None) -> Tuple[object, bool]:
+        """
+        Args:
+            key: Coalescing key
+            func: Work to run if no call for the key is in flight
+            timeout: Seconds a follower waits for the leader
+
+        Returns:
+            (result, shared) where shared is True for followers
+
+        Raises:
+            TimeoutError if the leader does not finish within timeout; the
+            leader's exception for followers when it fails
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(key)
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+in_flight = SingleFlight()
+
+
+class IdempotencyStore:
+    """Idempotency-Key records in the database (shared by every process)"""
+
+    _purged_at: Optional[float] = None  # time.monotonic() of this process's last purge
+    _purge_lock = threading.Lock()
+
+    @staticmethod
+    def request_hash(request) -> str:
+        """Fingerprint of who sent what to which endpoint"""
+        user_id = request.user.id if request.user.is_authenticated else None
+        payload = json.dumps([user_id, request.path, request.data], sort_keys=True, cls=JSONEncoder)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def scoped_key(request, key: str) -> str:
+        user_id = request.user.id if request.user.is_authenticated else None
+        return hashlib.sha256(f'{user_id}|{request.path}|{key}'.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def purge_expired(force: bool = False) -> int:
+        """
+        Delete records older than IDEMPOTENCY_KEY_TTL
+
+        Runs at most once per IDEMPOTENCY_PURGE_INTERVAL seconds per process
+        unless forced, so keyed requests don't each pay for the delete.
+
+        Returns:
+            Number of records deleted
+        """
+        interval = getattr(settings, 'IDEMPOTENCY_PURGE_INTERVAL', 300)
+        with IdempotencyStore._purge_lock:
+            now = time.monotonic()
+            if not force and IdempotencyStore._purged_at is not None and now - IdempotencyStore._purged_at < interval:
+                return 0
+            IdempotencyStore._purged_at = now
+        ttl = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600))
+        deleted, _ = IdempotencyRecord.objects.filter(created_at__lt=timezone.now() - ttl).delete()
+        return deleted
+
+    @staticmethod
+    def begin(key: str, request_hash: str) -> Tuple[IdempotencyRecord, bool]:
+        """
+        Claim a key
+
+        Returns:
+            (record, created); created is False when another request
+            already holds the key
+        """
+        now = timezone.now()
+        ttl = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600))
+        pending_timeout = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_PENDING_TIMEOUT', 120))
+        IdempotencyStore.purge_expired()
+        for _ in range(2):
+            try:
+                with transaction.atomic():
+                    return IdempotencyRecord.objects.create(key=key, request_hash=request_hash), True
+            except IntegrityError:
+                record = IdempotencyRecord.objects.filter(key=key).first()
+                if record is None:
+                    continue
+                expired = record.created_at < now - ttl
+                abandoned = record.state == 'pending' and record.updated_at < now - pending_timeout
+                if expired or abandoned:
+                    # Not purged yet, or the process holding the key died; take it over
+                    IdempotencyRecord.objects.filter(pk=record.pk, updated_at=record.updated_at).delete()
+                    continue
+                return record, False
+        return IdempotencyRecord.objects.get(key=key), False
+
+    @staticmethod
+    def wait(key: str, timeout: float) -> Optional[IdempotencyRecord]:
+        """Poll until another process completes a key; None on timeout or release"""
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            record = IdempotencyRecord.objects.filter(key=key).first()
+            if record is None or record.state == 'completed':
+                return record
+            delay = min(delay * 2, 1.0)
+        return None
+
+
+def _replay(status_code: int, data, headers: Dict) -> Response:
+    return Response(data, status=status_code, headers={**headers, 'Idempotent-Replayed': 'true'})
+
+
+def idempotent(view):
+    """
+    Make a DRF function view safe to retry (use below @api_view)
+
+    Identical concurrent requests share one execution, whatever
+    Idempotency-Key they carry. With an Idempotency-Key header the response
+    is stored for IDEMPOTENCY_KEY_TTL seconds and replayed for retries;
+    reusing a key with a different request body is rejected with 422. Server errors release the key so the
+    client can retry.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        wait_timeout = getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 60)
+        request_hash = IdempotencyStore.request_hash(request)
+        client_key = request.headers.get('Idempotency-Key')
+
+        def run():
+            response = view(request, *args, **kwargs)
+            return response.status_code, response.data
+
+        if not client_key:
+            try:
+                (status_code, data), shared = in_flight.do(request_hash, run, wait_timeout)
+            except TimeoutError:
+                return Response({'error': 'An identical request is still in progress'},
+                                status=status.HTTP_409_CONFLICT, headers={'Retry-After': '5'})
+            return _replay(status_code, data, {}) if shared else Response(data, status=status_code)
+
+        if len(client_key) > 255:
+            return Response({'error': 'Idempotency-Key must be at most 255 characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        key = IdempotencyStore.scoped_key(request, client_key)
+        headers = {'Idempotency-Key': client_key}
+
+        def run_once(execute=run):
+            record, created = IdempotencyStore.begin(key, request_hash)
+            if not created:
+                if record.request_hash != request_hash:
+                    return status.HTTP_422_UNPROCESSABLE_ENTITY, {
+                        'error': 'Idempotency-Key was already used with a different request'
+                    }, False
+                if record.state != 'completed':
+                    # Running in another process
+                    record = IdempotencyStore.wait(key, wait_timeout)
+                    if record is None or record.state != 'completed':
+                        return status.HTTP_409_CONFLICT, {
+                            'error': 'A request with this Idempotency-Key is still in progress'
+                        }, False
+                return record.response_status, record.response_body, True
+            try:
+                status_code, data = execute()
+            except Exception:
+                record.delete()
+                raise
+            if status_code >= 500:
+                record.delete()
+            else:
+                record.state = 'completed'
+                record.response_status = status_code
+                record.response_body = data
+                record.save(update_fields=['state', 'response_status', 'response_body', 'updated_at'])
+            return status_code, data, False
+
+        # Coalesce on the request alone, so a double submit that sent two
+        # different keys still runs the view once
+        try:
+            (leader_key, (status_code, data, replayed)), shared = in_flight.do(
+                'keyed:' + request_hash, lambda: (key, run_once()), wait_timeout)
+        except TimeoutError:
+            status_code, data, replayed, shared = status.HTTP_409_CONFLICT, {
+                'error': 'A request with this Idempotency-Key is still in progress'
+            }, False, False
+        else:
+            if shared and leader_key != key:
+                if status_code in (status.HTTP_409_CONFLICT, status.HTTP_422_UNPROCESSABLE_ENTITY):
+                    # The leader's key was the problem, not this request
+                    (status_code, data, replayed), shared = run_once(), False
+                else:
+                    # Store the shared response under this key too, so its
+                    # own retries replay it
+                    response = (status_code, data)
+                    status_code, data, replayed = run_once(lambda: response)
+                    shared = True
+        if status_code == status.HTTP_409_CONFLICT:
+            headers['Retry-After'] = '5'
+            return Response(data, status=status_code, headers=headers)
+        if replayed or (shared and status_code != status.HTTP_422_UNPROCESSABLE_ENTITY):
+            return _replay(status_code, data, headers)
+        return Response(data, status=status_code, headers=headers)
+
+    return wrapper
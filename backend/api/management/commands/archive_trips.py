@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.archive import TripArchive
+
+
+class Command(BaseCommand):
+    help = 'Move old completed trips out of the database into the monthly columnar archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=getattr(settings, 'ARCHIVE_AFTER_DAYS', 90),
+                            help='Archive completed trips last updated more than this many days ago')
+        parser.add_argument('--group-size', type=int, help='Trips per row group')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the trips that would be archived')
+        parser.add_argument('--rebuild-index', action='store_true',
+                            help='Recreate the sidecar index from the archive files and exit')
+
+    def handle(self, *args, **options):
+        if options['rebuild_index']:
+            count = TripArchive.rebuild_index()
+            self.stdout.write(self.style.SUCCESS(f'Indexed {count} archived trips'))
+            return
+
+        result = TripArchive.archive(
+            older_than_days=options['older_than'],
+            group_size=options['group_size'],
+            dry_run=options['dry_run'],
+        )
+        if options['dry_run']:
+            self.stdout.write(f"{result['trips']} trips from {result['months']} months would be archived")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {result['trips']} trips from {result['months']} months into {result['files']} files "
+            f"({result['bytes'] / 1024:,.0f} KiB) in {result['elapsed_seconds']}s"
+        ))
@@ -0,0 +1,76 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api.benchmarks import BenchmarkSuite, compare_runs
+
+
+class Command(BaseCommand):
+    help = 'Benchmark HOS calculations, log generation and API endpoints against a throwaway database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('cases', nargs='*', help='Benchmark cases to run (default: all)')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed iterations per case')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed warmup iterations per case')
+        parser.add_argument('--seed-trips', type=int, default=200, help='Trips seeded for the read endpoints')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Trips per batch HOS iteration')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for generated workloads')
+        parser.add_argument('--ors-latency', default='fixed:0',
+                            help='Latency of the local ORS stand-in, e.g. "lognormal:150:0.5"')
+        parser.add_argument('--output', help='Write JSON results to this file')
+        parser.add_argument('--compare', help='Compare against a previous JSON results file')
+
+    def handle(self, *args, **options):
+        suite = BenchmarkSuite(
+            iterations=options['iterations'],
+            warmup=options['warmup'],
+            seed_trips=options['seed_trips'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            ors_latency=options['ors_latency'],
+        )
+        unknown = [name for name in options['cases'] if name not in suite.cases]
+        if unknown:
+            raise CommandError(
+                f"Unknown benchmark cases: {', '.join(unknown)}. Available: {', '.join(suite.cases)}"
+            )
+
+        # Benchmarks always run against a disposable test database
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write(f"Seeding {options['seed_trips']} trips...")
+            suite.seed_database()
+            report = suite.run(
+                options['cases'],
+                progress=lambda name: self.stdout.write(f"Running {name}...")
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write('')
+        self.stdout.write(f"{'case':<28}{'mean ms':>12}{'median ms':>12}{'p95 ms':>12}{'ops/s':>12}{'queries':>9}")
+        for result in report['results']:
+            self.stdout.write(
+                f"{result['name']:<28}{result['mean_ms']:>12.3f}{result['median_ms']:>12.3f}"
+                f"{result['p95_ms']:>12.3f}{result['ops_per_sec'] or 0:>12.1f}{result.get('queries', ''):>9}"
+            )
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+            self.stdout.write('')
+            for row in compare_runs(baseline, report):
+                self.stdout.write(
+                    f"{row['name']:<28}{row['baseline_mean_ms']:>12.3f} -> {row['current_mean_ms']:>10.3f}"
+                    f"  ({row['change_pct']:+.1f}%)"
+                )
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(report, output_file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.geocoder import OfflineGeocoder, build_index, read_gazetteer_csv, write_index
+
+
+class Command(BaseCommand):
+    help = 'Compile a gazetteer CSV (name,state,kind,latitude,longitude,aliases) into the offline geocoder index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=str(settings.GAZETTEER_SOURCE_PATH), help='Gazetteer CSV file')
+        parser.add_argument('--output', default=str(settings.GAZETTEER_INDEX_PATH), help='Index file to write')
+
+    def handle(self, *args, **options):
+        try:
+            rows = read_gazetteer_csv(options['source'])
+        except (OSError, KeyError, ValueError) as e:
+            raise CommandError(f"Could not read {options['source']}: {e}")
+
+        started = time.perf_counter()
+        data = build_index(rows)
+        write_index(options['output'], data)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        geocoder = OfflineGeocoder.from_file(options['output'])
+        load_ms = (time.perf_counter() - started) * 1000
+        OfflineGeocoder.reset_default()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {options['output']}: {geocoder.record_count} places, {geocoder.key_count} keys, "
+            f"{len(data) / 1024:.1f} KiB (built in {build_ms:.1f} ms, loads in {load_ms:.2f} ms)"
+        ))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ors_standin import LatencyDistribution, ORSStandInServer, StandInConfig
+
+
+class Command(BaseCommand):
+    help = 'Run a local OpenRouteService stand-in for offline load testing (set ORS_BASE_URL to its address)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--latency', default='fixed:0',
+                            help='Latency for all endpoints, e.g. "lognormal:150:0.5" (kind:mean_ms[:spread])')
+        parser.add_argument('--geocode-latency', help='Override latency for /geocode/search')
+        parser.add_argument('--directions-latency', help='Override latency for /v2/directions')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+        parser.add_argument('--rate-limit-rpm', type=int, default=0,
+                            help='Per-endpoint requests per minute before answering 429 (0 disables)')
+        parser.add_argument('--points-per-mile', type=float, default=8.0, help='Route geometry density')
+        parser.add_argument('--circuity', type=float, default=1.2, help='Road distance / great-circle distance')
+        parser.add_argument('--seed', type=int, help='Random seed for latency and error injection')
+
+    def handle(self, *args, **options):
+        try:
+            default_latency = LatencyDistribution.parse(options['latency'])
+            config = StandInConfig(
+                geocode_latency=LatencyDistribution.parse(options['geocode_latency']) if options['geocode_latency'] else default_latency,
+                directions_latency=LatencyDistribution.parse(options['directions_latency']) if options['directions_latency'] else default_latency,
+                error_rate=options['error_rate'],
+                throttle_rate=options['throttle_rate'],
+                rate_limit_per_minute=options['rate_limit_rpm'],
+                points_per_mile=options['points_per_mile'],
+                circuity=options['circuity'],
+                seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        server = ORSStandInServer(config, host=options['host'], port=options['port'])
+        self.stdout.write(self.style.SUCCESS(f"ORS stand-in listening on {server.base_url}"))
+        self.stdout.write(
+            f"geocode latency {config.geocode_latency}, directions latency {config.directions_latency}, "
+            f"errors {config.error_rate:.1%}, throttled {config.throttle_rate:.1%}, "
+            f"rate limit {config.rate_limit_per_minute or 'off'}"
+        )
+        self.stdout.write(f"Run the API with ORS_BASE_URL={server.base_url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+            self.stdout.write(f"Stats: {server.stats()}")
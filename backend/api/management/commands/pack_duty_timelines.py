@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.timeline import DutyTimeline
+
+
+class Command(BaseCommand):
+    help = 'Convert stored ELD logs between DutyStatus rows and packed duty timelines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--unpack', action='store_true',
+                            help='Turn packed timelines back into DutyStatus rows')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Logs converted per transaction')
+
+    def handle(self, *args, **options):
+        if options['unpack']:
+            count = DutyTimeline.unpack_existing(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Unpacked {count} logs into duty status rows'))
+        else:
+            count = DutyTimeline.pack_existing(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Packed {count} logs into duty timelines'))
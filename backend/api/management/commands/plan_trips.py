@@ -0,0 +1,61 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bulk_planning import BulkTripPlanner
+
+
+class Command(BaseCommand):
+    help = ('Plan every trip request in a CSV or NDJSON file (the /api/calculate/ fields, plus an optional '
+            'ref column) and write one NDJSON result line per row. Interrupted runs resume where they stopped')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='CSV, or NDJSON with a .ndjson/.jsonl extension')
+        parser.add_argument('--results', help='Results file (default: <input>.results.ndjson)')
+        parser.add_argument('--run-name', help='Progress record to resume (default: the input file name)')
+        parser.add_argument('--restart', action='store_true', help='Start the run over instead of resuming')
+        parser.add_argument('--workers', type=int, help='Planning processes (default: CPU count; 0 plans in-process)')
+        parser.add_argument('--chunk-size', type=int, default=getattr(settings, 'PLAN_TRIPS_CHUNK_SIZE', 500),
+                            help='Rows per commit')
+        parser.add_argument('--route-workers', type=int, default=getattr(settings, 'PLAN_TRIPS_ROUTE_WORKERS', 8),
+                            help='Concurrent route lookups')
+        parser.add_argument('--user', help='Username owning the created trips')
+
+    def handle(self, *args, **options):
+        input_path = Path(options['input'])
+        if not input_path.is_file():
+            raise CommandError(f'No such file: {input_path}')
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"No such user: {options['user']}")
+        with open(input_path, 'rb') as handle:
+            total = sum(1 for line in handle if line.strip())
+        if input_path.suffix.lower() not in ('.ndjson', '.jsonl'):
+            total -= 1  # Header
+        results_path = Path(options['results'] or f'{input_path}.results.ndjson')
+
+        def progress(totals):
+            done = totals['rows_done']
+            rate = (done - totals['skipped']) / max(totals['elapsed_seconds'], 1e-9)
+            eta = (total - done) / rate if rate else 0
+            self.stdout.write(f"  {done}/{total} rows, {totals['trips']} trips, {totals['errors']} errors, "
+                              f"{rate:.0f} rows/s, ETA {eta:.0f}s")
+
+        planner = BulkTripPlanner(
+            input_path, results_path, run_name=options['run_name'], workers=options['workers'],
+            chunk_size=options['chunk_size'], route_workers=options['route_workers'], user=user, progress=progress,
+        )
+        try:
+            totals = planner.run(restart=options['restart'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if totals['skipped']:
+            self.stdout.write(f"Resumed after row {totals['skipped']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Planned {totals['rows']} rows in {totals['elapsed_seconds']}s: {totals['trips']} trips, "
+            f"{totals['errors']} errors. Results in {results_path}"
+        ))
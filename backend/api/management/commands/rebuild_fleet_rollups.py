@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.analytics import FleetRollups
+
+
+class Command(BaseCommand):
+    help = ('Recompute the fleet analytics rollups from the trips in the database '
+            '(contributions of archived trips are lost)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Trips read per batch')
+
+    def handle(self, *args, **options):
+        count = FleetRollups.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {count} trips'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.speed_profiles import SpeedProfiles
+
+
+class Command(BaseCommand):
+    help = ('Add trips completed since the last run to the time-of-day speed profiles '
+            '(run before archive_trips; archived trips are not read)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Trips read per batch')
+        parser.add_argument('--full', action='store_true', help='Drop the profiles and count every completed trip again')
+
+    def handle(self, *args, **options):
+        count = SpeedProfiles.update(batch_size=options['batch_size'], full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Added {count} completed trips to the speed profiles'))
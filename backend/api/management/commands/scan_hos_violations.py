@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api.violations import HOSViolationScanner
+
+
+class Command(BaseCommand):
+    help = 'Scan stored duty statuses for 11/14-hour, 30-minute break and 70-hour/8-day violations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Discard previous results and rescan every duty status')
+        parser.add_argument('--chunk-size', type=int, help='Rows fetched per database round trip')
+
+    def handle(self, *args, **options):
+        scanner = HOSViolationScanner(chunk_size=options['chunk_size'])
+        result = scanner.scan(full=options['full'])
+        rate = result['rows'] / result['elapsed_seconds'] * 60 if result['elapsed_seconds'] else 0
+        self.stdout.write(
+            f"Scanned {result['rows']} duty statuses for {result['drivers']} drivers "
+            f"in {result['elapsed_seconds']}s ({rate:,.0f} rows/min)"
+        )
+        if result['rescanned_drivers']:
+            self.stdout.write(f"Rescanned {result['rescanned_drivers']} drivers with back-dated rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['violations']} violations written, watermark at duty status {result['watermark']} "
+            f"and packed log {result['log_watermark']}"
+        ))
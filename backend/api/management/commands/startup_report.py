@@ -0,0 +1,123 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Runs in a fresh interpreter like a WSGI worker: set up Django and the
+# handler, optionally warm up, then time the first and second request
+PROBE = r'''
+import io, json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+from django.core.handlers.wsgi import WSGIHandler
+from wsgiref.util import setup_testing_defaults
+handler = WSGIHandler()
+result = {'setup_ms': round((time.perf_counter() - started) * 1000, 2)}
+if sys.argv[1] == 'warm':
+    from api.startup import StartupWarmer
+    result['steps'] = StartupWarmer.run()
+for key in ('first_request_ms', 'second_request_ms'):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[2], 'HTTP_HOST': sys.argv[3], 'wsgi.input': io.BytesIO()}
+    setup_testing_defaults(environ)
+    statuses = []
+    started = time.perf_counter()
+    b''.join(handler(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+    result[key] = round((time.perf_counter() - started) * 1000, 2)
+    result['status'] = int(statuses[0].split()[0])
+print('STARTUP_REPORT ' + json.dumps(result))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Break down worker start-up: import cost per module, warm-up steps and time to first response'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/health/', help='Request timed as the first request')
+        parser.add_argument('--top', type=int, default=20, help='Modules listed by import time')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def _probe(self, mode: str, path: str) -> tuple:
+        host = next((host for host in settings.ALLOWED_HOSTS if host not in ('*', '') and not host.startswith('.')),
+                    'localhost')
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'trip_planner.settings'),
+               'STARTUP_WARMUP': '0'}
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE, mode, path, host],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        report = next((line[len('STARTUP_REPORT '):] for line in process.stdout.splitlines()
+                       if line.startswith('STARTUP_REPORT ')), None)
+        if process.returncode or report is None:
+            raise CommandError(f'Start-up probe failed:\n{process.stderr[-2000:]}')
+        return json.loads(report), process.stderr
+
+    @staticmethod
+    def _import_times(stderr: str) -> list:
+        """(module, self microseconds, cumulative microseconds) from -X importtime output"""
+        modules = []
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            own, cumulative, name = line[len('import time:'):].split('|')
+            modules.append((name.strip(), int(own), int(cumulative)))
+        return modules
+
+    def handle(self, *args, **options):
+        cold, stderr = self._probe('cold', options['path'])
+        warm, _ = self._probe('warm', options['path'])
+        modules = self._import_times(stderr)
+
+        packages = {}
+        for name, own, _ in modules:
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0) + own
+        report = {
+            'import_ms': round(sum(own for _, own, _ in modules) / 1000, 2),
+            'setup_ms': cold['setup_ms'],
+            'status': cold['status'],
+            'cold_first_request_ms': cold['first_request_ms'],
+            'warm_first_request_ms': warm['first_request_ms'],
+            'second_request_ms': cold['second_request_ms'],
+            'warmup_steps_ms': warm['steps'],
+            'packages_ms': {package: round(own / 1000, 2) for package, own in
+                            sorted(packages.items(), key=lambda item: -item[1])[:options['top']]},
+            'modules_ms': [
+                {'module': name, 'self_ms': round(own / 1000, 2), 'cumulative_ms': round(cumulative / 1000, 2)}
+                for name, own, cumulative in sorted(modules, key=lambda module: -module[1])[:options['top']]
+            ],
+            'api_modules_ms': [
+                {'module': name, 'self_ms': round(own / 1000, 2), 'cumulative_ms': round(cumulative / 1000, 2)}
+                for name, own, cumulative in sorted(modules, key=lambda module: -module[2])
+                if name == 'api' or name.startswith('api.')
+            ],
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"Imports: {report['import_ms']} ms in {len(modules)} modules; "
+                          f"django.setup(): {report['setup_ms']} ms")
+        self.stdout.write(f"GET {options['path']} ({report['status']}): first request {report['cold_first_request_ms']} ms cold, "
+                          f"{report['warm_first_request_ms']} ms after warm-up; "
+                          f"second request {report['second_request_ms']} ms")
+        self.stdout.write('\nWarm-up steps (api/startup.py):')
+        for name, elapsed in report['warmup_steps_ms'].items():
+            self.stdout.write(f"  {name:<16} {'failed' if elapsed is None else f'{elapsed:>9.2f} ms'}")
+        self.stdout.write('\nImport time by top-level package (self):')
+        for package, elapsed in report['packages_ms'].items():
+            self.stdout.write(f'  {package:<32} {elapsed:>9.2f} ms')
+        self.stdout.write('\nSlowest modules (self / cumulative):')
+        for module in report['modules_ms']:
+            self.stdout.write(f"  {module['module']:<48} {module['self_ms']:>9.2f} {module['cumulative_ms']:>9.2f} ms")
+        self.stdout.write('\napi modules (self / cumulative):')
+        for module in report['api_modules_ms']:
+            self.stdout.write(f"  {module['module']:<48} {module['self_ms']:>9.2f} {module['cumulative_ms']:>9.2f} ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"\nWarm-up saves {round(report['cold_first_request_ms'] - report['warm_first_request_ms'], 2)} ms "
+            f"on the first request"
+        ))
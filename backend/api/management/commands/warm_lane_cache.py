@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.cache_warmup import LaneCacheWarmer
+
+
+class Command(BaseCommand):
+    help = 'Pre-populate geocode and route caches for the busiest lanes in trip history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=200, help='Number of lanes to warm')
+        parser.add_argument('--days', type=int, default=30,
+                            help='Trip history window in days (0 for all trips)')
+        parser.add_argument('--include-legs', action='store_true',
+                            help='Also warm the current -> pickup and pickup -> dropoff legs')
+        parser.add_argument('--refresh-within', type=float, default=6,
+                            help='Refetch routes that go stale within this many hours')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent ORS requests')
+
+    def handle(self, *args, **options):
+        if settings.CACHES['default']['BACKEND'].endswith('LocMemCache'):
+            self.stdout.write(self.style.WARNING(
+                'The default cache is process-local; set CACHE_BACKEND to a shared cache '
+                '(database, file or Redis) so the web server sees the warmed entries'
+            ))
+        result = LaneCacheWarmer.warm(
+            limit=options['top'],
+            days=options['days'] or None,
+            include_legs=options['include_legs'],
+            refresh_within=int(options['refresh_within'] * 3600),
+            workers=options['workers'],
+        )
+        self.stdout.write(
+            f"{result['lanes']} lanes: {result['fetched']} fetched, {result['cached']} already fresh, "
+            f"{result['failed']} failed in {result['elapsed_seconds']}s"
+        )
+        if result['failed']:
+            self.stdout.write(self.style.WARNING('Failed lanes fall back to offline estimates until routed'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Lane cache warm'))
@@ -0,0 +1,297 @@
+"""
+Distance matrix service for many-to-many lane planning
+Resolves every unique location once and fills a dense origin x destination
+matrix from the route cache, the ORS matrix endpoint (in chunks that respect
+upstream limits) and, as a last resort, offline estimates
+"""
+
+import logging
+import math
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from django.core.cache import cache
+
+from .calculations import HOSCalculator
+from .distance_service import DistanceService
+from .geocoder import great_circle_miles, normalize_location
+from .rate_limiter import OrsRateLimiter
+
+
+logger = logging.getLogger(__name__)
+
+
+class DistanceMatrixService:
+    """Many-to-many distances and durations between location strings"""
+
+    MATRIX_PATH = "/v2/matrix/driving-hgv"
+    MATRIX_CACHE_PREFIX = "lane:v1:"
+
+    @staticmethod
+    def _chunks(rows: List[int], columns: List[int]) -> List[Tuple[List[int], List[int]]]:
+        """
+        Split a block of matrix cells into ORS-sized requests
+
+        Each chunk keeps sources x destinations within ORS_MATRIX_MAX_ELEMENTS
+        and sources + destinations within ORS_MATRIX_MAX_LOCATIONS.
+        """
+        max_elements = getattr(settings, 'ORS_MATRIX_MAX_ELEMENTS', 3500)
+        max_locations = getattr(settings, 'ORS_MATRIX_MAX_LOCATIONS', 100)
+        # Pick the block shape needing the fewest requests
+        best = None
+        for row_size in range(1, min(len(rows), max(1, max_locations - 1), max(1, max_elements)) + 1):
+            column_size = max(1, min(len(columns), max_locations - row_size, max_elements // row_size))
+            requests_needed = -(-len(rows) // row_size) * -(-len(columns) // column_size)
+            if best is None or requests_needed < best[0]:
+                best = (requests_needed, row_size, column_size)
+        _, row_size, column_size = best
+        return [
+            (rows[row_start:row_start + row_size], columns[column_start:column_start + column_size])
+            for row_start in range(0, len(rows), row_size)
+            for column_start in range(0, len(columns), column_size)
+        ]
+
+    @staticmethod
+    def _fetch_chunk(locations: List[Tuple[float, float]], sources: List[int],
+                     destinations: List[int]) -> Optional[Tuple[list, list]]:
+        """
+        Request one chunk from the ORS matrix endpoint
+
+        Returns:
+            (distances in miles, durations in seconds) rows, or None on failure
+        """
+        used = sorted(set(sources) | set(destinations))
+        position = {location_index: offset for offset, location_index in enumerate(used)}
+        payload = {
+            'locations': [list(locations[index]) for index in used],
+            'sources': [position[index] for index in sources],
+            'destinations': [position[index] for index in destinations],
+            'metrics': ['distance', 'duration'],
+            'units': 'mi',
+        }
+        headers = {
+            'Authorization': getattr(settings, 'ORS_API_KEY', ''),
+            'Content-Type': 'application/json'
+        }
+        try:
+            if not OrsRateLimiter.acquire('matrix'):
+                return None
+            response = DistanceService.http().post(
+                DistanceService.ors_url(DistanceMatrixService.MATRIX_PATH),
+                headers=headers, json=payload, timeout=30
+            )
+            OrsRateLimiter.penalize_response('matrix', response)
+            response.raise_for_status()
+            data = response.json()
+            return data['distances'], data['durations']
+        except Exception as e:
+            logger.warning("Matrix calculation error: %s", e)
+            return None
+
+    @staticmethod
+    def _pair_chunks(lanes: List[Tuple[int, int]]) -> List[Tuple[List[int], List[int]]]:
+        """
+        Group independent (source, destination) pairs into ORS-sized requests
+
+        Each request asks for a small square block and only its diagonal is
+        needed, so pairs are packed up to ORS_MATRIX_MAX_LOCATIONS / 2 at a time.
+        """
+        max_elements = getattr(settings, 'ORS_MATRIX_MAX_ELEMENTS', 3500)
+        max_locations = getattr(settings, 'ORS_MATRIX_MAX_LOCATIONS', 100)
+        size = max(1, min(max_locations // 2, math.isqrt(max_elements)))
+        return [
+            ([source for source, _ in lanes[start:start + size]],
+             [destination for _, destination in lanes[start:start + size]])
+            for start in range(0, len(lanes), size)
+        ]
+
+    @staticmethod
+    def _resolve_lanes(lanes: Dict[Tuple[str, str], int], coords: Dict[str, Optional[Tuple[float, float]]],
+                       stats: Dict, pairwise: bool = False) -> Dict[Tuple[str, str], Dict]:
+        """
+        Look up distance and duration for a set of (origin, destination) lanes
+
+        Lanes are filled from the route cache and earlier matrix results first,
+        then from the ORS matrix endpoint, then from offline estimates.
+
+        Args:
+            lanes: Lane -> number of result cells it fills (for the statistics)
+            coords: Geocoded (lon, lat) for every location in the lanes
+            stats: Statistics dictionary updated in place
+            pairwise: Fetch lanes as independent pairs instead of a full block
+
+        Returns:
+            Lane -> {'distance_miles', 'duration_hours'} for every resolvable lane
+        """
+        values = {}
+
+        # Fill from the route cache and earlier matrix results
+        normalized = {location: normalize_location(location) for location in coords}
+        route_keys = {}
+        lane_keys = {}
+        for lane in lanes:
+            start, end = normalized[lane[0]], normalized[lane[1]]
+            route_keys[DistanceService.normalized_cache_key(DistanceService.ROUTE_CACHE_PREFIX, start, end)] = lane
+            lane_keys[DistanceService.normalized_cache_key(DistanceMatrixService.MATRIX_CACHE_PREFIX, start, end)] = lane
+        key_for_lane = {lane: key for key, lane in lane_keys.items()}
+        cached = cache.get_many(list(route_keys) + list(lane_keys))
+        for key, value in cached.items():
+            lane = route_keys.get(key) or lane_keys.get(key)
+            if lane not in values:
+                values[lane] = {'distance_miles': value['distance_miles'], 'duration_hours': value['duration_hours']}
+                stats['cache_hits'] += lanes[lane]
+
+        # Fetch the remaining resolvable lanes from ORS, grouped into chunks
+        unique_locations = list(coords)
+        location_index = {location: index for index, location in enumerate(unique_locations)}
+        locations = [coords[location] for location in unique_locations]
+        fetchable = [
+            (location_index[origin], location_index[destination])
+            for origin, destination in lanes
+            if (origin, destination) not in values and coords[origin] and coords[destination]
+        ]
+        fresh = {}
+        if fetchable:
+            if pairwise:
+                chunks = DistanceMatrixService._pair_chunks(fetchable)
+            else:
+                wanted = set(fetchable)
+                rows = sorted({source for source, _ in fetchable})
+                columns = sorted({destination for _, destination in fetchable})
+                chunks = [
+                    (chunk_rows, chunk_columns)
+                    for chunk_rows, chunk_columns in DistanceMatrixService._chunks(rows, columns)
+                    if any((r, c) in wanted for r in chunk_rows for c in chunk_columns)
+                ]
+            for chunk_rows, chunk_columns in chunks:
+                stats['ors_requests'] += 1
+                result = DistanceMatrixService._fetch_chunk(locations, chunk_rows, chunk_columns)
+                if result is None:
+                    continue
+                chunk_distances, chunk_durations = result
+                for i, source in enumerate(chunk_rows):
+                    for j, destination in enumerate(chunk_columns):
+                        lane = (unique_locations[source], unique_locations[destination])
+                        if lane not in lanes or lane in values or chunk_distances[i][j] is None:
+                            continue
+                        values[lane] = {
+                            'distance_miles': round(chunk_distances[i][j], 2),
+                            'duration_hours': round(chunk_durations[i][j] / 3600, 2),
+                        }
+                        fresh[key_for_lane[lane]] = values[lane]
+                        stats['ors_cells'] += lanes[lane]
+        if fresh:
+            cache.set_many(fresh, getattr(settings, 'ROUTE_CACHE_TIMEOUT', 24 * 3600))
+
+        # Offline estimate for lanes ORS could not answer
+        circuity = getattr(settings, 'ROAD_CIRCUITY_FACTOR', 1.2)
+        for lane in lanes:
+            if lane in values:
+                continue
+            start, end = coords[lane[0]], coords[lane[1]]
+            if start and end:
+                distance_miles = round(great_circle_miles(start, end) * circuity, 2)
+                values[lane] = {
+                    'distance_miles': distance_miles,
+                    'duration_hours': round(distance_miles / HOSCalculator.AVERAGE_SPEED, 2),
+                }
+                stats['estimated_cells'] += lanes[lane]
+            else:
+                stats['unresolved_cells'] += lanes[lane]
+
+        return values
+
+    @staticmethod
+    def _new_stats(cells: int, unique_locations: int) -> Dict:
+        """Empty fill statistics for a result of the given size"""
+        return {'cells': cells, 'cache_hits': 0, 'ors_cells': 0, 'estimated_cells': 0,
+                'unresolved_cells': 0, 'ors_requests': 0, 'unique_locations': unique_locations}
+
+    @staticmethod
+    def compute(origins: List[str], destinations: List[str]) -> Dict:
+        """
+        Calculate distances and durations for every origin/destination pair
+
+        Args:
+            origins: Origin location strings (matrix rows)
+            destinations: Destination location strings (matrix columns)
+
+        Returns:
+            Dictionary with dense distance_miles and duration_hours matrices
+            (None for cells that could not be resolved) and fill statistics
+        """
+        # Resolve every unique location exactly once
+        unique_locations = list(dict.fromkeys(origins + destinations))
+        coords = {location: DistanceService.geocode_location(location) for location in unique_locations}
+        stats = DistanceMatrixService._new_stats(len(origins) * len(destinations), len(unique_locations))
+
+        # Unique lanes, so duplicated origins/destinations cost one lookup
+        lanes: Dict[Tuple[str, str], int] = {}
+        for origin in origins:
+            for destination in destinations:
+                lanes[(origin, destination)] = lanes.get((origin, destination), 0) + 1
+        values = DistanceMatrixService._resolve_lanes(lanes, coords, stats)
+
+        distances = []
+        durations = []
+        for origin in origins:
+            row_values = [values.get((origin, destination)) for destination in destinations]
+            distances.append([value['distance_miles'] if value else None for value in row_values])
+            durations.append([value['duration_hours'] if value else None for value in row_values])
+
+        return {
+            'origins': origins,
+            'destinations': destinations,
+            'distance_miles': distances,
+            'duration_hours': durations,
+            'stats': stats,
+        }
+
+    @staticmethod
+    def compute_pairs(pairs: List[Tuple[str, str]]) -> Dict:
+        """
+        Calculate distances and durations for a list of independent pairs
+
+        Unlike compute(), only the listed (origin, destination) pairs are
+        requested, e.g. the pickup -> dropoff leg of every load.
+
+        Args:
+            pairs: (origin, destination) location strings
+
+        Returns:
+            Dictionary with distance_miles and duration_hours lists aligned
+            with pairs (None where unresolved) and fill statistics
+        """
+        unique_locations = list(dict.fromkeys(location for pair in pairs for location in pair))
+        coords = {location: DistanceService.geocode_location(location) for location in unique_locations}
+        stats = DistanceMatrixService._new_stats(len(pairs), len(unique_locations))
+
+        lanes: Dict[Tuple[str, str], int] = {}
+        for pair in pairs:
+            lanes[tuple(pair)] = lanes.get(tuple(pair), 0) + 1
+        values = DistanceMatrixService._resolve_lanes(lanes, coords, stats, pairwise=True)
+
+        resolved = [values.get(tuple(pair)) for pair in pairs]
+        return {
+            'pairs': [list(pair) for pair in pairs],
+            'distance_miles': [value['distance_miles'] if value else None for value in resolved],
+            'duration_hours': [value['duration_hours'] if value else None for value in resolved],
+            'stats': stats,
+        }
+
+    @staticmethod
+    def compute_with_feasibility(origins: List[str], destinations: List[str], cycle_used) -> Dict:
+        """
+        Distance matrix plus HOS cycle feasibility for every pair
+
+        Args:
+            origins: Origin location strings
+            destinations: Destination location strings
+            cycle_used: Cycle hours used, one value or one per origin
+
+        Returns:
+            compute() result extended with total_trip_time, feasible and
+            remaining_cycle_hours from HOSCalculator.feasibility_matrix
+        """
+        matrix = DistanceMatrixService.compute(origins, destinations)
+        matrix.update(HOSCalculator.feasibility_matrix(matrix['distance_miles'], cycle_used, matrix['duration_hours']))
+        return matrix
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_trip_route_geometry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HOSScanState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('driver_key', models.CharField(max_length=40, unique=True)),
+                ('state', models.JSONField(default=dict)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HOSScanWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_duty_status_id', models.BigIntegerField(default=0)),
+                ('rows_scanned', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HOSViolation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('driver_key', models.CharField(db_index=True, max_length=40)),
+                ('rule', models.CharField(choices=[('driving_11', '11-Hour Driving Limit'), ('window_14', '14-Hour Window'), ('break_30', '30-Minute Break'), ('cycle_70', '70-Hour/8-Day Limit')], max_length=20)),
+                ('occurred_at', models.DateTimeField()),
+                ('hours', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('duty_status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hos_violations', to='api.dutystatus')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hos_violations', to='api.trip')),
+            ],
+            options={
+                'ordering': ['driver_key', 'occurred_at'],
+                'unique_together': {('duty_status', 'rule')},
+            },
+        ),
+    ]
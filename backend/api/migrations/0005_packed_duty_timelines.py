@@ -0,0 +1,118 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:25
+
+import struct
+from datetime import time
+
+from django.conf import settings
+from django.db import migrations, models, transaction
+
+
+# Frozen copy of the packed timeline format (api/timeline.py) as of this migration
+FORMAT_VERSION = 1
+STATUS_CODES = ('off_duty', 'sleeper', 'driving', 'on_duty')
+RUN = struct.Struct('<II')
+SECOND_MASK = (1 << 17) - 1
+MAX_REMARKS = 1 << 13
+BATCH_SIZE = 1000
+
+
+def _seconds(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def _clock(second):
+    return time(second // 3600, second // 60 % 60, second % 60)
+
+
+def encode(rows):
+    remarks, remark_index = [], {}
+    packed = bytearray((FORMAT_VERSION,))
+    for row in rows:
+        remark = remark_index.get(row['location'])
+        if remark is None:
+            remark = remark_index[row['location']] = len(remarks)
+            if remark >= MAX_REMARKS:
+                raise ValueError(f'A packed timeline holds at most {MAX_REMARKS} distinct locations')
+            remarks.append(row['location'])
+        packed += RUN.pack(_seconds(row['start_time']) | STATUS_CODES.index(row['status']) << 17 | remark << 19,
+                           _seconds(row['end_time']))
+    return bytes(packed), remarks
+
+
+def decode(timeline, remarks):
+    """(sequence, status, start_time, end_time, location) per run"""
+    view = memoryview(timeline)
+    if not view:
+        return []
+    if view[0] != FORMAT_VERSION:
+        raise ValueError(f'Unknown duty timeline format {view[0]}')
+    return [
+        (sequence, STATUS_CODES[head >> 17 & 3], _clock(head & SECOND_MASK), _clock(end), remarks[head >> 19])
+        for sequence, (head, end) in enumerate(RUN.iter_unpack(view[1:]))
+    ]
+
+
+def pack_timelines(apps, schema_editor):
+    # Existing logs move to packed timelines when that is the configured
+    # storage. Logs with HOS violations wait for 0013: deleting their rows
+    # here would cascade to the violations
+    if getattr(settings, 'ELD_TIMELINE_STORAGE', 'rows') != 'packed':
+        return
+    ELDLog = apps.get_model('api', 'ELDLog')
+    DutyStatus = apps.get_model('api', 'DutyStatus')
+    log_ids = list(ELDLog.objects.filter(timeline__isnull=True).exclude(
+        duty_statuses__hos_violations__isnull=False).order_by('id').values_list('id', flat=True).distinct())
+    for offset in range(0, len(log_ids), BATCH_SIZE):
+        chunk = log_ids[offset:offset + BATCH_SIZE]
+        runs = {log_id: [] for log_id in chunk}
+        for row in DutyStatus.objects.filter(log_id__in=chunk).order_by('log_id', 'sequence', 'id').values(
+                'log_id', 'status', 'start_time', 'end_time', 'location'):
+            runs[row['log_id']].append(row)
+        updates = []
+        for log_id, rows in runs.items():
+            timeline, remarks = encode(rows)
+            updates.append(ELDLog(id=log_id, timeline=timeline, remarks=remarks))
+        with transaction.atomic():
+            ELDLog.objects.bulk_update(updates, ['timeline', 'remarks'])
+            DutyStatus.objects.filter(log_id__in=chunk).delete()
+
+
+def unpack_timelines(apps, schema_editor):
+    ELDLog = apps.get_model('api', 'ELDLog')
+    DutyStatus = apps.get_model('api', 'DutyStatus')
+    log_ids = list(ELDLog.objects.filter(timeline__isnull=False).order_by('id').values_list('id', flat=True))
+    for offset in range(0, len(log_ids), BATCH_SIZE):
+        logs = list(ELDLog.objects.filter(id__in=log_ids[offset:offset + BATCH_SIZE]).only(
+            'id', 'timeline', 'remarks'))
+        rows = [
+            DutyStatus(log_id=log.id, status=status, start_time=start_time, end_time=end_time,
+                       location=location, sequence=sequence)
+            for log in logs
+            for sequence, status, start_time, end_time, location in decode(log.timeline, log.remarks)
+        ]
+        for log in logs:
+            log.timeline, log.remarks = None, []
+        with transaction.atomic():
+            DutyStatus.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+            ELDLog.objects.bulk_update(logs, ['timeline', 'remarks'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_idempotency_records'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eldlog',
+            name='remarks',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='eldlog',
+            name='timeline',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(pack_timelines, unpack_timelines),
+    ]
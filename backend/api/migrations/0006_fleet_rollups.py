@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_packed_duty_timelines'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FleetRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('driver', 'Driver'), ('lane', 'Lane')], max_length=10)),
+                ('grain', models.CharField(choices=[('day', 'Day'), ('month', 'Month'), ('year', 'Year')], max_length=10)),
+                ('key', models.CharField(max_length=410)),
+                ('label', models.CharField(max_length=410)),
+                ('period', models.DateField()),
+                ('miles', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('driving_seconds', models.BigIntegerField(default=0)),
+                ('on_duty_seconds', models.BigIntegerField(default=0)),
+                ('trips', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dimension', 'grain', 'period', 'key', 'miles', 'driving_seconds', 'on_duty_seconds', 'trips'], name='api_fleetrollup_range_sums')],
+                'unique_together': {('dimension', 'grain', 'period', 'key')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TripRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('driver_key', models.CharField(max_length=40)),
+                ('lane_key', models.CharField(max_length=410)),
+                ('days', models.JSONField(default=dict)),
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rollup', to='api.trip')),
+            ],
+        ),
+    ]
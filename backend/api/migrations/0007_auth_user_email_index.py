@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Index auth_user.email for email logins and signup duplicate checks
+
+    The stock User model doesn't index email and can't be altered from this
+    app, so the index is plain SQL.
+    """
+
+    dependencies = [
+        ('api', '0006_fleet_rollups'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS api_auth_user_email_idx ON auth_user (email);',
+            reverse_sql='DROP INDEX IF EXISTS api_auth_user_email_idx;',
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_request_profiles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanningRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('input_path', models.CharField(max_length=500)),
+                ('rows_done', models.BigIntegerField(default=0)),
+                ('trips_created', models.BigIntegerField(default=0)),
+                ('errors', models.BigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
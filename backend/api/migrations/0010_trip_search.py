@@ -0,0 +1,77 @@
+import logging
+
+from django.db import migrations
+
+
+logger = logging.getLogger(__name__)
+
+# Frozen copies of api/search.py's index statements as of this migration
+SQLITE_INDEX = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS api_trip_search USING fts5(
+        current_location, pickup_location, dropoff_location, content='api_trip', content_rowid='id',
+        tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS api_trip_search_insert AFTER INSERT ON api_trip BEGIN
+        INSERT INTO api_trip_search(rowid, current_location, pickup_location, dropoff_location)
+        VALUES (new.id, new.current_location, new.pickup_location, new.dropoff_location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS api_trip_search_delete AFTER DELETE ON api_trip BEGIN
+        INSERT INTO api_trip_search(api_trip_search, rowid, current_location, pickup_location, dropoff_location)
+        VALUES ('delete', old.id, old.current_location, old.pickup_location, old.dropoff_location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS api_trip_search_update
+    AFTER UPDATE OF current_location, pickup_location, dropoff_location ON api_trip BEGIN
+        INSERT INTO api_trip_search(api_trip_search, rowid, current_location, pickup_location, dropoff_location)
+        VALUES ('delete', old.id, old.current_location, old.pickup_location, old.dropoff_location);
+        INSERT INTO api_trip_search(rowid, current_location, pickup_location, dropoff_location)
+        VALUES (new.id, new.current_location, new.pickup_location, new.dropoff_location);
+    END""",
+]
+
+POSTGRESQL_INDEX = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    "CREATE INDEX IF NOT EXISTS api_trip_search_trgm ON api_trip "
+    "USING gin ((current_location || ' ' || pickup_location || ' ' || dropoff_location) gin_trgm_ops)",
+]
+
+
+def install_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = SQLITE_INDEX if vendor == 'sqlite' else POSTGRESQL_INDEX if vendor == 'postgresql' else []
+    try:
+        with schema_editor.connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+            if vendor == 'sqlite':
+                cursor.execute("INSERT INTO api_trip_search(api_trip_search) VALUES ('rebuild')")
+    except Exception as e:
+        # SQLite before 3.34 has no trigram tokenizer; search falls back to scanning
+        logger.warning("Trip search index not installed: %s", e)
+
+
+def uninstall_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if schema_editor.connection.vendor == 'sqlite':
+            for trigger in ('insert', 'delete', 'update'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS api_trip_search_{trigger}')
+            cursor.execute('DROP TABLE IF EXISTS api_trip_search')
+        elif schema_editor.connection.vendor == 'postgresql':
+            cursor.execute('DROP INDEX IF EXISTS api_trip_search_trgm')
+
+
+class Migration(migrations.Migration):
+    """
+    Trigram index over the trip locations for /api/trips/search/
+
+    An FTS5 table kept current by triggers on SQLite, a pg_trgm GIN index on
+    PostgreSQL (api/search.py). Other databases get no index. The statements
+    are copied here so later changes to api/search.py don't change this
+    migration; the post_migrate handler there installs the current ones.
+    """
+
+    dependencies = [
+        ('api', '0009_planning_runs'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_index, uninstall_index),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_trip_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpeedProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('lane', 'Lane'), ('region', 'Region'), ('fleet', 'Fleet')], max_length=10)),
+                ('key', models.CharField(max_length=420, unique=True)),
+                ('trips', models.IntegerField(default=0)),
+                ('driving_minutes', models.FloatField(default=0)),
+                ('sums', models.BinaryField()),
+                ('factors', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SpeedProfileBuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counted_through', models.DateTimeField(blank=True, null=True)),
+                ('last_trip_id', models.BigIntegerField(default=0)),
+                ('trips', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
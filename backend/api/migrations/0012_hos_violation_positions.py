@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_positions(apps, schema_editor):
+    # Recorded violations point at their log and the status's sequence
+    HOSViolation = apps.get_model('api', 'HOSViolation')
+    DutyStatus = apps.get_model('api', 'DutyStatus')
+    status = DutyStatus.objects.filter(id=OuterRef('duty_status_id'))
+    HOSViolation.objects.update(
+        log_id=Subquery(status.values('log_id')[:1]),
+        sequence=Subquery(status.values('sequence')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_speed_profiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hosviolation',
+            name='log',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='hos_violations', to='api.eldlog'),
+        ),
+        migrations.AddField(
+            model_name='hosviolation',
+            name='sequence',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='hosviolation',
+            name='duty_status',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='hos_violations', to='api.dutystatus'),
+        ),
+        migrations.RunPython(fill_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,144 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:20
+
+import struct
+from datetime import time
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models, transaction
+from django.db.models import F
+
+
+# Frozen copy of the packed timeline format (api/timeline.py) as of this migration
+FORMAT_VERSION = 1
+STATUS_CODES = ('off_duty', 'sleeper', 'driving', 'on_duty')
+RUN = struct.Struct('<II')
+SECOND_MASK = (1 << 17) - 1
+MAX_REMARKS = 1 << 13
+BATCH_SIZE = 1000
+
+
+def _seconds(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def _clock(second):
+    return time(second // 3600, second // 60 % 60, second % 60)
+
+
+def encode(rows):
+    remarks, remark_index = [], {}
+    packed = bytearray((FORMAT_VERSION,))
+    for row in rows:
+        remark = remark_index.get(row['location'])
+        if remark is None:
+            remark = remark_index[row['location']] = len(remarks)
+            if remark >= MAX_REMARKS:
+                raise ValueError(f'A packed timeline holds at most {MAX_REMARKS} distinct locations')
+            remarks.append(row['location'])
+        packed += RUN.pack(_seconds(row['start_time']) | STATUS_CODES.index(row['status']) << 17 | remark << 19,
+                           _seconds(row['end_time']))
+    return bytes(packed), remarks
+
+
+def decode(timeline, remarks):
+    """(sequence, status, start_time, end_time, location) per run"""
+    view = memoryview(timeline)
+    if not view:
+        return []
+    if view[0] != FORMAT_VERSION:
+        raise ValueError(f'Unknown duty timeline format {view[0]}')
+    return [
+        (sequence, STATUS_CODES[head >> 17 & 3], _clock(head & SECOND_MASK), _clock(end), remarks[head >> 19])
+        for sequence, (head, end) in enumerate(RUN.iter_unpack(view[1:]))
+    ]
+
+
+def pack_timelines(apps, schema_editor):
+    # Existing logs move to packed timelines when that is the configured
+    # storage; their HOS violations keep pointing at the packed positions
+    if getattr(settings, 'ELD_TIMELINE_STORAGE', 'rows') != 'packed':
+        return
+    ELDLog = apps.get_model('api', 'ELDLog')
+    DutyStatus = apps.get_model('api', 'DutyStatus')
+    HOSViolation = apps.get_model('api', 'HOSViolation')
+    log_ids = list(ELDLog.objects.filter(timeline__isnull=True).order_by('id').values_list('id', flat=True))
+    for offset in range(0, len(log_ids), BATCH_SIZE):
+        chunk = log_ids[offset:offset + BATCH_SIZE]
+        runs = {log_id: [] for log_id in chunk}
+        positions = {}
+        for row in DutyStatus.objects.filter(log_id__in=chunk).order_by('log_id', 'sequence', 'id').values(
+                'id', 'log_id', 'status', 'start_time', 'end_time', 'location'):
+            positions[row['id']] = len(runs[row['log_id']])
+            runs[row['log_id']].append(row)
+        updates = []
+        for log_id, rows in runs.items():
+            timeline, remarks = encode(rows)
+            updates.append(ELDLog(id=log_id, timeline=timeline, remarks=remarks))
+        with transaction.atomic():
+            ELDLog.objects.bulk_update(updates, ['timeline', 'remarks'])
+            violations = list(HOSViolation.objects.filter(log_id__in=chunk).only('id', 'sequence', 'duty_status_id'))
+            for violation in violations:
+                # Negative first so no (log, sequence, rule) pair collides mid-update
+                violation.sequence = -1 - positions.get(violation.duty_status_id, violation.sequence)
+                violation.duty_status_id = None
+            HOSViolation.objects.bulk_update(violations, ['sequence', 'duty_status'], batch_size=BATCH_SIZE)
+            HOSViolation.objects.filter(log_id__in=chunk).update(sequence=-1 - F('sequence'))
+            DutyStatus.objects.filter(log_id__in=chunk).delete()
+
+
+def unpack_timelines(apps, schema_editor):
+    ELDLog = apps.get_model('api', 'ELDLog')
+    DutyStatus = apps.get_model('api', 'DutyStatus')
+    HOSViolation = apps.get_model('api', 'HOSViolation')
+    log_ids = list(ELDLog.objects.filter(timeline__isnull=False).order_by('id').values_list('id', flat=True))
+    for offset in range(0, len(log_ids), BATCH_SIZE):
+        logs = list(ELDLog.objects.filter(id__in=log_ids[offset:offset + BATCH_SIZE]).only(
+            'id', 'timeline', 'remarks'))
+        rows = [
+            DutyStatus(log_id=log.id, status=status, start_time=start_time, end_time=end_time,
+                       location=location, sequence=sequence)
+            for log in logs
+            for sequence, status, start_time, end_time, location in decode(log.timeline, log.remarks)
+        ]
+        for log in logs:
+            log.timeline, log.remarks = None, []
+        with transaction.atomic():
+            DutyStatus.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+            ELDLog.objects.bulk_update(logs, ['timeline', 'remarks'])
+            status_ids = {(row.log_id, row.sequence): row.id for row in rows}
+            violations = list(HOSViolation.objects.filter(log_id__in=[log.id for log in logs]).only(
+                'id', 'log_id', 'sequence'))
+            for violation in violations:
+                violation.duty_status_id = status_ids.get((violation.log_id, violation.sequence))
+            HOSViolation.objects.bulk_update(violations, ['duty_status'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_hos_violation_positions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hosviolation',
+            name='log',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hos_violations', to='api.eldlog'),
+        ),
+        migrations.AlterField(
+            model_name='hosviolation',
+            name='sequence',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='hosviolation',
+            unique_together={('log', 'sequence', 'rule')},
+        ),
+        migrations.AddField(
+            model_name='hosscanwatermark',
+            name='last_log_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(pack_timelines, unpack_timelines),
+    ]
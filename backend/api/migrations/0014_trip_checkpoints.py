@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_pack_duty_timelines'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recorded_at', models.DateTimeField()),
+                ('miles_completed', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('driving_hours', models.FloatField()),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='api.trip')),
+            ],
+            options={
+                'ordering': ['trip', 'recorded_at', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_trip_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpeedProfileContribution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('keys', models.JSONField(default=list)),
+                ('sums', models.BinaryField()),
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='speed_contribution', to='api.trip')),
+            ],
+        ),
+    ]
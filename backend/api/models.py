@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from rest_framework.utils.encoders import JSONEncoder
 
 
 class Trip(models.Model):
@@ -25,6 +26,11 @@ class Trip(models.Model):
     fuel_stops = models.IntegerField(default=0)
     rest_stops = models.IntegerField(default=0)
     
+    # Route geometry ([longitude, latitude] pairs) kept for re-planning
+    route_geometry = models.JSONField(default=list, blank=True)
+    miles_completed = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    replanned_at = models.DateTimeField(null=True, blank=True)
+    
     # Status and metadata
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='planned')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -75,6 +81,9 @@ class ELDLog(models.Model):
     carrier_name = models.CharField(max_length=100, default='Carrier')
     vehicle_number = models.CharField(max_length=50, default='V001')
     total_miles = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    # Packed duty timeline (api/timeline.py); None when the statuses are DutyStatus rows
+    timeline = models.BinaryField(null=True, blank=True, editable=False)
+    remarks = models.JSONField(default=list, blank=True)  # Locations the packed runs point into
     
     class Meta:
         ordering = ['trip', 'date']
@@ -105,4 +114,232 @@ class DutyStatus(models.Model):
         ordering = ['log', 'sequence']
     
     def __str__(self):
-        return f"{self.log} - {self.status} ({self.start_time} - {self.end_time})"
\ No newline at end of file
+        return f"{self.log} - {self.status} ({self.start_time} - {self.end_time})"
+
+
+class HOSViolation(models.Model):
+    """HOS rule violation found by the fleet-wide scanner (api/violations.py)"""
+    
+    RULE_CHOICES = [
+        ('driving_11', '11-Hour Driving Limit'),
+        ('window_14', '14-Hour Window'),
+        ('break_30', '30-Minute Break'),
+        ('cycle_70', '70-Hour/8-Day Limit'),
+    ]
+    
+    # 'user:<id>' for trips with a user, otherwise 'trip:<id>'
+    driver_key = models.CharField(max_length=40, db_index=True)
+    trip = models.ForeignKey(Trip, related_name='hos_violations', on_delete=models.CASCADE)
+    # The offending status is the log's entry at `sequence`; duty_status is
+    # also set while the log is row-stored and cleared when it is packed
+    log = models.ForeignKey(ELDLog, related_name='hos_violations', on_delete=models.CASCADE)
+    sequence = models.IntegerField()
+    duty_status = models.ForeignKey(DutyStatus, related_name='hos_violations', on_delete=models.SET_NULL,
+                                    null=True, blank=True)
+    rule = models.CharField(max_length=20, choices=RULE_CHOICES)
+    occurred_at = models.DateTimeField()
+    hours = models.DecimalField(max_digits=6, decimal_places=2)  # Hours counted when the limit was passed
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['driver_key', 'occurred_at']
+        unique_together = ['log', 'sequence', 'rule']
+    
+    def __str__(self):
+        return f"{self.driver_key} - {self.rule} at {self.occurred_at}"
+
+
+class HOSScanWatermark(models.Model):
+    """Highest duty status id (and packed log id) processed by an incremental violation scan"""
+    
+    name = models.CharField(max_length=50, unique=True)
+    last_duty_status_id = models.BigIntegerField(default=0)
+    last_log_id = models.BigIntegerField(default=0)  # Packed logs (api/timeline.py)
+    rows_scanned = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.last_duty_status_id}"
+
+
+class HOSScanState(models.Model):
+    """Per-driver scanner counters carried between incremental runs"""
+    
+    driver_key = models.CharField(max_length=40, unique=True)
+    state = models.JSONField(default=dict)
+    
+    def __str__(self):
+        return f"Scan state - {self.driver_key}"
+
+
+class PlanningRun(models.Model):
+    """Progress of a bulk planning run (manage.py plan_trips), for resuming"""
+    
+    name = models.CharField(max_length=200, unique=True)
+    input_path = models.CharField(max_length=500)
+    rows_done = models.BigIntegerField(default=0)  # Last input row committed
+    trips_created = models.BigIntegerField(default=0)
+    errors = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.name} @ row {self.rows_done}"
+
+
+class IdempotencyRecord(models.Model):
+    """Stored response for a request sent with an Idempotency-Key header"""
+    
+    STATE_CHOICES = [
+        ('pending', 'Pending'),
+        ('completed', 'Completed'),
+    ]
+    
+    # sha256 of user, path and the client's key, so keys never cross users
+    key = models.CharField(max_length=64, unique=True)
+    request_hash = models.CharField(max_length=64)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='pending')
+    response_status = models.IntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=JSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Idempotency key {self.key[:12]} ({self.state})"
+
+
+class FleetRollup(models.Model):
+    """Pre-aggregated miles and duty time per driver or lane (api/analytics.py)"""
+    
+    DIMENSION_CHOICES = [
+        ('driver', 'Driver'),
+        ('lane', 'Lane'),
+    ]
+    GRAIN_CHOICES = [
+        ('day', 'Day'),
+        ('month', 'Month'),
+        ('year', 'Year'),
+    ]
+    
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    grain = models.CharField(max_length=10, choices=GRAIN_CHOICES)
+    # 'user:<id>' / 'trip:<id>' for drivers, normalized 'pickup -> dropoff' for lanes
+    key = models.CharField(max_length=410)
+    label = models.CharField(max_length=410)
+    period = models.DateField()  # The day, or the first day of the month or year
+    miles = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    driving_seconds = models.BigIntegerField(default=0)
+    on_duty_seconds = models.BigIntegerField(default=0)  # Includes driving
+    trips = models.IntegerField(default=0)  # Trips starting in the period
+    
+    class Meta:
+        unique_together = ['dimension', 'grain', 'period', 'key']
+        # Covers date-range sums without reading the table
+        indexes = [models.Index(
+            fields=['dimension', 'grain', 'period', 'key', 'miles', 'driving_seconds', 'on_duty_seconds', 'trips'],
+            name='api_fleetrollup_range_sums',
+        )]
+    
+    def __str__(self):
+        return f"{self.dimension} {self.label} - {self.period} ({self.grain})"
+
+
+class TripRollup(models.Model):
+    """What a trip last contributed to the fleet rollups, so updates apply as deltas"""
+    
+    trip = models.OneToOneField(Trip, related_name='rollup', on_delete=models.CASCADE)
+    driver_key = models.CharField(max_length=40)
+    lane_key = models.CharField(max_length=410)
+    # {'YYYY-MM-DD': [miles, driving seconds, on-duty seconds, trips]}
+    days = models.JSONField(default=dict)
+    
+    def __str__(self):
+        return f"Rollup contribution - {self.trip_id}"
+
+
+class RequestProfile(models.Model):
+    """Sampled stack profile of one request (api/profiling.py)"""
+    
+    TRIGGER_CHOICES = [
+        ('header', 'X-Profile Header'),
+        ('sampled', 'Random Sample'),
+    ]
+    
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=300)
+    status_code = models.IntegerField()
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    user = models.ForeignKey(User, related_name='request_profiles', on_delete=models.SET_NULL, null=True, blank=True)
+    duration_ms = models.FloatField()
+    sample_interval_ms = models.FloatField()
+    samples = models.IntegerField()
+    collapsed = models.TextField()  # 'frame;frame;frame microseconds' lines, root frame first
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms, {self.samples} samples)"
+
+
+class TripCheckpoint(models.Model):
+    """Progress a driver reported while re-planning a trip; speed profiles learn from these"""
+    
+    trip = models.ForeignKey(Trip, related_name='checkpoints', on_delete=models.CASCADE)
+    recorded_at = models.DateTimeField()  # The re-plan's as_of
+    miles_completed = models.DecimalField(max_digits=8, decimal_places=2)
+    driving_hours = models.FloatField()  # Driving since the last 10-hour reset, as reported
+    
+    class Meta:
+        ordering = ['trip', 'recorded_at', 'id']
+    
+    def __str__(self):
+        return f"{self.trip} at {self.recorded_at}: {self.miles_completed} miles"
+
+
+class SpeedProfile(models.Model):
+    """Hour-of-day speed factors for a lane, a region or the whole fleet (api/speed_profiles.py)"""
+    
+    KIND_CHOICES = [
+        ('lane', 'Lane'),
+        ('region', 'Region'),
+        ('fleet', 'Fleet'),
+    ]
+    
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # 'lane:<pickup> -> <dropoff>' (normalized), 'region:<lat cell>:<lon cell>' or 'fleet'
+    key = models.CharField(max_length=420, unique=True)
+    trips = models.IntegerField(default=0)
+    driving_minutes = models.FloatField(default=0)
+    # Packed arrays: 24 mile sums then 24 minute sums (float64), and 24 factors (float32)
+    sums = models.BinaryField()
+    factors = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Speed profile {self.key} ({self.trips} trips)"
+
+
+class SpeedProfileContribution(models.Model):
+    """What a completed trip last added to the speed profiles, so a re-saved trip replaces it"""
+    
+    trip = models.OneToOneField(Trip, related_name='speed_contribution', on_delete=models.CASCADE)
+    keys = models.JSONField(default=list)  # Profile keys the sums were added to
+    sums = models.BinaryField()  # Packed like SpeedProfile.sums
+    
+    def __str__(self):
+        return f"Speed profile contribution - {self.trip_id}"
+
+
+class SpeedProfileBuild(models.Model):
+    """How far manage.py rebuild_speed_profiles has read the completed trips"""
+    
+    counted_through = models.DateTimeField(null=True, blank=True)  # updated_at of the last trip counted
+    last_trip_id = models.BigIntegerField(default=0)
+    trips = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Speed profiles through {self.counted_through} ({self.trips} trips)"
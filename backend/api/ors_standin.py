@@ -0,0 +1,395 @@
+"""
+Local stand-in for the OpenRouteService geocode, directions and matrix endpoints
+Used for deterministic, offline load testing of DistanceService with
+configurable latency, error rates and rate limiting
+"""
+
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import urlparse, parse_qs
+
+from .geocoder import OfflineGeocoder, haversine_meters
+
+
+# Continental US bounding box used to place unknown geocode queries
+US_LAT_RANGE = (25.0, 49.0)
+US_LON_RANGE = (-124.0, -67.0)
+
+
+class LatencyDistribution:
+    """
+    Latency distribution parsed from a spec string
+
+    Specs look like "<kind>:<mean_ms>[:<spread>]", for example "fixed:50",
+    "uniform:100:40" (mean +/- 40ms), "normal:120:30" (standard deviation),
+    "lognormal:150:0.5" (sigma of the underlying normal) or "exponential:80".
+    """
+
+    KINDS = ('fixed', 'uniform', 'normal', 'lognormal', 'exponential')
+
+    def __init__(self, kind: str = 'fixed', mean_ms: float = 0.0, spread: float = 0.0):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution '{kind}'")
+        self.kind = kind
+        self.mean_ms = mean_ms
+        self.spread = spread
+
+    @classmethod
+    def parse(cls, spec: Optional[str]) -> 'LatencyDistribution':
+        if not spec:
+            return cls()
+        parts = spec.split(':')
+        kind = parts[0]
+        mean_ms = float(parts[1]) if len(parts) > 1 else 0.0
+        spread = float(parts[2]) if len(parts) > 2 else 0.0
+        return cls(kind, mean_ms, spread)
+
+    def sample(self, rng: random.Random) -> float:
+        """Draw one latency in seconds"""
+        if self.kind == 'fixed':
+            value = self.mean_ms
+        elif self.kind == 'uniform':
+            value = rng.uniform(self.mean_ms - self.spread, self.mean_ms + self.spread)
+        elif self.kind == 'normal':
+            value = rng.gauss(self.mean_ms, self.spread)
+        elif self.kind == 'lognormal':
+            # Scale so the distribution mean equals mean_ms
+            mu = math.log(self.mean_ms) - self.spread ** 2 / 2 if self.mean_ms > 0 else 0.0
+            value = rng.lognormvariate(mu, self.spread) if self.mean_ms > 0 else 0.0
+        else:
+            value = rng.expovariate(1.0 / self.mean_ms) if self.mean_ms > 0 else 0.0
+        return max(0.0, value) / 1000.0
+
+    def __str__(self):
+        return f"{self.kind}:{self.mean_ms:g}:{self.spread:g}"
+
+
+class StandInConfig:
+    """Behaviour knobs for the ORS stand-in"""
+
+    def __init__(self, geocode_latency: Optional[LatencyDistribution] = None,
+                 directions_latency: Optional[LatencyDistribution] = None,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 rate_limit_per_minute: int = 0, points_per_mile: float = 8.0,
+                 circuity: float = 1.2, average_speed_mph: float = 58.0, matrix_max_elements: int = 3500,
+                 seed: Optional[int] = None):
+        self.geocode_latency = geocode_latency or LatencyDistribution()
+        self.directions_latency = directions_latency or LatencyDistribution()
+        self.error_rate = error_rate  # Fraction of requests answered with a 5xx
+        self.throttle_rate = throttle_rate  # Fraction of requests answered with a random 429
+        self.rate_limit_per_minute = rate_limit_per_minute  # Token bucket per endpoint, 0 disables
+        self.points_per_mile = points_per_mile  # Route geometry density
+        self.circuity = circuity  # Road distance / great-circle distance
+        self.average_speed_mph = average_speed_mph
+        self.matrix_max_elements = matrix_max_elements  # Larger matrix requests are rejected with 400
+        self.seed = seed
+
+
+class _TokenBucket:
+    """Per-endpoint token bucket used to emulate the ORS per-minute quota"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    @property
+    def remaining(self) -> int:
+        return int(self.tokens)
+
+
+def encode_polyline(coordinates: List[List[float]], precision: int = 5) -> str:
+    """Encode [longitude, latitude] pairs with the Google polyline algorithm used by ORS"""
+    factor = 10 ** precision
+    output = []
+    previous_lat = previous_lon = 0
+    for lon, lat in coordinates:
+        lat_value = int(round(lat * factor))
+        lon_value = int(round(lon * factor))
+        for delta in (lat_value - previous_lat, lon_value - previous_lon):
+            delta = ~(delta << 1) if delta < 0 else delta << 1
+            while delta >= 0x20:
+                output.append(chr((0x20 | (delta & 0x1f)) + 63))
+                delta >>= 5
+            output.append(chr(delta + 63))
+        previous_lat, previous_lon = lat_value, lon_value
+    return ''.join(output)
+
+
+def geocode_text(text: str) -> List[float]:
+    """
+    Resolve a free-text location
+
+    Known places come from the offline gazetteer; anything else is placed
+    deterministically inside the continental US.
+    """
+    geocoder = OfflineGeocoder.get_default()
+    match = geocoder.lookup(text) if geocoder else None
+    if match:
+        return [match.longitude, match.latitude]
+    digest = hashlib.sha1(text.strip().lower().encode('utf-8')).digest()
+    lat_fraction = int.from_bytes(digest[:4], 'big') / 0xFFFFFFFF
+    lon_fraction = int.from_bytes(digest[4:8], 'big') / 0xFFFFFFFF
+    latitude = US_LAT_RANGE[0] + lat_fraction * (US_LAT_RANGE[1] - US_LAT_RANGE[0])
+    longitude = US_LON_RANGE[0] + lon_fraction * (US_LON_RANGE[1] - US_LON_RANGE[0])
+    return [round(longitude, 6), round(latitude, 6)]
+
+
+def route_geometry(waypoints: List[List[float]], distance_miles: float,
+                   points_per_mile: float) -> List[List[float]]:
+    """Interpolate a route polyline through the waypoints at the configured density"""
+    total_points = max(len(waypoints), int(distance_miles * points_per_mile))
+    leg_lengths = [haversine_meters(a, b) for a, b in zip(waypoints, waypoints[1:])]
+    total_length = sum(leg_lengths) or 1.0
+    geometry = []
+    for (start, end), leg_length in zip(zip(waypoints, waypoints[1:]), leg_lengths):
+        steps = max(1, int(total_points * leg_length / total_length))
+        for step in range(steps):
+            fraction = step / steps
+            # Small deterministic wobble so the line is not perfectly straight
+            wobble = 0.01 * math.sin(fraction * math.pi * 7)
+            geometry.append([
+                round(start[0] + (end[0] - start[0]) * fraction + wobble, 6),
+                round(start[1] + (end[1] - start[1]) * fraction - wobble, 6),
+            ])
+    geometry.append(list(waypoints[-1]))
+    return geometry
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Request handler answering the ORS endpoints used by DistanceService"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: dict, status: int = 200, headers: Optional[dict] = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _upstream_behaviour(self, endpoint: str) -> bool:
+        """
+        Apply latency, rate limiting and injected errors for one request
+
+        Returns:
+            True when an error response has already been sent
+        """
+        server = self.server
+        config = server.config
+        latency = config.geocode_latency if endpoint == 'geocode' else config.directions_latency
+        with server.rng_lock:
+            delay = latency.sample(server.rng)
+            throttled = server.rng.random() < config.throttle_rate
+            failed = server.rng.random() < config.error_rate
+        server.record(endpoint, 'requests')
+        if delay:
+            time.sleep(delay)
+
+        bucket = server.buckets.get(endpoint)
+        if throttled or (bucket is not None and not bucket.take()):
+            server.record(endpoint, 'throttled')
+            self._send_json(
+                {'error': {'code': 429, 'message': 'Rate Limit Exceeded'}}, status=429,
+                headers={'Retry-After': '1', 'x-ratelimit-remaining': str(bucket.remaining if bucket else 0)}
+            )
+            return True
+        if failed:
+            server.record(endpoint, 'errors')
+            self._send_json({'error': {'code': 503, 'message': 'Service Unavailable'}}, status=503)
+            return True
+        return False
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == '/_standin/stats':
+            self._send_json(self.server.stats_snapshot())
+            return
+        if parsed.path != '/geocode/search':
+            self._send_json({'error': 'Not found'}, status=404)
+            return
+        if self._upstream_behaviour('geocode'):
+            return
+
+        text = parse_qs(parsed.query).get('text', [''])[0]
+        if not text.strip():
+            self._send_json({'type': 'FeatureCollection', 'features': []})
+            return
+        coordinates = geocode_text(text)
+        self._send_json({
+            'type': 'FeatureCollection',
+            'features': [{
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': coordinates},
+                'properties': {'label': text, 'confidence': 0.9, 'source': 'standin'},
+            }],
+        })
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        raw_body = self.rfile.read(length) if length else b''
+        parts = parsed.path.strip('/').split('/')
+        if len(parts) >= 3 and parts[:2] == ['v2', 'matrix']:
+            self._matrix(raw_body)
+            return
+        if len(parts) < 3 or parts[:2] != ['v2', 'directions']:
+            self._send_json({'error': 'Not found'}, status=404)
+            return
+        if self._upstream_behaviour('directions'):
+            return
+
+        try:
+            waypoints = json.loads(raw_body or b'{}')['coordinates']
+            if len(waypoints) < 2:
+                raise ValueError('At least two coordinates are required')
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json({'error': {'code': 2003, 'message': str(e)}}, status=400)
+            return
+
+        config = self.server.config
+        straight_meters = sum(haversine_meters(a, b) for a, b in zip(waypoints, waypoints[1:]))
+        distance_meters = straight_meters * config.circuity
+        distance_miles = distance_meters * 0.000621371
+        duration_seconds = distance_miles / config.average_speed_mph * 3600
+        geometry = route_geometry(waypoints, distance_miles, config.points_per_mile)
+        summary = {'distance': round(distance_meters, 1), 'duration': round(duration_seconds, 1)}
+
+        if len(parts) > 3 and parts[3] == 'geojson':
+            self._send_json({
+                'type': 'FeatureCollection',
+                'features': [{
+                    'type': 'Feature',
+                    'geometry': {'type': 'LineString', 'coordinates': geometry},
+                    'properties': {'summary': summary, 'way_points': [0, len(geometry) - 1]},
+                }],
+            })
+        else:
+            self._send_json({
+                'routes': [{
+                    'summary': summary,
+                    'geometry': encode_polyline(geometry),
+                    'way_points': [0, len(geometry) - 1],
+                }],
+            })
+
+    def _matrix(self, raw_body: bytes):
+        """Answer /v2/matrix/{profile} with circuity-scaled great-circle distances"""
+        if self._upstream_behaviour('matrix'):
+            return
+        try:
+            body = json.loads(raw_body or b'{}')
+            locations = body['locations']
+            sources = body.get('sources') or list(range(len(locations)))
+            destinations = body.get('destinations') or list(range(len(locations)))
+            if len(sources) * len(destinations) > self.server.config.matrix_max_elements:
+                raise ValueError('Request exceeds the matrix element limit')
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json({'error': {'code': 6004, 'message': str(e)}}, status=400)
+            return
+
+        config = self.server.config
+        meters_per_unit = {'m': 1.0, 'km': 1000.0, 'mi': 1609.344}.get(body.get('units', 'm'), 1.0)
+        distances = []
+        durations = []
+        for source in sources:
+            distance_row = []
+            duration_row = []
+            for destination in destinations:
+                meters = haversine_meters(locations[source], locations[destination]) * config.circuity
+                distance_row.append(round(meters / meters_per_unit, 2))
+                duration_row.append(round(meters * 0.000621371 / config.average_speed_mph * 3600, 1))
+            distances.append(distance_row)
+            durations.append(duration_row)
+        self._send_json({
+            'distances': distances,
+            'durations': durations,
+            'sources': [{'location': locations[index]} for index in sources],
+            'destinations': [{'location': locations[index]} for index in destinations],
+        })
+
+
+class ORSStandInServer:
+    """
+    Threaded HTTP server hosting the stand-in
+
+    Can be run in the foreground (serve_forever) or used as a context manager
+    that serves from a background thread.
+    """
+
+    def __init__(self, config: Optional[StandInConfig] = None, host: str = '127.0.0.1', port: int = 0):
+        self.config = config or StandInConfig()
+        self.httpd = ThreadingHTTPServer((host, port), StandInHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.config = self.config
+        self.httpd.rng = random.Random(self.config.seed)
+        self.httpd.rng_lock = threading.Lock()
+        self.httpd.buckets = {}
+        if self.config.rate_limit_per_minute:
+            self.httpd.buckets = {
+                'geocode': _TokenBucket(self.config.rate_limit_per_minute),
+                'directions': _TokenBucket(self.config.rate_limit_per_minute),
+                'matrix': _TokenBucket(self.config.rate_limit_per_minute),
+            }
+        self.httpd.stats = {}
+        self.httpd.stats_lock = threading.Lock()
+        self.httpd.record = self._record
+        self.httpd.stats_snapshot = self.stats
+        self._thread = None
+
+    def _record(self, endpoint: str, counter: str):
+        with self.httpd.stats_lock:
+            endpoint_stats = self.httpd.stats.setdefault(endpoint, {'requests': 0, 'throttled': 0, 'errors': 0})
+            endpoint_stats[counter] += 1
+
+    def stats(self) -> dict:
+        with self.httpd.stats_lock:
+            return {endpoint: dict(counters) for endpoint, counters in self.httpd.stats.items()}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
@@ -0,0 +1,188 @@
+"""
+On-demand request profiling
+ProfilingMiddleware samples the stack of the thread serving a request every
+PROFILE_SAMPLE_INTERVAL seconds and stores the result as collapsed stacks
+(one 'frame;frame;frame weight' line per distinct stack, the input format of
+flamegraph.pl and speedscope). Each sample weighs the microseconds since the
+previous one, so widths stay true to wall time when the sampler waits for
+the GIL. Wall-clock sampling also shows time spent waiting on ORS and the
+database.
+
+A request is profiled when a staff user sends 'X-Profile: 1', or at random
+with probability PROFILE_SAMPLE_RATE. Otherwise the middleware only looks at
+one header; the user is not even loaded. Under ASGI, sync views run on a
+worker thread (sync_to_async); the middleware's process_view runs on that
+same thread just before the view, so that is where the sampler starts.
+Async views (the event streams) are not profiled.
+"""
+
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from typing import Optional
+
+from asgiref.sync import SyncToAsync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from .models import RequestProfile
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+MAX_DEPTH = 200
+
+
+@lru_cache(maxsize=4096)
+def _frame_name(code) -> str:
+    filename = code.co_filename
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and filename.startswith(prefix):
+            filename = filename[len(prefix):].lstrip('/\\')
+            break
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """Samples one thread's stack from a background thread"""
+
+    def __init__(self, thread_id: int, interval: float, root_code=None):
+        """
+        Args:
+            thread_id: Thread to sample (threading.get_ident() of the request thread)
+            interval: Seconds between samples
+            root_code: Code object where stacks start; frames above it (the
+                server and outer middleware) are left out
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root_code = root_code
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and len(names) < MAX_DEPTH:
+                names.append(_frame_name(frame.f_code))
+                if frame.f_code is self.root_code:
+                    break
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += max(int(elapsed * 1e6), 1)
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """Collapsed stack lines weighted in microseconds, heaviest first"""
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common())
+
+
+class ProfilingMiddleware:
+    """Profile selected requests and store RequestProfile rows (goes after AuthenticationMiddleware)"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _trigger(self, request) -> Optional[str]:
+        """'header', 'sampled' or None when the request isn't profiled"""
+        if request.META.get(PROFILE_HEADER) == '1':
+            user = getattr(request, 'user', None)
+            return 'header' if user is not None and user.is_staff else None
+        rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+        if rate and random.random() < rate and request.path.startswith(
+                tuple(getattr(settings, 'PROFILE_PATHS', ['/api/']))):
+            return 'sampled'
+        return None
+
+    def _sampler(self, root_code) -> StackSampler:
+        return StackSampler(threading.get_ident(), getattr(settings, 'PROFILE_SAMPLE_INTERVAL', 0.005), root_code)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """ASGI only: start sampling the thread sync_to_async runs the view on"""
+        if not self.async_mode or iscoroutinefunction(view_func):
+            return None
+        trigger = self._trigger(request)
+        if trigger is not None:
+            sampler = self._sampler(SyncToAsync.thread_handler.__code__)
+            request._profiler = (sampler, trigger, time.perf_counter())
+            sampler.start()
+        return None
+
+    async def __acall__(self, request):
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler = getattr(request, '_profiler', None)
+            if profiler is not None:
+                await sync_to_async(profiler[0].stop)()
+        if profiler is None:
+            return response
+        sampler, trigger, started = profiler
+        duration_ms = (time.perf_counter() - started) * 1000
+        await sync_to_async(self._store, thread_sensitive=True)(request, response, trigger, sampler, duration_ms)
+        return response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        trigger = self._trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+
+        sampler = self._sampler(ProfilingMiddleware.__call__.__code__)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+        duration_ms = (time.perf_counter() - started) * 1000
+        self._store(request, response, trigger, sampler, duration_ms)
+        return response
+
+    @staticmethod
+    def _store(request, response, trigger: str, sampler: StackSampler, duration_ms: float):
+        """Save a RequestProfile and point the response at it"""
+        try:
+            profile = RequestProfile.objects.create(
+                method=request.method,
+                path=request.path[:300],
+                status_code=response.status_code,
+                trigger=trigger,
+                user=request.user if trigger == 'header' else None,
+                duration_ms=round(duration_ms, 2),
+                sample_interval_ms=round(sampler.interval * 1000, 3),
+                samples=sampler.samples,
+                collapsed=sampler.collapsed(),
+            )
+            response['X-Profile-Id'] = str(profile.id)
+            # Keep the newest PROFILE_MAX_STORED profiles
+            stale = RequestProfile.objects.order_by('-id').values_list('id', flat=True)[
+                getattr(settings, 'PROFILE_MAX_STORED', 500):]
+            RequestProfile.objects.filter(id__in=list(stale)).delete()
+        except Exception as e:
+            logger.exception("Could not store request profile: %s", e)
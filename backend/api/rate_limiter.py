@@ -0,0 +1,207 @@
+"""
+Cross-process rate limiting for OpenRouteService
+Token buckets kept in a small SQLite file that every worker process on the
+host shares, so the ORS quota is spent at the configured rate no matter how
+many gunicorn workers or threads are calling. Interactive requests are
+served before batch work (warm-up jobs, background refreshes); a request
+that cannot get a token before its deadline degrades to the caller's
+fallback instead of risking a 429.
+"""
+
+import contextvars
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+_priority = contextvars.ContextVar('ors_priority', default=INTERACTIVE)
+
+
+class OrsRateLimiter:
+    """Shared token buckets ('geocode', 'directions', 'matrix') for ORS calls"""
+
+    _local = threading.local()
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS buckets (
+            name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS waiters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS waiters_name ON waiters (name, expires);
+    """
+
+    @staticmethod
+    @contextmanager
+    def priority(lane: str):
+        """Run ORS calls in the block under a priority lane (INTERACTIVE or BATCH)"""
+        token = _priority.set(lane)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    @staticmethod
+    def current_priority() -> str:
+        return _priority.get()
+
+    @staticmethod
+    def bucket_config(name: str) -> Optional[Dict]:
+        """{'rate': tokens per second, 'burst': capacity}, or None when unlimited"""
+        limits = getattr(settings, 'ORS_RATE_LIMITS', None) or {}
+        config = limits.get(name)
+        if not config:
+            return None
+        return {'rate': config['per_minute'] / 60, 'burst': config.get('burst', 1)}
+
+    @staticmethod
+    def _connection() -> sqlite3.Connection:
+        """Per-thread connection to the shared store (created on first use)"""
+        path = str(getattr(settings, 'ORS_RATE_LIMIT_PATH', 'ors_ratelimit.sqlite3'))
+        local = OrsRateLimiter._local
+        if getattr(local, 'path', None) != path or getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(OrsRateLimiter.SCHEMA)
+            local.connection, local.path, local.pid = connection, path, os.getpid()
+        return local.connection
+
+    @staticmethod
+    def _take(connection: sqlite3.Connection, name: str, config: Dict, lane: str,
+              waiter: Optional[int], deadline: float) -> tuple:
+        """
+        One locked attempt to take a token
+
+        Returns:
+            (acquired, seconds until a token could be free, waiter id)
+        """
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM buckets WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                tokens = config['burst']
+            else:
+                tokens = min(config['burst'], row[0] + (now - row[1]) * config['rate'])
+
+            # Batch work leaves headroom for interactive requests and yields
+            # to any that are queued
+            needed = 1.0
+            if lane == BATCH:
+                needed += config['burst'] * getattr(settings, 'ORS_RATE_LIMIT_BATCH_RESERVE', 0.25)
+                queued = connection.execute(
+                    'SELECT COUNT(*) FROM waiters WHERE name = ? AND expires > ?', (name, now)
+                ).fetchone()[0]
+                if queued:
+                    needed = max(needed, tokens + 1.0)
+
+            acquired = tokens >= needed
+            if acquired:
+                tokens -= 1.0
+                if waiter is not None:
+                    connection.execute('DELETE FROM waiters WHERE id = ?', (waiter,))
+                    waiter = None
+            elif lane == INTERACTIVE and waiter is None:
+                waiter = connection.execute(
+                    'INSERT INTO waiters (name, expires) VALUES (?, ?)', (name, deadline)
+                ).lastrowid
+            connection.execute(
+                'INSERT INTO buckets (name, tokens, updated) VALUES (?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                (name, tokens, now)
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return acquired, max(needed - tokens, 0) / config['rate'], waiter
+
+    @staticmethod
+    def acquire(name: str, deadline: Optional[float] = None) -> bool:
+        """
+        Take a token from a bucket, queueing until the deadline
+
+        Args:
+            name: Bucket name ('geocode', 'directions', 'matrix')
+            deadline: Seconds to wait at most; defaults to the current
+                priority lane's entry in ORS_RATE_LIMIT_DEADLINES
+
+        Returns:
+            True if the call may go ahead, False if the caller should fall back
+        """
+        config = OrsRateLimiter.bucket_config(name)
+        if config is None:
+            return True
+        lane = OrsRateLimiter.current_priority()
+        if deadline is None:
+            deadlines = getattr(settings, 'ORS_RATE_LIMIT_DEADLINES', {})
+            deadline = deadlines.get(lane, 5.0)
+        give_up = time.time() + deadline
+
+        connection = OrsRateLimiter._connection()
+        waiter = None
+        try:
+            while True:
+                acquired, wait, waiter = OrsRateLimiter._take(connection, name, config, lane, waiter, give_up)
+                if acquired:
+                    return True
+                remaining = give_up - time.time()
+                if wait > remaining:
+                    logger.info("ORS %s rate limit, no token within %.1fs (%s)", name, deadline, lane)
+                    return False
+                # Jitter spreads out workers that woke up for the same token
+                time.sleep(min(wait, remaining) + random.uniform(0, 0.05))
+        finally:
+            if waiter is not None:
+                connection.execute('DELETE FROM waiters WHERE id = ?', (waiter,))
+
+    @staticmethod
+    def penalize(name: str, retry_after: Optional[float] = None):
+        """
+        Empty a bucket after ORS answered 429, so every worker backs off
+
+        Args:
+            name: Bucket name
+            retry_after: Seconds from the Retry-After header; the bucket goes
+                into debt for that long (default: one token interval)
+        """
+        config = OrsRateLimiter.bucket_config(name)
+        if config is None:
+            return
+        seconds = retry_after if retry_after is not None else 1 / config['rate']
+        connection = OrsRateLimiter._connection()
+        connection.execute(
+            'INSERT INTO buckets (name, tokens, updated) VALUES (?, ?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+            (name, -seconds * config['rate'], time.time())
+        )
+
+    @staticmethod
+    def penalize_response(name: str, response) -> bool:
+        """penalize() for a requests response with status 429; True if it was one"""
+        if response is None or response.status_code != 429:
+            return False
+        try:
+            retry_after = float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            retry_after = None
+        OrsRateLimiter.penalize(name, retry_after)
+        return True
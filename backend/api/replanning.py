@@ -0,0 +1,396 @@
+"""
+Re-planning for in-progress trips
+Projects the driver's position onto the stored route geometry, recomputes
+the remaining HOS timeline from the reported duty state and rewrites only
+the route point, ELD log and duty status rows that changed
+"""
+
+import math
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from django.db import transaction
+
+from .analytics import FleetRollups
+from .calculations import HOSCalculator
+from .geocoder import great_circle_miles
+from .models import DutyStatus, ELDLog, RoutePoint, Trip, TripCheckpoint
+from .scheduling import HOSClock
+from .speed_profiles import HourlySpeeds, SpeedProfiles
+from .timeline import DutyTimeline
+
+
+def _cumulative_miles(geometry: List[List[float]]) -> List[float]:
+    """Great-circle miles from the first vertex to every vertex"""
+    cumulative = [0.0]
+    for previous, point in zip(geometry, geometry[1:]):
+        cumulative.append(cumulative[-1] + great_circle_miles(previous, point))
+    return cumulative
+
+
+def project_onto_route(geometry: List[List[float]], position: Tuple[float, float]) -> Optional[float]:
+    """
+    Fraction of the route (0..1) closest to a position
+
+    Args:
+        geometry: Route vertices as [longitude, latitude]
+        position: (longitude, latitude) of the driver
+
+    Returns:
+        Fraction along the route, or None without usable geometry
+    """
+    if len(geometry) < 2:
+        return None
+    cumulative = _cumulative_miles(geometry)
+    if not cumulative[-1]:
+        return None
+    lon, lat = position
+    scale = math.cos(math.radians(lat))
+    best_distance = None
+    best_miles = 0.0
+    for index in range(len(geometry) - 1):
+        (lon1, lat1), (lon2, lat2) = geometry[index][:2], geometry[index + 1][:2]
+        # Project in a local equirectangular plane around the driver
+        ax, ay = (lon1 - lon) * scale, lat1 - lat
+        bx, by = (lon2 - lon) * scale, lat2 - lat
+        dx, dy = bx - ax, by - ay
+        length = dx * dx + dy * dy
+        t = 0.0 if not length else min(1.0, max(0.0, -(ax * dx + ay * dy) / length))
+        px, py = ax + t * dx, ay + t * dy
+        distance = px * px + py * py
+        if best_distance is None or distance < best_distance:
+            best_distance = distance
+            best_miles = cumulative[index] + t * (cumulative[index + 1] - cumulative[index])
+    return best_miles / cumulative[-1]
+
+
+def point_along_route(geometry: List[List[float]], fraction: float) -> Optional[Tuple[float, float]]:
+    """(longitude, latitude) at a fraction of the route, None without geometry"""
+    if len(geometry) < 2:
+        return None
+    cumulative = _cumulative_miles(geometry)
+    target = cumulative[-1] * min(1.0, max(0.0, fraction))
+    for index in range(len(geometry) - 1):
+        if cumulative[index + 1] >= target:
+            span = cumulative[index + 1] - cumulative[index]
+            t = (target - cumulative[index]) / span if span else 0.0
+            (lon1, lat1), (lon2, lat2) = geometry[index][:2], geometry[index + 1][:2]
+            return lon1 + t * (lon2 - lon1), lat1 + t * (lat2 - lat1)
+    return tuple(geometry[-1][:2])
+
+
+class TripReplanner:
+    """Recompute the remainder of an in-progress trip from a checkpoint"""
+
+    POINT_FIELDS = ['point_type', 'address', 'duration_minutes', 'latitude', 'longitude', 'estimated_arrival']
+    STATUS_FIELDS = ['status', 'start_time', 'end_time', 'location']
+    ARRIVED_MILES = 0.5  # A checkpoint this close to the end of the route completes the trip
+
+    @staticmethod
+    def remaining_clock(remaining_miles: float, miles_completed: float, driving_hours: float,
+                        on_duty_hours: float, since_break_hours: float, cycle_hours: float,
+                        pickup_completed: bool, speeds: Optional[HourlySpeeds] = None,
+                        start_minute: int = 0) -> HOSClock:
+        """HOS clock seeded with the reported duty state, run to the end of the trip"""
+        clock = HOSClock(cycle_hours, speeds, start_minute)
+        clock.driving = int(round(driving_hours * 60))
+        clock.window = int(round(on_duty_hours * 60))
+        clock.since_break = int(round(since_break_hours * 60))
+        # Keep fuel stops on the original 1,000-mile spacing
+        clock.driven = int(round(miles_completed / HOSCalculator.AVERAGE_SPEED * 60))
+        clock.miles = miles_completed
+        if not pickup_completed:
+            clock.on_duty(int(HOSCalculator.LOADING_TIME * 60), 'Pickup')
+        clock.drive(remaining_miles)
+        clock.on_duty(int(HOSCalculator.UNLOADING_TIME * 60), 'Dropoff')
+        clock.on_duty(45, 'Post-trip inspection')
+        return clock
+
+    @staticmethod
+    def logged_on_duty_hours(trip: Trip, as_of: datetime) -> float:
+        """On-duty and driving hours in the trip's logs before a checkpoint"""
+        minutes = 0
+        for log in trip.eld_logs.filter(date__lte=as_of.date()).prefetch_related('duty_statuses'):
+            for status in DutyTimeline.statuses(log):
+                if status.status not in ('driving', 'on_duty'):
+                    continue
+                end = status.end_time
+                if log.date == as_of.date():
+                    if status.start_time >= as_of.time():
+                        continue
+                    end = min(end, as_of.time())
+                minutes += _minutes(status.start_time, end)
+        return minutes / 60
+
+    @staticmethod
+    def _route_points(trip: Trip, events: List[Dict], completed_fraction: float,
+                      pickup_completed: bool) -> List[Dict]:
+        """Desired route points: passed stops as planned, upcoming ones from the new timeline"""
+        geometry = trip.route_geometry or []
+        total = float(trip.total_distance or 0)
+        existing = list(trip.route_points.all())
+
+        def position(miles):
+            point = point_along_route(geometry, miles / total) if total else None
+            if point is None:
+                return Decimal('0'), Decimal('0')
+            return Decimal(str(round(point[1], 7))), Decimal(str(round(point[0], 7)))
+
+        def stop(point_type, address, duration_minutes, miles, arrival):
+            latitude, longitude = position(miles)
+            return {'point_type': point_type, 'address': address, 'duration_minutes': duration_minutes,
+                    'latitude': latitude, 'longitude': longitude, 'estimated_arrival': arrival}
+
+        points = []
+        for point in existing:
+            if point.point_type == 'start' or (point.point_type == 'pickup' and pickup_completed):
+                points.append({field: getattr(point, field) for field in TripReplanner.POINT_FIELDS})
+
+        # Fuel stops already passed stay as planned
+        passed_fuel = int(completed_fraction * total // HOSCalculator.FUEL_STOP_INTERVAL) if total else 0
+        points.extend(
+            {field: getattr(point, field) for field in TripReplanner.POINT_FIELDS}
+            for point in [p for p in existing if p.point_type == 'fuel'][:passed_fuel]
+        )
+
+        miles = completed_fraction * total
+        fuel_number = passed_fuel
+        rest_number = 0
+        dropoff = None
+        for event in events:
+            minutes = int((event['end'] - event['start']).total_seconds() // 60)
+            if event['location'] == 'Pickup':
+                pickup = next((p for p in existing if p.point_type == 'pickup'), None)
+                points.insert(1, stop('pickup', pickup.address if pickup else trip.pickup_location,
+                                      minutes, miles, event['start']))
+            elif event['location'] == 'Fuel stop':
+                fuel_number += 1
+                points.append(stop('fuel', f'Fuel Stop {fuel_number}', minutes, miles, event['start']))
+            elif event['location'] in ('Rest break', '10-hour reset', '34-hour restart'):
+                rest_number += 1
+                points.append(stop('rest', f'Rest Stop {rest_number}', minutes, miles, event['start']))
+            elif event['location'] == 'Dropoff':
+                dropoff = stop('dropoff', trip.dropoff_location, minutes, total, event['start'])
+            miles += event['miles']
+        points.append(dropoff)
+        points.append(stop('end', 'Trip Complete', 0, total, events[-1]['end']))
+        for sequence, point in enumerate(points):
+            point['sequence'] = sequence
+        return points
+
+    @staticmethod
+    def _sync(existing: List, desired: List[Dict], fields: List[str], create) -> Tuple[list, list, list]:
+        """
+        Match rows to desired values by position, changing only what differs
+
+        Returns:
+            (rows to create, rows to update, rows to delete)
+        """
+        to_create, to_update = [], []
+        for index, values in enumerate(desired):
+            if index < len(existing):
+                row = existing[index]
+                changed = [field for field in fields if getattr(row, field) != values[field]]
+                if changed:
+                    for field in changed:
+                        setattr(row, field, values[field])
+                    to_update.append(row)
+            else:
+                to_create.append(create(values))
+        return to_create, to_update, existing[len(desired):]
+
+    @staticmethod
+    def replan(trip: Trip, position: Tuple[float, float], as_of: datetime, driving_hours: float,
+               on_duty_hours: float, since_break_hours: float, cycle_hours: float,
+               pickup_completed: Optional[bool] = None) -> Dict:
+        """
+        Re-plan the rest of a trip from the driver's current position
+
+        Args:
+            trip: Trip being driven
+            position: Driver's (longitude, latitude)
+            as_of: Time of the checkpoint
+            driving_hours: Driving since the last 10-hour reset
+            on_duty_hours: Time used in the current 14-hour window
+            since_break_hours: Driving since the last 30-minute break
+            cycle_hours: Hours used in the 70-hour cycle
+            pickup_completed: Whether the load is on board (default: once
+                the driver has left the start of the route)
+
+        A checkpoint at the dropoff (within ARRIVED_MILES of the end of the
+        route) marks the trip completed.
+
+        Returns:
+            Dictionary with the remaining plan and the created/updated/deleted
+            row ids per table
+        """
+        total = float(trip.total_distance or 0)
+        fraction = project_onto_route(trip.route_geometry or [], position)
+        if fraction is None:
+            # No stored geometry (older trips): keep the last known progress
+            fraction = float(trip.miles_completed) / total if total else 0.0
+        completed = round(fraction * total, 2)
+        if pickup_completed is None:
+            pickup_completed = completed > 0
+
+        clock = TripReplanner.remaining_clock(
+            total - completed, completed, driving_hours, on_duty_hours, since_break_hours,
+            cycle_hours, pickup_completed, SpeedProfiles.for_trip(trip), HourlySpeeds.minute_of_day(as_of)
+        )
+        events = clock.timed_events(as_of)
+        diff = {}
+
+        with transaction.atomic():
+            # Route points
+            desired_points = TripReplanner._route_points(trip, events, fraction, pickup_completed)
+            existing_points = list(trip.route_points.order_by('sequence'))
+            create, update, delete = TripReplanner._sync(
+                existing_points, desired_points, TripReplanner.POINT_FIELDS + ['sequence'],
+                lambda values: RoutePoint(trip=trip, **values)
+            )
+            RoutePoint.objects.bulk_create(create)
+            if update:
+                RoutePoint.objects.bulk_update(update, TripReplanner.POINT_FIELDS + ['sequence'])
+            RoutePoint.objects.filter(id__in=[row.id for row in delete]).delete()
+            diff['route_points'] = TripReplanner._diff(create, update, delete, len(existing_points))
+
+            diff['eld_logs'], diff['duty_statuses'] = TripReplanner._sync_logs(trip, events, as_of, completed)
+
+            arrived = total > 0 and total - completed <= TripReplanner.ARRIVED_MILES
+            trip.status = 'completed' if arrived else 'in_progress'
+            trip.miles_completed = Decimal(str(completed))
+            trip.replanned_at = as_of
+            trip.rest_stops = sum(1 for point in desired_points if point['point_type'] == 'rest')
+            trip.fuel_stops = sum(1 for point in desired_points if point['point_type'] == 'fuel')
+            trip.save(update_fields=['status', 'miles_completed', 'replanned_at', 'rest_stops',
+                                     'fuel_stops', 'updated_at'])
+            # Observed progress for the speed profiles
+            TripCheckpoint.objects.create(trip=trip, recorded_at=as_of, miles_completed=trip.miles_completed,
+                                          driving_hours=driving_hours)
+            FleetRollups.record_trip(trip)
+
+        return {
+            'trip_id': trip.id,
+            'status': trip.status,
+            'miles_completed': completed,
+            'remaining_miles': round(total - completed, 2),
+            'remaining_hours': round(clock.elapsed / 60, 2),
+            'estimated_arrival': events[-1]['end'],
+            'pickup_completed': pickup_completed,
+            'changes': diff,
+        }
+
+    @staticmethod
+    def _sync_logs(trip: Trip, events: List[Dict], as_of: datetime, miles_completed: float) -> Tuple[Dict, Dict]:
+        """
+        Bring ELD logs from the checkpoint onwards in line with new events
+
+        Days before the checkpoint are history and stay as they are; on the
+        checkpoint day the statuses already logged before it are kept, and
+        so are the miles the reported position shows were driven that day.
+        Packed logs (api/timeline.py) are rewritten as a whole, so their
+        status changes show up as an ELD log update.
+
+        Args:
+            miles_completed: Route miles behind the driver at the checkpoint
+
+        Returns:
+            (ELD log diff, duty status diff)
+        """
+        planned_logs = {log['date']: log for log in HOSCalculator.generate_eld_logs_from_events(events)}
+        logs = {log.date: log for log in trip.eld_logs.prefetch_related('duty_statuses')}
+        today = as_of.date()
+        checkpoint = as_of.time()
+        # Progress at the start of the checkpoint day, as logged on the days before
+        logged_miles = sum(float(log.total_miles) for day, log in logs.items() if day < today)
+        created_logs, updated_logs, deleted_logs = [], [], []
+        created_statuses, updated_statuses, deleted_statuses = [], [], []
+        existing_statuses_count = 0
+
+        for log_date in sorted(set(planned_logs) | {day for day in logs if day >= today}):
+            log = logs.get(log_date)
+            planned = planned_logs.get(log_date)
+            if planned is None:
+                deleted_logs.append(log)
+                continue
+            existing_statuses = DutyTimeline.statuses(log) if log else []
+            statuses = [{field: status[field] for field in TripReplanner.STATUS_FIELDS}
+                        for status in planned['duty_statuses']]
+            miles = planned['total_miles']
+            if log and log_date == today:
+                kept = [
+                    {'status': status.status, 'start_time': status.start_time,
+                     'end_time': min(status.end_time, checkpoint), 'location': status.location}
+                    for status in existing_statuses if status.start_time < checkpoint
+                ]
+                # Miles driven before the checkpoint: the reported progress not logged on earlier days
+                if any(status['status'] == 'driving' for status in kept):
+                    miles += max(0.0, miles_completed - logged_miles)
+                if kept and statuses and all(kept[-1][field] == statuses[0][field] for field in ('status', 'location')):
+                    # The plan continues what was under way at the checkpoint
+                    statuses[0]['start_time'] = kept.pop()['start_time']
+                statuses = kept + statuses
+            miles = Decimal(str(round(miles, 2)))
+
+            if log is None:
+                log = ELDLog(trip=trip, date=log_date, driver_name=planned['driver_name'],
+                             carrier_name=planned['carrier_name'], vehicle_number=planned['vehicle_number'],
+                             total_miles=miles)
+                if DutyTimeline.packed_storage():
+                    log.timeline, log.remarks = DutyTimeline.encode(statuses)
+                created_logs.append(log)
+                if log.timeline is not None:
+                    continue
+            else:
+                changed = log.total_miles != miles
+                log.total_miles = miles
+                if log.timeline is not None:
+                    timeline, remarks = DutyTimeline.encode(statuses)
+                    if bytes(log.timeline) != timeline or log.remarks != remarks:
+                        log.timeline, log.remarks = timeline, remarks
+                        changed = True
+                if changed:
+                    updated_logs.append(log)
+                if log.timeline is not None:
+                    continue
+
+            existing_statuses_count += len(existing_statuses)
+            create, update, delete = TripReplanner._sync(
+                existing_statuses,
+                [dict(values, sequence=sequence) for sequence, values in enumerate(statuses)],
+                TripReplanner.STATUS_FIELDS + ['sequence'],
+                lambda values, log=log: DutyStatus(log=log, **values)
+            )
+            created_statuses.extend(create)
+            updated_statuses.extend(update)
+            deleted_statuses.extend(delete)
+
+        ELDLog.objects.bulk_create(created_logs)
+        if updated_logs:
+            ELDLog.objects.bulk_update(updated_logs, ['total_miles', 'timeline', 'remarks'])
+        # Statuses of deleted logs go with them through the cascade
+        ELDLog.objects.filter(id__in=[log.id for log in deleted_logs]).delete()
+        DutyStatus.objects.bulk_create(created_statuses)
+        if updated_statuses:
+            DutyStatus.objects.bulk_update(updated_statuses, TripReplanner.STATUS_FIELDS + ['sequence'])
+        DutyStatus.objects.filter(id__in=[status.id for status in deleted_statuses]).delete()
+
+        return (
+            TripReplanner._diff(created_logs, updated_logs, deleted_logs, len(logs)),
+            TripReplanner._diff(created_statuses, updated_statuses, deleted_statuses, existing_statuses_count),
+        )
+
+    @staticmethod
+    def _diff(created: list, updated: list, deleted: list, existing: int) -> Dict:
+        return {
+            'created': [row.id for row in created],
+            'updated': [row.id for row in updated],
+            'deleted': [row.id for row in deleted],
+            'unchanged': existing - len(updated) - len(deleted),
+        }
+
+
+def _minutes(start, end) -> int:
+    """Minutes between two times of the same day"""
+    return (end.hour * 60 + end.minute) - (start.hour * 60 + start.minute)
@@ -0,0 +1,502 @@
+"""
+Appointment-window scheduling
+Finds departure times that reach the pickup and dropoff inside their
+appointment windows under HOS limits, the latest feasible departure and the
+earliest compliant arrival, and which rest periods absorb waiting time
+"""
+
+import copy
+import math
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from .calculations import HOSCalculator
+from .speed_profiles import DAY_MINUTES, HourlySpeeds
+
+
+class HOSClock:
+    """Greedy HOS state machine in minutes (10-hour resets, no splits)"""
+
+    MAX_DRIVING = HOSCalculator.MAX_DAILY_DRIVING * 60
+    MAX_WINDOW = HOSCalculator.MAX_DAILY_ON_DUTY * 60
+    MAX_DRIVING_BEFORE_BREAK = HOSCalculator.MAX_DRIVING_BEFORE_BREAK * 60
+    MAX_CYCLE = HOSCalculator.MAX_WEEKLY_ON_DUTY * 60
+    RESET = HOSCalculator.MIN_OFF_DUTY * 60
+    BREAK = int(HOSCalculator.MIN_REST_BREAK * 60)
+    RESTART = 34 * 60
+    FUEL_INTERVAL = round(HOSCalculator.FUEL_STOP_INTERVAL / HOSCalculator.AVERAGE_SPEED * 60)
+
+    def __init__(self, current_cycle_used: float = 0, speeds: Optional[HourlySpeeds] = None,
+                 start_minute: int = 0):
+        """
+        Args:
+            current_cycle_used: Hours already used in the 70-hour cycle
+            speeds: Hourly driving speeds (default: AVERAGE_SPEED at all hours)
+            start_minute: Minute of the day at elapsed 0, for the hourly speeds
+        """
+        self.speeds = speeds
+        self.start_minute = start_minute
+        self.elapsed = 0
+        self.driving = 0        # since the last 10-hour reset
+        self.window = 0         # counted against the 14-hour window
+        self.since_break = 0    # driving since the last 30+ minute interruption
+        self.cycle = int(round(float(current_cycle_used) * 60))
+        self.driven = 0         # total driving minutes, for fuel stops
+        self.miles = 0.0        # total miles, for fuel stops at hourly speeds
+        self.events: List[Tuple[str, int, str, float]] = []
+
+    def copy(self) -> 'HOSClock':
+        clone = copy.copy(self)
+        clone.events = list(self.events)
+        return clone
+
+    def on_duty(self, minutes: int, location: str):
+        self.events.append(('on_duty', minutes, location, 0.0))
+        self.elapsed += minutes
+        self.window += minutes
+        self.cycle += minutes
+        if minutes >= self.BREAK:
+            self.since_break = 0
+
+    def off_duty(self, minutes: int, location: str) -> str:
+        """
+        Record off-duty time
+
+        Returns:
+            Which HOS rest the period counts as
+        """
+        self.events.append(('off_duty', minutes, location, 0.0))
+        self.elapsed += minutes
+        if minutes >= self.RESTART:
+            self.driving = self.window = self.since_break = self.cycle = 0
+            return '34-hour restart'
+        if minutes >= self.RESET:
+            self.driving = self.window = self.since_break = 0
+            return '10-hour reset'
+        self.window += minutes
+        if minutes >= self.BREAK:
+            self.since_break = 0
+            return '30-minute break'
+        return 'off duty (counts against the 14-hour window)'
+
+    def _allowed(self) -> int:
+        """
+        Driving minutes available now, taking the rest that is due first
+
+        Returns:
+            Minutes that can be driven, or 0 after recording a rest
+        """
+        if self.cycle >= self.MAX_CYCLE:
+            self.off_duty(self.RESTART, '34-hour restart')
+            return 0
+        allowed = min(self.MAX_DRIVING - self.driving, self.MAX_WINDOW - self.window,
+                      self.MAX_DRIVING_BEFORE_BREAK - self.since_break, self.MAX_CYCLE - self.cycle)
+        if allowed <= 0:
+            only_break_due = (self.driving < self.MAX_DRIVING
+                              and self.window + self.BREAK < self.MAX_WINDOW)
+            if only_break_due:
+                self.off_duty(self.BREAK, 'Rest break')
+            else:
+                self.off_duty(self.RESET, '10-hour reset')
+            return 0
+        return allowed
+
+    def _record_driving(self, minutes: int, miles: float):
+        self.events.append(('driving', minutes, 'Driving', miles))
+        self.elapsed += minutes
+        self.driving += minutes
+        self.window += minutes
+        self.since_break += minutes
+        self.cycle += minutes
+        self.driven += minutes
+        self.miles += miles
+
+    def drive(self, miles: float, more_driving_after: bool = False):
+        """Drive a leg, inserting breaks, resets, restarts and fuel stops"""
+        if self.speeds is not None:
+            return self._drive_hourly(miles, more_driving_after)
+        remaining = round(miles / HOSCalculator.AVERAGE_SPEED * 60)
+        miles_per_minute = HOSCalculator.AVERAGE_SPEED / 60
+        while remaining > 0:
+            allowed = self._allowed()
+            if not allowed:
+                continue
+            until_fuel = self.FUEL_INTERVAL - self.driven % self.FUEL_INTERVAL
+            minutes = min(allowed, remaining, until_fuel)
+            self._record_driving(minutes, minutes * miles_per_minute)
+            remaining -= minutes
+            if minutes == until_fuel and (remaining > 0 or more_driving_after):
+                self.on_duty(int(HOSCalculator.FUEL_STOP_TIME * 60), 'Fuel stop')
+
+    def _drive_hourly(self, miles: float, more_driving_after: bool):
+        """drive() at the speed of each hour of the day; fuel stops go by miles"""
+        remaining = float(miles)
+        interval = HOSCalculator.FUEL_STOP_INTERVAL
+        while remaining > 1e-6:
+            allowed = self._allowed()
+            if not allowed:
+                continue
+            minute = (self.start_minute + self.elapsed) % DAY_MINUTES
+            miles_per_minute = self.speeds.mph[minute // 60] / 60
+            until_fuel = interval - self.miles % interval
+            if until_fuel < 1e-6:
+                until_fuel += interval
+            # Whole minutes, up to the end of the hour, the leg or the tank
+            minutes = min(allowed, 60 - minute % 60,
+                          math.ceil(min(remaining, until_fuel) / miles_per_minute - 1e-9))
+            driven = min(minutes * miles_per_minute, remaining, until_fuel)
+            self._record_driving(minutes, driven)
+            remaining -= driven
+            if driven >= until_fuel - 1e-6 and (remaining > 1e-6 or more_driving_after):
+                self.on_duty(int(HOSCalculator.FUEL_STOP_TIME * 60), 'Fuel stop')
+
+    def timed_events(self, start: datetime) -> List[Dict]:
+        """Events as datetimes, consecutive identical entries merged"""
+        events = []
+        current = start
+        for status, minutes, location, miles in self.events:
+            end = current + timedelta(minutes=minutes)
+            if events and events[-1]['status'] == status and events[-1]['location'] == location:
+                events[-1]['end'] = end
+                events[-1]['miles'] += miles
+            else:
+                events.append({'status': status, 'start': current, 'end': end, 'location': location, 'miles': miles})
+            current = end
+        return events
+
+
+class AppointmentScheduler:
+    """Departure and arrival planning against pickup/dropoff appointment windows"""
+
+    STEP_MINUTES = 15      # spacing of candidate departure times
+    DEFAULT_HORIZON = 7 * 24 * 60  # search horizon without a closing window
+
+    def __init__(self, pickup_miles: float, delivery_miles: float, current_cycle_used: float,
+                 earliest_departure: datetime, pickup_window: Tuple[Optional[datetime], Optional[datetime]] = (None, None),
+                 dropoff_window: Tuple[Optional[datetime], Optional[datetime]] = (None, None),
+                 speeds: Optional[HourlySpeeds] = None):
+        """
+        Args:
+            pickup_miles: Current location -> pickup distance
+            delivery_miles: Pickup -> dropoff distance
+            current_cycle_used: Hours already used in the 70-hour cycle
+            earliest_departure: Earliest time the driver can start
+            pickup_window: (opens, closes) for the pickup appointment, either may be None
+            dropoff_window: (opens, closes) for the dropoff appointment, either may be None
+            speeds: Hourly driving speeds (default: AVERAGE_SPEED at all hours)
+        """
+        self.earliest_departure = earliest_departure
+        self.pickup_miles = pickup_miles
+        self.delivery_miles = delivery_miles
+        self.current_cycle_used = current_cycle_used
+        self.speeds = speeds
+        self.start_minute = HourlySpeeds.minute_of_day(earliest_departure)
+
+        def offset(moment):
+            return None if moment is None else int((moment - earliest_departure).total_seconds() // 60)
+
+        self.pickup_opens, self.pickup_closes = (offset(moment) for moment in pickup_window)
+        self.dropoff_opens, self.dropoff_closes = (offset(moment) for moment in dropoff_window)
+
+        self._to_pickup: Dict[int, HOSClock] = {}
+        self._after_pickup: Dict[Tuple[int, int, int], Tuple[HOSClock, Optional[str]]] = {}
+        self.simulations = 0
+        self.candidates_evaluated = 0
+
+    def _minute_of_day(self, offset: int) -> int:
+        """Minute of the day `offset` minutes after earliest_departure, 0 when speeds don't vary by hour"""
+        if self.speeds is None or self.speeds.flat:
+            return 0
+        return (self.start_minute + offset) % DAY_MINUTES
+
+    def to_pickup(self, departure: int) -> HOSClock:
+        """
+        Clock at the pickup when leaving `departure` minutes after earliest_departure
+
+        At a constant speed the drive does not depend on the departure time;
+        with hourly speeds it depends on the time of day, so there is one
+        simulation per distinct departure minute of the day.
+        """
+        key = self._minute_of_day(departure)
+        if key not in self._to_pickup:
+            clock = HOSClock(self.current_cycle_used, self.speeds, key)
+            clock.on_duty(30, 'Pre-trip inspection')
+            clock.drive(self.pickup_miles, more_driving_after=self.delivery_miles > 0)
+            self._to_pickup[key] = clock
+        return self._to_pickup[key]
+
+    def _wait_class(self, wait: int) -> int:
+        """Waits that leave the same HOS state share one simulation"""
+        if wait >= HOSClock.RESTART:
+            return HOSClock.RESTART
+        if wait >= HOSClock.RESET:
+            return HOSClock.RESET
+        return wait
+
+    def _delivery_key(self, departure: int, wait: int) -> Tuple[int, int, int]:
+        """Deliveries with equal keys share a simulation: (departure minute of day, wait class, loading minute of day)"""
+        loading = departure + self.to_pickup(departure).elapsed + wait
+        return self._minute_of_day(departure), self._wait_class(wait), self._minute_of_day(loading)
+
+    def _deliver(self, departure: int, wait: int) -> Tuple[HOSClock, Optional[str], int]:
+        """Clock after waiting at the pickup, loading and driving to the dropoff"""
+        key = self._delivery_key(departure, wait)
+        wait_class = key[1]
+        if key not in self._after_pickup:
+            self.simulations += 1
+            clock = self.to_pickup(departure).copy()
+            absorbed = clock.off_duty(wait_class, 'Waiting for pickup appointment') if wait_class else None
+            # The extra waiting comes before loading, so later hours shift by it
+            clock.start_minute += wait - wait_class
+            clock.on_duty(int(HOSCalculator.LOADING_TIME * 60), 'Pickup')
+            clock.drive(self.delivery_miles)
+            self._after_pickup[key] = (clock, absorbed)
+        clock, absorbed = self._after_pickup[key]
+        # Elapsed time beyond the wait class is plain extra waiting
+        return clock, absorbed, wait - wait_class
+
+    def evaluate(self, departure: int) -> Dict:
+        """
+        Outcome of leaving `departure` minutes after earliest_departure
+
+        Returns:
+            Dictionary with feasibility, pickup/dropoff arrival offsets, the
+            chosen pickup wait and which rest it counts as
+        """
+        self.candidates_evaluated += 1
+        pickup_arrival = departure + self.to_pickup(departure).elapsed
+        if self.pickup_closes is not None and pickup_arrival > self.pickup_closes:
+            return {'departure': departure, 'feasible': False, 'reason': 'pickup window missed',
+                    'pickup_arrival': pickup_arrival}
+
+        wait = max(0, self.pickup_opens - pickup_arrival) if self.pickup_opens is not None else 0
+        options = [wait]
+        # Stretching a short wait into a full reset can save a later one
+        stretched = max(wait, HOSClock.RESET)
+        if wait < HOSClock.RESET and (self.pickup_closes is None or pickup_arrival + stretched <= self.pickup_closes):
+            options.append(stretched)
+
+        best = None
+        for option in options:
+            clock, absorbed, extra = self._deliver(departure, option)
+            dropoff_arrival = departure + clock.elapsed + extra
+            compliant_arrival = max(dropoff_arrival, self.dropoff_opens) if self.dropoff_opens is not None else dropoff_arrival
+            if best is None or compliant_arrival < best['dropoff_arrival']:
+                best = {
+                    'departure': departure,
+                    'feasible': self.dropoff_closes is None or dropoff_arrival <= self.dropoff_closes,
+                    'pickup_arrival': pickup_arrival,
+                    'pickup_wait': option,
+                    'pickup_wait_absorbed_as': absorbed,
+                    'reset_at_pickup': option != wait,
+                    'dropoff_arrival': compliant_arrival,
+                    'dropoff_wait': compliant_arrival - dropoff_arrival,
+                }
+        if not best['feasible']:
+            best['reason'] = 'dropoff window missed'
+        return best
+
+    def _latest_start(self) -> int:
+        """Departures after this offset cannot meet the closing windows"""
+        latest = self.DEFAULT_HORIZON
+        fastest = self.speeds.fastest if self.speeds else HOSCalculator.AVERAGE_SPEED
+        if self.speeds is None or self.speeds.flat:
+            to_pickup = self.to_pickup(0).elapsed
+        else:
+            # Pre-trip plus driving at the fastest hour's speed is a lower bound
+            to_pickup = 30 + int(self.pickup_miles / fastest * 60)
+        delivery_driving = int(self.delivery_miles / fastest * 60)
+        if self.pickup_closes is not None:
+            latest = min(latest, self.pickup_closes - to_pickup)
+        if self.dropoff_closes is not None:
+            # Loading plus pure driving time is a lower bound on the rest of the trip
+            minimum_rest = int(HOSCalculator.LOADING_TIME * 60) + delivery_driving
+            latest = min(latest, self.dropoff_closes - to_pickup - minimum_rest)
+        return latest
+
+    def solve(self) -> Dict:
+        """
+        Evaluate candidate departures and pick the schedule
+
+        Candidates are spaced STEP_MINUTES apart up to the last departure that
+        can still make the closing windows; the latest feasible departure is
+        then refined to the minute by bisection.
+
+        Returns:
+            Dictionary with feasibility, latest departure, earliest compliant
+            arrival, the chosen schedule and its timed duty events
+        """
+        latest_start = self._latest_start()
+        candidates = list(range(0, max(latest_start, 0) + 1, self.STEP_MINUTES))
+        if latest_start > 0 and candidates[-1] != latest_start:
+            candidates.append(latest_start)
+        results = [self.evaluate(departure) for departure in candidates]
+        feasible = [result for result in results if result['feasible']]
+        if not feasible:
+            first = results[0] if results else self.evaluate(0)
+            return {
+                'feasible': False,
+                'reason': first.get('reason', 'appointment windows cannot be met'),
+                'candidates_evaluated': self.candidates_evaluated,
+            }
+
+        # Refine the latest feasible departure between grid points
+        low = feasible[-1]['departure']
+        later = [result['departure'] for result in results if result['departure'] > low]
+        high = later[0] if later else low
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.evaluate(middle)['feasible']:
+                low = middle
+            else:
+                high = middle
+        latest = self.evaluate(low)
+
+        # Earliest compliant arrival; among ties leave as late as possible
+        chosen = min(feasible, key=lambda result: (result['dropoff_arrival'], -result['departure']))
+        return {
+            'feasible': True,
+            'latest_departure': self._moment(latest['departure']),
+            'earliest_arrival': self._moment(chosen['dropoff_arrival']),
+            'schedule': self._describe(chosen),
+            'events': self.events(chosen),
+            'candidates_evaluated': self.candidates_evaluated,
+            'simulations': self.simulations,
+        }
+
+    def _moment(self, offset: int) -> datetime:
+        return self.earliest_departure + timedelta(minutes=offset)
+
+    def _describe(self, result: Dict) -> Dict:
+        waits = []
+        if result['pickup_wait']:
+            waits.append({
+                'location': 'pickup',
+                'minutes': result['pickup_wait'],
+                'absorbed_as': result['pickup_wait_absorbed_as'],
+                'reset_moved_to_wait': result['reset_at_pickup'],
+            })
+        if result['dropoff_wait']:
+            waits.append({'location': 'dropoff', 'minutes': result['dropoff_wait'], 'absorbed_as': 'off duty'})
+        return {
+            'departure': self._moment(result['departure']),
+            'pickup_arrival': self._moment(result['pickup_arrival']),
+            'dropoff_arrival': self._moment(result['dropoff_arrival']),
+            'waits': waits,
+        }
+
+    def events(self, result: Dict) -> List[Dict]:
+        """Timed duty events for one evaluated departure"""
+        clock, _, extra = self._deliver(result['departure'], result['pickup_wait'])
+        clock = clock.copy()
+        if extra:
+            # Fold waiting beyond the wait class into the recorded wait
+            for index, event in enumerate(clock.events):
+                if event[2] == 'Waiting for pickup appointment':
+                    clock.events[index] = (event[0], event[1] + extra, event[2], event[3])
+                    break
+        if result['dropoff_wait']:
+            clock.off_duty(result['dropoff_wait'], 'Waiting for dropoff appointment')
+        clock.on_duty(int(HOSCalculator.UNLOADING_TIME * 60), 'Dropoff')
+        clock.on_duty(45, 'Post-trip inspection')
+        return clock.timed_events(self._moment(result['departure']))
+
+
+class DepartureSweep:
+    """Arrival and feasibility curve over a range of departure times, without saving a trip"""
+
+    def __init__(self, pickup_miles: float, delivery_miles: float, current_cycle_used: float,
+                 pickup_window: Tuple[Optional[datetime], Optional[datetime]] = (None, None),
+                 dropoff_window: Tuple[Optional[datetime], Optional[datetime]] = (None, None),
+                 speeds: Optional[HourlySpeeds] = None):
+        """
+        Args:
+            pickup_miles: Current location -> pickup distance
+            delivery_miles: Pickup -> dropoff distance
+            current_cycle_used: Hours already used in the 70-hour cycle
+            pickup_window: (opens, closes) for the pickup appointment, either may be None
+            dropoff_window: (opens, closes) for the dropoff appointment, either may be None
+            speeds: Hourly driving speeds (default: AVERAGE_SPEED at all hours)
+        """
+        self.pickup_miles = pickup_miles
+        self.delivery_miles = delivery_miles
+        self.current_cycle_used = current_cycle_used
+        self.pickup_window = pickup_window
+        self.dropoff_window = dropoff_window
+        self.speeds = speeds
+
+    @staticmethod
+    def _rests(clock: HOSClock, absorbed: Optional[str]) -> Dict[str, int]:
+        """Resets, restarts and breaks taken on the way to the dropoff"""
+        locations = [event[2] for event in clock.events if event[0] == 'off_duty']
+        return {
+            'resets': locations.count('10-hour reset') + (absorbed == '10-hour reset'),
+            'restarts': locations.count('34-hour restart') + (absorbed == '34-hour restart'),
+            'breaks': locations.count('Rest break') + (absorbed == '30-minute break'),
+        }
+
+    def run(self, first_departure: datetime, last_departure: datetime, step_minutes: int) -> Dict:
+        """
+        Evaluate departures from first_departure up to (not including) last_departure
+
+        At a constant speed the timeline only depends on the departure
+        through the wait at the pickup, and waits leaving the same HOS state
+        share one simulation (AppointmentScheduler._deliver), so a sweep runs
+        a handful of simulations however many candidates it has. Hourly
+        speeds add the departure's time of day to the key, so there are up
+        to two simulations per candidate.
+
+        Returns:
+            Dictionary with one entry per candidate departure (feasibility,
+            pickup and dropoff arrival, trip hours, waits and rests) and a
+            summary: earliest arrival, latest feasible departure and the
+            departure with the fewest resets
+        """
+        scheduler = AppointmentScheduler(
+            self.pickup_miles, self.delivery_miles, self.current_cycle_used, first_departure,
+            pickup_window=self.pickup_window, dropoff_window=self.dropoff_window, speeds=self.speeds
+        )
+        span = int((last_departure - first_departure).total_seconds() // 60)
+        rests: Dict[Tuple[int, int, int], Dict[str, int]] = {}
+        candidates = []
+        for departure in range(0, span, step_minutes):
+            result = scheduler.evaluate(departure)
+            candidate = {
+                'departure': scheduler._moment(departure),
+                'feasible': result['feasible'],
+                'pickup_arrival': scheduler._moment(result['pickup_arrival']),
+            }
+            if 'dropoff_arrival' in result:
+                key = scheduler._delivery_key(departure, result['pickup_wait'])
+                if key not in rests:
+                    clock, absorbed, _ = scheduler._deliver(departure, result['pickup_wait'])
+                    rests[key] = self._rests(clock, absorbed)
+                candidate.update({
+                    'dropoff_arrival': scheduler._moment(result['dropoff_arrival']),
+                    'trip_hours': round((result['dropoff_arrival'] - departure) / 60, 2),
+                    'pickup_wait_minutes': result['pickup_wait'],
+                    'dropoff_wait_minutes': result['dropoff_wait'],
+                    'reset_at_pickup': result['reset_at_pickup'],
+                    **rests[key],
+                })
+            if not result['feasible']:
+                candidate['reason'] = result['reason']
+            candidates.append(candidate)
+
+        feasible = [candidate for candidate in candidates if candidate['feasible']]
+        summary = {'feasible_departures': len(feasible)}
+        if feasible:
+            earliest = min(feasible, key=lambda candidate: (candidate['dropoff_arrival'], -candidate['departure'].timestamp()))
+            fewest = min(feasible, key=lambda candidate: (candidate['resets'] + candidate['restarts'],
+                                                          candidate['dropoff_arrival']))
+            summary.update({
+                'earliest_arrival': {'departure': earliest['departure'], 'dropoff_arrival': earliest['dropoff_arrival']},
+                'latest_feasible_departure': feasible[-1]['departure'],
+                'fewest_resets': {'departure': fewest['departure'], 'resets': fewest['resets'],
+                                  'restarts': fewest['restarts']},
+            })
+        return {
+            'candidates': candidates,
+            'summary': summary,
+            'simulations': scheduler.simulations,
+        }
@@ -0,0 +1,266 @@
+"""
+Trip search by location
+Finds trips whose current, pickup or dropoff location contains every word
+of the query, newest first. The words are looked up in a trigram index kept
+up to date by the database itself:
+
+- SQLite: an FTS5 table with the trigram tokenizer (api_trip_search),
+  filled by triggers on api_trip, so bulk inserts, re-planning and archive
+  deletes keep it current
+- PostgreSQL: a pg_trgm GIN index on the three locations, which serves the
+  ILIKE filters
+
+Other databases scan the table. When no trip contains a word, the word is
+replaced by the most similar word (trigram Dice score) in recent trips that
+share half of it, and the search is run again ('fuzzy' matches).
+"""
+
+import logging
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+from .geocoder import trigram_codes
+from .models import Trip
+
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('current_location', 'pickup_location', 'dropoff_location')
+MIN_WORD = 3  # Shortest word the trigram indexes can look up
+SUGGEST_SAMPLE = 500  # Recent trips read per word fragment when correcting a word
+MIN_SIMILARITY = 0.5
+
+_DOCUMENT = "(current_location || ' ' || pickup_location || ' ' || dropoff_location)"
+
+SQLITE_INDEX = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS api_trip_search USING fts5(
+        {', '.join(FIELDS)}, content='api_trip', content_rowid='id', tokenize='trigram')""",
+    f"""CREATE TRIGGER IF NOT EXISTS api_trip_search_insert AFTER INSERT ON api_trip BEGIN
+        INSERT INTO api_trip_search(rowid, {', '.join(FIELDS)})
+        VALUES (new.id, {', '.join(f'new.{field}' for field in FIELDS)});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS api_trip_search_delete AFTER DELETE ON api_trip BEGIN
+        INSERT INTO api_trip_search(api_trip_search, rowid, {', '.join(FIELDS)})
+        VALUES ('delete', old.id, {', '.join(f'old.{field}' for field in FIELDS)});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS api_trip_search_update AFTER UPDATE OF {', '.join(FIELDS)} ON api_trip BEGIN
+        INSERT INTO api_trip_search(api_trip_search, rowid, {', '.join(FIELDS)})
+        VALUES ('delete', old.id, {', '.join(f'old.{field}' for field in FIELDS)});
+        INSERT INTO api_trip_search(rowid, {', '.join(FIELDS)})
+        VALUES (new.id, {', '.join(f'new.{field}' for field in FIELDS)});
+    END""",
+]
+
+POSTGRESQL_INDEX = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    f'CREATE INDEX IF NOT EXISTS api_trip_search_trgm ON api_trip USING gin ({_DOCUMENT} gin_trgm_ops)',
+]
+
+
+def query_words(text: str) -> List[str]:
+    """Lowercase letter and digit runs of a query ("Dallas, TX" -> ['dallas', 'tx'])"""
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+def similarity(a: str, b: str) -> float:
+    """Dice coefficient of the two words' trigram sets"""
+    a_codes, b_codes = set(trigram_codes(a)), set(trigram_codes(b))
+    return 2.0 * len(a_codes & b_codes) / (len(a_codes) + len(b_codes))
+
+
+class TripSearch:
+    """Location search over trips, backed by the database's trigram index"""
+
+    _fts_ready: Dict[str, bool] = {}
+
+    # Index maintenance
+
+    @staticmethod
+    def install(schema_connection, rebuild: bool = False) -> bool:
+        """
+        Create the search index and its triggers if missing
+
+        Args:
+            schema_connection: Database connection to install on
+            rebuild: Re-read every trip into the SQLite index
+
+        Returns:
+            Whether the database has a trigram index
+        """
+        vendor = schema_connection.vendor
+        statements = SQLITE_INDEX if vendor == 'sqlite' else POSTGRESQL_INDEX if vendor == 'postgresql' else []
+        try:
+            with schema_connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+                if vendor == 'sqlite' and rebuild:
+                    cursor.execute("INSERT INTO api_trip_search(api_trip_search) VALUES ('rebuild')")
+        except Exception as e:
+            # SQLite before 3.34 has no trigram tokenizer; search falls back to scanning
+            logger.warning("Trip search index not installed: %s", e)
+            return False
+        TripSearch._fts_ready.pop(schema_connection.alias, None)
+        return bool(statements)
+
+    @staticmethod
+    def uninstall(schema_connection):
+        """Drop the search index and its triggers"""
+        with schema_connection.cursor() as cursor:
+            if schema_connection.vendor == 'sqlite':
+                for trigger in ('insert', 'delete', 'update'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS api_trip_search_{trigger}')
+                cursor.execute('DROP TABLE IF EXISTS api_trip_search')
+            elif schema_connection.vendor == 'postgresql':
+                cursor.execute('DROP INDEX IF EXISTS api_trip_search_trgm')
+        TripSearch._fts_ready.pop(schema_connection.alias, None)
+
+    @staticmethod
+    def _backend() -> str:
+        """'fts5', 'pg_trgm' or 'scan'"""
+        if connection.vendor == 'postgresql':
+            return 'pg_trgm'
+        if connection.vendor != 'sqlite':
+            return 'scan'
+        ready = TripSearch._fts_ready.get(connection.alias)
+        if ready is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'api_trip_search'")
+                ready = TripSearch._fts_ready[connection.alias] = cursor.fetchone() is not None
+        return 'fts5' if ready else 'scan'
+
+    # Queries
+
+    @staticmethod
+    def _matching_ids(words: List[str], offset: int, limit: int) -> List[int]:
+        """Ids of trips containing every word, newest first"""
+        long_words = [word for word in words if len(word) >= MIN_WORD]
+        short_words = [word for word in words if len(word) < MIN_WORD]
+        backend = TripSearch._backend()
+
+        if backend == 'fts5':
+            # Short words can't be looked up by trigram; they filter the matched rows
+            sql = ['SELECT api_trip_search.rowid FROM api_trip_search']
+            if short_words:
+                sql.append('JOIN api_trip ON api_trip.id = api_trip_search.rowid')
+            sql.append('WHERE api_trip_search MATCH %s')
+            params = [' '.join(f'"{word}"' for word in long_words)]
+            for word in short_words:
+                sql.append('AND (' + ' OR '.join(f'api_trip.{field} LIKE %s' for field in FIELDS) + ')')
+                params.extend([f'%{word}%'] * len(FIELDS))
+            sql.append('ORDER BY api_trip_search.rowid DESC LIMIT %s OFFSET %s')
+        elif backend == 'pg_trgm':
+            sql = ['SELECT id FROM api_trip WHERE', ' AND '.join(f'{_DOCUMENT} ILIKE %s' for _ in words),
+                   'ORDER BY id DESC LIMIT %s OFFSET %s']
+            params = [f'%{word}%' for word in words]
+        else:
+            trips = Trip.objects.all()
+            for word in words:
+                trips = trips.filter(Q(current_location__icontains=word) | Q(pickup_location__icontains=word) |
+                                     Q(dropoff_location__icontains=word))
+            return list(trips.order_by('-id').values_list('id', flat=True)[offset:offset + limit])
+
+        with connection.cursor() as cursor:
+            cursor.execute(' '.join(sql), params + [limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def _sample(fragment: str, limit: int) -> List[Tuple[str, str, str]]:
+        """Locations of the most recent trips containing a fragment (3+ characters)"""
+        backend = TripSearch._backend()
+        if backend == 'fts5':
+            sql = (f"SELECT {', '.join(FIELDS)} FROM api_trip_search WHERE api_trip_search MATCH %s "
+                   f"ORDER BY rowid DESC LIMIT %s")
+            params = [f'"{fragment}"', limit]
+        elif backend == 'pg_trgm':
+            sql = f"SELECT {', '.join(FIELDS)} FROM api_trip WHERE {_DOCUMENT} ILIKE %s ORDER BY id DESC LIMIT %s"
+            params = [f'%{fragment}%', limit]
+        else:
+            return list(Trip.objects.filter(
+                Q(current_location__icontains=fragment) | Q(pickup_location__icontains=fragment) |
+                Q(dropoff_location__icontains=fragment)
+            ).order_by('-id').values_list(*FIELDS)[:limit])
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    @staticmethod
+    def suggest(word: str) -> Optional[str]:
+        """
+        The word in recent trips most similar to a word no trip contains
+
+        A single typo leaves one half of the word intact, so candidates come
+        from trips containing either half.
+        """
+        if len(word) < MIN_WORD:
+            return None
+        middle = len(word) // 2
+        if middle >= MIN_WORD and len(word) - middle >= MIN_WORD:
+            fragments = [word[:middle], word[middle:]]
+        else:
+            fragments = [word[:MIN_WORD], word[-MIN_WORD:]]
+
+        candidates = Counter()
+        for fragment in dict.fromkeys(fragments):
+            for locations in TripSearch._sample(fragment, SUGGEST_SAMPLE):
+                candidates.update(set(query_words(' '.join(locations))))
+        best = None
+        for candidate, count in candidates.items():
+            if len(candidate) < MIN_WORD or candidate == word:
+                continue
+            score = similarity(word, candidate)
+            if score >= MIN_SIMILARITY and (best is None or (score, count) > best[1:]):
+                best = (candidate, score, count)
+        return best[0] if best else None
+
+    @staticmethod
+    def search(text: str, page: int = 1, page_size: int = 20) -> Dict:
+        """
+        Trips whose locations contain every word of a query, newest first
+
+        Args:
+            text: Partial cities or addresses ("dallas phoenix", "1200 main")
+            page: 1-based page number
+            page_size: Trips per page
+
+        Returns:
+            Dictionary with the matching trip ids of the page, whether more
+            pages follow, the match type ('exact', 'fuzzy' or 'none') and
+            the corrected words of a fuzzy match
+        """
+        words = list(dict.fromkeys(query_words(text)))
+        offset = (page - 1) * page_size
+        ids = TripSearch._matching_ids(words, offset, page_size + 1)
+        match, corrected = 'exact', None
+        if not ids and (page == 1 or not TripSearch._matching_ids(words, 0, 1)):
+            # Correct the words no trip contains and search again
+            corrected = []
+            for word in words:
+                if len(word) >= MIN_WORD and not TripSearch._matching_ids([word], 0, 1):
+                    word = TripSearch.suggest(word) or word
+                corrected.append(word)
+            if corrected != words:
+                ids = TripSearch._matching_ids(corrected, offset, page_size + 1)
+            match = 'fuzzy' if ids else 'none'
+        return {
+            'ids': ids[:page_size],
+            'has_more': len(ids) > page_size,
+            'match': match,
+            'corrected_query': ' '.join(corrected) if match == 'fuzzy' else None,
+        }
+
+
+@receiver(post_migrate)
+def _reinstall_triggers(sender, using='default', **kwargs):
+    # SQLite rebuilds a table to alter it, which drops its triggers
+    if sender.name == 'api':
+        from django.db import connections
+        from django.db.migrations.recorder import MigrationRecorder
+        applied = MigrationRecorder(connections[using]).applied_migrations()
+        if ('api', '0010_trip_search') in applied:
+            TripSearch.install(connections[using])
@@ -1,6 +1,11 @@
+from datetime import timedelta
+
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Trip, RoutePoint, ELDLog, DutyStatus
+from django.utils import timezone
+from .models import Trip, RoutePoint, ELDLog, DutyStatus, RequestProfile
+from .timeline import DutyTimeline
+from .search import MIN_WORD, query_words
 
 
 class RoutePointSerializer(serializers.ModelSerializer):
@@ -21,7 +26,7 @@ class DutyStatusSerializer(serializers.ModelSerializer):
 
 
 class ELDLogSerializer(serializers.ModelSerializer):
-    duty_statuses = DutyStatusSerializer(many=True, read_only=True)
+    duty_statuses = serializers.SerializerMethodField()
     
     class Meta:
         model = ELDLog
@@ -29,6 +34,10 @@ class ELDLogSerializer(serializers.ModelSerializer):
             'id', 'date', 'driver_name', 'carrier_name', 
             'vehicle_number', 'total_miles', 'duty_statuses'
         ]
+    
+    def get_duty_statuses(self, log):
+        # Same shape for row-stored and packed logs (packed entries have no id)
+        return DutyStatusSerializer(DutyTimeline.statuses(log), many=True).data
 
 
 class TripSerializer(serializers.ModelSerializer):
@@ -41,11 +50,26 @@ class TripSerializer(serializers.ModelSerializer):
             'id', 'current_location', 'pickup_location', 'dropoff_location',
             'current_cycle_used', 'total_distance', 'estimated_drive_time',
             'total_trip_time', 'fuel_stops', 'rest_stops', 'status',
+            'miles_completed', 'replanned_at',
             'created_at', 'updated_at', 'route_points', 'eld_logs'
         ]
         read_only_fields = [
             'total_distance', 'estimated_drive_time', 'total_trip_time',
-            'fuel_stops', 'rest_stops', 'created_at', 'updated_at'
+            'fuel_stops', 'rest_stops', 'miles_completed', 'replanned_at',
+            'created_at', 'updated_at'
+        ]
+
+
+class TripSummarySerializer(serializers.ModelSerializer):
+    """Trip fields without the route points and ELD logs, for result lists"""
+    
+    class Meta:
+        model = Trip
+        fields = [
+            'id', 'current_location', 'pickup_location', 'dropoff_location',
+            'current_cycle_used', 'total_distance', 'estimated_drive_time',
+            'total_trip_time', 'fuel_stops', 'rest_stops', 'status',
+            'miles_completed', 'replanned_at', 'created_at', 'updated_at'
         ]
 
 
@@ -55,6 +79,150 @@ class TripCalculationRequestSerializer(serializers.Serializer):
     pickup_location = serializers.CharField(max_length=200)
     dropoff_location = serializers.CharField(max_length=200)
     current_cycle_used = serializers.DecimalField(max_digits=5, decimal_places=2)
+    use_sleeper_berth = serializers.BooleanField(required=False, default=False)  # Plan 7/3 and 8/2 splits
+    
+    # Optional appointment windows; any of them switches to appointment scheduling
+    earliest_departure = serializers.DateTimeField(required=False)
+    pickup_window_start = serializers.DateTimeField(required=False)
+    pickup_window_end = serializers.DateTimeField(required=False)
+    dropoff_window_start = serializers.DateTimeField(required=False)
+    dropoff_window_end = serializers.DateTimeField(required=False)
+    
+    WINDOW_FIELDS = ['pickup_window_start', 'pickup_window_end', 'dropoff_window_start', 'dropoff_window_end']
+    
+    def validate(self, data):
+        for stop in ('pickup', 'dropoff'):
+            start, end = data.get(f'{stop}_window_start'), data.get(f'{stop}_window_end')
+            if start and end and start >= end:
+                raise serializers.ValidationError({f'{stop}_window_end': 'Window must end after it starts.'})
+        return data
+
+
+class DepartureSweepRequestSerializer(serializers.Serializer):
+    """Serializer for departure-time what-if requests"""
+    current_location = serializers.CharField(max_length=200)
+    pickup_location = serializers.CharField(max_length=200)
+    dropoff_location = serializers.CharField(max_length=200)
+    current_cycle_used = serializers.DecimalField(max_digits=5, decimal_places=2, min_value=0, max_value=70)
+    departure_start = serializers.DateTimeField()
+    departure_end = serializers.DateTimeField(required=False)  # Exclusive; default 24 hours after the start
+    step_minutes = serializers.IntegerField(min_value=1, max_value=24 * 60, default=15)
+    pickup_window_start = serializers.DateTimeField(required=False)
+    pickup_window_end = serializers.DateTimeField(required=False)
+    dropoff_window_start = serializers.DateTimeField(required=False)
+    dropoff_window_end = serializers.DateTimeField(required=False)
+    
+    MAX_CANDIDATES = 2000
+    
+    def validate(self, data):
+        data.setdefault('departure_end', data['departure_start'] + timedelta(hours=24))
+        if data['departure_end'] <= data['departure_start']:
+            raise serializers.ValidationError({'departure_end': 'Must be after departure_start.'})
+        span = (data['departure_end'] - data['departure_start']).total_seconds() / 60
+        if span / data['step_minutes'] > self.MAX_CANDIDATES:
+            raise serializers.ValidationError(
+                {'step_minutes': f'At most {self.MAX_CANDIDATES} departures per request; use a larger step.'}
+            )
+        for stop in ('pickup', 'dropoff'):
+            start, end = data.get(f'{stop}_window_start'), data.get(f'{stop}_window_end')
+            if start and end and start >= end:
+                raise serializers.ValidationError({f'{stop}_window_end': 'Window must end after it starts.'})
+        return data
+
+
+class TripReplanRequestSerializer(serializers.Serializer):
+    """Serializer for re-planning an in-progress trip from the driver's position"""
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    as_of = serializers.DateTimeField(required=False)
+    driving_hours_used = serializers.FloatField(min_value=0, max_value=11, default=0)  # Since the last 10-hour reset
+    on_duty_hours_used = serializers.FloatField(min_value=0, max_value=14, required=False)  # In the 14-hour window
+    driving_since_break_hours = serializers.FloatField(min_value=0, max_value=8, required=False)
+    cycle_hours_used = serializers.FloatField(min_value=0, max_value=70, required=False)
+    pickup_completed = serializers.BooleanField(required=False, allow_null=True, default=None)
+    
+    def validate(self, data):
+        data.setdefault('on_duty_hours_used', data['driving_hours_used'])
+        data.setdefault('driving_since_break_hours', min(data['driving_hours_used'], 8))
+        if data['on_duty_hours_used'] < data['driving_hours_used']:
+            raise serializers.ValidationError({'on_duty_hours_used': 'Cannot be less than driving_hours_used.'})
+        return data
+
+
+class FleetAnalyticsRequestSerializer(serializers.Serializer):
+    """Query parameters for fleet analytics"""
+    group_by = serializers.ChoiceField(choices=['driver', 'lane'], default='driver')
+    start = serializers.DateField(required=False)  # Default: 30 days before end
+    end = serializers.DateField(required=False)  # Default: today
+    interval = serializers.ChoiceField(choices=['total', 'month', 'day'], default='total')
+    key = serializers.CharField(max_length=410, required=False)  # A single driver or lane
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+    
+    def validate(self, data):
+        data.setdefault('end', timezone.localdate())
+        data.setdefault('start', data['end'] - timedelta(days=30))
+        if data['start'] > data['end']:
+            raise serializers.ValidationError({'start': 'Must not be after end.'})
+        return data
+
+
+class TripSearchRequestSerializer(serializers.Serializer):
+    """Query parameters for trip search"""
+    q = serializers.CharField(max_length=200)
+    page = serializers.IntegerField(min_value=1, default=1)
+    page_size = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    
+    def validate_q(self, value):
+        if not any(len(word) >= MIN_WORD for word in query_words(value)):
+            raise serializers.ValidationError(f'Must contain a word of at least {MIN_WORD} letters or digits.')
+        return value
+
+
+class DistanceMatrixRequestSerializer(serializers.Serializer):
+    """Serializer for many-to-many distance matrix requests"""
+    origins = serializers.ListField(
+        child=serializers.CharField(max_length=200), min_length=1, max_length=500
+    )
+    destinations = serializers.ListField(
+        child=serializers.CharField(max_length=200), min_length=1, max_length=500
+    )
+    current_cycle_used = serializers.DecimalField(max_digits=5, decimal_places=2, required=False, default=0)
+    cycle_used = serializers.ListField(
+        child=serializers.DecimalField(max_digits=5, decimal_places=2), required=False
+    )  # Optional per-origin cycle hours, overrides current_cycle_used
+    
+    def validate(self, data):
+        if 'cycle_used' in data and len(data['cycle_used']) != len(data['origins']):
+            raise serializers.ValidationError({'cycle_used': 'Provide one value per origin.'})
+        return data
+
+
+class AssignmentDriverSerializer(serializers.Serializer):
+    """Driver available for load assignment"""
+    id = serializers.CharField(max_length=100)
+    location = serializers.CharField(max_length=200)
+    cycle_used = serializers.DecimalField(max_digits=5, decimal_places=2, required=False, default=0)
+
+
+class AssignmentLoadSerializer(serializers.Serializer):
+    """Load waiting for a driver"""
+    id = serializers.CharField(max_length=100)
+    pickup_location = serializers.CharField(max_length=200)
+    dropoff_location = serializers.CharField(max_length=200)
+
+
+class LoadAssignmentRequestSerializer(serializers.Serializer):
+    """Serializer for driver-to-load assignment requests"""
+    drivers = AssignmentDriverSerializer(many=True, min_length=1, max_length=500)
+    loads = AssignmentLoadSerializer(many=True, min_length=1, max_length=500)
+    max_deadhead_miles = serializers.FloatField(required=False, min_value=0)
+    
+    def validate(self, data):
+        for field in ('drivers', 'loads'):
+            ids = [item['id'] for item in data[field]]
+            if len(set(ids)) != len(ids):
+                raise serializers.ValidationError({field: 'Ids must be unique.'})
+        return data
 
 
 class TripCalculationResponseSerializer(serializers.Serializer):
@@ -70,6 +238,17 @@ class TripCalculationResponseSerializer(serializers.Serializer):
     message = serializers.CharField()
 
 
+class RequestProfileSerializer(serializers.ModelSerializer):
+    """Stored request profile; the collapsed stacks only in the detail view"""
+    
+    class Meta:
+        model = RequestProfile
+        fields = [
+            'id', 'method', 'path', 'status_code', 'trigger', 'user', 'duration_ms',
+            'sample_interval_ms', 'samples', 'created_at'
+        ]
+
+
 class UserSerializer(serializers.ModelSerializer):
     """Serializer for user data"""
     current_cycle_used = serializers.SerializerMethodField()
@@ -0,0 +1,274 @@
+"""
+Sleeper-berth split planning
+Searches legal rest placements along a trip's drive timeline, including the
+7/3 and 8/2 sleeper-berth splits (49 CFR 395.1(g)), and returns the schedule
+that arrives earliest together with ELD duty statuses for it
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .calculations import HOSCalculator
+
+
+class _Label(NamedTuple):
+    """DP label: HOS counters (minutes) after a prefix of the timeline"""
+    elapsed: int        # minutes since trip start
+    driving: int        # driving since the 11/14-hour calculation point
+    window: int         # time counted against the 14-hour window
+    since_break: int    # driving since the last 30+ minute interruption
+    cycle: int          # on-duty time counted against the 70-hour cycle
+    pending: int        # length of the unpaired split period (0 = none)
+    pending_sleeper: bool
+    pending_driving: int  # driving since the end of the unpaired period
+    pending_window: int   # window time since the end of the unpaired period
+    back: Optional[tuple]  # (previous label, events) for reconstruction
+
+
+class SleeperBerthPlanner:
+    """Earliest-arrival HOS schedule using sleeper-berth splits"""
+
+    QUANTUM = 15  # minutes of driving per timeline step
+    MAX_DRIVING = HOSCalculator.MAX_DAILY_DRIVING * 60
+    MAX_WINDOW = HOSCalculator.MAX_DAILY_ON_DUTY * 60
+    MAX_DRIVING_BEFORE_BREAK = HOSCalculator.MAX_DRIVING_BEFORE_BREAK * 60
+    MAX_CYCLE = HOSCalculator.MAX_WEEKLY_ON_DUTY * 60
+    RESET = HOSCalculator.MIN_OFF_DUTY * 60
+    RESTART = 34 * 60
+    MIN_SPLIT_LONG = 7 * 60  # sleeper-berth half of a split
+    MIN_SPLIT_SHORT = 2 * 60
+
+    # Rest periods tried whenever the next driving step is blocked
+    # (kind, minutes, duty status, log location)
+    SPLIT_RESTS = [
+        ('split', 120, 'off_duty', 'Off duty (split rest)'),
+        ('split', 180, 'off_duty', 'Off duty (split rest)'),
+        ('split', 420, 'sleeper', 'Sleeper berth (split rest)'),
+        ('split', 480, 'sleeper', 'Sleeper berth (split rest)'),
+    ]
+    BASIC_RESTS = [
+        ('break', 30, 'off_duty', 'Rest break'),
+        ('reset', 600, 'sleeper', 'Sleeper berth (10-hour reset)'),
+    ]
+    RESTART_REST = ('restart', 2040, 'off_duty', '34-hour restart')
+
+    @staticmethod
+    def build_timeline(distance_miles: float, pickup_miles: float = 0) -> List[Tuple[str, int, str, float]]:
+        """
+        Break a trip into on-duty tasks and fixed-size driving steps
+
+        Mirrors calculate_trip_details: pre/post-trip duty, one hour each for
+        pickup and dropoff and a 30-minute fuel stop every 1,000 miles.
+
+        Args:
+            distance_miles: Total trip distance in miles
+            pickup_miles: Part of the distance driven before the pickup
+
+        Returns:
+            List of (status, minutes, location, miles) steps
+        """
+        speed = HOSCalculator.AVERAGE_SPEED / 60  # miles per minute
+        steps = [('on_duty', 30, 'Pre-trip inspection', 0.0)]
+        driven = 0.0
+        next_fuel = HOSCalculator.FUEL_STOP_INTERVAL
+
+        def drive(miles):
+            nonlocal driven, next_fuel
+            remaining = round(miles / speed)
+            while remaining > 0:
+                minutes = min(SleeperBerthPlanner.QUANTUM, remaining)
+                steps.append(('driving', minutes, 'Driving', minutes * speed))
+                driven += minutes * speed
+                remaining -= minutes
+                if driven >= next_fuel and driven < distance_miles - 1e-6 and remaining > 0:
+                    steps.append(('on_duty', int(HOSCalculator.FUEL_STOP_TIME * 60), 'Fuel stop', 0.0))
+                    next_fuel += HOSCalculator.FUEL_STOP_INTERVAL
+
+        pickup_miles = min(max(pickup_miles, 0), distance_miles)
+        drive(pickup_miles)
+        steps.append(('on_duty', int(HOSCalculator.LOADING_TIME * 60), 'Pickup', 0.0))
+        drive(distance_miles - pickup_miles)
+        steps.append(('on_duty', int(HOSCalculator.UNLOADING_TIME * 60), 'Dropoff', 0.0))
+        steps.append(('on_duty', 45, 'Post-trip inspection', 0.0))
+        return steps
+
+    @staticmethod
+    def _can_drive(label: _Label, minutes: int, cycle_limit: int) -> bool:
+        return (label.driving + minutes <= SleeperBerthPlanner.MAX_DRIVING
+                and label.window + minutes <= SleeperBerthPlanner.MAX_WINDOW
+                and label.since_break + minutes <= SleeperBerthPlanner.MAX_DRIVING_BEFORE_BREAK
+                and label.cycle + minutes <= cycle_limit)
+
+    @staticmethod
+    def _pairs(first: int, first_sleeper: bool, second: int, second_sleeper: bool) -> bool:
+        """Whether two rest periods form a qualifying sleeper-berth split"""
+        return (first + second >= SleeperBerthPlanner.RESET
+                and min(first, second) >= SleeperBerthPlanner.MIN_SPLIT_SHORT
+                and ((first_sleeper and first >= SleeperBerthPlanner.MIN_SPLIT_LONG)
+                     or (second_sleeper and second >= SleeperBerthPlanner.MIN_SPLIT_LONG)))
+
+    @staticmethod
+    def _rest(label: _Label, rest: tuple) -> _Label:
+        kind, minutes, status, location = rest
+        back = (label, ((status, minutes, location, 0.0),))
+        elapsed = label.elapsed + minutes
+        if kind == 'restart':
+            return _Label(elapsed, 0, 0, 0, 0, 0, False, 0, 0, back)
+        if kind == 'reset':
+            return _Label(elapsed, 0, 0, 0, label.cycle, 0, False, 0, 0, back)
+        if kind == 'break':
+            return label._replace(
+                elapsed=elapsed, window=label.window + minutes, since_break=0,
+                pending_window=label.pending_window + minutes, back=back
+            )
+        sleeper = status == 'sleeper'
+        if label.pending and SleeperBerthPlanner._pairs(label.pending, label.pending_sleeper, minutes, sleeper):
+            # Split completed: recalculate from the end of the first period,
+            # neither period counts against the 14-hour window
+            return _Label(elapsed, label.pending_driving, label.pending_window, 0, label.cycle,
+                          minutes, sleeper, 0, 0, back)
+        return _Label(elapsed, label.driving, label.window + minutes, 0, label.cycle,
+                      minutes, sleeper, 0, 0, back)
+
+    @staticmethod
+    def _rested(label: _Label, minutes: int, rests: list, cycle_limit: int) -> List[_Label]:
+        """Labels after one or two rest periods that allow the next driving step"""
+        options = list(rests)
+        if label.cycle + minutes > cycle_limit:
+            options = [SleeperBerthPlanner.RESTART_REST]
+        result = []
+        for rest in options:
+            first = SleeperBerthPlanner._rest(label, rest)
+            if SleeperBerthPlanner._can_drive(first, minutes, cycle_limit):
+                result.append(first)
+                continue
+            for follow_up in options:
+                second = SleeperBerthPlanner._rest(first, follow_up)
+                if SleeperBerthPlanner._can_drive(second, minutes, cycle_limit):
+                    result.append(second)
+        return result
+
+    @staticmethod
+    def _prune(labels: List[_Label]) -> List[_Label]:
+        """Drop labels that are no better than another in every counter"""
+        kept = []
+        groups: Dict[tuple, List[_Label]] = {}
+        for label in sorted(labels, key=lambda item: item[:9]):
+            group = groups.setdefault((label.pending, label.pending_sleeper), [])
+            if any(other.elapsed <= label.elapsed and other.driving <= label.driving
+                   and other.window <= label.window and other.since_break <= label.since_break
+                   and other.cycle <= label.cycle and other.pending_driving <= label.pending_driving
+                   and other.pending_window <= label.pending_window
+                   for other in group):
+                continue
+            group.append(label)
+            kept.append(label)
+        return kept
+
+    @staticmethod
+    def plan(distance_miles: float, current_cycle_used: float, start: datetime,
+             use_splits: bool = True, pickup_miles: float = 0) -> Dict:
+        """
+        Earliest-arrival schedule for a trip
+
+        Dynamic programming over the drive timeline: after every step only
+        non-dominated HOS states are kept, and rest periods (30-minute break,
+        2/3-hour off duty, 7/8-hour sleeper berth, 10-hour reset, 34-hour
+        restart) are inserted wherever the next driving step would break a limit.
+
+        Args:
+            distance_miles: Total trip distance in miles
+            current_cycle_used: Hours already used in the 70-hour cycle
+            start: Start of the first on-duty period
+            use_splits: Allow sleeper-berth splits (False gives the flat
+                10-hour reset schedule for comparison)
+            pickup_miles: Part of the distance driven before the pickup
+
+        Returns:
+            Dictionary with the duty status events, total elapsed hours and
+            the number of split and full rest periods used
+        """
+        # Cycle time is counted from the hours already used so a 34-hour
+        # restart frees the full 70 hours
+        cycle_limit = SleeperBerthPlanner.MAX_CYCLE
+        rests = SleeperBerthPlanner.BASIC_RESTS + (SleeperBerthPlanner.SPLIT_RESTS if use_splits else [])
+        labels = [_Label(0, 0, 0, 0, int(round(float(current_cycle_used) * 60)), 0, False, 0, 0, None)]
+
+        for status, minutes, location, miles in SleeperBerthPlanner.build_timeline(distance_miles, pickup_miles):
+            event = ((status, minutes, location, miles),)
+            advanced = []
+            if status != 'driving':
+                for label in labels:
+                    advanced.append(label._replace(
+                        elapsed=label.elapsed + minutes, window=label.window + minutes,
+                        since_break=0 if minutes >= 30 else label.since_break,
+                        cycle=label.cycle + minutes, pending_window=label.pending_window + minutes,
+                        back=(label, event)
+                    ))
+            else:
+                for label in labels:
+                    if SleeperBerthPlanner._can_drive(label, minutes, cycle_limit):
+                        candidates = [label]
+                    else:
+                        candidates = SleeperBerthPlanner._rested(label, minutes, rests, cycle_limit)
+                    for candidate in candidates:
+                        advanced.append(_Label(
+                            candidate.elapsed + minutes, candidate.driving + minutes,
+                            candidate.window + minutes, candidate.since_break + minutes,
+                            candidate.cycle + minutes, candidate.pending, candidate.pending_sleeper,
+                            candidate.pending_driving + minutes, candidate.pending_window + minutes,
+                            (candidate, event)
+                        ))
+            labels = SleeperBerthPlanner._prune(advanced)
+
+        best = min(labels, key=lambda label: label.elapsed)
+        return {
+            'events': SleeperBerthPlanner._events(best, start),
+            'total_hours': round(best.elapsed / 60, 2),
+            'labels_kept': len(labels),
+        }
+
+    @staticmethod
+    def _events(label: _Label, start: datetime) -> List[Dict]:
+        """Walk the back pointers and merge consecutive identical steps"""
+        steps = []
+        while label.back is not None:
+            label, events = label.back
+            steps.extend(reversed(events))
+        steps.reverse()
+
+        events = []
+        current = start
+        for status, minutes, location, miles in steps:
+            end = current + timedelta(minutes=minutes)
+            if events and events[-1]['status'] == status and events[-1]['location'] == location:
+                events[-1]['end'] = end
+                events[-1]['miles'] += miles
+            else:
+                events.append({'status': status, 'start': current, 'end': end, 'location': location, 'miles': miles})
+            current = end
+        return events
+
+    @staticmethod
+    def summarize(plan: Dict) -> Dict:
+        """Counts of the rest periods in a plan"""
+        sleeper = [event for event in plan['events'] if event['status'] == 'sleeper']
+        return {
+            'total_hours': plan['total_hours'],
+            'sleeper_periods': len(sleeper),
+            'sleeper_hours': round(sum((event['end'] - event['start']).total_seconds() for event in sleeper) / 3600, 2),
+            'split_rests': sum(1 for event in plan['events'] if 'split' in event['location']),
+        }
+
+    @staticmethod
+    def generate_eld_logs(plan: Dict) -> list:
+        """
+        ELD logs for a planned schedule, one per calendar day
+
+        Args:
+            plan: Result of plan()
+
+        Returns:
+            List of ELD log dictionaries in the generate_eld_logs format
+        """
+        return HOSCalculator.generate_eld_logs_from_events(plan['events'])
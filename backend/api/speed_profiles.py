@@ -0,0 +1,336 @@
+"""
+Time-of-day travel speeds
+ORS returns one duration per route, as if traffic were the same all day.
+Speed profiles scale the route's average speed by hour of day with factors
+learned from what drivers actually reported: every re-plan stores a
+TripCheckpoint (miles completed and the driving clock), and two consecutive
+checkpoints of a trip give the miles driven in the driving time between
+them. Those are spread over the hours the interval covers. The planner's
+own ELD logs are not used; they only echo the speeds it planned with. An
+hour's factor is its average speed over the profile's overall average,
+pulled towards 1.0 while the hour has little data.
+
+Profiles are kept per lane (normalized pickup -> dropoff), per region (a
+grid cell around the start of the route) and for the whole fleet; planning
+uses the most specific one with SPEED_PROFILE_MIN_HOURS of driving. A
+profile row stores its running sums and its 24 factors as packed arrays, so
+manage.py rebuild_speed_profiles only adds the trips completed since its
+last run, and the simulation looks a speed up by list index. What each trip
+added is kept (SpeedProfileContribution), so a completed trip that is saved
+again replaces its earlier sums instead of being counted twice.
+
+Checkpoint hours are read in local time (TIME_ZONE), the clock re-planning
+and the ELD logs use.
+"""
+
+import math
+import time
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .calculations import HOSCalculator
+from .geocoder import normalize_location
+from .models import SpeedProfile, SpeedProfileBuild, SpeedProfileContribution, Trip
+
+
+HOURS = 24
+DAY_MINUTES = HOURS * 60
+FLEET_KEY = 'fleet'
+# Checkpoint pairs faster than this are position glitches, not driving
+MAX_OBSERVED_MPH = 90
+
+# key -> (loaded at, factors or None); factors only for profiles with enough data
+_cache: Dict[str, Tuple[float, Optional[Tuple[float, ...]]]] = {}
+
+
+class HourlySpeeds:
+    """Driving speed in mph for each hour of the day"""
+
+    def __init__(self, mph: Sequence[float], source: str):
+        """
+        Args:
+            mph: 24 speeds, midnight first
+            source: Profile key the speeds come from, or 'route' for the
+                route's average speed without a profile
+        """
+        self.mph = tuple(mph)
+        self.source = source
+        self.fastest = max(self.mph)
+        self.flat = min(self.mph) == self.fastest
+
+    @staticmethod
+    def minute_of_day(moment: datetime) -> int:
+        return moment.hour * 60 + moment.minute
+
+    def drive_minutes(self, miles: float, start_minute: int) -> float:
+        """Minutes to drive a distance without stopping, starting at a minute of the day"""
+        minutes = 0.0
+        minute = start_minute % DAY_MINUTES
+        remaining = float(miles)
+        while remaining > 1e-9:
+            speed = self.mph[int(minute // 60) % HOURS] / 60
+            hour_left = 60 - minute % 60
+            if hour_left * speed >= remaining:
+                return minutes + remaining / speed
+            minutes += hour_left
+            remaining -= hour_left * speed
+            minute = (minute + hour_left) % DAY_MINUTES
+        return minutes
+
+    def to_dict(self) -> Dict:
+        return {'source': self.source, 'mph': [round(speed, 1) for speed in self.mph]}
+
+
+def _unpack(data, typecode: str) -> array:
+    values = array(typecode)
+    values.frombytes(bytes(data))
+    return values
+
+
+class SpeedProfiles:
+    """Learn SpeedProfile rows from completed trips' checkpoints and look them up for planning"""
+
+    # Keys
+
+    @staticmethod
+    def lane_key(pickup_location: str, dropoff_location: str) -> str:
+        """Spelling variants of a lane share a key (as in the fleet rollups)"""
+        return f'lane:{normalize_location(pickup_location)} -> {normalize_location(dropoff_location)}'[:420]
+
+    @staticmethod
+    def region_key(coordinates: Sequence) -> Optional[str]:
+        """Grid cell of the first route vertex ([longitude, latitude]), None without geometry"""
+        if not coordinates:
+            return None
+        longitude, latitude = coordinates[0][:2]
+        size = getattr(settings, 'SPEED_PROFILE_REGION_DEGREES', 2.0)
+        return f'region:{math.floor(latitude / size)}:{math.floor(longitude / size)}'
+
+    @staticmethod
+    def keys(pickup_location: str, dropoff_location: str, coordinates: Sequence) -> List[str]:
+        """Profile keys for a route, most specific first"""
+        keys = [SpeedProfiles.lane_key(pickup_location, dropoff_location)]
+        region = SpeedProfiles.region_key(coordinates)
+        if region:
+            keys.append(region)
+        keys.append(FLEET_KEY)
+        return keys
+
+    # Learning
+
+    @staticmethod
+    def observe(checkpoints: Iterable) -> array:
+        """
+        A trip's observed miles and driving minutes per hour of day
+
+        Consecutive checkpoints are used when the driving clock went up
+        between them (no 10-hour reset), the driving fits in the time that
+        passed and the pair is at most SPEED_PROFILE_MAX_GAP_MINUTES apart.
+        The driving is spread evenly over that interval.
+
+        Args:
+            checkpoints: The trip's TripCheckpoint rows in recorded_at order
+
+        Returns:
+            array('d') of 24 mile sums followed by 24 minute sums
+        """
+        sums = array('d', bytes(8 * 2 * HOURS))
+        max_gap = getattr(settings, 'SPEED_PROFILE_MAX_GAP_MINUTES', 180)
+        previous = None
+        for checkpoint in checkpoints:
+            if previous is not None:
+                start = timezone.localtime(previous.recorded_at)
+                elapsed = (checkpoint.recorded_at - previous.recorded_at).total_seconds() / 60
+                driven = (checkpoint.driving_hours - previous.driving_hours) * 60
+                miles = float(checkpoint.miles_completed - previous.miles_completed)
+                if (0 < driven <= elapsed + 1 and elapsed <= max_gap and miles >= 0
+                        and miles / driven * 60 <= MAX_OBSERVED_MPH):
+                    minute = HourlySpeeds.minute_of_day(start) + start.second / 60
+                    remaining = elapsed
+                    while remaining > 1e-9:
+                        step = min(60 - minute % 60, remaining)
+                        hour = int(minute // 60) % HOURS
+                        sums[hour] += miles * step / elapsed
+                        sums[HOURS + hour] += driven * step / elapsed
+                        minute = (minute + step) % DAY_MINUTES
+                        remaining -= step
+            previous = checkpoint
+        return sums
+
+    @staticmethod
+    def factors(sums: array) -> array:
+        """
+        Hour-of-day speed factors from mile and minute sums
+
+        Each hour starts from SPEED_PROFILE_PRIOR_MINUTES of driving at the
+        profile's average speed, so thinly observed hours stay near 1.0.
+        """
+        total_miles, total_minutes = sum(sums[:HOURS]), sum(sums[HOURS:])
+        if not total_minutes or not total_miles:
+            return array('f', [1.0] * HOURS)
+        average = total_miles / total_minutes
+        prior = getattr(settings, 'SPEED_PROFILE_PRIOR_MINUTES', 120)
+        return array('f', [
+            (sums[hour] + average * prior) / (sums[HOURS + hour] + prior) / average
+            for hour in range(HOURS)
+        ])
+
+    @staticmethod
+    def _add(deltas: Dict[str, list], keys: Iterable[str], sums: array, sign: int):
+        for key in keys:
+            kind = key.split(':', 1)[0]
+            entry = deltas.setdefault(key, [kind, 0, array('d', bytes(8 * 2 * HOURS))])
+            entry[1] += sign
+            for index, value in enumerate(sums):
+                entry[2][index] += sign * value
+
+    @staticmethod
+    def _apply(deltas: Dict[str, list]):
+        """Add per-key sums to the profile rows and recompute their factors"""
+        existing = {profile.key: profile for profile in
+                    SpeedProfile.objects.select_for_update().filter(key__in=list(deltas))}
+        created, updated = [], []
+        for key, (kind, trips, sums) in deltas.items():
+            profile = existing.get(key)
+            if profile is None:
+                profile = SpeedProfile(kind=kind, key=key, trips=0)
+                created.append(profile)
+            else:
+                stored = _unpack(profile.sums, 'd')
+                for index, value in enumerate(stored):
+                    sums[index] += value
+                updated.append(profile)
+            profile.trips += trips
+            profile.driving_minutes = round(sum(sums[HOURS:]), 2)
+            profile.sums = sums.tobytes()
+            profile.factors = SpeedProfiles.factors(sums).tobytes()
+        SpeedProfile.objects.bulk_create(created)
+        if updated:
+            SpeedProfile.objects.bulk_update(updated, ['trips', 'driving_minutes', 'sums', 'factors', 'updated_at'])
+
+    @staticmethod
+    def update(batch_size: int = 500, full: bool = False) -> int:
+        """
+        Add trips completed since the last run to the profiles
+
+        Completed trips are read in (updated_at, id) order and the position
+        is saved with each batch, so an interrupted run picks up where it
+        stopped. A completed trip that is saved again is read again, and
+        what it added last time is taken off before its new sums are added.
+
+        Args:
+            batch_size: Trips read and committed per batch
+            full: Drop all profiles and count every completed trip again
+
+        Returns:
+            Number of trips added
+        """
+        if full:
+            with transaction.atomic():
+                SpeedProfile.objects.all().delete()
+                SpeedProfileContribution.objects.all().delete()
+                SpeedProfileBuild.objects.all().delete()
+        build, _ = SpeedProfileBuild.objects.get_or_create(pk=1)
+        added = 0
+        while True:
+            trips = Trip.objects.filter(status='completed').order_by('updated_at', 'id').only(
+                'id', 'pickup_location', 'dropoff_location', 'route_geometry', 'updated_at'
+            ).prefetch_related('checkpoints', 'speed_contribution')
+            if build.counted_through is not None:
+                trips = trips.filter(Q(updated_at__gt=build.counted_through) |
+                                     Q(updated_at=build.counted_through, id__gt=build.last_trip_id))
+            batch = list(trips[:batch_size])
+            if not batch:
+                break
+            deltas = {}
+            created, updated, deleted = [], [], []
+            for trip in batch:
+                previous = getattr(trip, 'speed_contribution', None)
+                if previous is not None:
+                    SpeedProfiles._add(deltas, previous.keys, _unpack(previous.sums, 'd'), -1)
+                sums = SpeedProfiles.observe(trip.checkpoints.all())
+                if not any(sums[HOURS:]):
+                    if previous is not None:
+                        deleted.append(previous.id)
+                    continue
+                keys = SpeedProfiles.keys(trip.pickup_location, trip.dropoff_location, trip.route_geometry or [])
+                SpeedProfiles._add(deltas, keys, sums, 1)
+                if previous is None:
+                    created.append(SpeedProfileContribution(trip=trip, keys=keys, sums=sums.tobytes()))
+                else:
+                    previous.keys, previous.sums = keys, sums.tobytes()
+                    updated.append(previous)
+            with transaction.atomic():
+                SpeedProfiles._apply(deltas)
+                SpeedProfileContribution.objects.bulk_create(created)
+                if updated:
+                    SpeedProfileContribution.objects.bulk_update(updated, ['keys', 'sums'])
+                SpeedProfileContribution.objects.filter(id__in=deleted).delete()
+                build.counted_through, build.last_trip_id = batch[-1].updated_at, batch[-1].id
+                build.trips += len(batch)
+                build.save()
+            added += len(batch)
+        _cache.clear()
+        return added
+
+    # Lookups
+
+    @staticmethod
+    def load(keys: Iterable[str]):
+        """Read the factors of uncached (or expired) keys in one query"""
+        now = time.monotonic()
+        timeout = getattr(settings, 'SPEED_PROFILE_CACHE_SECONDS', 300)
+        missing = {key for key in keys if key not in _cache or now - _cache[key][0] > timeout}
+        if not missing:
+            return
+        if len(_cache) + len(missing) > getattr(settings, 'SPEED_PROFILE_CACHE_SIZE', 10000):
+            _cache.clear()
+        found = dict(SpeedProfile.objects.filter(
+            key__in=missing, driving_minutes__gte=getattr(settings, 'SPEED_PROFILE_MIN_HOURS', 24) * 60
+        ).values_list('key', 'factors'))
+        for key in missing:
+            _cache[key] = (now, tuple(_unpack(found[key], 'f')) if key in found else None)
+
+    @staticmethod
+    def speeds(pickup_location: str, dropoff_location: str, coordinates: Sequence,
+               distance_miles: float, duration_hours: Optional[float]) -> Optional[HourlySpeeds]:
+        """
+        Hourly speeds for a route
+
+        Args:
+            pickup_location: Pickup location (for the lane profile)
+            dropoff_location: Dropoff location
+            coordinates: Route geometry as [longitude, latitude] (for the region profile)
+            distance_miles: Route distance
+            duration_hours: Route duration from ORS; without one the fixed
+                AVERAGE_SPEED is scaled
+
+        Returns:
+            The route's average speed scaled by the most specific profile
+            with enough data (flat without one), or None when
+            SPEED_PROFILES_ENABLED is off
+        """
+        if not getattr(settings, 'SPEED_PROFILES_ENABLED', True):
+            return None
+        average = HOSCalculator.AVERAGE_SPEED
+        if distance_miles and duration_hours:
+            average = float(distance_miles) / float(duration_hours)
+        keys = SpeedProfiles.keys(pickup_location, dropoff_location, coordinates)
+        SpeedProfiles.load(keys)
+        for key in keys:
+            factors = _cache[key][1]
+            if factors is not None:
+                return HourlySpeeds([average * factor for factor in factors], key)
+        return HourlySpeeds([average] * HOURS, 'route')
+
+    @staticmethod
+    def for_trip(trip: Trip) -> Optional[HourlySpeeds]:
+        """Hourly speeds for a saved trip, around its planned average driving speed"""
+        return SpeedProfiles.speeds(trip.pickup_location, trip.dropoff_location, trip.route_geometry or [],
+                                    trip.total_distance, trip.estimated_drive_time)
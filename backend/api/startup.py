@@ -0,0 +1,95 @@
+"""
+Worker start-up warm-up
+Loads what the first request of a fresh worker would otherwise pay for: the
+URLconf with every view module, the DRF classes it imports lazily, the auth
+backends and session engine, the gazetteer index and the ORS HTTP session.
+wsgi.py and asgi.py run it in a background thread, so the worker takes
+requests right away; a request arriving mid-way just loads the rest itself.
+"""
+
+import logging
+import threading
+import time
+from importlib import import_module
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def _load_urls():
+    from django.urls import reverse
+    reverse('health_check')  # Imports and indexes the whole URLconf
+
+
+def _load_rest_framework():
+    from rest_framework.settings import api_settings
+    for name in ('DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES', 'DEFAULT_AUTHENTICATION_CLASSES',
+                 'DEFAULT_PERMISSION_CLASSES', 'DEFAULT_THROTTLE_CLASSES', 'DEFAULT_CONTENT_NEGOTIATION_CLASS',
+                 'DEFAULT_METADATA_CLASS', 'EXCEPTION_HANDLER'):
+        getattr(api_settings, name)
+
+
+def _load_auth():
+    from django.contrib.auth import get_backends
+    get_backends()
+    import_module(settings.SESSION_ENGINE)
+
+
+def _load_gazetteer():
+    from .geocoder import OfflineGeocoder
+    OfflineGeocoder.get_default()
+
+
+def _load_http_session():
+    from .distance_service import DistanceService
+    DistanceService.http()
+
+
+class StartupWarmer:
+    """Run the warm-up steps, in the foreground or in a background thread"""
+
+    STEPS: List[Tuple[str, Callable]] = [
+        ('url_conf', _load_urls),
+        ('rest_framework', _load_rest_framework),
+        ('auth', _load_auth),
+        ('gazetteer', _load_gazetteer),
+        ('http_session', _load_http_session),
+    ]
+
+    _thread: Optional[threading.Thread] = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def run() -> Dict[str, Optional[float]]:
+        """
+        Run every step
+
+        Returns:
+            Milliseconds per step (None for a step that failed)
+        """
+        timings = {}
+        for name, step in StartupWarmer.STEPS:
+            started = time.perf_counter()
+            try:
+                step()
+                timings[name] = round((time.perf_counter() - started) * 1000, 2)
+            except Exception as e:
+                logger.warning("Start-up warm-up step %s failed: %s", name, e)
+                timings[name] = None
+        return timings
+
+    @staticmethod
+    def start() -> Optional[threading.Thread]:
+        """Start the warm-up thread once per process, unless STARTUP_WARMUP is off"""
+        if not getattr(settings, 'STARTUP_WARMUP', True):
+            return None
+        with StartupWarmer._lock:
+            if StartupWarmer._thread is None:
+                StartupWarmer._thread = threading.Thread(
+                    target=StartupWarmer.run, name='startup-warmup', daemon=True
+                )
+                StartupWarmer._thread.start()
+        return StartupWarmer._thread
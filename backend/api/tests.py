@@ -1,3 +1,1420 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import multiprocessing
+import random
+import shutil
+import tempfile
+import threading
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import permutations
+from pathlib import Path
+from time import monotonic, sleep
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.decorators import api_view
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from .analytics import FleetRollups, _month_end
+from .archive import TripArchive
+from .assignment import INFEASIBLE_COST, LoadAssignmentOptimizer, solve_assignment
+from .auth_backend import CachedModelBackend, user_cache_enabled
+from .benchmarks import BenchmarkSuite, compare_runs, summarize
+from .bulk_planning import BulkTripPlanner
+from .compression import negotiate
+from .distance_service import DistanceService, LocationNotFound
+from .events import TripEventBroker
+from .fuel_planner import FuelStation, FuelStationIndex, FuelStopPlanner
+from .geocoder import OfflineGeocoder, build_index, great_circle_miles
+from .idempotency import IdempotencyStore, SingleFlight, idempotent
+from .matrix_service import DistanceMatrixService
+from .models import (
+    DutyStatus, ELDLog, FleetRollup, HOSViolation, IdempotencyRecord, PlanningRun, RoutePoint, SpeedProfile,
+    SpeedProfileContribution, Trip, TripCheckpoint
+)
+from .ors_standin import LatencyDistribution, ORSStandInServer, StandInConfig, encode_polyline, geocode_text
+from .rate_limiter import BATCH, OrsRateLimiter
+from .replanning import TripReplanner, project_onto_route
+from .scheduling import AppointmentScheduler, DepartureSweep
+from .serializers import TripSerializer
+from .sleeper_planner import SleeperBerthPlanner
+from .speed_profiles import HOURS, SpeedProfiles, _cache
+from .timeline import DutyTimeline
+from .violations import HOSViolationScanner
+
+
+class BenchmarkSuiteTests(TestCase):
+    """Benchmark statistics, a short run and run comparison"""
+
+    def test_summarize(self):
+        result = summarize('case', [4_000_000, 1_000_000, 2_000_000, 3_000_000], {'rows': 4})
+        self.assertEqual((result['iterations'], result['min_ms'], result['max_ms']), (4, 1.0, 4.0))
+        self.assertEqual((result['mean_ms'], result['median_ms'], result['p95_ms']), (2.5, 2.5, 4.0))
+        self.assertEqual((result['ops_per_sec'], result['rows']), (400.0, 4))
+        self.assertEqual(summarize('once', [1_000_000])['stdev_ms'], 0.0)
+
+    def test_short_run_and_comparison(self):
+        suite = BenchmarkSuite(iterations=2, warmup=0, seed_trips=3)
+        suite.seed_database()
+        run = suite.run(['hos_scalar', 'duty_timeline', 'read_endpoints'])
+        names = [result['name'] for result in run['results']]
+        self.assertIn('hos_scalar', names)
+        self.assertIn('trip_detail', names)
+        self.assertTrue(all(result['iterations'] == 2 for result in run['results']))
+        self.assertEqual(run['options']['seed_trips'], 3)
+        detail = next(result for result in run['results'] if result['name'] == 'trip_detail')
+        self.assertGreater(detail['queries'], 0)
+
+        baseline = {'results': [{**result, 'mean_ms': result['mean_ms'] * 2} for result in run['results'][:1]]}
+        self.assertEqual(compare_runs(baseline, run), [{
+            'name': run['results'][0]['name'], 'baseline_mean_ms': run['results'][0]['mean_ms'] * 2,
+            'current_mean_ms': run['results'][0]['mean_ms'], 'change_pct': -50.0,
+        }])
+        with self.assertRaises(ValueError):
+            suite.run(['no_such_case'])
+
+
+class OrsStandInTests(SimpleTestCase):
+    """The local ORS stand-in and DistanceService talking to it"""
+
+    def test_latency_specs(self):
+        rng = random.Random(27)
+        self.assertEqual(LatencyDistribution.parse(None).sample(rng), 0.0)
+        self.assertEqual(LatencyDistribution.parse('fixed:50').sample(rng), 0.05)
+        uniform = LatencyDistribution.parse('uniform:100:40')
+        self.assertTrue(all(0.06 <= uniform.sample(rng) <= 0.14 for _ in range(100)))
+        lognormal = LatencyDistribution.parse('lognormal:150:0.5')
+        mean = sum(lognormal.sample(rng) for _ in range(5000)) / 5000
+        self.assertAlmostEqual(mean, 0.15, delta=0.01)
+        self.assertEqual(str(LatencyDistribution.parse('normal:120:30')), 'normal:120:30')
+        with self.assertRaises(ValueError):
+            LatencyDistribution.parse('pareto:10')
+
+    def test_polyline_reference_vector(self):
+        # The example from the polyline algorithm's documentation
+        self.assertEqual(encode_polyline([[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]),
+                         '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+
+    @override_settings(ORS_API_KEY='test', ORS_RATE_LIMITS={}, OFFLINE_GEOCODER_ENABLED=False)
+    def test_distance_service_against_stand_in(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        with ORSStandInServer(StandInConfig(seed=27, circuity=1.3)) as server:
+            with self.settings(ORS_BASE_URL=server.base_url):
+                result = DistanceService.fetch_route('Standin Origin', 'Standin Destination')
+                stats = server.stats()
+        self.assertTrue(result['success'])
+        miles = great_circle_miles(geocode_text('Standin Origin'), geocode_text('Standin Destination')) * 1.3
+        self.assertAlmostEqual(result['distance_miles'], miles, delta=miles * 0.005)
+        self.assertGreater(len(result['route_info']['coordinates']), 2)
+        self.assertEqual((stats['geocode']['requests'], stats['directions']['requests']), (2, 1))
+        self.assertEqual(DistanceService.calculate_distance_and_duration('Standin Origin', 'Standin Destination'),
+                         result)
+
+    def test_injected_throttling_and_matrix_limit(self):
+        http = DistanceService.http()
+        with ORSStandInServer(StandInConfig(throttle_rate=1.0, matrix_max_elements=4)) as server:
+            throttled = http.get(f'{server.base_url}/geocode/search', params={'text': 'Dallas'}, timeout=5)
+            too_large = http.post(f'{server.base_url}/v2/matrix/driving-hgv',
+                                  json={'locations': [[0, 0]] * 3}, timeout=5)
+            self.assertEqual(server.stats()['geocode'], {'requests': 1, 'throttled': 1, 'errors': 0})
+        self.assertEqual(throttled.status_code, 429)
+        self.assertEqual(throttled.headers['Retry-After'], '1')
+        # Throttling applies before the size check, like ORS
+        self.assertEqual(too_large.status_code, 429)
+        with ORSStandInServer(StandInConfig(matrix_max_elements=4)) as server:
+            too_large = http.post(f'{server.base_url}/v2/matrix/driving-hgv',
+                                  json={'locations': [[0, 0]] * 3}, timeout=5)
+        self.assertEqual(too_large.status_code, 400)
+
+
+class OfflineGeocoderTests(SimpleTestCase):
+    """ZIP, exact and trigram tiers"""
+
+    ROWS = [
+        ('Chicago', 'IL', 'city', 41.8781, -87.6298, ['Chi-Town']),
+        ('Springfield', 'IL', 'city', 39.7817, -89.6501, []),
+        ('Springfield', 'MO', 'city', 37.2090, -93.2923, []),
+        ('Saint Louis', 'MO', 'city', 38.6270, -90.1994, []),
+        ('Kansas City', 'MO', 'city', 39.0997, -94.5786, []),
+        ('60601', 'IL', 'zip', 41.8858, -87.6181, []),
+        ('65806', 'MO', 'zip', 37.2034, -93.2986, []),
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.geocoder = OfflineGeocoder(build_index([
+            {'name': name, 'state': state, 'kind': kind, 'latitude': latitude, 'longitude': longitude,
+             'aliases': aliases}
+            for name, state, kind, latitude, longitude, aliases in cls.ROWS
+        ]))
+
+    def test_exact_match_on_trailing_parts(self):
+        match = self.geocoder.lookup('Navy Pier, Chicago, Illinois, USA')
+        self.assertEqual((match.name, match.score), ('Chicago, IL', 1.0))
+        self.assertEqual(self.geocoder.lookup('Saint Louis, Missouri').name, 'Saint Louis, MO')
+        self.assertEqual(self.geocoder.lookup('Chi-Town').name, 'Chicago, IL')
+
+    def test_whole_words_and_trigram_matches(self):
+        self.assertEqual(self.geocoder.lookup('Springfield').name, 'Springfield, IL')
+        self.assertEqual(self.geocoder.lookup('Kansas City').name, 'Kansas City, MO')
+        # A partial word or a shorter name is only a trigram match
+        partial = self.geocoder.lookup('Chicag')
+        self.assertEqual(partial.name, 'Chicago, IL')
+        self.assertLess(partial.score, 1.0)
+        self.assertIsNone(self.geocoder.geocode('Kansas'))
+        fuzzy = self.geocoder.lookup('Chicgo Illinois')
+        self.assertEqual(fuzzy.name, 'Chicago, IL')
+        self.assertLess(fuzzy.score, 1.0)
+        self.assertIsNone(self.geocoder.lookup('Qwzxv'))
+
+    def test_trailing_zip_code(self):
+        self.assertEqual(self.geocoder.lookup('Chicago, IL 60601').kind, 'zip')
+        self.assertEqual(self.geocoder.lookup('Chicago, IL 60601-1234').name, '60601')
+        self.assertEqual(self.geocoder.lookup('IL 60601').name, '60601')
+        # A ZIP far from the city given with it is a conflict, not a match
+        self.assertGreater(great_circle_miles((-93.2923, 37.2090), (-87.6181, 41.8858)), 60)
+        self.assertIsNone(self.geocoder.lookup('Springfield, MO 60601'))
+
+    def test_street_addresses_are_left_to_ors(self):
+        self.assertIsNone(self.geocoder.geocode('60601 Main St, Springfield, IL'))
+        self.assertEqual(self.geocoder.geocode('60601 Main St, Springfield, IL', street_addresses=True),
+                         (-89.6501, 39.7817))
+
+
+class OfflineDistanceTests(TestCase):
+    """Distance estimates when ORS can't route, and locations nobody can place"""
+
+    def setUp(self):
+        geocoder = OfflineGeocoder(build_index([
+            {'name': name, 'state': state, 'kind': kind, 'latitude': latitude, 'longitude': longitude,
+             'aliases': aliases}
+            for name, state, kind, latitude, longitude, aliases in OfflineGeocoderTests.ROWS
+        ]))
+        for patcher in (mock.patch.object(OfflineGeocoder, 'get_default', return_value=geocoder),
+                        mock.patch.object(DistanceService, 'geocode_location', side_effect=geocoder.geocode)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_estimate_uses_gazetteer_coordinates(self):
+        with self.settings(ROAD_CIRCUITY_FACTOR=1.25):
+            result = DistanceService._mock_calculation('Chicago, IL', 'Saint Louis, MO')
+        miles = great_circle_miles((-87.6298, 41.8781), (-90.1994, 38.6270)) * 1.25
+        self.assertAlmostEqual(result['distance_miles'], miles, places=1)
+        self.assertTrue(result['offline_estimate'])
+
+    def test_unresolved_location_is_an_error(self):
+        with self.assertRaises(LocationNotFound) as raised:
+            DistanceService.fetch_route('Chicago, IL', 'Qwzxv')
+        self.assertEqual(raised.exception.locations, ['Qwzxv'])
+        response = self.client.post('/api/calculate/', {
+            'current_location': 'Qwzxv', 'pickup_location': 'Chicago, IL',
+            'dropoff_location': 'Saint Louis, MO', 'current_cycle_used': 10,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("'Qwzxv'", response.json()['error'])
+
+
+class DistanceMatrixChunkTests(SimpleTestCase):
+    """ORS matrix requests stay within the element and location limits"""
+
+    def test_chunks_cover_every_cell_within_limits(self):
+        for max_elements, max_locations, rows, columns in [
+            (3500, 100, 10, 10), (3500, 100, 1, 250), (3500, 100, 250, 1), (3500, 100, 120, 90),
+            (50, 12, 17, 23), (4, 100, 5, 5), (3500, 2, 3, 4),
+        ]:
+            with self.settings(ORS_MATRIX_MAX_ELEMENTS=max_elements, ORS_MATRIX_MAX_LOCATIONS=max_locations):
+                chunks = DistanceMatrixService._chunks(list(range(rows)), list(range(columns)))
+            cells = [(row, column) for chunk_rows, chunk_columns in chunks
+                     for row in chunk_rows for column in chunk_columns]
+            self.assertEqual(sorted(cells), [(row, column) for row in range(rows) for column in range(columns)])
+            for chunk_rows, chunk_columns in chunks:
+                self.assertLessEqual(len(chunk_rows) * len(chunk_columns), max(max_elements, 1))
+                self.assertLessEqual(len(chunk_rows) + len(chunk_columns), max(max_locations, 2))
+        # A small matrix is one request
+        self.assertEqual(len(DistanceMatrixService._chunks(list(range(10)), list(range(10)))), 1)
+
+    @override_settings(ORS_MATRIX_MAX_ELEMENTS=3500, ORS_MATRIX_MAX_LOCATIONS=100)
+    def test_pair_chunks(self):
+        lanes = [(index, 200 + index) for index in range(120)]
+        chunks = DistanceMatrixService._pair_chunks(lanes)
+        self.assertEqual([len(sources) for sources, _ in chunks], [50, 50, 20])
+        self.assertEqual([lane for sources, destinations in chunks for lane in zip(sources, destinations)], lanes)
+
+
+class DistanceMatrixServiceTests(SimpleTestCase):
+    """Matrix fill order: cache, chunked ORS requests, offline estimates"""
+
+    COORDS = {'A': (-96.8, 32.8), 'B': (-97.3, 32.8), 'C': (-112.1, 33.4), 'D': (-106.4, 31.8)}
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.requests = []
+
+        def fetch_chunk(locations, sources, destinations):
+            self.requests.append((len(sources), len(destinations)))
+            return ([[100 * source + destination for destination in destinations] for source in sources],
+                    [[3600.0] * len(destinations) for _ in sources])
+
+        for patcher in (mock.patch.object(DistanceService, 'geocode_location', side_effect=self.COORDS.get),
+                        mock.patch.object(DistanceMatrixService, '_fetch_chunk', side_effect=fetch_chunk)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @override_settings(ORS_MATRIX_MAX_ELEMENTS=4, ORS_MATRIX_MAX_LOCATIONS=100)
+    def test_compute_chunks_and_caches(self):
+        origins, destinations = ['A', 'B', 'A', 'Nowhere'], ['C', 'D', 'B']
+        result = DistanceMatrixService.compute(origins, destinations)
+        stats = result['stats']
+        self.assertEqual(stats['unique_locations'], 5)
+        self.assertEqual((stats['cells'], stats['ors_cells'], stats['unresolved_cells']), (12, 9, 3))
+        self.assertTrue(all(rows * columns <= 4 for rows, columns in self.requests))
+        self.assertEqual(result['distance_miles'][0], result['distance_miles'][2])
+        self.assertEqual(result['distance_miles'][3], [None, None, None])
+        self.assertEqual(result['duration_hours'][1], [1.0, 1.0, 1.0])
+
+        # The same lanes come from the cache, in either spelling
+        self.requests.clear()
+        again = DistanceMatrixService.compute(['A', 'B'], ['C', 'D', 'B'])
+        self.assertEqual(self.requests, [])
+        self.assertEqual(again['stats']['cache_hits'], 6)
+        self.assertEqual(again['distance_miles'], result['distance_miles'][:2])
+
+    def test_failed_chunks_fall_back_to_estimates(self):
+        DistanceMatrixService._fetch_chunk.side_effect = lambda *args: None
+        result = DistanceMatrixService.compute_pairs([('A', 'C'), ('B', 'D')])
+        self.assertEqual(result['stats']['estimated_cells'], 2)
+        self.assertGreater(result['distance_miles'][0], 900)
+
+
+class SolveAssignmentTests(SimpleTestCase):
+    """Hungarian assignment against brute force"""
+
+    @staticmethod
+    def brute_force(cost):
+        rows, columns = len(cost), len(cost[0])
+        if rows <= columns:
+            return min(sum(cost[row][column] for row, column in enumerate(chosen))
+                       for chosen in permutations(range(columns), rows))
+        return min(sum(cost[row][column] for column, row in enumerate(chosen))
+                   for chosen in permutations(range(rows), columns))
+
+    def test_matches_brute_force(self):
+        generator = random.Random(30)
+        for rows, columns in [(1, 1), (3, 3), (4, 6), (6, 4), (5, 5), (2, 7), (7, 3)]:
+            for _ in range(20):
+                cost = [[generator.choice([generator.randint(0, 50), round(generator.uniform(0, 500), 2)])
+                         for _ in range(columns)] for _ in range(rows)]
+                assignment = solve_assignment(cost)
+                chosen = [column for column in assignment if column >= 0]
+                self.assertEqual(len(chosen), min(rows, columns))
+                self.assertEqual(len(set(chosen)), len(chosen))
+                total = sum(cost[row][column] for row, column in enumerate(assignment) if column >= 0)
+                self.assertAlmostEqual(total, self.brute_force(cost), places=6, msg=cost)
+
+    def test_empty_and_infeasible_cells(self):
+        self.assertEqual(solve_assignment([]), [])
+        self.assertEqual(solve_assignment([[], []]), [-1, -1])
+        # The only feasible plan keeps both drivers off the infeasible cells
+        self.assertEqual(solve_assignment([[1, INFEASIBLE_COST], [2, 100]]), [0, 1])
+
+    def test_build_costs_masks_deadhead_cap(self):
+        costs = LoadAssignmentOptimizer.build_costs([[10, 400], [None, 50]], [500, 600], [0, 0],
+                                                    max_deadhead_miles=300)
+        self.assertEqual(costs['cost'], [[10, INFEASIBLE_COST], [INFEASIBLE_COST, 50]])
+
+
+class SleeperBerthPlannerTests(SimpleTestCase):
+    """Label search over rest options, including the 70-hour cycle"""
+
+    START = datetime(2025, 1, 6, 6, tzinfo=dt_timezone.utc)
+
+    def _on_duty_minutes(self, events):
+        return sum((event['end'] - event['start']).total_seconds() / 60 for event in events
+                   if event['status'] in ('driving', 'on_duty'))
+
+    def test_splits_never_arrive_later(self):
+        split = SleeperBerthPlanner.plan(1400, 0, self.START)
+        flat = SleeperBerthPlanner.plan(1400, 0, self.START, use_splits=False)
+        self.assertLessEqual(split['total_hours'], flat['total_hours'])
+        # Driving is planned in whole minutes
+        self.assertAlmostEqual(sum(event['miles'] for event in split['events']), 1400, delta=1)
+
+    def test_no_restart_with_cycle_hours_left(self):
+        plan = SleeperBerthPlanner.plan(1000, 0, self.START)
+        self.assertNotIn('34-hour restart', [event['location'] for event in plan['events']])
+
+    def test_cycle_limit_forces_a_restart(self):
+        plan = SleeperBerthPlanner.plan(1000, 68, self.START)
+        locations = [event['location'] for event in plan['events']]
+        self.assertIn('34-hour restart', locations)
+        restart = locations.index('34-hour restart')
+        # Only the 2 hours left in the cycle are worked before the restart
+        self.assertLessEqual(self._on_duty_minutes(plan['events'][:restart]), 120)
+        self.assertLessEqual(self._on_duty_minutes(plan['events'][restart + 1:]), 70 * 60)
+        self.assertAlmostEqual(sum(event['miles'] for event in plan['events']), 1000, delta=1)
+
+
+class AppointmentSchedulerTests(SimpleTestCase):
+    """Departure planning against pickup and dropoff windows"""
+
+    EARLIEST = datetime(2025, 1, 6, 6, tzinfo=dt_timezone.utc)
+
+    def _scheduler(self, pickup_window=(None, None), dropoff_window=(None, None)):
+        return AppointmentScheduler(110, 550, 0, self.EARLIEST, pickup_window, dropoff_window)
+
+    def test_waits_for_a_late_pickup_window(self):
+        opens = self.EARLIEST + timedelta(hours=6)
+        result = self._scheduler(pickup_window=(opens, opens + timedelta(hours=2))).solve()
+        self.assertTrue(result['feasible'])
+        locations = [event['location'] for event in result['events']]
+        pickup = locations.index('Pickup')
+        # Loading starts when the window opens, not before
+        self.assertGreaterEqual(result['events'][pickup]['start'], opens)
+        self.assertLessEqual(result['latest_departure'], opens + timedelta(hours=2))
+
+    def test_missed_pickup_window_is_infeasible(self):
+        closes = self.EARLIEST + timedelta(hours=1)
+        result = self._scheduler(pickup_window=(None, closes)).solve()
+        self.assertFalse(result['feasible'])
+        self.assertEqual(result['reason'], 'pickup window missed')
+
+    def test_latest_departure_is_exact(self):
+        closes = self.EARLIEST + timedelta(hours=30)
+        scheduler = self._scheduler(dropoff_window=(None, closes))
+        result = scheduler.solve()
+        self.assertTrue(result['feasible'])
+        latest = int((result['latest_departure'] - self.EARLIEST).total_seconds() // 60)
+        self.assertTrue(scheduler.evaluate(latest)['feasible'])
+        self.assertFalse(scheduler.evaluate(latest + 1)['feasible'])
+        self.assertLessEqual(result['earliest_arrival'], closes)
+
+
+class TripReplannerTests(TestCase):
+    """Re-planning a stored trip rewrites only what changed"""
+
+    GEOMETRY = [[-100 + step * 0.5, 40.0] for step in range(21)]
+
+    def setUp(self):
+        total = sum(great_circle_miles(a, b) for a, b in zip(self.GEOMETRY, self.GEOMETRY[1:]))
+        self.trip = Trip.objects.create(current_location='Start, KS', pickup_location='Start, KS',
+                                        dropoff_location='Finish, IL', current_cycle_used=Decimal('0'),
+                                        total_distance=Decimal(str(round(total, 2))), route_geometry=self.GEOMETRY)
+        RoutePoint.objects.create(trip=self.trip, point_type='start', address='Start, KS', sequence=0,
+                                  latitude=Decimal('40'), longitude=Decimal('-100'))
+        # Initial plan: the driver is at the start with the load still to pick up
+        self.replan(6, -100, 0, 0, 0, pickup_completed=False)
+
+    def replan(self, hour, longitude, driving, on_duty, since_break, minute=0, pickup_completed=True):
+        self.trip.refresh_from_db()
+        as_of = datetime(2025, 1, 6, hour, minute, tzinfo=dt_timezone.utc)
+        return TripReplanner.replan(self.trip, (longitude, 40.0), as_of, driving, on_duty, since_break, on_duty,
+                                    pickup_completed)
+
+    def statuses(self, day):
+        log = self.trip.eld_logs.get(date=datetime(2025, 1, day).date())
+        return [(status.status, status.start_time, status.end_time, status.location)
+                for status in DutyTimeline.statuses(log)]
+
+    def assert_diff_applied(self, model, before, diff):
+        after = set(model.objects.filter(trip=self.trip).values_list('id', flat=True))
+        self.assertEqual(after, (before - set(diff['deleted'])) | set(diff['created']))
+        self.assertTrue(set(diff['updated']) <= before)
+        self.assertEqual(diff['unchanged'], len(before) - len(diff['updated']) - len(diff['deleted']))
+
+    def test_mid_route_replan(self):
+        points_before = set(self.trip.route_points.values_list('id', flat=True))
+        logs_before = set(self.trip.eld_logs.values_list('id', flat=True))
+        morning = [status for status in self.statuses(6) if status[1].hour < 12]
+
+        result = self.replan(12, -95, 5, 6, 5)
+        changes = result['changes']
+        self.trip.refresh_from_db()
+        self.assert_diff_applied(RoutePoint, points_before, changes['route_points'])
+        self.assert_diff_applied(ELDLog, logs_before, changes['eld_logs'])
+        self.assertGreaterEqual(changes['route_points']['unchanged'], 2)  # Start and pickup
+
+        halfway = float(self.trip.total_distance) * project_onto_route(self.GEOMETRY, (-95, 40.0))
+        self.assertAlmostEqual(result['miles_completed'], halfway, delta=0.01)
+        self.assertEqual(self.trip.status, 'in_progress')
+        self.assertEqual(self.trip.miles_completed, Decimal(str(result['miles_completed'])))
+        self.assertEqual(self.trip.replanned_at, datetime(2025, 1, 6, 12, tzinfo=dt_timezone.utc))
+        points = list(self.trip.route_points.values_list('point_type', flat=True))
+        self.assertEqual((self.trip.rest_stops, self.trip.fuel_stops), (points.count('rest'), points.count('fuel')))
+        self.assertEqual([point for point in points if point in ('start', 'pickup', 'dropoff', 'end')],
+                         ['start', 'pickup', 'dropoff', 'end'])
+
+        # The morning before the checkpoint is history
+        self.assertEqual(self.statuses(6)[:len(morning) - 1], morning[:-1])
+        self.assertEqual(self.statuses(6)[len(morning) - 1][:2], morning[-1][:2])
+
+        # Logged miles: the reported progress, then the plan for the rest
+        logged = sum(self.trip.eld_logs.values_list('total_miles', flat=True))
+        self.assertAlmostEqual(float(logged), float(self.trip.total_distance), delta=0.05)
+
+        self.assertEqual(TripCheckpoint.objects.filter(trip=self.trip).count(), 2)
+        checkpoint = TripCheckpoint.objects.filter(trip=self.trip).last()
+        self.assertEqual((checkpoint.miles_completed, checkpoint.driving_hours), (self.trip.miles_completed, 5))
+
+        year = FleetRollup.objects.get(dimension='lane', grain='year')
+        self.assertEqual((year.miles, year.trips), (logged, 1))
+        self.assertEqual(sum(day[0] for day in self.trip.rollup.days.values()), float(logged))
+
+    def test_second_replan(self):
+        self.replan(12, -95, 5, 6, 5)
+        first = self.statuses(6)
+        result = self.replan(15, -93, 8, 9, 0, minute=30)
+        self.trip.refresh_from_db()
+
+        self.assertEqual(TripCheckpoint.objects.filter(trip=self.trip).count(), 3)
+        self.assertGreater(self.trip.miles_completed, Decimal('300'))
+        kept = [status for status in first if status[1].hour * 60 + status[1].minute < 15 * 60 + 30]
+        self.assertEqual(self.statuses(6)[:len(kept) - 1], kept[:-1])
+        logged = sum(self.trip.eld_logs.values_list('total_miles', flat=True))
+        self.assertAlmostEqual(float(logged), float(self.trip.total_distance), delta=0.05)
+        self.assertEqual(FleetRollup.objects.get(dimension='lane', grain='year').miles, logged)
+
+        # The same checkpoint again changes nothing
+        repeat = self.replan(15, -93, 8, 9, 0, minute=30)
+        for table in ('route_points', 'eld_logs', 'duty_statuses'):
+            self.assertEqual((repeat['changes'][table]['created'], repeat['changes'][table]['updated'],
+                              repeat['changes'][table]['deleted']), ([], [], []), table)
+        self.assertEqual(repeat['estimated_arrival'], result['estimated_arrival'])
+
+
+class TripEventBrokerTests(SimpleTestCase):
+    """Replay, live delivery and resync of server-sent events"""
+
+    def setUp(self):
+        self.broker = TripEventBroker(history=10, queue_size=2)
+
+    @staticmethod
+    def event_id(wire):
+        return int(wire.split('\n')[0][len('id: '):])
+
+    async def test_replay_from_last_event_id(self):
+        first = self.broker.publish(['trips', 'trip:1'], 'trip.created', {'trip_id': 1})
+        second = self.broker.publish(['trips', 'trip:2'], 'trip.created', {'trip_id': 2})
+        third = self.broker.publish(['trips', 'trip:1'], 'trip.updated', {'trip_id': 1, 'status': 'in_progress'})
+
+        stream = self.broker.stream('trip:1', last_event_id=first)
+        self.assertEqual(await stream.__anext__(), 'retry: 5000\n\n')
+        replayed = await stream.__anext__()
+        self.assertEqual(self.event_id(replayed), third)
+        self.assertEqual(replayed.split('\n')[1:3],
+                         ['event: trip.updated', 'data: {"trip_id":1,"status":"in_progress"}'])
+        self.assertGreater(third, second)
+
+        # Live events are published from sync views in other threads
+        live = await asyncio.to_thread(self.broker.publish, ['trip:1'], 'trip.updated', {'trip_id': 1})
+        self.assertEqual(self.event_id(await stream.__anext__()), live)
+        self.assertEqual(self.broker.subscriber_count(), 1)
+        await stream.aclose()
+        self.assertEqual(self.broker.subscriber_count(), 0)
+
+    async def test_slow_client_gets_a_resync(self):
+        stream = self.broker.stream('trips')
+        await stream.__anext__()
+        ids = [self.broker.publish(['trips'], 'trip.updated', {'trip_id': number}) for number in range(4)]
+        self.assertEqual([self.event_id(await stream.__anext__()) for _ in range(2)], ids[:2])
+        resync = await stream.__anext__()
+        self.assertEqual(resync, f'id: {ids[1]}\nevent: resync\ndata: {{"topic":"trips"}}\n\n')
+        with self.assertRaises(StopAsyncIteration):
+            await stream.__anext__()
+        self.assertEqual(self.broker.subscriber_count(), 0)
+
+    @override_settings(SSE_HEARTBEAT_SECONDS=0.01)
+    async def test_idle_streams_get_keep_alives(self):
+        stream = self.broker.stream('trips')
+        await stream.__anext__()
+        self.assertEqual(await stream.__anext__(), ': keep-alive\n\n')
+        await stream.aclose()
+
+
+class TripDeltaTests(TestCase):
+    """publish_trip sends only what changed"""
+
+    def test_snapshot_then_deltas(self):
+        broker = TripEventBroker()
+        trip = Trip.objects.create(current_location='A', pickup_location='B', dropoff_location='C',
+                                   current_cycle_used=Decimal('0'), total_distance=Decimal('120.50'))
+        broker.publish_trip(trip, 'trip.created')
+        created = broker._history[-1]
+        self.assertEqual(created['topics'], ['trips', f'trip:{trip.id}'])
+        self.assertEqual(created['data'], {
+            'status': 'planned', 'estimated_arrival': None, 'total_trip_time': None, 'total_distance': '120.50',
+            'miles_completed': 0, 'fuel_stops': 0, 'rest_stops': 0, 'trip_id': trip.id,
+        })
+        self.assertIsNone(broker.publish_trip(trip))
+
+        trip.status = 'in_progress'
+        trip.miles_completed = Decimal('40')
+        changes = {
+            'route_points': {'created': [7], 'updated': [3, 4], 'deleted': [], 'unchanged': 2},
+            'eld_logs': {'created': [], 'updated': [], 'deleted': [], 'unchanged': 1},
+        }
+        event_id = broker.publish_trip(trip, changes=changes)
+        updated = broker._history[-1]
+        self.assertEqual(updated['id'], event_id)
+        self.assertEqual(updated['data'], {
+            'status': 'in_progress', 'miles_completed': '40', 'trip_id': trip.id,
+            'changes': {'route_points': {'created': [7], 'updated': [3, 4]}},
+        })
+        self.assertEqual(json.loads(updated['wire'].split('data: ', 1)[1]), updated['data'])
+
+
+def _statuses(*runs):
+    """Duty status dictionaries from (status, 'HH:MM', 'HH:MM') runs"""
+    return [
+        {'status': status, 'start_time': time.fromisoformat(start), 'end_time': time.fromisoformat(end),
+         'location': status.replace('_', ' ').title(), 'sequence': sequence}
+        for sequence, (status, start, end) in enumerate(runs)
+    ]
+
+
+class HOSViolationScannerTests(TestCase):
+    """Each HOS rule is reported once, where its limit was passed"""
+
+    def _trip(self, days):
+        trip = Trip.objects.create(current_location='Chicago, IL', pickup_location='Denver, CO',
+                                   dropoff_location='Boise, ID', current_cycle_used=Decimal('0'))
+        first = date(2025, 1, 6)
+        DutyTimeline.create_logs(
+            [ELDLog(trip=trip, date=first + timedelta(days=index)) for index in range(len(days))], days
+        )
+        return trip
+
+    def _scan(self):
+        HOSViolationScanner().scan(full=True)
+        return list(HOSViolation.objects.order_by('occurred_at').values_list('rule', 'occurred_at'))
+
+    def _at(self, day, hour):
+        return datetime(2025, 1, day, hour, tzinfo=dt_timezone.utc)
+
+    def test_compliant_day_has_no_violations(self):
+        self._trip([_statuses(('on_duty', '06:00', '06:30'), ('driving', '06:30', '10:30'),
+                              ('off_duty', '10:30', '11:00'), ('driving', '11:00', '15:00'))])
+        self.assertEqual(self._scan(), [])
+
+    def test_eleven_hour_driving_limit(self):
+        self._trip([_statuses(('driving', '06:00', '10:00'), ('off_duty', '10:00', '10:30'),
+                              ('driving', '10:30', '14:30'), ('off_duty', '14:30', '15:00'),
+                              ('driving', '15:00', '19:00'))])
+        self.assertEqual(self._scan(), [('driving_11', self._at(6, 18))])
+
+    def test_fourteen_hour_window(self):
+        self._trip([_statuses(('on_duty', '06:00', '12:00'), ('driving', '12:00', '16:00'),
+                              ('off_duty', '16:00', '16:30'), ('driving', '16:30', '21:00'))])
+        self.assertEqual(self._scan(), [('window_14', self._at(6, 20))])
+
+    def test_thirty_minute_break(self):
+        self._trip([_statuses(('driving', '06:00', '15:00'))])
+        self.assertEqual(self._scan(), [('break_30', self._at(6, 14))])
+
+    def test_seventy_hour_cycle(self):
+        # 9.5 on-duty hours a day, each day compliant on its own
+        day = _statuses(('driving', '06:00', '10:00'), ('off_duty', '10:00', '10:30'),
+                        ('driving', '10:30', '14:30'), ('on_duty', '14:30', '16:00'))
+        self._trip([day] * 8)
+        # 7 days give 66.5 hours; the eighth passes 70 after 3.5 hours
+        self.assertEqual(self._scan(), [('cycle_70', datetime(2025, 1, 13, 9, 30, tzinfo=dt_timezone.utc))])
+
+
+class RouteCacheTests(SimpleTestCase):
+    """Stale-while-revalidate route cache"""
+
+    START, END = 'Dallas, TX', 'Phoenix, AZ'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.refreshed = threading.Event()
+        self.release = threading.Event()
+        self.priorities = []
+
+        def fetch_route(start_location, end_location):
+            self.priorities.append(OrsRateLimiter.current_priority())
+            self.release.wait(5)
+            self.refreshed.set()
+            return {'distance_miles': 1065.0, 'duration_hours': 15.5, 'success': True}
+
+        patcher = mock.patch.object(DistanceService, 'fetch_route', side_effect=fetch_route)
+        self.fetch_route = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cache_route(self, refresh_in):
+        route = {'distance_miles': 1000.0, 'duration_hours': 15.0, 'success': True,
+                 'refresh_after': timezone.now().timestamp() + refresh_in}
+        cache.set(DistanceService.route_cache_key(self.START, self.END), route)
+        return route
+
+    def test_fresh_route_is_served_from_cache(self):
+        route = self.cache_route(3600)
+        # Keys are normalized, so spelling variants share the entry
+        self.assertEqual(DistanceService.calculate_distance_and_duration(' dallas,  tx', 'PHOENIX, AZ'), route)
+        self.fetch_route.assert_not_called()
+
+    def test_stale_route_is_served_while_one_refresh_runs(self):
+        route = self.cache_route(-1)
+        self.assertEqual(DistanceService.calculate_distance_and_duration(self.START, self.END), route)
+        self.assertEqual(DistanceService.calculate_distance_and_duration(self.START, self.END), route)
+        self.release.set()
+        self.assertTrue(self.refreshed.wait(5))
+        self.assertEqual(self.fetch_route.call_count, 1)
+        self.assertEqual(self.priorities, [BATCH])
+        # The refresh lock is released once the refresh is done
+        lock_key = DistanceService.route_cache_key(self.START, self.END) + ':refreshing'
+        for _ in range(50):
+            if cache.get(lock_key) is None:
+                break
+            sleep(0.02)
+        else:
+            self.fail('refresh lock was not released')
+
+    def test_missing_route_is_fetched_inline(self):
+        self.release.set()
+        result = DistanceService.calculate_distance_and_duration(self.START, self.END)
+        self.assertEqual(result['distance_miles'], 1065.0)
+        self.assertEqual(self.priorities, ['interactive'])
+
+
+calls = []
+
+
+@api_view(['POST'])
+@idempotent
+def _counting_view(request):
+    calls.append(request.data)
+    if request.data.get('fail'):
+        return Response({'error': 'boom'}, status=500)
+    return Response({'calls': len(calls)}, status=201)
+
+
+class IdempotencyTests(TestCase):
+    """Idempotency-Key replay, key reuse and in-flight coalescing"""
+
+    def setUp(self):
+        calls.clear()
+        self.factory = APIRequestFactory()
+        IdempotencyStore._purged_at = None
+
+    def _post(self, data, key=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return _counting_view(self.factory.post('/api/calculate/', data, format='json', **headers))
+
+    def test_retry_replays_the_stored_response(self):
+        first = self._post({'trip': 1}, 'key-1')
+        second = self._post({'trip': 1}, 'key-1')
+        self.assertEqual((first.status_code, first.data), (201, {'calls': 1}))
+        self.assertEqual((second.status_code, second.data), (201, {'calls': 1}))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(calls), 1)
+
+    def test_key_reused_with_another_body_is_rejected(self):
+        self._post({'trip': 1}, 'key-1')
+        response = self._post({'trip': 2}, 'key-1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(len(calls), 1)
+
+    def test_server_errors_release_the_key(self):
+        self.assertEqual(self._post({'fail': True}, 'key-1').status_code, 500)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+        self.assertEqual(self._post({'fail': True}, 'key-1').status_code, 500)
+        self.assertEqual(len(calls), 2)
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+        entered, release = threading.Event(), threading.Event()
+        runs, results = [], []
+
+        def work():
+            runs.append(1)
+            entered.set()
+            release.wait(5)
+            return 'planned'
+
+        leader = threading.Thread(target=lambda: results.append(flight.do('trip', work, 5)))
+        leader.start()
+        entered.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do('trip', work, 5)))
+                     for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(sorted(results), [('planned', False)] + [('planned', True)] * 3)
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.2)
+    def test_key_held_elsewhere_times_out_with_409(self):
+        self._post({'trip': 1}, 'key-1')
+        # Another process claimed the key and is still running
+        IdempotencyRecord.objects.update(state='pending', response_status=None, response_body=None)
+        response = self._post({'trip': 1}, 'key-1')
+        self.assertEqual((response.status_code, response['Retry-After']), (409, '5'))
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_pending_key_is_taken_over(self):
+        self._post({'trip': 1}, 'key-1')
+        # The process holding the key died mid-request
+        IdempotencyRecord.objects.update(state='pending', response_status=None, response_body=None,
+                                         updated_at=timezone.now() - timedelta(minutes=5))
+        response = self._post({'trip': 1}, 'key-1')
+        self.assertEqual((response.status_code, response.data), (201, {'calls': 2}))
+        self.assertEqual(IdempotencyRecord.objects.get().state, 'completed')
+
+    def test_expired_keys_are_purged_on_an_interval(self):
+        self._post({'trip': 1}, 'key-1')
+        IdempotencyRecord.objects.update(created_at=timezone.now() - timedelta(days=2))
+        # Purged moments ago: the expired record stays, but isn't replayed
+        IdempotencyStore._purged_at = monotonic()
+        self._post({'trip': 2}, 'key-2')
+        self.assertEqual(IdempotencyRecord.objects.count(), 2)
+        response = self._post({'trip': 1}, 'key-1')
+        self.assertEqual((response.status_code, response.data), (201, {'calls': 3}))
+
+        IdempotencyRecord.objects.update(created_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(IdempotencyStore.purge_expired(), 0)
+        self.assertEqual(IdempotencyStore.purge_expired(force=True), 2)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+
+def _take_tokens(count):
+    return sum(OrsRateLimiter.acquire('directions', deadline=0) for _ in range(count))
+
+
+class OrsRateLimiterTests(SimpleTestCase):
+    """Token buckets shared through the SQLite store"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        # Four tokens and almost no refill for the length of a test
+        settings_override = override_settings(
+            ORS_RATE_LIMIT_PATH=Path(directory) / 'ors_ratelimit.sqlite3',
+            ORS_RATE_LIMITS={'directions': {'per_minute': 0.6, 'burst': 4}},
+            ORS_RATE_LIMIT_BATCH_RESERVE=0.25,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_processes_share_one_bucket(self):
+        with multiprocessing.get_context('fork').Pool(3) as pool:
+            taken = pool.map(_take_tokens, [3, 3, 3])
+        self.assertEqual(sum(taken), 4)
+        self.assertFalse(OrsRateLimiter.acquire('directions', deadline=0))
+
+    def test_batch_leaves_reserve_for_interactive(self):
+        self.assertEqual(_take_tokens(2), 2)
+        # Batch work needs a token plus a quarter of the burst
+        with OrsRateLimiter.priority(BATCH):
+            self.assertEqual(OrsRateLimiter.current_priority(), BATCH)
+            self.assertTrue(OrsRateLimiter.acquire('directions', deadline=0))
+            self.assertFalse(OrsRateLimiter.acquire('directions', deadline=0))
+        self.assertTrue(OrsRateLimiter.acquire('directions', deadline=0))
+
+    def test_penalize_and_unlimited_buckets(self):
+        OrsRateLimiter.penalize('directions', retry_after=60)
+        self.assertFalse(OrsRateLimiter.acquire('directions', deadline=0))
+        self.assertTrue(all(OrsRateLimiter.acquire('geocode', deadline=0) for _ in range(10)))
+
+
+class DutyTimelineTests(TestCase):
+    """Packed timelines decode to the statuses they were built from"""
+
+    def test_encode_decode_round_trip(self):
+        statuses = _statuses(('off_duty', '00:00', '06:00'), ('on_duty', '06:00', '06:30'),
+                             ('driving', '06:30', '11:00'), ('sleeper', '11:00', '18:00'),
+                             ('off_duty', '18:00', '23:59'))
+        statuses[-1]['end_time'] = time(23, 59, 59)
+        statuses[3]['location'] = statuses[0]['location']
+        timeline, remarks = DutyTimeline.encode(statuses)
+        self.assertEqual(len(remarks), 3)
+        decoded = DutyTimeline.decode(timeline, remarks)
+        self.assertEqual(
+            [(entry.status, entry.start_time, entry.end_time, entry.location, entry.sequence) for entry in decoded],
+            [(status['status'], status['start_time'], status['end_time'], status['location'], status['sequence'])
+             for status in statuses]
+        )
+        self.assertEqual(DutyTimeline.decode(b'', []), [])
+        with self.assertRaises(ValueError):
+            DutyTimeline.decode(b'\x09' + timeline[1:], remarks)
+
+    def test_packed_and_row_storage_read_the_same(self):
+        statuses = _statuses(('on_duty', '06:00', '06:30'), ('driving', '06:30', '10:00'))
+        trip = Trip.objects.create(current_location='A', pickup_location='B', dropoff_location='C',
+                                   current_cycle_used=Decimal('0'))
+        rows = DutyTimeline.create_logs([ELDLog(trip=trip, date=date(2025, 1, 6))], [statuses])[0]
+        with override_settings(ELD_TIMELINE_STORAGE='packed'):
+            packed = DutyTimeline.create_logs([ELDLog(trip=trip, date=date(2025, 1, 7))], [statuses])[0]
+
+        def read(log):
+            log = ELDLog.objects.get(pk=log.pk)
+            return [(entry.status, entry.start_time, entry.end_time, entry.location, entry.sequence)
+                    for entry in DutyTimeline.statuses(log)]
+
+        self.assertIsNone(ELDLog.objects.get(pk=rows.pk).timeline)
+        self.assertEqual(read(rows), read(packed))
+
+    def test_scanner_reads_packed_logs(self):
+        trip = Trip.objects.create(current_location='A', pickup_location='B', dropoff_location='C',
+                                   current_cycle_used=Decimal('0'))
+        with override_settings(ELD_TIMELINE_STORAGE='packed'):
+            DutyTimeline.create_logs([ELDLog(trip=trip, date=date(2025, 1, 6))],
+                                     [_statuses(('driving', '06:00', '15:00'))])
+        HOSViolationScanner().scan(full=True)
+        violation = HOSViolation.objects.get()
+        self.assertEqual((violation.rule, violation.sequence, violation.duty_status), ('break_30', 0, None))
+        self.assertIsNotNone(violation.log.timeline)
+
+    def test_packing_keeps_violations(self):
+        trip = Trip.objects.create(current_location='A', pickup_location='B', dropoff_location='C',
+                                   current_cycle_used=Decimal('0'))
+        DutyTimeline.create_logs([ELDLog(trip=trip, date=date(2025, 1, 6))], [
+            _statuses(('off_duty', '00:00', '06:00'), ('driving', '06:00', '15:00'))
+        ])
+        HOSViolationScanner().scan(full=True)
+        before = list(HOSViolation.objects.values_list('rule', 'log_id', 'sequence', 'occurred_at'))
+        self.assertEqual({row[2] for row in before}, {1})
+
+        DutyTimeline.pack_existing()
+        self.assertFalse(DutyStatus.objects.exists())
+        self.assertEqual(list(HOSViolation.objects.values_list('rule', 'log_id', 'sequence', 'occurred_at')), before)
+        self.assertFalse(HOSViolation.objects.filter(duty_status__isnull=False).exists())
+
+        DutyTimeline.unpack_existing()
+        self.assertEqual({(violation.duty_status.sequence, violation.duty_status.status)
+                          for violation in HOSViolation.objects.select_related('duty_status')}, {(1, 'driving')})
+
+
+class TripArchiveTests(TestCase):
+    """Archived trips read back through the API in their live shape"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_override = override_settings(ARCHIVE_DIR=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_trip(self, number, status='completed'):
+        trip = Trip.objects.create(current_location=f'Start {number}, TX', pickup_location='Dallas, TX',
+                                   dropoff_location='Phoenix, AZ', current_cycle_used=Decimal('12.50'),
+                                   total_distance=Decimal('1065.40'), status=status)
+        for sequence, (point_type, address) in enumerate([('start', trip.current_location),
+                                                          ('pickup', 'Dallas, TX'), ('dropoff', 'Phoenix, AZ')]):
+            RoutePoint.objects.create(trip=trip, point_type=point_type, address=address, sequence=sequence,
+                                      latitude=Decimal('32.7767') + sequence, longitude=Decimal('-96.797') - sequence,
+                                      duration_minutes=60 if sequence else 0)
+        DutyTimeline.create_logs([ELDLog(trip=trip, date=date(2025, 1, 6), total_miles=Decimal('550.00'))], [[
+            {'status': 'on_duty', 'start_time': time(6), 'end_time': time(7), 'location': 'Dallas, TX',
+             'sequence': 0},
+            {'status': 'driving', 'start_time': time(7), 'end_time': time(17), 'location': 'En route',
+             'sequence': 1},
+            {'status': 'off_duty', 'start_time': time(17), 'end_time': time(23, 59, 59), 'location': 'Abilene, TX',
+             'sequence': 2},
+        ]])
+        return trip
+
+    def rendered(self, trip):
+        trip = Trip.objects.prefetch_related('route_points', 'eld_logs__duty_statuses').get(id=trip.id)
+        return json.loads(JSONRenderer().render(TripSerializer(trip).data))
+
+    def test_archive_and_read_back(self):
+        trips = [self.create_trip(number) for number in range(3)]
+        active = self.create_trip(3, status='in_progress')
+        Trip.objects.update(updated_at=timezone.now() - timedelta(days=120))
+        expected = {trip.id: self.rendered(trip) for trip in trips}
+
+        result = TripArchive.archive(older_than_days=90, group_size=2)
+        self.assertEqual((result['trips'], result['months'], result['files']), (3, 1, 1))
+        self.assertEqual(list(Trip.objects.values_list('id', flat=True)), [active.id])
+        for trip in trips:
+            self.assertEqual(TripArchive.load(trip.id), expected[trip.id])
+            response = self.client.get(f'/api/trips/{trip.id}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), expected[trip.id])
+        route = self.client.get(f'/api/trips/{trips[1].id}/route/').json()
+        self.assertEqual([point['address'] for point in route['route_points']],
+                         [trips[1].current_location, 'Dallas, TX', 'Phoenix, AZ'])
+        # Trips in neither the database nor the archive are still a 404
+        self.assertIsNone(TripArchive.load(active.id + 100))
+        self.assertEqual(self.client.get(f'/api/trips/{active.id + 100}/').status_code, 404)
+
+    def test_recent_trips_stay_and_index_rebuilds(self):
+        old, recent = self.create_trip(0), self.create_trip(1)
+        Trip.objects.filter(id=old.id).update(updated_at=timezone.now() - timedelta(days=120))
+        expected = self.rendered(old)
+        self.assertEqual(TripArchive.archive(older_than_days=90)['trips'], 1)
+        self.assertTrue(Trip.objects.filter(id=recent.id).exists())
+
+        TripArchive._index().execute('DELETE FROM trips')
+        self.assertIsNone(TripArchive.load(old.id))
+        self.assertEqual(TripArchive.rebuild_index(), 1)
+        self.assertEqual(TripArchive.load(old.id), expected)
+
+
+class FleetRollupPiecesTests(SimpleTestCase):
+    """_pieces covers a date range exactly once with the coarsest rows"""
+
+    def _days(self, pieces):
+        days = []
+        for grain, low, high in pieces:
+            period = low
+            while period <= high:
+                if grain == 'day':
+                    last, following = period, period + timedelta(days=1)
+                elif grain == 'month':
+                    last = _month_end(period)
+                    following = last + timedelta(days=1)
+                else:
+                    last, following = date(period.year, 12, 31), date(period.year + 1, 1, 1)
+                days += [period + timedelta(days=offset) for offset in range((last - period).days + 1)]
+                period = following
+        return days
+
+    def test_mixed_grains(self):
+        self.assertEqual(FleetRollups._pieces(date(2024, 1, 15), date(2026, 3, 10), 'year'), [
+            ('day', date(2024, 1, 15), date(2024, 1, 31)),
+            ('day', date(2026, 3, 1), date(2026, 3, 10)),
+            ('month', date(2024, 2, 1), date(2024, 12, 31)),
+            ('year', date(2025, 1, 1), date(2025, 1, 1)),
+            ('month', date(2026, 1, 1), date(2026, 2, 1)),
+        ])
+        self.assertEqual(FleetRollups._pieces(date(2024, 1, 15), date(2024, 3, 10), 'day'),
+                         [('day', date(2024, 1, 15), date(2024, 3, 10))])
+
+    def test_every_day_covered_once(self):
+        starts = [date(2023, 1, 1), date(2023, 2, 28), date(2023, 12, 31), date(2024, 2, 29), date(2024, 6, 15)]
+        lengths = [0, 1, 27, 30, 45, 365, 400, 800]
+        for coarsest in ('day', 'month', 'year'):
+            for start in starts:
+                for length in lengths:
+                    end = start + timedelta(days=length)
+                    with self.subTest(start=start, end=end, coarsest=coarsest):
+                        pieces = FleetRollups._pieces(start, end, coarsest)
+                        expected = [start + timedelta(days=offset) for offset in range(length + 1)]
+                        self.assertEqual(sorted(self._days(pieces)), expected)
+                        grains = {grain for grain, _, _ in pieces}
+                        if coarsest != 'year':
+                            self.assertNotIn('year', grains)
+                        if coarsest == 'day':
+                            self.assertEqual(grains, {'day'})
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class CachedModelBackendTests(TestCase):
+    """Email logins and the shared-cache user cache"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('driver', email='driver@example.com', password='s3cret-pass')
+        CachedModelBackend._users.clear()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, True)
+        self.addCleanup(CachedModelBackend._users.clear)
+
+    def shared_cache(self):
+        return override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': self.cache_dir,
+        }})
+
+    def test_login_by_email(self):
+        response = self.client.post('/api/auth/login/', {'email': 'driver@example.com', 'password': 's3cret-pass'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['username'], 'driver')
+        self.assertEqual(self.client.get('/api/auth/me/').json()['user']['email'], 'driver@example.com')
+
+        for email, password in (('driver@example.com', 'wrong'), ('nobody@example.com', 's3cret-pass')):
+            response = self.client.post('/api/auth/login/', {'email': email, 'password': password},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 401)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(CachedModelBackend().authenticate(None, email='driver@example.com',
+                                                            password='s3cret-pass'))
+
+    def test_local_cache_turns_user_cache_off(self):
+        self.assertFalse(user_cache_enabled())
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        with self.assertNumQueries(1):
+            backend.get_user(self.user.pk)
+
+    def test_cache_hits_skip_the_database(self):
+        backend = CachedModelBackend()
+        with self.shared_cache():
+            self.assertTrue(user_cache_enabled())
+            first = backend.get_user(self.user.pk)
+            with self.assertNumQueries(0):
+                second = backend.get_user(self.user.pk)
+            self.assertEqual(second.pk, self.user.pk)
+            # Each request gets its own copy
+            second.first_name = 'Changed'
+            self.assertEqual(backend.get_user(self.user.pk).first_name, first.first_name)
+
+    def test_save_and_delete_invalidate(self):
+        backend = CachedModelBackend()
+        with self.shared_cache():
+            backend.get_user(self.user.pk)
+            self.user.first_name = 'Renamed'
+            self.user.save()
+            with self.assertNumQueries(1):
+                self.assertEqual(backend.get_user(self.user.pk).first_name, 'Renamed')
+
+            # Another process only sees the bumped version in the shared cache
+            CachedModelBackend._users[str(self.user.pk)] = (User(pk=self.user.pk, username='stale'), 0,
+                                                            float('inf'))
+            self.assertEqual(backend.get_user(self.user.pk).username, 'driver')
+
+            self.user.delete()
+            self.assertIsNone(backend.get_user(self.user.pk))
+
+
+class BulkTripPlannerTests(TestCase):
+    """Bulk planning with the process pool, per-row errors and resuming"""
+
+    ROWS = [
+        {'ref': 'a', 'current_location': 'Dallas, TX', 'pickup_location': 'Dallas, TX',
+         'dropoff_location': 'Phoenix, AZ', 'current_cycle_used': 10},
+        {'ref': 'b', 'current_location': 'Dallas, TX', 'pickup_location': 'Dallas, TX',
+         'dropoff_location': 'Phoenix, AZ', 'current_cycle_used': 75},
+        {'ref': 'c', 'current_location': 'Dallas, TX', 'pickup_location': 'Dallas, TX',
+         'dropoff_location': 'Phoenix, AZ', 'current_cycle_used': 'lots'},
+        {'ref': 'd', 'current_location': 'Qwzxv', 'pickup_location': 'Dallas, TX',
+         'dropoff_location': 'Phoenix, AZ', 'current_cycle_used': 20},
+        {'ref': 'e', 'current_location': 'Phoenix, AZ', 'pickup_location': 'Phoenix, AZ',
+         'dropoff_location': 'Dallas, TX', 'use_sleeper_berth': True, 'current_cycle_used': 0},
+    ]
+
+    def setUp(self):
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.input_path, self.results_path = directory / 'trips.ndjson', directory / 'results.ndjson'
+        self.input_path.write_text(''.join(json.dumps(row) + '\n' for row in self.ROWS))
+        self.lanes = []
+
+        def route(start_location, end_location):
+            self.lanes.append((start_location, end_location))
+            if 'Qwzxv' in (start_location, end_location):
+                raise LocationNotFound(['Qwzxv'])
+            return {'distance_miles': 1065.0, 'duration_hours': 16.0, 'success': True,
+                    'route_info': {'coordinates': [[-96.797, 32.7767], [-112.074, 33.4484]]}}
+
+        patcher = mock.patch.object(DistanceService, 'calculate_distance_and_duration', side_effect=route)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def results(self):
+        return [json.loads(line) for line in self.results_path.read_text().splitlines()]
+
+    def plan(self, workers, run_name):
+        return BulkTripPlanner(self.input_path, self.results_path, run_name=run_name, workers=workers,
+                               chunk_size=2, route_workers=2).run()
+
+    def test_pool_plans_like_the_main_process(self):
+        totals = self.plan(2, 'pooled')
+        self.assertEqual((totals['rows'], totals['trips'], totals['errors']), (5, 3, 2))
+        pooled = self.results()
+        self.results_path.unlink()
+        self.assertEqual(self.plan(0, 'inline')['trips'], 3)
+        inline = self.results()
+
+        self.assertEqual([row['row'] for row in pooled], [1, 2, 3, 4, 5])
+        self.assertEqual([row['status'] for row in pooled], ['ok', 'ok', 'error', 'error', 'ok'])
+        self.assertIn('current_cycle_used', pooled[2]['errors'])
+        self.assertIn("'Qwzxv'", pooled[3]['error'])
+        self.assertIn('sleeper_plan', pooled[4])
+        ignored = {'trip_id'}
+        self.assertEqual([{key: value for key, value in row.items() if key not in ignored} for row in pooled],
+                         [{key: value for key, value in row.items() if key not in ignored} for row in inline])
+        # Rows 1 and 2 share a chunk and a lane, which is routed once per run
+        self.assertEqual(self.lanes.count(('Dallas, TX', 'Phoenix, AZ')), 2)
+
+        trip = Trip.objects.get(id=pooled[0]['trip_id'])
+        self.assertEqual(trip.total_distance, 1065)
+        self.assertTrue(RoutePoint.objects.filter(trip=trip).exists())
+        self.assertEqual(ELDLog.objects.filter(trip=trip).count(), pooled[0]['eld_logs'])
+
+    def test_resume_skips_committed_rows(self):
+        self.plan(0, 'resumable')
+        again = self.plan(0, 'resumable')
+        self.assertEqual((again['skipped'], again['rows'], again['trips']), (5, 0, 0))
+        self.assertEqual(len(self.results()), 5)
+        run = PlanningRun.objects.get(name='resumable')
+        self.assertEqual((run.rows_done, run.trips_created, run.errors), (5, 3, 2))
+
+
+class CompressionTests(TestCase):
+    """Accept-Encoding negotiation, the middleware and cached trip documents"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        settings_override = override_settings(COMPRESSION_MIN_SIZE=200)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.trip = Trip.objects.create(current_location='Dallas, TX', pickup_location='Dallas, TX',
+                                        dropoff_location='Phoenix, AZ', current_cycle_used=Decimal('10'),
+                                        total_distance=Decimal('1065.40'))
+        for sequence in range(10):
+            RoutePoint.objects.create(trip=self.trip, point_type='rest', address=f'Rest area {sequence}',
+                                      sequence=sequence, latitude=Decimal('32.5'), longitude=Decimal('-100.25'))
+
+    def test_negotiate_q_values(self):
+        with mock.patch('api.compression.brotli', None):
+            self.assertEqual(negotiate('gzip, deflate'), 'gzip')
+            self.assertEqual(negotiate('GZIP;q=0.4'), 'gzip')
+            self.assertIsNone(negotiate('gzip;q=0'))
+            self.assertIsNone(negotiate('gzip;q=zero'))
+            self.assertIsNone(negotiate('identity, deflate'))
+            self.assertIsNone(negotiate(''))
+            self.assertEqual(negotiate('*'), 'gzip')
+            self.assertIsNone(negotiate('*, gzip;q=0'))
+        with mock.patch('api.compression.brotli', object()):
+            self.assertEqual(negotiate('gzip, br'), 'br')
+            self.assertEqual(negotiate('br;q=0.5, gzip;q=0.8'), 'gzip')
+            self.assertEqual(negotiate('*;q=0.5, gzip;q=0'), 'br')
+            self.assertIsNone(negotiate('br;q=0, gzip;q=0'))
+
+    def test_middleware_compresses_large_json(self):
+        with mock.patch('api.compression.brotli', None):
+            plain = self.client.get('/api/trips/')
+            compressed = self.client.get('/api/trips/', HTTP_ACCEPT_ENCODING='gzip;q=1.0, br;q=0.5')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        # Small responses are left alone
+        health = self.client.get('/api/health/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(health.has_header('Content-Encoding'))
+
+    def test_trip_documents_are_cached_until_the_trip_changes(self):
+        url = f'/api/trips/{self.trip.id}/route/'
+        with mock.patch('api.compression.brotli', None):
+            plain = self.client.get(url)
+            compressed = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(compressed['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(compressed.content), plain.content)
+            # A cached document is served without querying the route points
+            with self.assertNumQueries(1):
+                self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+
+            RoutePoint.objects.filter(trip=self.trip, sequence=0).update(address='Fort Worth, TX')
+            self.assertEqual(self.client.get(url).content, plain.content)
+            self.trip.save()
+            changed = json.loads(gzip.decompress(self.client.get(url, HTTP_ACCEPT_ENCODING='gzip').content))
+        self.assertEqual(changed['route_points'][0]['address'], 'Fort Worth, TX')
+
+
+class DepartureSweepTests(SimpleTestCase):
+    """The sweep agrees with planning each departure on its own"""
+
+    START = datetime(2025, 1, 6, 0, tzinfo=dt_timezone.utc)
+    PICKUP = (START + timedelta(hours=8), START + timedelta(hours=12))
+    DROPOFF = (None, START + timedelta(hours=40))
+
+    def test_candidates_match_single_departures(self):
+        result = DepartureSweep(110, 900, 20, self.PICKUP, self.DROPOFF).run(
+            self.START, self.START + timedelta(hours=24), 30)
+        candidates = result['candidates']
+        self.assertEqual(len(candidates), 48)
+        # Waits leaving the same HOS state share a simulation
+        self.assertLess(result['simulations'], len(candidates) / 2)
+        for candidate in candidates:
+            alone = AppointmentScheduler(110, 900, 20, candidate['departure'], self.PICKUP, self.DROPOFF)
+            expected = alone.evaluate(0)
+            self.assertEqual(candidate['feasible'], expected['feasible'], candidate['departure'])
+            if 'dropoff_arrival' in expected:
+                self.assertEqual(candidate['dropoff_arrival'], alone._moment(expected['dropoff_arrival']))
+
+        feasible = [candidate for candidate in candidates if candidate['feasible']]
+        summary = result['summary']
+        self.assertEqual(summary['feasible_departures'], len(feasible))
+        self.assertEqual(summary['latest_feasible_departure'], feasible[-1]['departure'])
+        self.assertEqual(summary['earliest_arrival']['dropoff_arrival'],
+                         min(candidate['dropoff_arrival'] for candidate in feasible))
+        # Leaving after the pickup window closes misses it
+        self.assertFalse(candidates[-1]['feasible'])
+        self.assertEqual(candidates[-1]['reason'], 'pickup window missed')
+
+
+class DepartureSweepViewTests(TestCase):
+    """POST /api/what-if/departures/"""
+
+    def post(self, **fields):
+        return self.client.post('/api/what-if/departures/', {
+            'current_location': 'Dallas, TX', 'pickup_location': 'Fort Worth, TX',
+            'dropoff_location': 'Phoenix, AZ', 'current_cycle_used': 20,
+            'departure_start': '2025-01-06T00:00:00Z', **fields,
+        }, content_type='application/json')
+
+    def test_sweep_and_validation(self):
+        def route(start_location, end_location):
+            if 'Qwzxv' in (start_location, end_location):
+                raise LocationNotFound([start_location])
+            miles = 35.0 if end_location == 'Fort Worth, TX' else 1030.0
+            return {'distance_miles': miles, 'duration_hours': miles / 55, 'success': True,
+                    'route_info': {'coordinates': []}}
+
+        with mock.patch.object(DistanceService, 'calculate_distance_and_duration', side_effect=route):
+            response = self.post(step_minutes=60)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertEqual((data['pickup_miles'], data['delivery_miles']), (35.0, 1030.0))
+            self.assertFalse(data['route_estimated'])
+            self.assertEqual(len(data['candidates']), 24)
+            self.assertEqual(data['summary']['feasible_departures'], 24)
+
+            self.assertIn('step_minutes', self.post(step_minutes=1, departure_end='2025-01-08T00:00:00Z').json())
+            self.assertIn('departure_end', self.post(departure_end='2025-01-05T00:00:00Z').json())
+            unknown = self.post(current_location='Qwzxv')
+            self.assertEqual(unknown.status_code, 400)
+            self.assertIn("'Qwzxv'", unknown.json()['error'])
+
+
+@override_settings(SPEED_PROFILE_PRIOR_MINUTES=60, SPEED_PROFILE_MIN_HOURS=1)
+class SpeedProfileTests(TestCase):
+    """Profiles learn from checkpoints, once per trip"""
+
+    START = datetime(2025, 1, 6, 8, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        _cache.clear()
+        self.addCleanup(_cache.clear)
+
+    def trip(self, progress, pickup='Denver, CO', dropoff='Boise, ID', status='completed'):
+        trip = Trip.objects.create(current_location=pickup, pickup_location=pickup, dropoff_location=dropoff,
+                                   current_cycle_used=Decimal('0'), total_distance=Decimal('100'),
+                                   route_geometry=[[-105.0, 39.7], [-116.2, 43.6]], status=status)
+        for hours, miles in progress:
+            TripCheckpoint.objects.create(trip=trip, recorded_at=self.START + timedelta(hours=hours),
+                                          miles_completed=Decimal(miles), driving_hours=hours)
+        return trip
+
+    def profiles(self):
+        return {profile.key: (profile.trips, profile.driving_minutes) for profile in SpeedProfile.objects.all()}
+
+    def test_observe_spreads_driving_over_hours(self):
+        sums = SpeedProfiles.observe(self.trip([(0, 0), (1, 60), (2, 100)]).checkpoints.all())
+        self.assertEqual((sums[8], sums[9], sums[HOURS + 8], sums[HOURS + 9]), (60, 40, 60, 60))
+        self.assertEqual(sum(sums), 220)
+
+    def test_build_and_incremental_update(self):
+        trip = self.trip([(0, 0), (1, 60), (2, 100)])
+        self.trip([(0, 0)])  # One checkpoint: nothing observed
+        self.trip([(0, 0), (1, 50)], status='in_progress')
+        lane = SpeedProfiles.lane_key('Denver, CO', 'Boise, ID')
+        region = SpeedProfiles.region_key(trip.route_geometry)
+
+        self.assertEqual(SpeedProfiles.update(), 2)
+        self.assertEqual(self.profiles(), {lane: (1, 120), region: (1, 120), 'fleet': (1, 120)})
+        self.assertEqual(SpeedProfiles.update(), 0)
+
+        # Saving a counted trip again replaces its contribution
+        trip.save()
+        self.assertEqual(SpeedProfiles.update(), 1)
+        self.assertEqual(self.profiles(), {lane: (1, 120), region: (1, 120), 'fleet': (1, 120)})
+        TripCheckpoint.objects.create(trip=trip, recorded_at=self.START + timedelta(hours=3),
+                                      miles_completed=Decimal('150'), driving_hours=3)
+        trip.save()
+        SpeedProfiles.update()
+        self.assertEqual(self.profiles(), {lane: (1, 180), region: (1, 180), 'fleet': (1, 180)})
+
+        other = self.trip([(0, 0), (1, 45)], pickup='Reno, NV', dropoff='Salem, OR')
+        SpeedProfiles.update()
+        profiles = self.profiles()
+        self.assertEqual(profiles['fleet'], (2, 240))
+        self.assertEqual(profiles[lane], (1, 180))
+        self.assertEqual(SpeedProfileContribution.objects.get(trip=other).keys,
+                         SpeedProfiles.keys('Reno, NV', 'Salem, OR', other.route_geometry))
+
+        SpeedProfiles.update(full=True)
+        self.assertEqual(self.profiles(), profiles)
+
+    def test_speeds(self):
+        self.trip([(0, 0), (1, 60), (2, 100)])
+        SpeedProfiles.update()
+        coordinates = [[-105.0, 39.7], [-116.2, 43.6]]
+        speeds = SpeedProfiles.speeds('Denver, CO', 'Boise, ID', coordinates, 110, 2)
+        self.assertEqual(speeds.source, SpeedProfiles.lane_key('Denver, CO', 'Boise, ID'))
+        self.assertGreater(speeds.mph[8], 55)
+        self.assertLess(speeds.mph[9], 55)
+        self.assertAlmostEqual(speeds.mph[12], 55, places=3)
+
+        # Another lane from the same region uses the region's profile
+        self.assertEqual(SpeedProfiles.speeds('Denver, CO', 'Reno, NV', coordinates, 110, 2).source,
+                         SpeedProfiles.region_key(coordinates))
+        _cache.clear()
+        with override_settings(SPEED_PROFILE_MIN_HOURS=24):
+            flat = SpeedProfiles.speeds('Denver, CO', 'Boise, ID', coordinates, 110, 2)
+        self.assertEqual((flat.source, flat.flat, flat.fastest), ('route', True, 55))
+        with override_settings(SPEED_PROFILES_ENABLED=False):
+            self.assertIsNone(SpeedProfiles.speeds('Denver, CO', 'Boise, ID', coordinates, 110, 2))
+
+    def test_replan_at_the_dropoff_completes_the_trip(self):
+        trip = Trip.objects.create(current_location='Denver, CO', pickup_location='Denver, CO',
+                                   dropoff_location='Limon, CO', current_cycle_used=Decimal('0'),
+                                   total_distance=Decimal('54.38'), route_geometry=[[-105.0, 39.3], [-104.0, 39.3]])
+        result = TripReplanner.replan(trip, (-104.5, 39.3), self.START, 0.5, 1.5, 0.5, 1.5, True)
+        self.assertEqual(result['status'], 'in_progress')
+        self.assertEqual(SpeedProfiles.update(), 0)
+
+        result = TripReplanner.replan(trip, (-104.0, 39.3), self.START + timedelta(minutes=30), 1, 2, 1, 2, True)
+        self.assertEqual(result['status'], 'completed')
+        trip.refresh_from_db()
+        self.assertEqual(trip.status, 'completed')
+        self.assertEqual(SpeedProfiles.update(), 1)
+        self.assertEqual(SpeedProfile.objects.get(key='fleet').trips, 1)
+
+
+@override_settings(FUEL_TANK_RANGE_MILES=400, FUEL_START_LEVEL=0.6, FUEL_RESERVE_MILES=50, FUEL_MPG=6.5,
+                   FUEL_PLAN_UNIT_MILES=10, FUEL_STOP_PENALTY=15.0, FUEL_CORRIDOR_MILES=5)
+class FuelStopPlannerTests(SimpleTestCase):
+    """Cheapest stops within the tank range"""
+
+    # Due east along the 35th parallel, about 57 miles per degree
+    ROUTE = [[-100 + step * 0.25, 35.0] for step in range(41)]
+
+    def _station(self, name, longitude, price):
+        return FuelStation(name, f'{name} Rd', 35.0, longitude, price)
+
+    def _plan(self, stations):
+        distance = sum(great_circle_miles(a, b) for a, b in zip(self.ROUTE, self.ROUTE[1:]))
+        return distance, FuelStopPlanner.plan(self.ROUTE, distance, 0, index=FuelStationIndex(stations))
+
+    def test_buys_at_the_cheaper_of_two_nearby_stations(self):
+        distance, plan = self._plan([self._station('Dear', -96.2, 4.50), self._station('Cheap', -96.0, 3.00)])
+        self.assertEqual([stop['name'] for stop in plan['stops']], ['Cheap'])
+        stop = plan['stops'][0]
+        # Start with 240 miles; arrive with at least the 50-mile reserve
+        self.assertGreaterEqual(240 + stop['gallons'] * 6.5, distance + 50 - 10)
+        self.assertAlmostEqual(plan['fuel_cost'], stop['gallons'] * 3.00, places=1)
+
+    def test_fills_up_where_fuel_is_cheap(self):
+        _, plan = self._plan([self._station('Cheap', -98.5, 2.50), self._station('Dear', -96.0, 5.00),
+                              self._station('Later', -93.0, 4.80)])
+        self.assertEqual([stop['name'] for stop in plan['stops']], ['Cheap', 'Later'])
+        cheap = plan['stops'][0]
+        # The tank is filled at the cheap station, the rest bought at the cheaper later one
+        self.assertGreaterEqual(240 - cheap['route_mile'] + cheap['gallons'] * 6.5, 400 - 10)
+        self.assertTrue(all(stop['gallons'] > 0 for stop in plan['stops']))
+
+    def test_gap_longer_than_the_range_has_no_plan(self):
+        _, plan = self._plan([self._station('Only', -90.5, 3.00)])
+        self.assertIsNone(plan)
+
+    def test_no_stations_means_no_plan(self):
+        self.assertIsNone(FuelStopPlanner.plan(self.ROUTE, 560, 0, index=FuelStationIndex([])))
@@ -0,0 +1,219 @@
+"""
+Packed duty timelines
+An ELD log's duty statuses stored as one run-length encoded blob on the log
+row instead of a DutyStatus row per status. Each run takes 8 bytes and
+points into the log's remarks list for its location, so a day's sheet comes
+back with the log itself and decodes in a few microseconds.
+
+Logs keep the storage they were written with; ELD_TIMELINE_STORAGE picks
+the storage for new logs, and DutyTimeline.statuses() reads either.
+"""
+
+import struct
+from collections import namedtuple
+from datetime import time
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import DutyStatus, ELDLog, HOSViolation
+
+
+FORMAT_VERSION = 1
+STATUS_CODES = ('off_duty', 'sleeper', 'driving', 'on_duty')
+_STATUS_INDEX = {status: code for code, status in enumerate(STATUS_CODES)}
+
+# Run: (start second | status << 17 | remark << 19, end second), little endian
+_RUN = struct.Struct('<II')
+_SECOND_MASK = (1 << 17) - 1
+MAX_REMARKS = 1 << 13
+
+# Read-only stand-in for a DutyStatus row (id is None for packed logs)
+DutyEntry = namedtuple('DutyEntry', ['id', 'status', 'start_time', 'end_time', 'location', 'sequence'])
+
+
+@lru_cache(maxsize=None)
+def _clock(second: int) -> time:
+    return time(second // 3600, second // 60 % 60, second % 60)
+
+
+def _seconds(value: time) -> int:
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+class DutyTimeline:
+    """Encode, decode and store packed duty timelines"""
+
+    @staticmethod
+    def packed_storage() -> bool:
+        """True when new logs should be written as packed timelines"""
+        return getattr(settings, 'ELD_TIMELINE_STORAGE', 'rows') == 'packed'
+
+    @staticmethod
+    def encode(statuses: Iterable[Dict]) -> Tuple[bytes, List[str]]:
+        """
+        Pack a day's duty statuses
+
+        Args:
+            statuses: Dictionaries with status, start_time, end_time and
+                location, in sequence order. Times keep whole seconds.
+
+        Returns:
+            (timeline bytes, remarks) where remarks holds each distinct
+            location once
+        """
+        remarks: List[str] = []
+        remark_index: Dict[str, int] = {}
+        packed = bytearray((FORMAT_VERSION,))
+        for status in statuses:
+            location = status['location']
+            remark = remark_index.get(location)
+            if remark is None:
+                remark = remark_index[location] = len(remarks)
+                if remark >= MAX_REMARKS:
+                    raise ValueError(f'A packed timeline holds at most {MAX_REMARKS} distinct locations')
+                remarks.append(location)
+            packed += _RUN.pack(
+                _seconds(status['start_time']) | _STATUS_INDEX[status['status']] << 17 | remark << 19,
+                _seconds(status['end_time']),
+            )
+        return bytes(packed), remarks
+
+    @staticmethod
+    def decode(timeline, remarks: List[str]) -> List[DutyEntry]:
+        """
+        Unpack a timeline into entries shaped like DutyStatus rows
+
+        Args:
+            timeline: Bytes (or memoryview) from ELDLog.timeline
+            remarks: ELDLog.remarks
+
+        Returns:
+            DutyEntry tuples in sequence order
+        """
+        view = memoryview(timeline)
+        if not view:
+            return []
+        if view[0] != FORMAT_VERSION:
+            raise ValueError(f'Unknown duty timeline format {view[0]}')
+        return [
+            DutyEntry(None, STATUS_CODES[head >> 17 & 3], _clock(head & _SECOND_MASK), _clock(end),
+                      remarks[head >> 19], sequence)
+            for sequence, (head, end) in enumerate(_RUN.iter_unpack(view[1:]))
+        ]
+
+    @staticmethod
+    def statuses(log: ELDLog) -> list:
+        """
+        A log's duty statuses, whichever way they are stored
+
+        Row-stored logs return their DutyStatus rows (prefetch
+        'duty_statuses' to avoid a query per log); packed logs return
+        DutyEntry tuples with the same attributes.
+        """
+        if log.timeline is not None:
+            return DutyTimeline.decode(log.timeline, log.remarks)
+        return list(log.duty_statuses.all())
+
+    @staticmethod
+    def create_logs(logs: List[ELDLog], statuses: List[List[Dict]],
+                    batch_size: Optional[int] = None) -> List[ELDLog]:
+        """
+        Save new logs with their duty statuses in the configured storage
+
+        Args:
+            logs: Unsaved ELDLog instances
+            statuses: Each log's duty status dictionaries (generate_eld_logs format)
+            batch_size: Rows per INSERT
+
+        Returns:
+            The saved logs
+        """
+        if DutyTimeline.packed_storage():
+            for log, log_statuses in zip(logs, statuses):
+                log.timeline, log.remarks = DutyTimeline.encode(log_statuses)
+            return ELDLog.objects.bulk_create(logs, batch_size=batch_size)
+
+        logs = ELDLog.objects.bulk_create(logs, batch_size=batch_size)
+        DutyStatus.objects.bulk_create([
+            DutyStatus(log=log, status=status['status'], start_time=status['start_time'],
+                       end_time=status['end_time'], location=status['location'], sequence=status['sequence'])
+            for log, log_statuses in zip(logs, statuses)
+            for status in log_statuses
+        ], batch_size=batch_size)
+        return logs
+
+    # Conversion between storages (manage.py pack_duty_timelines; migrations
+    # 0005 and 0013 carry frozen copies)
+
+    @staticmethod
+    def pack_existing(batch_size: int = 1000) -> int:
+        """
+        Move row-stored logs into packed timelines and delete their rows
+
+        HOS violations on the deleted rows are kept: they point at the log
+        and the packed position of their status.
+
+        Returns:
+            Number of logs packed
+        """
+        log_ids = list(ELDLog.objects.filter(timeline__isnull=True).order_by('id').values_list('id', flat=True))
+        for offset in range(0, len(log_ids), batch_size):
+            chunk = log_ids[offset:offset + batch_size]
+            runs = {log_id: [] for log_id in chunk}
+            positions = {}
+            for row in DutyStatus.objects.filter(log_id__in=chunk).order_by('log_id', 'sequence', 'id').values(
+                    'id', 'log_id', 'status', 'start_time', 'end_time', 'location'):
+                positions[row['id']] = len(runs[row['log_id']])
+                runs[row['log_id']].append(row)
+            updates = []
+            for log_id, rows in runs.items():
+                timeline, remarks = DutyTimeline.encode(rows)
+                updates.append(ELDLog(id=log_id, timeline=timeline, remarks=remarks))
+            with transaction.atomic():
+                ELDLog.objects.bulk_update(updates, ['timeline', 'remarks'])
+                violations = list(HOSViolation.objects.filter(log_id__in=chunk).only('id', 'sequence', 'duty_status_id'))
+                for violation in violations:
+                    # Negative first so no (log, sequence, rule) pair collides mid-update
+                    violation.sequence = -1 - positions.get(violation.duty_status_id, violation.sequence)
+                    violation.duty_status_id = None
+                HOSViolation.objects.bulk_update(violations, ['sequence', 'duty_status'], batch_size=batch_size)
+                HOSViolation.objects.filter(log_id__in=chunk).update(sequence=-1 - F('sequence'))
+                DutyStatus.objects.filter(log_id__in=chunk).delete()
+        return len(log_ids)
+
+    @staticmethod
+    def unpack_existing(batch_size: int = 1000) -> int:
+        """
+        Turn packed timelines back into DutyStatus rows
+
+        HOS violations are pointed at the new rows again.
+
+        Returns:
+            Number of logs unpacked
+        """
+        log_ids = list(ELDLog.objects.filter(timeline__isnull=False).order_by('id').values_list('id', flat=True))
+        for offset in range(0, len(log_ids), batch_size):
+            logs = list(ELDLog.objects.filter(id__in=log_ids[offset:offset + batch_size]).only(
+                'id', 'timeline', 'remarks'))
+            rows = [
+                DutyStatus(log_id=log.id, status=entry.status, start_time=entry.start_time,
+                             end_time=entry.end_time, location=entry.location, sequence=entry.sequence)
+                for log in logs
+                for entry in DutyTimeline.decode(log.timeline, log.remarks)
+            ]
+            for log in logs:
+                log.timeline, log.remarks = None, []
+            with transaction.atomic():
+                DutyStatus.objects.bulk_create(rows, batch_size=batch_size)
+                ELDLog.objects.bulk_update(logs, ['timeline', 'remarks'])
+                status_ids = {(row.log_id, row.sequence): row.id for row in rows}
+                violations = list(HOSViolation.objects.filter(log_id__in=[log.id for log in logs]).only(
+                    'id', 'log_id', 'sequence'))
+                for violation in violations:
+                    violation.duty_status_id = status_ids.get((violation.log_id, violation.sequence))
+                HOSViolation.objects.bulk_update(violations, ['duty_status'], batch_size=batch_size)
+        return len(log_ids)
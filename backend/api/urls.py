@@ -11,11 +11,27 @@ urlpatterns = [
     path('auth/signup/', views.signup_user, name='signup'),
     path('auth/logout/', views.logout_user, name='logout'),
     path('auth/me/', views.get_current_user, name='current_user'),
+    path('auth/me/events/', views.user_events, name='user_events'),
     
     # Trip management
     path('trips/', views.trip_list, name='trip_list'),
+    path('trips/search/', views.trip_search, name='trip_search'),
     path('trips/<int:trip_id>/', views.trip_detail, name='trip_detail'),
+    path('trips/events/', views.trip_list_events, name='trip_list_events'),
+    path('trips/<int:trip_id>/events/', views.trip_events, name='trip_events'),
     path('calculate/', views.calculate_trip, name='calculate_trip'),
+    path('what-if/departures/', views.departure_sweep, name='departure_sweep'),
+    path('matrix/', views.distance_matrix, name='distance_matrix'),
+    path('assign/', views.assign_loads, name='assign_loads'),
     path('trips/<int:trip_id>/route/', views.trip_route, name='trip_route'),
     path('trips/<int:trip_id>/logs/', views.trip_eld_logs, name='trip_eld_logs'),
+    path('trips/<int:trip_id>/replan/', views.replan_trip, name='replan_trip'),
+    
+    # Fleet analytics
+    path('analytics/', views.fleet_analytics, name='fleet_analytics'),
+    
+    # Request profiles (staff only)
+    path('profiles/', views.profile_list, name='profile_list'),
+    path('profiles/<int:profile_id>/', views.profile_detail, name='profile_detail'),
+    path('profiles/<int:profile_id>/collapsed/', views.profile_detail, name='profile_collapsed'),
 ]
@@ -1,49 +1,131 @@
+import logging
+from decimal import Decimal
+
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from django.utils import timezone
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import require_GET
 from django.middleware.csrf import get_token
 
-from .models import Trip, RoutePoint, ELDLog, DutyStatus
+from .models import Trip, RoutePoint, ELDLog, RequestProfile
 from .serializers import (
     TripSerializer, TripCalculationRequestSerializer, 
-    TripCalculationResponseSerializer, UserSerializer
+    TripCalculationResponseSerializer, UserSerializer,
+    DistanceMatrixRequestSerializer, LoadAssignmentRequestSerializer,
+    TripReplanRequestSerializer, FleetAnalyticsRequestSerializer, RequestProfileSerializer,
+    TripSearchRequestSerializer, TripSummarySerializer, DepartureSweepRequestSerializer
 )
 from .calculations import HOSCalculator
-from .distance_service import DistanceService
+from .distance_service import DistanceService, LocationNotFound
+from .matrix_service import DistanceMatrixService
+from .assignment import LoadAssignmentOptimizer
+from .sleeper_planner import SleeperBerthPlanner
+from .scheduling import AppointmentScheduler, DepartureSweep
+from .replanning import TripReplanner
+from .events import broker
+from .idempotency import idempotent
+from .timeline import DutyTimeline
+from .archive import TripArchive
+from .analytics import FleetRollups
+from .compression import TripDocumentCache
+from .search import TripSearch
+from .speed_profiles import HourlySpeeds, SpeedProfiles
+from .fuel_planner import FuelStopPlanner
+
+
+logger = logging.getLogger(__name__)
+
+
+def _archived_trip_or_404(trip_id):
+    """Fallback for read endpoints: the trip from the cold archive, or the usual 404"""
+    archived = TripArchive.load(trip_id)
+    if archived is None:
+        raise Http404('No Trip matches the given query.')
+    return archived
+
+
+def _decimal(value):
+    # Archived decimals are strings; live responses render Decimal fields as numbers
+    return Decimal(value) if value is not None else None
 
 
 @api_view(['GET'])
 def trip_list(request):
     """Get list of all trips"""
-    trips = Trip.objects.all()
+    trips = Trip.objects.defer('route_geometry')
     serializer = TripSerializer(trips, many=True)
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+def trip_search(request):
+    """
+    Find trips by partial city or address in any of their locations
+    
+    Every word must appear in the current, pickup or dropoff location;
+    results are newest first. Misspelled words are corrected from recent
+    trips when nothing matches (api/search.py).
+    
+    Query parameters:
+        q: Search text ("dallas phoenix", "1200 main st")
+        page: Page number (default 1)
+        page_size: Trips per page (default 20, at most 100)
+    """
+    serializer = TripSearchRequestSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    found = TripSearch.search(data['q'], data['page'], data['page_size'])
+    trips = Trip.objects.defer('route_geometry').in_bulk(found['ids'])
+    return Response({
+        'query': data['q'],
+        'match': found['match'],
+        'corrected_query': found['corrected_query'],
+        'page': data['page'],
+        'page_size': data['page_size'],
+        'has_more': found['has_more'],
+        'results': TripSummarySerializer([trips[trip_id] for trip_id in found['ids'] if trip_id in trips], many=True).data,
+    })
+
+
 @api_view(['GET'])
 def trip_detail(request, trip_id):
     """Get detailed trip information"""
-    trip = get_object_or_404(Trip, id=trip_id)
-    serializer = TripSerializer(trip)
-    return Response(serializer.data)
+    trip = Trip.objects.defer('route_geometry').filter(id=trip_id).first()
+    if trip is None:
+        return Response(_archived_trip_or_404(trip_id))
+    return TripDocumentCache.respond(request, 'detail', trip, lambda: TripSerializer(trip).data)
 
 
 @api_view(['POST'])
+@idempotent
 def calculate_trip(request):
     """
     Calculate trip details based on HOS regulations
     
+    Send an Idempotency-Key header to make retries safe: the stored response
+    is replayed instead of planning (and saving) the trip again.
+    
     Expected payload:
     {
         "current_location": "Current Location",
         "pickup_location": "Pickup Location", 
         "dropoff_location": "Dropoff Location",
-        "current_cycle_used": 25.5
+        "current_cycle_used": 25.5,
+        "use_sleeper_berth": false,   (optional, plan sleeper-berth splits)
+        "earliest_departure": "2025-01-06T06:00:00Z",   (optional, default now)
+        "pickup_window_start": "2025-01-06T14:00:00Z",  (optional appointment windows)
+        "pickup_window_end": "2025-01-06T16:00:00Z",
+        "dropoff_window_start": "2025-01-08T08:00:00Z",
+        "dropoff_window_end": "2025-01-08T12:00:00Z"
     }
     """
     print(f"DEBUG: Calculate trip request data: {request.data}")
@@ -59,18 +141,66 @@ def calculate_trip(request):
     pickup_location = serializer.validated_data['pickup_location']
     dropoff_location = serializer.validated_data['dropoff_location']
     current_cycle_used = serializer.validated_data['current_cycle_used']
+    use_sleeper_berth = serializer.validated_data['use_sleeper_berth']
+    windows = {
+        field: serializer.validated_data.get(field)
+        for field in TripCalculationRequestSerializer.WINDOW_FIELDS + ['earliest_departure']
+    }
     
     # Calculate real distance and duration between locations
     print(f"DEBUG: Calculating distance from {current_location} to {dropoff_location}")
-    route_data = DistanceService.calculate_distance_and_duration(current_location, dropoff_location)
+    try:
+        route_data = DistanceService.calculate_distance_and_duration(current_location, dropoff_location)
+    except LocationNotFound as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     distance_miles = route_data['distance_miles']
     estimated_duration = route_data['duration_hours']
     
     print(f"DEBUG: Calculated distance: {distance_miles} miles, duration: {estimated_duration} hours")
     
+    # The route's ORS speed, shaped by the learned time-of-day profile
+    speeds = SpeedProfiles.speeds(
+        pickup_location, dropoff_location, route_data.get('route_info', {}).get('coordinates', []),
+        distance_miles, estimated_duration
+    )
+    
+    # Appointment windows: plan departure and arrival around them
+    schedule = None
+    if any(windows.values()):
+        try:
+            pickup_leg = DistanceService.calculate_distance_and_duration(current_location, pickup_location)
+            delivery_leg = DistanceService.calculate_distance_and_duration(pickup_location, dropoff_location)
+        except LocationNotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        scheduler = AppointmentScheduler(
+            pickup_leg['distance_miles'], delivery_leg['distance_miles'], current_cycle_used,
+            windows['earliest_departure'] or timezone.now(),
+            pickup_window=(windows['pickup_window_start'], windows['pickup_window_end']),
+            dropoff_window=(windows['dropoff_window_start'], windows['dropoff_window_end']),
+            speeds=speeds
+        )
+        schedule = scheduler.solve()
+        if not schedule['feasible']:
+            return Response(
+                {'error': f"No HOS-compliant schedule meets the appointment windows: {schedule['reason']}",
+                 'schedule': schedule},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
     # Calculate trip details
     try:
-        trip_details = HOSCalculator.calculate_trip_details(current_cycle_used, distance_miles)
+        departure = schedule['schedule']['departure'] if schedule else timezone.now()
+        drive_hours = None
+        if speeds:
+            drive_hours = speeds.drive_minutes(distance_miles, HourlySpeeds.minute_of_day(departure)) / 60
+        # Fuel at the cheapest stations along the route (when a station list is installed)
+        fuel_plan = FuelStopPlanner.plan(
+            route_data.get('route_info', {}).get('coordinates', []), distance_miles, current_cycle_used,
+            speeds, departure
+        )
+        trip_details = HOSCalculator.calculate_trip_details(
+            current_cycle_used, distance_miles, drive_hours, len(fuel_plan['stops']) if fuel_plan else None
+        )
         
         # Create trip record
         trip = Trip.objects.create(
@@ -83,12 +213,14 @@ def calculate_trip(request):
             total_trip_time=trip_details['total_trip_time'],
             fuel_stops=trip_details['fuel_stops'],
             rest_stops=trip_details['rest_stops'],
-            status='planned'
+            route_geometry=route_data.get('route_info', {}).get('coordinates', []),
+            status='planned',
+            user=request.user if request.user.is_authenticated else None
         )
         
         # Generate route points
         route_points_data = HOSCalculator.generate_route_points(
-            current_location, pickup_location, dropoff_location, trip_details
+            current_location, pickup_location, dropoff_location, trip_details, fuel_plan
         )
         
         # Create route points
@@ -106,32 +238,35 @@ def calculate_trip(request):
             route_points.append(point)
         
         # Generate ELD logs
-        eld_logs_data = HOSCalculator.generate_eld_logs(trip_details, timezone.now())
+        sleeper_plan = None
+        if schedule:
+            eld_logs_data = HOSCalculator.generate_eld_logs_from_events(schedule.pop('events'))
+        elif use_sleeper_berth:
+            start = timezone.localtime().replace(hour=6, minute=0, second=0, microsecond=0)
+            plan = SleeperBerthPlanner.plan(distance_miles, current_cycle_used, start)
+            eld_logs_data = SleeperBerthPlanner.generate_eld_logs(plan)
+            sleeper_plan = SleeperBerthPlanner.summarize(plan)
+            sleeper_plan['flat_total_hours'] = SleeperBerthPlanner.plan(
+                distance_miles, current_cycle_used, start, use_splits=False
+            )['total_hours']
+        else:
+            eld_logs_data = HOSCalculator.generate_eld_logs(trip_details, timezone.now())
         
-        # Create ELD logs and duty statuses
-        eld_logs = []
-        for log_data in eld_logs_data:
-            log = ELDLog.objects.create(
+        # Create ELD logs and duty statuses (rows or packed timelines)
+        eld_logs = DutyTimeline.create_logs(
+            [ELDLog(
                 trip=trip,
                 date=log_data['date'],
                 driver_name=log_data['driver_name'],
                 carrier_name=log_data['carrier_name'],
                 vehicle_number=log_data['vehicle_number'],
                 total_miles=log_data['total_miles']
-            )
-            
-            # Create duty statuses for this log
-            for status_data in log_data['duty_statuses']:
-                DutyStatus.objects.create(
-                    log=log,
-                    status=status_data['status'],
-                    start_time=status_data['start_time'],
-                    end_time=status_data['end_time'],
-                    location=status_data['location'],
-                    sequence=status_data['sequence']
-                )
-            
-            eld_logs.append(log)
+            ) for log_data in eld_logs_data],
+            [log_data['duty_statuses'] for log_data in eld_logs_data]
+        )
+        FleetRollups.record_trip(trip)
+        
+        transaction.on_commit(lambda: broker.publish_trip(trip, 'trip.created'))
         
         # Prepare response
         response_data = {
@@ -155,6 +290,14 @@ def calculate_trip(request):
                       (" Trip is feasible with current cycle." if trip_details['feasible'] else 
                        " Warning: Trip may exceed current cycle limits.")
         }
+        if sleeper_plan:
+            response_data['sleeper_plan'] = sleeper_plan
+        if schedule:
+            response_data['schedule'] = schedule
+        if speeds:
+            response_data['speed_profile'] = speeds.to_dict()
+        if fuel_plan:
+            response_data['fuel_plan'] = fuel_plan
         
         return Response(response_data, status=status.HTTP_201_CREATED)
         
@@ -165,56 +308,305 @@ def calculate_trip(request):
         )
 
 
+@api_view(['POST'])
+def replan_trip(request, trip_id):
+    """
+    Re-plan the remainder of a trip from the driver's current position
+    
+    Reuses the stored route geometry, so nothing is geocoded or routed again,
+    and rewrites only the route points, ELD logs and duty statuses that change.
+    
+    Expected payload:
+    {
+        "latitude": 39.76, "longitude": -86.15,
+        "as_of": "2025-01-06T14:30:00Z",   (optional, default now)
+        "driving_hours_used": 6.5,         (since the last 10-hour reset)
+        "on_duty_hours_used": 8,           (optional, 14-hour window used)
+        "driving_since_break_hours": 2,    (optional)
+        "cycle_hours_used": 40.5,          (optional, default trip cycle + duty logged so far)
+        "pickup_completed": true           (optional)
+    }
+    """
+    trip = get_object_or_404(Trip, id=trip_id)
+    if trip.status in ('completed', 'cancelled'):
+        return Response({'error': f'Trip is {trip.status}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = TripReplanRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    as_of = timezone.localtime(data.get('as_of') or timezone.now())
+    cycle_hours = data.get('cycle_hours_used')
+    if cycle_hours is None:
+        # Cycle state at planning time plus the duty logged since
+        cycle_hours = min(
+            float(trip.current_cycle_used) + TripReplanner.logged_on_duty_hours(trip, as_of),
+            HOSCalculator.MAX_WEEKLY_ON_DUTY
+        )
+    result = TripReplanner.replan(
+        trip,
+        (data['longitude'], data['latitude']),
+        as_of,
+        data['driving_hours_used'],
+        data['on_duty_hours_used'],
+        data['driving_since_break_hours'],
+        cycle_hours,
+        data['pickup_completed'],
+    )
+    transaction.on_commit(lambda: broker.publish_trip(trip, changes=result['changes']))
+    return Response(result)
+
+
+@api_view(['POST'])
+def departure_sweep(request):
+    """
+    What-if: arrival and feasibility for every departure time in a range
+    
+    Nothing is saved. Both legs are routed once and every candidate
+    departure is evaluated against the same HOS simulation.
+    
+    Expected payload:
+    {
+        "current_location": "Chicago, IL",
+        "pickup_location": "Denver, CO",
+        "dropoff_location": "Los Angeles, CA",
+        "current_cycle_used": 25.5,
+        "departure_start": "2025-01-06T00:00:00Z",
+        "departure_end": "2025-01-07T00:00:00Z",   (optional, exclusive, default start + 24h)
+        "step_minutes": 15,                       (optional)
+        "pickup_window_start": "2025-01-06T14:00:00Z",  (optional appointment windows)
+        "pickup_window_end": "2025-01-06T16:00:00Z",
+        "dropoff_window_start": "2025-01-08T08:00:00Z",
+        "dropoff_window_end": "2025-01-08T12:00:00Z"
+    }
+    """
+    serializer = DepartureSweepRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    try:
+        pickup_leg = DistanceService.calculate_distance_and_duration(data['current_location'], data['pickup_location'])
+        delivery_leg = DistanceService.calculate_distance_and_duration(data['pickup_location'], data['dropoff_location'])
+    except LocationNotFound as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    speeds = SpeedProfiles.speeds(
+        data['pickup_location'], data['dropoff_location'], pickup_leg.get('route_info', {}).get('coordinates', []),
+        pickup_leg['distance_miles'] + delivery_leg['distance_miles'],
+        pickup_leg['duration_hours'] + delivery_leg['duration_hours']
+    )
+    sweep = DepartureSweep(
+        pickup_leg['distance_miles'], delivery_leg['distance_miles'], data['current_cycle_used'],
+        pickup_window=(data.get('pickup_window_start'), data.get('pickup_window_end')),
+        dropoff_window=(data.get('dropoff_window_start'), data.get('dropoff_window_end')),
+        speeds=speeds
+    )
+    result = sweep.run(data['departure_start'], data['departure_end'], data['step_minutes'])
+    return Response({
+        'pickup_miles': pickup_leg['distance_miles'],
+        'delivery_miles': delivery_leg['distance_miles'],
+        'route_estimated': not (pickup_leg.get('success') and delivery_leg.get('success')),
+        'step_minutes': data['step_minutes'],
+        'speed_profile': speeds.to_dict() if speeds else None,
+        **result,
+    })
+
+
+@api_view(['POST'])
+def distance_matrix(request):
+    """
+    Many-to-many distances, durations and HOS feasibility
+    
+    Expected payload:
+    {
+        "origins": ["Chicago, IL", ...],
+        "destinations": ["Dallas, TX", ...],
+        "current_cycle_used": 25.5,
+        "cycle_used": [25.5, ...]   (optional, one per origin)
+    }
+    """
+    serializer = DistanceMatrixRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    cycle_used = data.get('cycle_used') or data['current_cycle_used']
+    result = DistanceMatrixService.compute_with_feasibility(data['origins'], data['destinations'], cycle_used)
+    return Response(result)
+
+
+@api_view(['POST'])
+def assign_loads(request):
+    """
+    Assign loads to drivers, minimising deadhead miles within HOS limits
+    
+    Expected payload:
+    {
+        "drivers": [{"id": "D1", "location": "Chicago, IL", "cycle_used": 25.5}, ...],
+        "loads": [{"id": "L1", "pickup_location": "Gary, IN", "dropoff_location": "Dallas, TX"}, ...],
+        "max_deadhead_miles": 250   (optional)
+    }
+    """
+    serializer = LoadAssignmentRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    result = LoadAssignmentOptimizer.optimize(data['drivers'], data['loads'], data.get('max_deadhead_miles'))
+    return Response(result)
+
+
 @api_view(['GET'])
 def trip_route(request, trip_id):
     """Get route information for a trip"""
-    trip = get_object_or_404(Trip, id=trip_id)
-    route_points = RoutePoint.objects.filter(trip=trip).order_by('sequence')
-    
-    response_data = {
-        'trip_id': trip.id,
-        'total_distance': trip.total_distance,
-        'route_points': [{
-            'point_type': point.point_type,
-            'latitude': point.latitude,
-            'longitude': point.longitude,
-            'address': point.address,
-            'sequence': point.sequence,
-            'duration_minutes': point.duration_minutes
-        } for point in route_points]
-    }
+    trip = Trip.objects.defer('route_geometry').filter(id=trip_id).first()
+    if trip is None:
+        archived = _archived_trip_or_404(trip_id)
+        return Response({
+            'trip_id': archived['id'],
+            'total_distance': _decimal(archived['total_distance']),
+            'route_points': [{
+                'point_type': point['point_type'],
+                'latitude': _decimal(point['latitude']),
+                'longitude': _decimal(point['longitude']),
+                'address': point['address'],
+                'sequence': point['sequence'],
+                'duration_minutes': point['duration_minutes']
+            } for point in archived['route_points']]
+        })
     
-    return Response(response_data)
+    def build():
+        route_points = RoutePoint.objects.filter(trip=trip).order_by('sequence')
+        
+        return {
+            'trip_id': trip.id,
+            'total_distance': trip.total_distance,
+            'route_points': [{
+                'point_type': point.point_type,
+                'latitude': point.latitude,
+                'longitude': point.longitude,
+                'address': point.address,
+                'sequence': point.sequence,
+                'duration_minutes': point.duration_minutes
+            } for point in route_points]
+        }
+    
+    return TripDocumentCache.respond(request, 'route', trip, build)
 
 
 @api_view(['GET'])
 def trip_eld_logs(request, trip_id):
     """Get ELD logs for a trip"""
-    trip = get_object_or_404(Trip, id=trip_id)
-    eld_logs = ELDLog.objects.filter(trip=trip).order_by('date')
+    trip = Trip.objects.defer('route_geometry').filter(id=trip_id).first()
+    if trip is None:
+        archived = _archived_trip_or_404(trip_id)
+        return Response([{
+            **log,
+            'total_miles': _decimal(log['total_miles']),
+            'duty_statuses': [
+                {field: value for field, value in duty_status.items() if field != 'id'}
+                for duty_status in log['duty_statuses']
+            ]
+        } for log in archived['eld_logs']])
     
-    response_data = []
-    for log in eld_logs:
-        duty_statuses = DutyStatus.objects.filter(log=log).order_by('sequence')
+    def build():
+        eld_logs = ELDLog.objects.filter(trip=trip).order_by('date').prefetch_related('duty_statuses')
         
-        log_data = {
-            'id': log.id,
-            'date': log.date,
-            'driver_name': log.driver_name,
-            'carrier_name': log.carrier_name,
-            'vehicle_number': log.vehicle_number,
-            'total_miles': log.total_miles,
-            'duty_statuses': [{
-                'status': status.status,
-                'start_time': status.start_time,
-                'end_time': status.end_time,
-                'location': status.location,
-                'sequence': status.sequence
-            } for status in duty_statuses]
-        }
-        response_data.append(log_data)
+        response_data = []
+        for log in eld_logs:
+            duty_statuses = DutyTimeline.statuses(log)
+            
+            log_data = {
+                'id': log.id,
+                'date': log.date,
+                'driver_name': log.driver_name,
+                'carrier_name': log.carrier_name,
+                'vehicle_number': log.vehicle_number,
+                'total_miles': log.total_miles,
+                'duty_statuses': [{
+                    'status': status.status,
+                    'start_time': status.start_time,
+                    'end_time': status.end_time,
+                    'location': status.location,
+                    'sequence': status.sequence
+                } for status in duty_statuses]
+            }
+            response_data.append(log_data)
+        return response_data
+    
+    return TripDocumentCache.respond(request, 'logs', trip, build)
+
+
+@api_view(['GET'])
+def fleet_analytics(request):
+    """
+    Miles, driving hours, on-duty hours and trips per driver or lane
     
-    return Response(response_data)
+    Answered from pre-aggregated rollups (api/analytics.py).
+    
+    Query parameters:
+        group_by: driver (default) or lane
+        start, end: Date range, inclusive (default: the last 30 days)
+        interval: total (default), month or day
+        key: Only this driver ('user:<id>') or lane
+        limit: Number of drivers or lanes, busiest first (default 100)
+    """
+    serializer = FleetAnalyticsRequestSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    results = FleetRollups.query(
+        data['group_by'], data['start'], data['end'], data['interval'], data.get('key'), data['limit']
+    )
+    return Response({
+        'group_by': data['group_by'],
+        'start': data['start'],
+        'end': data['end'],
+        'interval': data['interval'],
+        'results': results,
+    })
+
+
+@api_view(['GET'])
+def profile_list(request):
+    """
+    Stored request profiles, newest first (staff only)
+    
+    Query parameters:
+        path: Only profiles of paths starting with this
+        limit: Number of profiles (default 50)
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'Admin access required'}, status=status.HTTP_403_FORBIDDEN)
+    profiles = RequestProfile.objects.defer('collapsed')
+    if request.query_params.get('path'):
+        profiles = profiles.filter(path__startswith=request.query_params['path'])
+    try:
+        limit = min(max(int(request.query_params.get('limit', 50)), 1), 500)
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(RequestProfileSerializer(profiles[:limit], many=True).data)
+
+
+@api_view(['GET'])
+def profile_detail(request, profile_id):
+    """
+    One request profile with its collapsed stacks (staff only)
+    
+    /collapsed/ returns the stacks as plain text for flamegraph.pl or speedscope.
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'Admin access required'}, status=status.HTTP_403_FORBIDDEN)
+    profile = get_object_or_404(RequestProfile, id=profile_id)
+    if request.resolver_match.url_name == 'profile_collapsed':
+        response = HttpResponse(profile.collapsed, content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'inline; filename="profile-{profile.id}.folded"'
+        return response
+    data = RequestProfileSerializer(profile).data
+    data['collapsed'] = profile.collapsed
+    return Response(data)
 
 
 @api_view(['GET'])
@@ -239,28 +631,14 @@ def login_user(request):
         email = data.get('email')
         password = data.get('password')
         
-        print(f"DEBUG: Email: {email}, Password: {password}")
-        
         if not email or not password:
             return Response(
                 {'error': 'Email and password are required'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Find user by email
-        try:
-            user = User.objects.get(email=email)
-            print(f"DEBUG: Found user: {user.username}")
-        except User.DoesNotExist:
-            print(f"DEBUG: User not found for email: {email}")
-            return Response(
-                {'error': 'Invalid email or password'}, 
-                status=status.HTTP_401_UNAUTHORIZED
-            )
-        
-        # Authenticate user
-        authenticated_user = authenticate(username=user.username, password=password)
-        print(f"DEBUG: Authenticated user: {authenticated_user}")
+        # Authenticate user (one indexed lookup by email, see api/auth_backend.py)
+        authenticated_user = authenticate(request, email=email, password=password)
         if authenticated_user is None:
             return Response(
                 {'error': 'Invalid email or password'}, 
@@ -269,11 +647,9 @@ def login_user(request):
         
         # Login user (creates session)
         login(request, authenticated_user)
-        print(f"DEBUG: User logged in, session key: {request.session.session_key}")
         
         # Return user data
         serializer = UserSerializer(authenticated_user)
-        print(f"DEBUG: User serializer data: {serializer.data}")
         return Response({
             'message': 'Login successful',
             'user': serializer.data,
@@ -282,9 +658,7 @@ def login_user(request):
         })
         
     except Exception as e:
-        print(f"DEBUG: Exception in login: {e}")
-        import traceback
-        print(f"DEBUG: Traceback: {traceback.format_exc()}")
+        logger.exception("Login failed")
         return Response(
             {'error': f'Login failed: {str(e)}'}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -362,4 +736,45 @@ def get_current_user(request):
         return Response(
             {'error': 'Not authenticated'}, 
             status=status.HTTP_401_UNAUTHORIZED
-        )
\ No newline at end of file
+        )
+
+
+def _event_stream(request, topic):
+    """Streaming server-sent events response for a broker topic"""
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id'))
+    except (TypeError, ValueError):
+        last_event_id = None
+    response = StreamingHttpResponse(broker.stream(topic, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Keep nginx from buffering the stream
+    return response
+
+
+@require_GET
+async def trip_list_events(request):
+    """Server-sent trip deltas for every trip"""
+    return _event_stream(request, 'trips')
+
+
+@require_GET
+async def trip_events(request, trip_id):
+    """
+    Server-sent deltas for one trip
+    
+    Each event carries only what changed (status, ETA, totals, miles completed)
+    plus the ids of re-planned route points, ELD logs and duty statuses.
+    Needs an ASGI server: every open stream is an idle coroutine, not a thread.
+    """
+    if not await Trip.objects.filter(id=trip_id).aexists():
+        return JsonResponse({'error': 'Trip not found'}, status=status.HTTP_404_NOT_FOUND)
+    return _event_stream(request, f'trip:{trip_id}')
+
+
+@require_GET
+async def user_events(request):
+    """Server-sent trip deltas for the logged-in user's trips"""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
+    return _event_stream(request, f'user:{user.id}')
@@ -0,0 +1,412 @@
+"""
+Fleet-wide HOS violation scanner
+Streams persisted duty statuses ordered by driver and time and checks the
+11-hour driving, 14-hour window, 30-minute break and 70-hour/8-day rules in
+a single pass, keeping only running counters and an 8-day sliding window of
+on-duty time per driver. Incremental runs carry those counters between runs
+and only read duty statuses added since the last watermark.
+
+Row-stored statuses are read straight from DutyStatus; packed logs
+(api/timeline.py) are decoded with DutyTimeline.statuses() and merged into
+the same ordered stream, with a log id watermark of their own.
+"""
+
+import heapq
+import time as timer
+from collections import deque
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import CharField, F, Max
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from .calculations import HOSCalculator
+from .models import DutyStatus, ELDLog, HOSScanState, HOSScanWatermark, HOSViolation
+from .timeline import DutyTimeline, _seconds
+
+
+DAY = 24 * 60
+DAY_END = '23:59:59'  # End-of-day marker used by the ELD log generators
+DAY_END_SECOND = 23 * 3600 + 59 * 60 + 59
+
+
+class _DriverState:
+    """HOS counters (minutes) for one driver at the end of the rows seen so far"""
+
+    __slots__ = ('last_end', 'rest', 'rest_sleeper', 'break_run', 'driving', 'window', 'since_break',
+                 'pending', 'pending_sleeper', 'pending_driving', 'pending_window',
+                 'cycle', 'cycle_minutes', 'flagged')
+
+    def __init__(self, data: Optional[Dict] = None):
+        data = data or {}
+        self.last_end = data.get('last_end')
+        self.rest = data.get('rest', 0)                  # current run of off-duty/sleeper time
+        self.rest_sleeper = data.get('rest_sleeper', 0)  # sleeper part of that run
+        self.break_run = data.get('break_run', 0)        # current run of non-driving time
+        self.driving = data.get('driving', 0)            # driving since the 11/14-hour calculation point
+        self.window = data.get('window', 0)              # time counted against the 14-hour window
+        self.since_break = data.get('since_break', 0)    # driving since the last 30-minute interruption
+        self.pending = data.get('pending', 0)            # unpaired sleeper-berth split period
+        self.pending_sleeper = data.get('pending_sleeper', False)
+        self.pending_driving = data.get('pending_driving', 0)
+        self.pending_window = data.get('pending_window', 0)
+        self.cycle = deque(tuple(interval) for interval in data.get('cycle', []))  # on-duty (start, end)
+        self.cycle_minutes = sum(end - start for start, end in self.cycle)
+        self.flagged = set(data.get('flagged', []))      # rules already reported for the current period
+
+    def to_dict(self) -> Dict:
+        return {
+            'last_end': self.last_end, 'rest': self.rest, 'rest_sleeper': self.rest_sleeper,
+            'break_run': self.break_run, 'driving': self.driving, 'window': self.window,
+            'since_break': self.since_break, 'pending': self.pending,
+            'pending_sleeper': self.pending_sleeper, 'pending_driving': self.pending_driving,
+            'pending_window': self.pending_window, 'cycle': [list(interval) for interval in self.cycle],
+            'flagged': sorted(self.flagged),
+        }
+
+
+class HOSViolationScanner:
+    """Single-pass HOS audit over every stored duty status"""
+
+    MAX_DRIVING = HOSCalculator.MAX_DAILY_DRIVING * 60
+    MAX_WINDOW = HOSCalculator.MAX_DAILY_ON_DUTY * 60
+    MAX_DRIVING_BEFORE_BREAK = HOSCalculator.MAX_DRIVING_BEFORE_BREAK * 60
+    MAX_CYCLE = HOSCalculator.MAX_WEEKLY_ON_DUTY * 60
+    CYCLE_SPAN = 8 * DAY
+    BREAK = 30
+    RESET = HOSCalculator.MIN_OFF_DUTY * 60
+    RESTART = 34 * 60
+    MIN_SPLIT_LONG = 7 * 60
+    MIN_SPLIT_SHORT = 2 * 60
+
+    WATERMARK = 'hos_violations'
+
+    def __init__(self, chunk_size: Optional[int] = None, batch_size: int = 1000):
+        self.chunk_size = chunk_size or getattr(settings, 'HOS_SCAN_CHUNK_SIZE', 20000)
+        self.batch_size = batch_size
+        self.violations: List[HOSViolation] = []
+        self.stats = {'rows': 0, 'drivers': 0, 'violations': 0, 'rescanned_drivers': 0}
+
+    # Rule evaluation
+
+    def _rest(self, state: _DriverState, minutes: float, sleeper: bool):
+        state.rest += minutes
+        if sleeper:
+            state.rest_sleeper += minutes
+        state.break_run += minutes
+        if state.break_run >= self.BREAK:
+            state.since_break = 0
+            state.flagged.discard('break_30')
+
+    def _end_rest(self, state: _DriverState):
+        """Apply a completed off-duty/sleeper period when duty resumes"""
+        minutes = state.rest
+        sleeper = state.rest_sleeper >= self.MIN_SPLIT_LONG
+        if minutes >= self.RESTART:
+            state.cycle.clear()
+            state.cycle_minutes = 0
+            state.flagged.discard('cycle_70')
+        if minutes >= self.RESET:
+            state.driving = state.window = 0
+            state.pending = state.pending_driving = state.pending_window = 0
+            state.pending_sleeper = False
+        elif minutes >= self.MIN_SPLIT_SHORT:
+            # Sleeper-berth split (49 CFR 395.1(g)): when the two periods pair
+            # up, the limits are recalculated from the end of the first one
+            # and neither period counts against the 14-hour window
+            if (state.pending and state.pending + minutes >= self.RESET
+                    and min(state.pending, minutes) >= self.MIN_SPLIT_SHORT
+                    and ((state.pending_sleeper and state.pending >= self.MIN_SPLIT_LONG) or sleeper)):
+                state.driving = state.pending_driving
+                state.window = state.pending_window
+            else:
+                state.window += minutes
+            state.pending = minutes
+            state.pending_sleeper = sleeper
+            state.pending_driving = state.pending_window = 0
+        else:
+            state.window += minutes
+            state.pending_window += minutes
+        if state.driving <= self.MAX_DRIVING:
+            state.flagged.discard('driving_11')
+        if state.window <= self.MAX_WINDOW:
+            state.flagged.discard('window_14')
+        state.rest = state.rest_sleeper = 0
+
+    def _cycle_used(self, state: _DriverState, at: float) -> float:
+        """On-duty minutes in the 8 days ending at a point in time"""
+        cycle = state.cycle
+        window_start = at - self.CYCLE_SPAN
+        while cycle and cycle[0][1] <= window_start:
+            start, end = cycle.popleft()
+            state.cycle_minutes -= end - start
+        if cycle and cycle[0][0] < window_start:
+            return state.cycle_minutes - (window_start - cycle[0][0])
+        return state.cycle_minutes
+
+    def _advance(self, state: _DriverState, status: str, start: float, end: float) -> List[Tuple[str, float, float]]:
+        """
+        Feed one duty status into the driver's counters
+
+        Returns:
+            List of (rule, minute the limit was passed, hours reached) tuples
+        """
+        if state.last_end is not None:
+            if start > state.last_end:
+                # Time without a record is off duty
+                self._rest(state, start - state.last_end, False)
+            elif start < state.last_end:
+                # Overlapping logs (e.g. two trips planned for the same day)
+                start = state.last_end
+        if end <= start:
+            return []
+        state.last_end = end
+        minutes = end - start
+
+        if status == 'off_duty' or status == 'sleeper':
+            self._rest(state, minutes, status == 'sleeper')
+            return []
+        if state.rest:
+            self._end_rest(state)
+
+        state.window += minutes
+        state.pending_window += minutes
+        cycle = state.cycle
+        if cycle and cycle[-1][1] == start:
+            cycle[-1] = (cycle[-1][0], end)
+        else:
+            cycle.append((start, end))
+        state.cycle_minutes += minutes
+
+        if status != 'driving':
+            state.break_run += minutes
+            if state.break_run >= self.BREAK:
+                state.since_break = 0
+                state.flagged.discard('break_30')
+            if self._cycle_used(state, end) <= self.MAX_CYCLE:
+                state.flagged.discard('cycle_70')
+            return []
+
+        state.break_run = 0
+        state.driving += minutes
+        state.pending_driving += minutes
+        state.since_break += minutes
+        found = []
+        flagged = state.flagged
+        # Each limit is reported once per period; the offence starts where
+        # the counter crossed the limit inside this status
+        for rule, used, limit in (
+            ('driving_11', state.driving, self.MAX_DRIVING),
+            ('window_14', state.window, self.MAX_WINDOW),
+            ('break_30', state.since_break, self.MAX_DRIVING_BEFORE_BREAK),
+        ):
+            if used > limit and rule not in flagged:
+                flagged.add(rule)
+                found.append((rule, max(start, end - (used - limit)), used / 60))
+        cycle_used = self._cycle_used(state, end)
+        if cycle_used > self.MAX_CYCLE:
+            if 'cycle_70' not in flagged:
+                flagged.add('cycle_70')
+                found.append(('cycle_70', max(start, end - (cycle_used - self.MAX_CYCLE)), cycle_used / 60))
+        else:
+            flagged.discard('cycle_70')
+        return found
+
+    # Streaming
+
+    @staticmethod
+    def _queryset():
+        """Duty statuses ordered by driver, then time"""
+        return DutyStatus.objects.annotate(
+            # Users are drivers; trips without a user stand for their own driver
+            driver=Coalesce('log__trip__user_id', -F('log__trip_id'))
+        ).order_by('driver', 'log__date', 'start_time', 'sequence', 'id')
+
+    @staticmethod
+    def _log_queryset():
+        """Packed logs ordered by driver, then date"""
+        return ELDLog.objects.filter(timeline__isnull=False).annotate(
+            driver=Coalesce('trip__user_id', -F('trip_id')), user_id=F('trip__user_id')
+        ).only('id', 'trip_id', 'date', 'timeline', 'remarks').order_by('driver', 'date', 'id')
+
+    def _rows(self, queryset) -> Iterable[tuple]:
+        """
+        (driver order, start minute, end minute, status, trip id, user id,
+        log id, sequence, status id), streamed in chunks
+        """
+        # Dates and times come back as text: parsing 'HH:MM:SS' by slicing is
+        # several times cheaper than the ORM's per-value converters
+        day_starts = {}
+        for (status_id, status, start_time, end_time, log_date, trip_id, user_id, driver, log_id,
+             sequence) in queryset.annotate(
+                start_text=Cast('start_time', CharField()), end_text=Cast('end_time', CharField()),
+                date_text=Cast('log__date', CharField()),
+        ).values_list(
+                'id', 'status', 'start_text', 'end_text', 'date_text', 'log__trip_id', 'log__trip__user_id',
+                'driver', 'log_id', 'sequence'
+        ).iterator(chunk_size=self.chunk_size):
+            day = day_starts.get(log_date)
+            if day is None:
+                day = day_starts[log_date] = date.fromisoformat(log_date[:10]).toordinal() * DAY
+            start = day + int(start_time[:2]) * 60 + int(start_time[3:5]) + int(start_time[6:8]) / 60
+            if end_time.startswith(DAY_END):
+                end = day + DAY
+            else:
+                end = day + int(end_time[:2]) * 60 + int(end_time[3:5]) + int(end_time[6:8]) / 60
+            yield driver, start, end, status, trip_id, user_id, log_id, sequence, status_id
+
+    def _packed_rows(self, log_queryset) -> Iterable[tuple]:
+        """Entries of packed logs, in the _rows format (status id None)"""
+        group_key, group = None, []
+        for log in log_queryset.iterator(chunk_size=max(1, self.chunk_size // 20)):
+            if (log.driver, log.date) != group_key:
+                # Logs of one driver and day (several trips) are merged by start time
+                yield from sorted(group)
+                group_key, group = (log.driver, log.date), []
+            day = log.date.toordinal() * DAY
+            for entry in DutyTimeline.statuses(log):
+                start = day + _seconds(entry.start_time) / 60
+                end_second = _seconds(entry.end_time)
+                end = day + (DAY if end_second == DAY_END_SECOND else end_second / 60)
+                group.append((log.driver, start, end, entry.status, log.trip_id, log.user_id, log.id,
+                              entry.sequence, None))
+        yield from sorted(group)
+
+    def _stream(self, queryset, log_queryset) -> Iterable[tuple]:
+        """Row-stored and packed statuses merged in driver and time order"""
+        return heapq.merge(self._rows(queryset), self._packed_rows(log_queryset), key=lambda row: row[:2])
+
+    @staticmethod
+    def _timestamp(minute: float) -> datetime:
+        day, minutes = divmod(minute, DAY)
+        return timezone.make_aware(datetime.fromordinal(int(day)) + timedelta(minutes=minutes))
+
+    def _record(self, driver: str, trip_id: int, log_id: int, sequence: int, status_id: Optional[int],
+                found: List[Tuple[str, float, float]]):
+        for rule, at, hours in found:
+            self.violations.append(HOSViolation(
+                driver_key=driver, trip_id=trip_id, log_id=log_id, sequence=sequence, duty_status_id=status_id,
+                rule=rule, occurred_at=self._timestamp(at), hours=Decimal(str(round(hours, 2)))
+            ))
+        if len(self.violations) >= self.batch_size:
+            self._flush_violations()
+
+    def _flush_violations(self):
+        if self.violations:
+            HOSViolation.objects.bulk_create(self.violations, batch_size=self.batch_size, ignore_conflicts=True)
+            self.stats['violations'] += len(self.violations)
+            self.violations = []
+
+    def _save_states(self, states: Dict[str, _DriverState]):
+        HOSScanState.objects.bulk_create(
+            [HOSScanState(driver_key=driver, state=state.to_dict()) for driver, state in states.items()],
+            batch_size=self.batch_size,
+            update_conflicts=True, unique_fields=['driver_key'], update_fields=['state'],
+        )
+
+    def _scan(self, queryset, log_queryset, incremental: bool) -> List[str]:
+        """
+        One pass over the queryset rows and packed logs
+
+        Returns:
+            Drivers whose new rows start before their saved counters end;
+            those need a full rescan
+        """
+        advance = self._advance
+        record = self._record
+        driver = None
+        state = None
+        skip = False
+        out_of_order = []
+        states: Dict[str, _DriverState] = {}
+        rows = 0
+        for _, start, end, status, trip_id, user_id, log_id, sequence, status_id in self._stream(
+                queryset, log_queryset):
+            rows += 1
+            key = f'user:{user_id}' if user_id else f'trip:{trip_id}'
+            if key != driver:
+                driver = key
+                skip = False
+                saved = None
+                if incremental:
+                    saved = HOSScanState.objects.filter(driver_key=driver).values_list('state', flat=True).first()
+                state = _DriverState(saved)
+                if saved and start < (state.last_end or 0) - 1:
+                    # Rows inserted into the past can't be applied on top of
+                    # the saved counters
+                    out_of_order.append(driver)
+                    skip = True
+                    continue
+                states[driver] = state
+                if len(states) >= self.batch_size:
+                    self._save_states(states)
+                    states = {}
+                self.stats['drivers'] += 1
+            if skip:
+                continue
+            found = advance(state, status, start, end)
+            if found:
+                record(driver, trip_id, log_id, sequence, status_id, found)
+        self._flush_violations()
+        self._save_states(states)
+        self.stats['rows'] += rows
+        return out_of_order
+
+    def _driver_filter(self, queryset, driver: str, trip_path: str = 'log__trip'):
+        kind, value = driver.split(':')
+        if kind == 'user':
+            return queryset.filter(**{f'{trip_path}__user_id': int(value)})
+        return queryset.filter(**{f'{trip_path}_id': int(value), f'{trip_path}__user__isnull': True})
+
+    def scan(self, full: bool = False) -> Dict:
+        """
+        Audit duty statuses and write HOSViolation rows
+
+        Args:
+            full: Discard previous results and counters and scan every row;
+                otherwise only rows and packed logs added since the last
+                watermarks are read
+
+        Returns:
+            Dictionary with rows, drivers, violations written, drivers that
+            had to be rescanned, the new watermarks and elapsed seconds
+        """
+        started = timer.perf_counter()
+        watermark, _ = HOSScanWatermark.objects.get_or_create(name=self.WATERMARK)
+        # Rows and logs added while the scan runs are left for the next run
+        high = DutyStatus.objects.aggregate(high=Max('id'))['high'] or 0
+        high_log = ELDLog.objects.filter(timeline__isnull=False).aggregate(high=Max('id'))['high'] or 0
+        if full:
+            HOSViolation.objects.all().delete()
+            HOSScanState.objects.all().delete()
+            watermark.last_duty_status_id = watermark.last_log_id = 0
+
+        queryset = self._queryset().filter(id__gt=watermark.last_duty_status_id, id__lte=high)
+        log_queryset = self._log_queryset().filter(id__gt=watermark.last_log_id, id__lte=high_log)
+        incremental = not full and (watermark.last_duty_status_id > 0 or watermark.last_log_id > 0)
+        out_of_order = self._scan(queryset, log_queryset, incremental=incremental)
+
+        for driver in out_of_order:
+            with transaction.atomic():
+                HOSViolation.objects.filter(driver_key=driver).delete()
+                HOSScanState.objects.filter(driver_key=driver).delete()
+                self._scan(self._driver_filter(self._queryset().filter(id__lte=high), driver),
+                           self._driver_filter(self._log_queryset().filter(id__lte=high_log), driver, 'trip'),
+                           incremental=False)
+        self.stats['rescanned_drivers'] = len(out_of_order)
+
+        watermark.last_duty_status_id = max(watermark.last_duty_status_id, high)
+        watermark.last_log_id = max(watermark.last_log_id, high_log)
+        watermark.rows_scanned += self.stats['rows']
+        watermark.save()
+        elapsed = timer.perf_counter() - started
+        return {
+            **self.stats,
+            'watermark': watermark.last_duty_status_id,
+            'log_watermark': watermark.last_log_id,
+            'elapsed_seconds': round(elapsed, 2),
+        }
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -45,10 +48,12 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'api.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -115,6 +120,19 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache (geocode results, routes, matrix lanes)
+# Use a shared backend (e.g. file-based, Redis) so all workers see the same entries
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'trip-planner'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+        },
+    }
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -148,6 +166,8 @@ CORS_ALLOWED_ORIGINS = [
 # Allow all origins for deployment
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True   # Allow cookies to be sent
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'x-profile')
+CORS_EXPOSE_HEADERS = ['Idempotency-Key', 'Idempotent-Replayed', 'X-Profile-Id']
 
 # REST Framework settings
 REST_FRAMEWORK = {
@@ -165,3 +185,133 @@ REST_FRAMEWORK = {
 # Session settings
 SESSION_COOKIE_HTTPONLY = False  # Allow JavaScript access for frontend
 SESSION_COOKIE_SAMESITE = 'Lax'  # Allow cross-site requests
+# cached_db reads sessions from the cache and only hits the sessions table on
+# a miss; 'django.contrib.sessions.backends.signed_cookies' (or '.cache' with
+# a shared cache) keeps sessions out of the database altogether
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db')
+
+# Users behind a valid session come from a per-process cache (api/auth_backend.py)
+# instead of auth_user. Saving a user bumps a version in the default cache, so the user
+# cache is only used when CACHE_BACKEND is shared between workers (not locmem/dummy).
+# 0 disables the cache
+AUTHENTICATION_BACKENDS = ['api.auth_backend.CachedModelBackend']
+USER_CACHE_TIMEOUT = 300  # seconds
+
+# OpenRouteService settings
+# Point ORS_BASE_URL at a local stand-in (manage.py ors_standin) for offline load testing
+ORS_BASE_URL = os.environ.get('ORS_BASE_URL', 'https://api.openrouteservice.org')
+GEOCODE_CACHE_TIMEOUT = 30 * 24 * 3600  # seconds
+ROUTE_CACHE_TIMEOUT = 24 * 3600  # seconds
+# Stale-while-revalidate: expired routes are still served this much longer
+# while a background thread refetches them
+ROUTE_CACHE_STALE_TIMEOUT = 6 * 3600  # seconds
+ROUTE_REFRESH_WORKERS = 2
+ROUTE_REFRESH_LOCK_TIMEOUT = 60  # seconds
+# Per-request limits of the ORS matrix endpoint (sources x destinations, and locations)
+ORS_MATRIX_MAX_ELEMENTS = 3500
+ORS_MATRIX_MAX_LOCATIONS = 100
+
+# ORS quota, shared by every worker process on the host through a SQLite file
+# (api/rate_limiter.py). Buckets refill at per_minute and hold up to burst
+# tokens; remove a bucket (or set ORS_RATE_LIMITS = {}) to disable it
+ORS_RATE_LIMITS = {
+    'geocode': {'per_minute': 100, 'burst': 10},
+    'directions': {'per_minute': 40, 'burst': 5},
+    'matrix': {'per_minute': 40, 'burst': 5},
+}
+ORS_RATE_LIMIT_PATH = BASE_DIR / 'ors_ratelimit.sqlite3'
+# Seconds a request queues for a token before falling back to offline estimates
+ORS_RATE_LIMIT_DEADLINES = {'interactive': 5.0, 'batch': 120.0}
+ORS_RATE_LIMIT_BATCH_RESERVE = 0.25  # Share of each burst kept for interactive requests
+
+# Offline geocoding (first lookup tier, and distance estimates when ORS is unavailable)
+# The compiled index is rebuilt from the CSV on first use when missing or stale
+# (or explicitly with manage.py build_gazetteer)
+OFFLINE_GEOCODER_ENABLED = True
+OFFLINE_GEOCODER_MIN_SCORE = 0.75
+GAZETTEER_SOURCE_PATH = BASE_DIR / 'api' / 'data' / 'gazetteer_us.csv'
+GAZETTEER_INDEX_PATH = BASE_DIR / 'api' / 'data' / 'gazetteer_us.idx'
+ROAD_CIRCUITY_FACTOR = 1.2  # Road miles per great-circle mile
+
+# Server-sent trip events (api/events.py). The broker is per-process: run the API as a single
+# server process, or events published by one process never reach streams held by another.
+SSE_HEARTBEAT_SECONDS = 15  # Keep-alive comment interval for idle streams
+SSE_RETRY_MILLISECONDS = 5000  # Client reconnect delay
+SSE_HISTORY_SIZE = 1000  # Recent events replayed to reconnecting clients
+SSE_QUEUE_SIZE = 100  # Events buffered per slow client before a resync
+
+# Fleet-wide HOS violation scan (manage.py scan_hos_violations)
+HOS_SCAN_CHUNK_SIZE = 20000  # Duty statuses fetched per database round trip
+
+# Duty status storage for new ELD logs (api/timeline.py): 'rows' writes a
+# DutyStatus row per status, 'packed' one run-length encoded timeline per log.
+# Existing logs keep their storage; manage.py pack_duty_timelines converts them
+# (HOS violations follow their statuses) and the violation scan reads both.
+ELD_TIMELINE_STORAGE = os.environ.get('ELD_TIMELINE_STORAGE', 'rows')
+
+# Cold archive of completed trips (manage.py archive_trips, api/archive.py)
+# Monthly columnar files plus a sidecar index; read endpoints fall back to it
+ARCHIVE_DIR = Path(os.environ.get('ARCHIVE_DIR', BASE_DIR / 'archive'))
+ARCHIVE_AFTER_DAYS = 90  # Completed trips untouched this long are archived
+ARCHIVE_ROW_GROUP_TRIPS = 100  # Trips per row group (the unit read for one lookup)
+
+# Idempotency-Key handling for POST /api/calculate/ (api/idempotency.py)
+IDEMPOTENCY_KEY_TTL = 24 * 3600  # Seconds a stored response is replayed
+IDEMPOTENCY_WAIT_TIMEOUT = 60  # Seconds a duplicate waits for the original request
+IDEMPOTENCY_PENDING_TIMEOUT = 120  # Seconds before an unfinished key is taken over
+IDEMPOTENCY_PURGE_INTERVAL = 300  # Seconds between deletes of expired keys, per process
+
+# Start-up warm-up (api/startup.py): wsgi.py and asgi.py load the URLconf,
+# DRF classes, auth backends, gazetteer and ORS HTTP session in a background
+# thread when a worker starts. manage.py startup_report measures the effect
+STARTUP_WARMUP = os.environ.get('STARTUP_WARMUP', '1') != '0'
+ORS_HTTP_POOL_SIZE = 10  # Kept-alive ORS connections per host and process
+
+# Request profiling (api/profiling.py): staff requests with 'X-Profile: 1' and a
+# random PROFILE_SAMPLE_RATE share of PROFILE_PATHS are stack-sampled and stored
+# as collapsed stacks, viewable at /api/profiles/ (staff only)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_PATHS = ['/api/']
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+PROFILE_MAX_STORED = 500  # Older profiles are deleted
+
+# Bulk planning (manage.py plan_trips, api/bulk_planning.py): rows are
+# validated and routed in chunks, planned in a process pool and committed
+# with their progress, so interrupted runs resume after the last chunk
+PLAN_TRIPS_CHUNK_SIZE = 500  # Rows per commit
+PLAN_TRIPS_ROUTE_WORKERS = 8  # Concurrent route lookups (at batch priority)
+
+# Response compression (api/compression.py): responses of COMPRESSION_MIN_SIZE
+# bytes or more are sent with brotli (needs the optional 'brotli' package) or
+# gzip, whichever the client accepts. Trip detail, route and log documents are
+# cached with their compressed bytes until the trip is next saved
+COMPRESSION_MIN_SIZE = 1024  # bytes
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+TRIP_DOCUMENT_CACHE_TIMEOUT = 3600  # seconds
+
+# Time-of-day speed profiles (manage.py rebuild_speed_profiles, api/speed_profiles.py):
+# the ORS route speed scaled by hour-of-day factors learned from the progress drivers
+# report when re-planning completed trips, per lane, region and fleet; off, planning
+# uses the fixed 55 mph
+SPEED_PROFILES_ENABLED = os.environ.get('SPEED_PROFILES_ENABLED', '1') != '0'
+SPEED_PROFILE_MIN_HOURS = 24  # Driving a profile needs before it is used
+SPEED_PROFILE_PRIOR_MINUTES = 120  # Per hour, at the profile's average speed
+SPEED_PROFILE_MAX_GAP_MINUTES = 180  # Checkpoints further apart are not attributed to hours
+SPEED_PROFILE_REGION_DEGREES = 2.0  # Region grid cell size
+SPEED_PROFILE_CACHE_SECONDS = 300  # Profiles are re-read after this long
+SPEED_PROFILE_CACHE_SIZE = 10000  # Cached keys per process
+
+# Fuel stop planning (api/fuel_planner.py): with a station CSV (name, address,
+# latitude, longitude, price) fuel stops go to the cheapest stations within
+# FUEL_CORRIDOR_MILES of the route; without one, a stop every 1,000 miles
+FUEL_STATIONS_PATH = Path(os.environ.get('FUEL_STATIONS_PATH', BASE_DIR / 'api' / 'data' / 'fuel_stations.csv'))
+FUEL_TANK_RANGE_MILES = 1000
+FUEL_START_LEVEL = 1.0  # Share of the tank full at departure
+FUEL_RESERVE_MILES = 50  # Range left on arrival
+FUEL_MPG = 6.5
+FUEL_CORRIDOR_MILES = 5  # Farthest station from the route
+FUEL_STOP_PENALTY = 15.0  # Cost of the time a stop takes, in the price currency
+FUEL_BREAK_ALIGN_MILES = 25  # Stops this close to an HOS rest cost no extra time
+FUEL_PLAN_UNIT_MILES = 10  # Fuel level resolution of the planner
+FUEL_INDEX_CELL_DEGREES = 0.1  # Station grid cell size
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trip_planner.settings')
 
 application = get_wsgi_application()
+
+# Load the URLconf, gazetteer and HTTP session in the background so the
+# first request doesn't pay for them (api/startup.py, STARTUP_WARMUP)
+from api.startup import StartupWarmer  # noqa: E402
+
+StartupWarmer.start()
@@ -1,4 +1,4 @@
-import React, { useState } from "react";
+import React, { useRef, useState } from "react";
 import { LoginPage } from "./components/LoginPage";
 import { Dashboard } from "./components/Dashboard";
 import { TripInputForm } from "./components/TripInputForm";
@@ -57,6 +57,9 @@ export default function App() {
   const [currentTripResult, setCurrentTripResult] = useState<TripResult | null>(
     null
   );
+  // One Idempotency-Key per trip submission, reused when the same trip is
+  // submitted again before it comes back (double clicks, resubmits)
+  const submission = useRef<{ body: string; key: string } | null>(null);
   const [pastTrips, setPastTrips] = useState<TripResult[]>([
     {
       id: "1",
@@ -121,10 +124,17 @@ export default function App() {
 
   const handleTripSubmit = async (tripData: TripInputData) => {
     setCurrentTripData(tripData);
+    const body = JSON.stringify(tripData);
+    const key =
+      submission.current?.body === body
+        ? submission.current.key
+        : crypto.randomUUID();
+    submission.current = { body, key };
 
     try {
       // Use the API calculation function
-      const result = await calculateTrip(tripData);
+      const result = await calculateTrip(tripData, key);
+      submission.current = null;
       setCurrentTripResult(result);
       setCurrentPage("results");
     } catch (error) {
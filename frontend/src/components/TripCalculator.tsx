@@ -74,7 +74,7 @@ function calculateDistance(from: string, to: string): number {
   return distances[key] || distances[reverseKey] || Math.floor(Math.random() * 800 + 200);
 }
 
-export async function calculateTrip(inputData: TripInputData): Promise<TripResult> {
+export async function calculateTrip(inputData: TripInputData, idempotencyKey?: string): Promise<TripResult> {
   try {
     // Call the Django backend API
     const response = await apiService.calculateTrip({
@@ -82,7 +82,8 @@ export async function calculateTrip(inputData: TripInputData): Promise<TripResul
       pickup_location: inputData.pickupLocation,
       dropoff_location: inputData.dropoffLocation,
       current_cycle_used: inputData.currentCycleUsed,
-    });
+      use_sleeper_berth: inputData.useSleeperBerth,
+    }, idempotencyKey);
 
     // Convert API response to TripResult format
     return convertApiResponseToTripResult(response, inputData);
@@ -7,6 +7,7 @@ export interface TripCalculationRequest {
   pickup_location: string;
   dropoff_location: string;
   current_cycle_used: number;
+  use_sleeper_berth?: boolean;
 }
 
 export interface RoutePoint {
@@ -21,7 +22,7 @@ export interface RoutePoint {
 }
 
 export interface DutyStatus {
-  id: number;
+  id: number | null;  // null for logs stored as packed timelines
   status: string;
   start_time: string;
   end_time: string;
@@ -69,6 +70,33 @@ export interface Trip {
   eld_logs: ELDLog[];
 }
 
+export interface TripSearchResponse {
+  query: string;
+  // "fuzzy": misspelled words were replaced, see corrected_query
+  match: "exact" | "fuzzy" | "none";
+  corrected_query: string | null;
+  page: number;
+  page_size: number;
+  has_more: boolean;
+  results: Omit<Trip, "route_points" | "eld_logs">[];
+}
+
+export interface TripDelta {
+  trip_id: number;
+  status?: string;
+  estimated_arrival?: string | null;
+  total_trip_time?: string | null;
+  total_distance?: string | null;
+  miles_completed?: string;
+  fuel_stops?: number;
+  rest_stops?: number;
+  // Row ids of re-planned route_points / eld_logs / duty_statuses
+  changes?: Record<
+    string,
+    { created?: number[]; updated?: number[]; deleted?: number[] }
+  >;
+}
+
 export interface User {
   id: number;
   username: string;
@@ -107,12 +135,12 @@ class ApiService {
     const csrfToken = this.getCookieValue("csrftoken");
 
     const config: RequestInit = {
+      ...options,
       headers: {
         "Content-Type": "application/json",
         ...(csrfToken && { "X-CSRFToken": csrfToken }),
         ...options.headers,
       },
-      ...options,
     };
 
     try {
@@ -144,14 +172,25 @@ class ApiService {
     return this.request("/health/");
   }
 
-  // Calculate trip
+  // Calculate trip. The Idempotency-Key makes a retry (or a double submit)
+  // return the trip already planned instead of planning and saving it twice.
   async calculateTrip(
-    data: TripCalculationRequest
+    data: TripCalculationRequest,
+    idempotencyKey: string = crypto.randomUUID()
   ): Promise<TripCalculationResponse> {
-    return this.request("/calculate/", {
+    const options: RequestInit = {
       method: "POST",
       body: JSON.stringify(data),
-    });
+      headers: { "Idempotency-Key": idempotencyKey },
+    };
+    try {
+      return await this.request("/calculate/", options);
+    } catch (error) {
+      // Network failure: the server may have finished, so retry once with
+      // the same key
+      if (!(error instanceof TypeError)) throw error;
+      return this.request("/calculate/", options);
+    }
   }
 
   // Get all trips
@@ -159,6 +198,20 @@ class ApiService {
     return this.request("/trips/");
   }
 
+  // Search trips by partial city or address, newest first
+  async searchTrips(
+    query: string,
+    page = 1,
+    pageSize = 20
+  ): Promise<TripSearchResponse> {
+    const params = new URLSearchParams({
+      q: query,
+      page: String(page),
+      page_size: String(pageSize),
+    });
+    return this.request(`/trips/search/?${params}`);
+  }
+
   // Get trip details
   async getTrip(tripId: number): Promise<Trip> {
     return this.request(`/trips/${tripId}/`);
@@ -178,6 +231,47 @@ class ApiService {
     return this.request(`/trips/${tripId}/logs/`);
   }
 
+  // Pushed trip deltas (server-sent events) instead of polling the trip
+  // endpoints. EventSource reconnects on its own and resumes from the last
+  // event id; onResync fires when events were missed and the caller should
+  // refetch over REST. Returns a function that closes the stream.
+  private subscribe(
+    endpoint: string,
+    onDelta: (delta: TripDelta) => void,
+    onResync?: () => void
+  ): () => void {
+    const source = new EventSource(`${API_BASE_URL}${endpoint}`, {
+      withCredentials: true,
+    });
+    const handle = (event: MessageEvent) => onDelta(JSON.parse(event.data));
+    source.addEventListener("trip.created", handle);
+    source.addEventListener("trip.updated", handle);
+    source.addEventListener("resync", () => onResync?.());
+    return () => source.close();
+  }
+
+  subscribeToTrip(
+    tripId: number,
+    onDelta: (delta: TripDelta) => void,
+    onResync?: () => void
+  ): () => void {
+    return this.subscribe(`/trips/${tripId}/events/`, onDelta, onResync);
+  }
+
+  subscribeToTrips(
+    onDelta: (delta: TripDelta) => void,
+    onResync?: () => void
+  ): () => void {
+    return this.subscribe("/trips/events/", onDelta, onResync);
+  }
+
+  subscribeToMyTrips(
+    onDelta: (delta: TripDelta) => void,
+    onResync?: () => void
+  ): () => void {
+    return this.subscribe("/auth/me/events/", onDelta, onResync);
+  }
+
   // Authentication methods
   async login(data: LoginRequest): Promise<AuthResponse> {
     return this.request("/auth/login/", {